@@ -0,0 +1,148 @@
+# Copyright (C) 2018 Ion Torrent Systems, Inc. All Rights Reserved
+"""
+Admission control for the job server's ``AnalysisQueue``.
+
+Every analysis is given a priority class and a weight.  Thumbnails run
+before full-chip analyses, and reanalyses from an existing report and
+combineAlignments run last; within a class analyses start in the order they
+were submitted.  The weight is the number of slots an analysis holds while it
+runs, a stand-in for its memory footprint, and depends on the chip type.  An
+analysis is started only when its weight fits in the free slots.
+
+The head of the queue is never overtaken by a later, smaller analysis, so a
+large chip waiting for slots to free up cannot be starved by a stream of
+small ones.
+"""
+import heapq
+import json
+import re
+import time
+
+DEFAULT_SLOTS = 8
+
+# priority classes, lowest runs first
+THUMBNAIL = 0
+FULLCHIP = 1
+REANALYSIS = 2
+CLASS_NAMES = {THUMBNAIL: "thumbnail", FULLCHIP: "fullchip", REANALYSIS: "reanalysis"}
+
+SGE_SLOTS_RE = re.compile(r"-pe\s+\S+\s+(\d+)")
+
+
+def get_job_class(analysis):
+    """Returns the priority class of analysis"""
+    if analysis.job_type == "thumbnail":
+        return THUMBNAIL
+    if analysis.job_type == "combineAlignments":
+        return REANALYSIS
+    params = analysis.params
+    if not isinstance(params, dict):
+        # sent as JSON text by the reanalysis launch
+        try:
+            params = json.loads(params or "{}")
+        except (TypeError, ValueError):
+            params = {}
+    if isinstance(params, dict) and params.get("previousReport"):
+        return REANALYSIS
+    return FULLCHIP
+
+
+def match_chip(chip_map, chipType):
+    """Returns the value of the longest chip name in chip_map found in
+    chipType, or None"""
+    best = None
+    for chip, value in (chip_map or {}).items():
+        if chip and chip in (chipType or "") and (best is None or len(chip) > best[0]):
+            best = (len(chip), value)
+    return best[1] if best else None
+
+
+class AnalysisScheduler(object):
+    """
+    Queue of analyses waiting for slots.
+
+    ``chip_weights`` maps chip names to the weight of their full-chip
+    analyses.  Chip types not listed there fall back to the slot count of the
+    chip's "-pe ion_pe N" SGE parameters sent with the analysis, then to 1.
+    Thumbnails always weigh 1.  Weights are capped at ``slots`` so that any
+    analysis can run on an otherwise idle server.
+
+    Not thread safe, the ``AnalysisQueue`` serializes access under its lock.
+    """
+
+    def __init__(self, slots=DEFAULT_SLOTS, chip_weights=None, clock=time.time):
+        self.slots = max(1, int(slots))
+        self.chip_weights = dict(chip_weights or {})
+        self.clock = clock
+        self.used = 0
+        self._heap = []  # (class, sequence, enqueued, analysis)
+        self._seq = 0
+        self._holding = {}  # pk -> weight, for analyses started and not released
+        self.last_wait = 0.0  # seconds the most recently started analysis waited
+
+    def get_weight(self, analysis, job_class=None):
+        if job_class is None:
+            job_class = get_job_class(analysis)
+        if job_class == THUMBNAIL:
+            weight = 1
+        else:
+            weight = match_chip(self.chip_weights, analysis.chipType)
+            if weight is None:
+                args = match_chip(analysis.chips, analysis.chipType)
+                match = SGE_SLOTS_RE.search(args or "")
+                weight = int(match.group(1)) if match else 1
+        return min(max(1, int(weight)), self.slots)
+
+    def add(self, analysis):
+        """Queue analysis"""
+        entry = (get_job_class(analysis), self._seq, self.clock(), analysis)
+        self._seq += 1
+        heapq.heappush(self._heap, entry)
+
+    def pop_ready(self):
+        """Returns the next analysis to start and holds its slots, or None if
+        the queue is empty or the next analysis does not fit yet"""
+        if not self._heap:
+            return None
+        job_class, _, enqueued, analysis = self._heap[0]
+        weight = self.get_weight(analysis, job_class)
+        if self.used + weight > self.slots:
+            return None
+        heapq.heappop(self._heap)
+        self.used += weight
+        self._holding[analysis.pk] = self._holding.get(analysis.pk, 0) + weight
+        self.last_wait = self.clock() - enqueued
+        return analysis
+
+    def release(self, analysis):
+        """Frees the slots held by analysis"""
+        self.used -= self._holding.pop(analysis.pk, 0)
+
+    def depth(self):
+        return len(self._heap)
+
+    def queued(self, pk):
+        """Returns (position, of, seconds waited) for a queued analysis with
+        primary key pk, or None"""
+        now = self.clock()
+        for position, (_, _, enqueued, analysis) in enumerate(sorted(self._heap)):
+            if analysis.pk == pk:
+                return position + 1, len(self._heap), now - enqueued
+        return None
+
+    def stats(self):
+        """Returns a dict of the queue state, suitable for XML-RPC"""
+        now = self.clock()
+        by_class = dict((name, 0) for name in CLASS_NAMES.values())
+        max_wait = 0.0
+        for job_class, _, enqueued, _ in self._heap:
+            by_class[CLASS_NAMES[job_class]] += 1
+            max_wait = max(max_wait, now - enqueued)
+        return {
+            "slots": self.slots,
+            "slots_used": self.used,
+            "queued": len(self._heap),
+            "queued_by_class": by_class,
+            "max_wait": max_wait,
+            "last_wait": self.last_wait,
+        }
@@ -74,6 +74,7 @@ logger.addHandler(cachehandle)
 REFERENCE_LIBRARY_TEMP_DIR = "/results/referenceLibrary/temp/"
 
 import iondb.anaserve.djangoinit
+from iondb.anaserve.scheduler import AnalysisScheduler
 
 # from iondb.bin import djangoinit
 # from iondb.rundb import models
@@ -586,9 +587,11 @@ class AnalysisQueue(object):
     singleton object.
 
     It maintains a queue
-    of analyses (literally ``Analysis`` objects) waiting to be run. It
-    operates a thread that sequentially pops analyses from the queue and
-    runs them each in a separate thread.
+    of analyses (literally ``Analysis`` objects) waiting to be run, ordered
+    by an ``AnalysisScheduler``. It operates a thread that pops analyses
+    from the queue as soon as the scheduler has free slots for them and
+    runs them each in a separate thread. The slots held by an analysis are
+    released once it concludes or fails to start.
 
     The process of running each analysis consists of three parts. It is
     implemented in the ``run_analysis`` method.
@@ -603,18 +606,15 @@ class AnalysisQueue(object):
        the analysis object's ``conclude()`` method to clean up.
 
     The reason for acquiring a lock is to allow the ``AnalysisQueue`` to keep
-    track of which analyses are running, and to make it easier to implement
-    queuing in the future. For example, it would be straightforward to
-    have the ``AnalysisQueue``'s main thread wait until there are less than
-    N analyses running before initiating another.
+    track of which analyses are running and which slots they hold.
     """
 
-    def __init__(self, rootdir):
+    def __init__(self, rootdir, scheduler=None):
         if rootdir.startswith("../"):
             rootdir = path.join(os.getcwd(), rootdir)
         self.cv = threading.Condition()
         self.exit_event = threading.Event()
-        self.q = []
+        self.scheduler = scheduler or AnalysisScheduler()
         self.monitors = []
         self.running = {}
         self.rootdir = rootdir
@@ -628,6 +628,18 @@ class AnalysisQueue(object):
         """Spawn a thread which attempts to start an analysis."""
 
         def go():
+            try:
+                _go()
+            finally:
+                # give the slots back to the scheduler
+                self.cv.acquire()
+                try:
+                    self.scheduler.release(a)
+                    self.cv.notify()
+                finally:
+                    self.cv.release()
+
+        def _go():
             # acquire a lock while initiating
             self.cv.acquire()
             try:
@@ -669,13 +681,28 @@ class AnalysisQueue(object):
         def _loop():
             while not self.exit_event.isSet():
                 self.cv.acquire()
-                while len(self.q) == 0:
-                    self.cv.wait()
-                    if self.exit_event.is_set():
-                        logger.info("Main loop exiting")
-                        return  # leave loop if we're done
-                a = self.q.pop(0)
-                self.cv.release()
+                try:
+                    # wait for an analysis and free slots to run it
+                    a = self.scheduler.pop_ready()
+                    while a is None:
+                        self.cv.wait()
+                        if self.exit_event.is_set():
+                            logger.info("Main loop exiting")
+                            return  # leave loop if we're done
+                        a = self.scheduler.pop_ready()
+                    stats = self.scheduler.stats()
+                finally:
+                    self.cv.release()
+                logger.info(
+                    "Starting %s after %.0fs in queue, %d/%d slots used, %d queued"
+                    % (
+                        a.name,
+                        stats["last_wait"],
+                        stats["slots_used"],
+                        stats["slots"],
+                        stats["queued"],
+                    )
+                )
                 self.run_analysis(a)
 
         tr = threading.Thread(target=_loop)
@@ -686,7 +713,7 @@ class AnalysisQueue(object):
     def add_analysis(self, a):
         """Add an analysis to the queue."""
         self.cv.acquire()
-        self.q.append(a)
+        self.scheduler.add(a)
         self.cv.notify()
         self.cv.release()
         logger.info("Added analysis %s" % a.name)
@@ -694,15 +721,20 @@ class AnalysisQueue(object):
     def stop(self):
         """Terminate the main loop."""
         self.exit_event.set()
+        self.cv.acquire()
         self.cv.notify()
+        self.cv.release()
 
     def status(self, save_path, pk):
         """Determine the status of an analysis identified by 'pk' running
         at 'save_path'."""
         self.cv.acquire()
         try:
+            queued = self.scheduler.queued(pk)
             if pk in self.running:
                 ret = (True, self.running[pk].status_string())
+            elif queued is not None:
+                ret = (True, "Queued %d of %d, waiting %ds" % queued)
             else:
                 fname = path.join(save_path, "status.txt")
                 if not path.exists(fname):
@@ -727,6 +759,17 @@ class AnalysisQueue(object):
         """Return the number of jobs currently running."""
         return len(self.running)
 
+    def queue_status(self):
+        """Return the scheduler's queue depth, slot use and wait times,
+        along with the number of jobs running."""
+        self.cv.acquire()
+        try:
+            ret = self.scheduler.stats()
+        finally:
+            self.cv.release()
+        ret["running"] = self.n_jobs()
+        return ret
+
     def uptime(self):
         """Return the amount of time the ``AnalysisQueue`` has been running."""
         if self.start_time is None:
@@ -897,6 +940,11 @@ class AnalysisServer(xmlrpc.XMLRPC):
         running."""
         return self.q.n_jobs()
 
+    def xmlrpc_queue_status(self):
+        """Return the number of jobs queued, per priority class, the slots
+        in use and the time jobs have waited in the ``AnalysisQueue``."""
+        return self.q.queue_status()
+
     def xmlrpc_uptime(self):
         """Return the ``AnalysisQueue``'s uptime."""
         logger.debug("uptime checked")
@@ -961,7 +1009,10 @@ if __name__ == "__main__":
     try:
         logger.info("ionJobServer Started Ver: %s" % __version__)
 
-        aq = AnalysisQueue(settings.ANALYSIS_ROOT)
+        scheduler = AnalysisScheduler(
+            settings.JOBSERVER_SLOTS, settings.JOBSERVER_CHIP_WEIGHTS
+        )
+        aq = AnalysisQueue(settings.ANALYSIS_ROOT, scheduler)
         aq.loop()
 
         r = AnalysisServer(aq)
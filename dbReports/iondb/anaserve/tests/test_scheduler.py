@@ -0,0 +1,112 @@
+# Copyright (C) 2018 Ion Torrent Systems, Inc. All Rights Reserved
+import json
+
+from django.test import SimpleTestCase
+
+from iondb.anaserve import scheduler
+
+
+class FakeAnalysis(object):
+    def __init__(self, pk, chipType="540", job_type="", params=None, chips=None):
+        self.pk = pk
+        self.name = "analysis_%d" % pk
+        self.chipType = chipType
+        self.job_type = job_type
+        self.params = params or {}
+        self.chips = chips or {}
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class AnalysisSchedulerTest(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = scheduler.AnalysisScheduler(
+            slots=4, chip_weights={"540": 4, "530": 2}, clock=self.clock
+        )
+
+    def drain(self):
+        started = []
+        while True:
+            analysis = self.scheduler.pop_ready()
+            if analysis is None:
+                return started
+            started.append(analysis.pk)
+
+    def test_priority_classes_fifo(self):
+        for analysis in [
+            FakeAnalysis(1, "314", params={"previousReport": "/results/a"}),
+            FakeAnalysis(2, "314"),
+            FakeAnalysis(3, "314", job_type="thumbnail"),
+            FakeAnalysis(4, "", job_type="combineAlignments"),
+            FakeAnalysis(5, "314"),
+            FakeAnalysis(6, "530", job_type="thumbnail"),
+        ]:
+            self.scheduler.add(analysis)
+        self.assertEqual([3, 6, 2, 5], self.drain())
+        self.assertEqual(4, self.scheduler.used)
+        self.assertEqual(2, self.scheduler.depth())
+
+        self.scheduler.release(FakeAnalysis(3))
+        self.scheduler.release(FakeAnalysis(6))
+        self.assertEqual([1, 4], self.drain())
+
+    def test_reanalysis_json_params(self):
+        # analyze.py sends params as a JSON string over XML-RPC
+        reanalysis = FakeAnalysis(
+            1, "314", params=json.dumps({"previousReport": "/results/a"})
+        )
+        self.assertEqual(scheduler.REANALYSIS, scheduler.get_job_class(reanalysis))
+        for params in [json.dumps({"previousReport": ""}), "", "not json", "[]"]:
+            self.assertEqual(
+                scheduler.FULLCHIP,
+                scheduler.get_job_class(FakeAnalysis(2, "314", params=params)),
+            )
+
+    def test_weights(self):
+        get_weight = self.scheduler.get_weight
+        self.assertEqual(4, get_weight(FakeAnalysis(1, "540")))
+        self.assertEqual(2, get_weight(FakeAnalysis(1, "530v1")))
+        self.assertEqual(1, get_weight(FakeAnalysis(1, "540", "thumbnail")))
+        self.assertEqual(1, get_weight(FakeAnalysis(1, "314")))
+        chips = {"31": "-pe ion_pe 2", "318": "-pe ion_pe 3"}
+        self.assertEqual(3, get_weight(FakeAnalysis(1, "318C", chips=chips)))
+        chips = {"P1": "-pe ion_pe 12"}
+        self.assertEqual(4, get_weight(FakeAnalysis(1, "P1.1.17", chips=chips)))
+
+    def test_head_of_line_not_overtaken(self):
+        self.scheduler.add(FakeAnalysis(1, "530"))
+        self.scheduler.add(FakeAnalysis(2, "540"))
+        self.scheduler.add(FakeAnalysis(3, "314"))
+        self.assertEqual([1], self.drain())
+        # the 540 needs all 4 slots, the 314 waits behind it
+        self.scheduler.release(FakeAnalysis(1))
+        self.assertEqual([2], self.drain())
+        self.scheduler.release(FakeAnalysis(2))
+        self.assertEqual([3], self.drain())
+
+    def test_queue_status(self):
+        self.scheduler.add(FakeAnalysis(1, "540"))
+        self.clock.now += 10
+        self.scheduler.add(FakeAnalysis(2, "540"))
+        self.scheduler.add(FakeAnalysis(3, "540", job_type="thumbnail"))
+        self.clock.now += 5
+        self.assertEqual((1, 3, 5), self.scheduler.queued(3))
+        self.assertEqual((3, 3, 5), self.scheduler.queued(2))
+        self.assertEqual(None, self.scheduler.queued(4))
+
+        self.assertEqual([3], self.drain())
+        stats = self.scheduler.stats()
+        self.assertEqual(5, stats["last_wait"])
+        self.assertEqual(15, stats["max_wait"])
+        self.assertEqual(2, stats["queued"])
+        self.assertEqual(1, stats["slots_used"])
+        self.assertEqual(
+            {"thumbnail": 0, "fullchip": 2, "reanalysis": 0}, stats["queued_by_class"]
+        )
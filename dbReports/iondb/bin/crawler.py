@@ -25,6 +25,7 @@ This module uses the Twisted XMLRPC server, which on Ubuntu can be installed
 with ``sudo apt-get install python-twisted``.
 """
 import datetime
+import fnmatch
 import glob
 import json
 import logging
@@ -46,10 +47,18 @@ from django.conf import settings
 from twisted.internet import reactor
 from twisted.internet import task
 from twisted.web import xmlrpc, server
+from twisted.python import filepath
+
+try:
+    from twisted.internet import inotify
+except ImportError:
+    # inotify is Linux only; the crawler falls back to polling
+    inotify = None
 
 from iondb.rundb import models
 from ion.utils.explogparser import load_log
 from ion.utils.explogparser import parse_log
+from iondb.utils.crawl_index import CrawlIndex
 
 try:
     import iondb.version as version  # @UnresolvedImport
@@ -63,6 +72,12 @@ LOG_FINAL_BASENAME = "explog_final.txt"
 
 DO_THUMBNAIL = True
 
+# maximum number of expDirs per database lookup
+DB_LOOKUP_CHUNK = 500
+
+# seconds to let inotify events on a run folder accumulate before processing it
+WATCH_SETTLE = 2.0
+
 
 class CrawlLog(object):
 
@@ -206,6 +221,123 @@ class Status(xmlrpc.XMLRPC):
         return sorted(ret, key=lambda l: l[0], reverse=True)
 
 
+class CrawlWatcher(object):
+
+    """``CrawlWatcher`` objects use inotify to watch rig folders for new run
+    folders, and run folders for new explog and acq files.  Run folders with
+    activity are queued for the crawl thread, which processes just those runs
+    instead of waiting for the next full crawl.
+
+    inotify watches are managed in the reactor thread; the crawl thread only
+    calls `watch_folders` and `wait`."""
+
+    RIG_MASK = inotify.IN_CREATE | inotify.IN_MOVED_TO if inotify else 0
+    RUN_MASK = (
+        inotify.IN_CREATE | inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO
+        if inotify
+        else 0
+    )
+    RUN_FILES = [LOG_BASENAME, LOG_FINAL_BASENAME]
+    RUN_PATTERN = "acq*.dat"
+    THUMBNAIL = "thumbnail"
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.notifier = inotify.INotify()
+        self.notifier.startReading()
+        self.rig_watches = set()
+        self.run_watches = set()
+        self.cond = threading.Condition()
+        self.queued = set()
+
+    def watch_folders(self, rig_folders, run_folders):
+        """Replace the watched rig and run folders; callable from any thread"""
+        reactor.callFromThread(
+            self._update_watches, set(rig_folders), set(run_folders)
+        )
+
+    def _update_watches(self, rig_folders, run_folders):
+        for path in self.rig_watches - rig_folders:
+            self._ignore(path)
+        for path in rig_folders - self.rig_watches:
+            self._watch(path, self.RIG_MASK, self._rig_event)
+        self.rig_watches = rig_folders
+
+        wanted = set(run_folders)
+        for folder in run_folders:
+            thumbnail = os.path.join(folder, self.THUMBNAIL)
+            if os.path.isdir(thumbnail):
+                wanted.add(thumbnail)
+        for path in self.run_watches - wanted:
+            self._ignore(path)
+        for path in wanted - self.run_watches:
+            self._watch(path, self.RUN_MASK, self._run_event)
+        self.run_watches = wanted
+
+    def _watch(self, path, mask, callback):
+        try:
+            self.notifier.watch(
+                filepath.FilePath(path), mask=mask, callbacks=[callback]
+            )
+        except Exception:
+            self.logger.errors.warn("Unable to watch %s" % path)
+
+    def _ignore(self, path):
+        try:
+            self.notifier.ignore(filepath.FilePath(path))
+        except KeyError:
+            pass  # folder was removed and its watch dropped by the kernel
+
+    def _rig_event(self, ignored, fpath, mask):
+        """A new entry in a rig folder: watch and queue new run folders"""
+        path = fpath.path
+        if mask & inotify.IN_ISDIR and path not in self.run_watches:
+            self._watch(path, self.RUN_MASK, self._run_event)
+            self.run_watches.add(path)
+            self.queue(path)
+
+    def _run_event(self, ignored, fpath, mask):
+        """A new or written file in a run folder: queue the run folder"""
+        name = fpath.basename()
+        parent = fpath.dirname()
+        if mask & inotify.IN_ISDIR:
+            if name == self.THUMBNAIL and fpath.path not in self.run_watches:
+                self._watch(fpath.path, self.RUN_MASK, self._run_event)
+                self.run_watches.add(fpath.path)
+            return
+        if os.path.basename(parent) == self.THUMBNAIL:
+            parent = os.path.dirname(parent)
+        if name in self.RUN_FILES or fnmatch.fnmatch(name, self.RUN_PATTERN):
+            self.queue(parent)
+
+    def queue(self, folder):
+        """Queue ``folder`` for processing and wake up the crawl thread"""
+        self.cond.acquire()
+        self.queued.add(folder)
+        self.cond.notify()
+        self.cond.release()
+
+    def wait(self, timeout, settle=WATCH_SETTLE):
+        """Wait up to ``timeout`` seconds for activity, then let events settle
+        for ``settle`` seconds and return the list of queued run folders."""
+        self.cond.acquire()
+        try:
+            if not self.queued and timeout > 0:
+                self.cond.wait(timeout)
+            if not self.queued:
+                return []
+        finally:
+            self.cond.release()
+        time.sleep(settle)
+        self.cond.acquire()
+        try:
+            folders = sorted(self.queued)
+            self.queued.clear()
+        finally:
+            self.cond.release()
+        return folders
+
+
 def extract_prefix(folder):
     """Given the name of a folder storing experiment data, return the
     name of the directory under which all PGMs at a given location
@@ -221,21 +353,28 @@ def tdelt2secs(td):
     return day_seconds + float(td.seconds) + ms_seconds
 
 
-def construct_crawl_directories(logger):
+def construct_crawl_directories(logger, index=None):
     """Query the database and build a list of directories to crawl.
     Returns an array.
     For every Rig in the database, construct a filesystem path and
-    get all subdirectories in that path."""
-
-    def dbase_isComplete(name, explist):
-        """
-        explist consists of tuples containing experiment name and ftpstatus
-        """
-        for item in explist:
-            if name == item[0]:
-                if item[1] in models.Experiment.FTP_STATUS_DONE_ALL:
-                    return True
-        return False
+    get all subdirectories in that path.
+    If a ``CrawlIndex`` is given, rig folders are only re-listed when their
+    mtime changed and directories already known to be complete are skipped."""
+    if index is None:
+        index = CrawlIndex()
+    index.expire()
+
+    def dbase_complete(candidates):
+        """Return the subset of candidates whose ftp transfer is done"""
+        done = []
+        for i in range(0, len(candidates), DB_LOOKUP_CHUNK):
+            done.extend(
+                models.Experiment.objects.filter(
+                    expDir__in=candidates[i : i + DB_LOOKUP_CHUNK],
+                    ftpStatus__in=models.Experiment.FTP_STATUS_DONE_ALL,
+                ).values_list("expDir", flat=True)
+            )
+        return done
 
     fserves = models.FileServer.objects.all()
     ret = []
@@ -248,24 +387,15 @@ def construct_crawl_directories(logger):
             rig_folder = os.path.join(fs.filesPrefix, r.name)
             if os.path.exists(rig_folder):
                 logger.errors.debug("Checking %s" % rig_folder)
-                exp_val_list = models.Experiment.objects.filter(
-                    expDir__startswith=rig_folder
-                ).values_list("expDir", "ftpStatus")
                 try:
-                    subdir_bases = os.listdir(rig_folder)
-                    # create array of paths for all directories in Rig's directory
-                    s1 = [os.path.join(rig_folder, subd) for subd in subdir_bases]
-                    s2 = [subd for subd in s1 if os.path.isdir(subd)]
-                    # create array of paths of not complete ftp transfer only
-                    s3 = [
-                        subd
-                        for subd in s2
-                        if dbase_isComplete(subd, exp_val_list) is False
-                    ]
-                    ret.extend(s3)
+                    # array of paths for all directories in Rig's directory
+                    subdirs = index.list_rig(rig_folder)
+                    # array of paths of not complete ftp transfer only
+                    ret.extend(index.pending(subdirs, dbase_complete))
                 except Exception:
                     logger.errors.error(traceback.format_exc())
                     logger.set_state("error")
+    index.save()
     return ret
 
 
@@ -571,9 +701,10 @@ def reports_exist(exp):
     return composite, thumbnail
 
 
-def crawl(folders, logger):
+def crawl(folders, logger, index=None):
     """Crawl over ``folders``, reporting information to the ``CrawlLog``
-    ``logger``."""
+    ``logger``.  Folders whose transfer completes are recorded in the
+    optional ``CrawlIndex`` ``index``."""
 
     def get_expobj(_folder):
         """Returns Experiment object associated with given folder"""
@@ -688,6 +819,9 @@ def crawl(folders, logger):
                 else:
                     update_expobj_ftptransfer(exp)
 
+                if index is not None and exp.ftpStatus in exp.FTP_STATUS_DONE_ALL:
+                    index.mark_complete(folder)
+
                 # --------------------------------
                 # Handle auto-run analysis
                 # Conditions for starting auto-analysis:
@@ -706,18 +840,42 @@ def crawl(folders, logger):
             logger.errors.exception(traceback.format_exc())
 
     logger.current_folder = "(none)"
+    if index is not None:
+        index.save()
+
+
+def process_events(logger, index, watcher, start, delay):
+    """Process run folders queued by ``watcher`` until delay seconds past
+    start, when the next full crawl is due."""
+    while True:
+        remaining = delay - tdelt2secs(datetime.datetime.now() - start)
+        if remaining <= 0:
+            break
+        folders = watcher.wait(remaining)
+        if folders:
+            connection.close()  # Close any db connection to force new one.
+            logger.set_state("working")
+            crawl(folders, logger, index)
+            logger.set_state("sleeping")
+            db.reset_queries()
 
 
-def loop(logger, end_event, delay):
-    """Outer loop of the crawl thread, calls ``crawl`` every minute."""
+def loop(logger, end_event, delay, watcher=None):
+    """Outer loop of the crawl thread, calls ``crawl`` every ``delay`` seconds.
+    With a ``CrawlWatcher``, runs with inotify activity are processed as soon
+    as it is reported and the full crawl is a low-frequency safety net."""
     logger.start()
+    index = CrawlIndex(settings.CRAWLER_INDEX)
+    index.load()
     while not end_event.isSet():
         connection.close()  # Close any db connection to force new one.
+        start = datetime.datetime.now()
         try:
             logger.set_state("working")
-            start = datetime.datetime.now()
-            folders = construct_crawl_directories(logger)
-            crawl(folders, logger)
+            folders = construct_crawl_directories(logger, index)
+            crawl(folders, logger, index)
+            if watcher is not None:
+                watcher.watch_folders(index.rigs.keys(), folders)
             logger.set_state("sleeping")
 
         except KeyboardInterrupt:
@@ -725,8 +883,17 @@ def loop(logger, end_event, delay):
         except:
             logger.errors.error(traceback.format_exc())
             logger.set_state("error")
-        sleep_delay(start, datetime.datetime.now(), delay)
         db.reset_queries()
+        if watcher is None:
+            sleep_delay(start, datetime.datetime.now(), delay)
+        else:
+            try:
+                process_events(logger, index, watcher, start, delay)
+            except KeyboardInterrupt:
+                end_event.set()
+            except:
+                logger.errors.error(traceback.format_exc())
+                logger.set_state("error")
     sys.exit(0)
 
 
@@ -750,8 +917,18 @@ def main(args):
     if logger.disableautoanalysis:
         logger.errors.info("Auto-Analysis has been disabled")
 
+    watcher = None
+    delay = settings.CRAWLER_PERIOD
+    if args.watch:
+        if inotify is None:
+            logger.errors.warn("inotify is not available, using polling crawl")
+        else:
+            watcher = CrawlWatcher(logger)
+            delay = settings.CRAWLER_WATCH_PERIOD
+            logger.errors.info("Watching run folders with inotify")
+
     exit_event = threading.Event()
-    loopfunc = lambda: loop(logger, exit_event, settings.CRAWLER_PERIOD)
+    loopfunc = lambda: loop(logger, exit_event, delay, watcher)
     lthread = threading.Thread(target=loopfunc)
     lthread.setDaemon(True)
     lthread.start()
@@ -777,6 +954,12 @@ if __name__ == "__main__":
         default=False,
         help="Disable launching analysis when new experiment data is detected",
     )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        default=settings.CRAWLER_WATCH,
+        help="Process runs on inotify events; full crawl every CRAWLER_WATCH_PERIOD seconds",
+    )
 
     args = parser.parse_args()
     sys.exit(main(args))
@@ -2,12 +2,11 @@
 # Copyright (C) 2014 Ion Torrent Systems, Inc. All Rights Reserved
 """
 There is a single cached.filelist file in the report directory.  All four file categories
-use this file.
+use this file.  It is a manifest of directory listings, see dm_filelist.FileListManifest.
 """
 import os
 import sys
 import argparse
-from cPickle import Unpickler
 
 from iondb.bin import djangoinit
 from iondb.rundb import models
@@ -17,6 +16,7 @@ try:
     from dm_utils import get_walk_filelist, _file_selector
 except Exception:
     from iondb.rundb.data.dm_utils import get_walk_filelist, _file_selector
+from iondb.rundb.data.dm_filelist import FileListManifest
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
 
 
@@ -53,13 +53,10 @@ def validate_result(result, filter_plugins=True, print_files=False, write_file=F
     dmfs = result.get_filestat(dmtypes.SIG)
 
     # Get the cached filelist from cached.filelist file
-    try:
-        with open(path_to_file, "rb") as fhandle:
-            pickle = Unpickler(fhandle)
-            cached_filelist = pickle.load()
-    except IOError as ioerror:
-        print("%s" % ioerror)
+    if not os.path.isfile(path_to_file):
+        print("No such file: %s" % path_to_file)
         return None
+    cached_filelist = FileListManifest(path_to_report_dir).filelist()
 
     # Get a list of files on the filesystem currently
     dirs = [dmfs.result.get_report_dir(), dmfs.result.experiment.expDir]
@@ -22,10 +22,17 @@ from djangoinit import settings
 from iondb.plugins.runner import PluginRunner
 from iondb.plugins.manager import pluginmanager
 from iondb.plugins.launch_utils import get_plugins_to_run, add_hold_jid
-from iondb.plugins.plugin_json import make_plugin_json
-
-from iondb.rundb.models import Results, PluginResult, PluginResultJob, User, Plugin
-from django.db import IntegrityError
+from iondb.plugins.plugin_json import make_plugin_json, make_result_context
+
+from iondb.rundb.models import (
+    GlobalConfig,
+    Results,
+    PluginResult,
+    PluginResultJob,
+    User,
+    Plugin,
+)
+from django.db import IntegrityError, transaction
 
 from ion.plugin.constants import Feature, RunLevel
 
@@ -306,6 +313,9 @@ class PluginServer(object):
             result = Results.objects.get(pk=result_pk)
             report_dir = result.get_report_dir()
             url_root = result.reportWebLink()
+            gc = GlobalConfig.get()
+            # ion_params, expmeta, plan etc. are the same for all the plugins
+            context = make_result_context(result_pk, report_dir, result)
 
             # get pluginresult owner - must be a valid TS user
             try:
@@ -317,8 +327,82 @@ class PluginServer(object):
                     % (username, user.username)
                 )
 
-            for name in plugins_to_run:
-                try:
+            # The jobs are held until their PluginResultJob is created, all
+            # at once when the PluginResults of the launch are committed
+            queued_jobs = []
+            committed = False
+            try:
+                with transaction.atomic():
+                    msg += self._launch_plugins(
+                        plugins,
+                        plugins_to_run,
+                        satisfied_dependencies,
+                        result,
+                        report_dir,
+                        url_root,
+                        gc,
+                        context,
+                        user,
+                        net_location,
+                        username,
+                        runlevel,
+                        params,
+                        queued_jobs,
+                    )
+                    PluginResultJob.objects.bulk_create(
+                        [prj for prj, jid in queued_jobs]
+                    )
+                committed = True
+            finally:
+                # Release now that jobid and queued state are set, jobs whose
+                # pluginresult was rolled back are removed
+                action = (
+                    drmaa.JobControlAction.RELEASE
+                    if committed
+                    else drmaa.JobControlAction.TERMINATE
+                )
+                for prj, jid in queued_jobs:
+                    try:
+                        _session.control(jid, action)  # no return value
+                    except Exception:
+                        logger.error(
+                            "Failed to %s SGE job %s: %s"
+                            % (action, jid, traceback.format_exc())
+                        )
+        except Exception:
+            logger.error(traceback.format_exc())
+            msg += "ERROR: Failed to launch requested plugins."
+
+        return plugins, msg
+
+    def _launch_plugins(
+        self,
+        plugins,
+        plugins_to_run,
+        satisfied_dependencies,
+        result,
+        report_dir,
+        url_root,
+        gc,
+        context,
+        user,
+        net_location,
+        username,
+        runlevel,
+        params,
+        queued_jobs,
+    ):
+        """
+        Submit held jobs for plugins_to_run, appending (PluginResultJob, jobid)
+        to queued_jobs, with the PluginResultJobs still to be saved
+        """
+        msg = ""
+        result_pk = result.pk
+        for name in plugins_to_run:
+            jid = None
+            queued = None
+            try:
+                with transaction.atomic():
                     p = plugins[name]
                     # get params for this plugin, make empty json value if doesn't exist
                     plugin_params = params.setdefault("plugins", {}).setdefault(
@@ -345,8 +429,9 @@ class PluginServer(object):
                     # Create new pluginresult - this is the most common path
                     if not pr:
                         pr = PluginResult.objects.create(
-                            result_id=result_pk, plugin_id=p["id"], owner=user
+                            result=result, plugin_id=p["id"], owner=user
                         )
+                        pr._gc = gc
                         logger.debug(
                             "New pluginresult id=%s created for plugin %s and result %s."
                             % (pr.pk, name, result.resultsName)
@@ -356,6 +441,7 @@ class PluginServer(object):
                         plugin_output = pr.path(create=True, fallback=False)
                     else:
                         # Use existing output folder
+                        pr._gc = gc
                         plugin_output = pr.path(create=False)
 
                     p["results_dir"] = plugin_output
@@ -376,6 +462,7 @@ class PluginServer(object):
                         params.get("blockId", ""),
                         params.get("block_dirs", ["."]),
                         plugin_params.get("instance_config", {}),
+                        context,
                     )
 
                     # Pass on run_mode (launch source - manual/instance, pipeline)
@@ -427,19 +514,14 @@ class PluginServer(object):
 
                     if jid:
                         # Update pluginresult status
-                        prj, created = PluginResultJob.objects.get_or_create(
+                        prj = PluginResultJob(
                             plugin_result=pr,
                             run_level=runlevel,
                             grid_engine_jobid=jid,
                             state="Queued",
                             config=start_json["pluginconfig"],
                         )
-                        prj.save()
-
-                        # Release now that jobid and queued state are set.
-                        _session.control(
-                            jid, drmaa.JobControlAction.RELEASE
-                        )  # no return value
+                        queued = (prj, jid)
 
                     msg += (
                         "Plugin: %s result: %s, jid %s, depends %s, holding for %s \n"
@@ -457,15 +539,24 @@ class PluginServer(object):
                     else:
                         p.setdefault("block_jid", []).append(jid)
 
-                except Exception as exc:
-                    logger.error(traceback.format_exc())
-                    msg += "ERROR: Plugin %s failed to launch.\n" % p["name"]
-                    pr = PluginResult.objects.get(pk=pr.pk)
-        except Exception:
-            logger.error(traceback.format_exc())
-            msg += "ERROR: Failed to launch requested plugins."
+                # only queued once its PluginResult savepoint is released
+                if queued:
+                    queued_jobs.append(queued)
+
+            except Exception as exc:
+                logger.error(traceback.format_exc())
+                msg += "ERROR: Plugin %s failed to launch.\n" % name
+                if jid:
+                    # held job of a rolled back PluginResult
+                    try:
+                        _session.control(jid, drmaa.JobControlAction.TERMINATE)
+                    except Exception:
+                        logger.error(
+                            "Failed to terminate SGE job %s: %s"
+                            % (jid, traceback.format_exc())
+                        )
 
-        return plugins, msg
+        return msg
 
     def sgeStop(self, jobid):
         """
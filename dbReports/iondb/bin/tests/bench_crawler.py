@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# Copyright (C) 2018 Ion Torrent Systems, Inc. All Rights Reserved
+"""
+Benchmark a crawl pass over a synthetic rig folder.
+
+Builds a rig folder with ``--runs`` run folders, of which all but
+``--incomplete`` are treated as complete in the (simulated) database, and times
+
+* the legacy pass: listdir + isdir + linear scan of the experiment list
+* a cold indexed pass: empty CrawlIndex
+* a warm indexed pass: rig folder unchanged since the previous pass
+
+No database is needed; the experiment table is simulated in memory.
+
+    python -m iondb.bin.tests.bench_crawler --runs 10000
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from iondb.utils.crawl_index import CrawlIndex
+
+DONE = "Complete"
+
+
+def make_tree(root, runs):
+    rig_folder = os.path.join(root, "rig1")
+    os.mkdir(rig_folder)
+    for i in range(runs):
+        os.mkdir(os.path.join(rig_folder, "R_2018_01_01_%05d_run" % i))
+    return rig_folder
+
+
+def legacy_pass(rig_folder, explist):
+    def dbase_isComplete(name, explist):
+        for item in explist:
+            if name == item[0]:
+                if item[1] == DONE:
+                    return True
+        return False
+
+    s1 = [os.path.join(rig_folder, subd) for subd in os.listdir(rig_folder)]
+    s2 = [subd for subd in s1 if os.path.isdir(subd)]
+    return [subd for subd in s2 if dbase_isComplete(subd, explist) is False]
+
+
+def indexed_pass(index, rig_folder, done_set):
+    def lookup_complete(candidates):
+        return [c for c in candidates if c in done_set]
+
+    return index.pending(index.list_rig(rig_folder), lookup_complete)
+
+
+def timed(func, *args):
+    start = time.time()
+    ret = func(*args)
+    return time.time() - start, ret
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark a crawl pass")
+    parser.add_argument("--runs", type=int, default=10000)
+    parser.add_argument("--incomplete", type=int, default=5)
+    parser.add_argument(
+        "--skip-legacy", action="store_true", help="do not time the legacy pass"
+    )
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="bench_crawler_")
+    try:
+        rig_folder = make_tree(root, args.runs)
+        subdirs = sorted(os.path.join(rig_folder, d) for d in os.listdir(rig_folder))
+        explist = [
+            (d, "0" if i < args.incomplete else DONE) for i, d in enumerate(subdirs)
+        ]
+        done_set = set(d for d, status in explist if status == DONE)
+
+        index = CrawlIndex(os.path.join(root, "crawler_index.json"))
+        cold, pending = timed(indexed_pass, index, rig_folder, done_set)
+        index.save()
+        index = CrawlIndex(index.filename)
+        index.load()
+        warm, warm_pending = timed(indexed_pass, index, rig_folder, done_set)
+        assert sorted(pending) == sorted(warm_pending)
+
+        print("runs: %d  incomplete: %d" % (args.runs, len(pending)))
+        if not args.skip_legacy:
+            legacy, legacy_pending = timed(legacy_pass, rig_folder, explist)
+            assert sorted(pending) == sorted(legacy_pending)
+            print("legacy pass:       %8.3f s" % legacy)
+        print("cold indexed pass: %8.3f s" % cold)
+        print("warm indexed pass: %8.3f s" % warm)
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+# Copyright (C) 2018 Ion Torrent Systems, Inc. All Rights Reserved
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from django.test import SimpleTestCase
+from twisted.python import filepath
+
+from iondb.bin import crawler
+
+inotify = crawler.inotify
+
+
+class FakeINotify(object):
+    """Records watches instead of asking the kernel, events are delivered by
+    calling ``event``"""
+
+    def __init__(self):
+        self.callbacks = {}
+        self.watched = []
+        self.ignored = []
+
+    def startReading(self):
+        pass
+
+    def watch(self, path, mask, callbacks):
+        self.callbacks[path.path] = callbacks[0]
+        self.watched.append(path.path)
+
+    def ignore(self, path):
+        del self.callbacks[path.path]
+        self.ignored.append(path.path)
+
+    def event(self, path, mask):
+        """Deliver an event about path to the watch of its folder"""
+        self.callbacks[os.path.dirname(path)](None, filepath.FilePath(path), mask)
+
+
+class FakeLog(object):
+    def __init__(self):
+        self.errors = logging.getLogger(__name__)
+        self.states = []
+
+    def start(self):
+        pass
+
+    def set_state(self, state):
+        self.states.append(state)
+
+
+@unittest.skipIf(inotify is None, "inotify is not available")
+class CrawlWatcherTest(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.rigs = []
+        self.runs = []
+        for rig in ["rig1", "rig2"]:
+            self.rigs.append(os.path.join(self.tmpdir, rig))
+            for run in ["R_1", "R_2"]:
+                self.runs.append(os.path.join(self.tmpdir, rig, run))
+                os.makedirs(self.runs[-1])
+        os.mkdir(os.path.join(self.runs[0], "thumbnail"))
+
+        saved = inotify.INotify
+        inotify.INotify = FakeINotify
+        try:
+            self.watcher = crawler.CrawlWatcher(FakeLog())
+        finally:
+            inotify.INotify = saved
+        self.notifier = self.watcher.notifier
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def queued(self):
+        return self.watcher.wait(0, settle=0)
+
+    def test_update_watches(self):
+        self.watcher._update_watches(set(self.rigs), set(self.runs))
+        thumbnail = os.path.join(self.runs[0], "thumbnail")
+        self.assertEqual(
+            sorted(self.notifier.watched), sorted(self.rigs + self.runs + [thumbnail])
+        )
+
+        # after the next full crawl only the changes are applied
+        new_rig = os.path.join(self.tmpdir, "rig3")
+        new_run = os.path.join(new_rig, "R_1")
+        os.makedirs(new_run)
+        del self.notifier.watched[:]
+        self.watcher._update_watches(
+            set([self.rigs[0], new_rig]), set(self.runs[1:] + [new_run])
+        )
+        self.assertEqual(sorted(self.notifier.watched), [new_rig, new_run])
+        self.assertEqual(
+            sorted(self.notifier.ignored),
+            sorted([self.rigs[1], self.runs[0], thumbnail]),
+        )
+        self.assertEqual(self.queued(), [])
+
+    def test_rig_events(self):
+        self.watcher._update_watches(set(self.rigs), set(self.runs))
+        new_run = os.path.join(self.rigs[0], "R_3")
+        os.mkdir(new_run)
+        self.notifier.event(new_run, inotify.IN_CREATE | inotify.IN_ISDIR)
+        # a file in a rig folder and a run folder already watched
+        self.notifier.event(os.path.join(self.rigs[0], "notes.txt"), inotify.IN_CREATE)
+        self.notifier.event(self.runs[1], inotify.IN_MOVED_TO | inotify.IN_ISDIR)
+        self.assertEqual(self.queued(), [new_run])
+        self.assertEqual(self.notifier.watched.count(new_run), 1)
+        self.assertEqual(self.notifier.watched.count(self.runs[1]), 1)
+
+        # the new run folder is watched for its files
+        self.notifier.event(
+            os.path.join(new_run, crawler.LOG_BASENAME), inotify.IN_CLOSE_WRITE
+        )
+        self.assertEqual(self.queued(), [new_run])
+
+    def test_run_events(self):
+        self.watcher._update_watches(set(self.rigs), set(self.runs))
+        run, other = self.runs[0], self.runs[2]
+        self.notifier.event(os.path.join(run, "acq_0000.dat"), inotify.IN_CLOSE_WRITE)
+        self.notifier.event(os.path.join(run, "acq_0001.dat"), inotify.IN_CLOSE_WRITE)
+        self.notifier.event(
+            os.path.join(other, crawler.LOG_FINAL_BASENAME), inotify.IN_MOVED_TO
+        )
+        self.notifier.event(os.path.join(run, "InitLog.txt"), inotify.IN_CLOSE_WRITE)
+        self.assertEqual(self.queued(), sorted([run, other]))
+
+        # nothing new since
+        self.notifier.event(os.path.join(run, "InitLog.txt"), inotify.IN_CLOSE_WRITE)
+        self.assertEqual(self.queued(), [])
+
+        # thumbnail files queue their run folder
+        self.notifier.event(
+            os.path.join(run, "thumbnail", "acq_0000.dat"), inotify.IN_CLOSE_WRITE
+        )
+        self.assertEqual(self.queued(), [run])
+        thumbnail = os.path.join(self.runs[1], "thumbnail")
+        os.mkdir(thumbnail)
+        self.notifier.event(thumbnail, inotify.IN_CREATE | inotify.IN_ISDIR)
+        self.assertEqual(self.queued(), [])
+        self.notifier.event(
+            os.path.join(thumbnail, crawler.LOG_BASENAME), inotify.IN_CLOSE_WRITE
+        )
+        self.assertEqual(self.queued(), [self.runs[1]])
+
+    def test_wait_wakes_up(self):
+        run = self.runs[0]
+        timer = threading.Timer(0.1, self.watcher.queue, [run])
+        timer.start()
+        start = time.time()
+        self.assertEqual(self.watcher.wait(10, settle=0), [run])
+        self.assertTrue(time.time() - start < 5)
+        timer.join()
+
+
+class FakeWatcher(object):
+    """Reports ``folders`` every ``interval`` seconds"""
+
+    def __init__(self, folders, interval):
+        self.folders = folders
+        self.interval = interval
+        self.watch_calls = []
+
+    def watch_folders(self, rig_folders, run_folders):
+        self.watch_calls.append((sorted(rig_folders), list(run_folders)))
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        return list(self.folders) if timeout >= self.interval else []
+
+
+class FakeIndex(object):
+    rigs = {"/rawdata/rig1": None}
+
+    def __init__(self, *args):
+        pass
+
+    def load(self):
+        pass
+
+
+class Stub(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class CrawlLoopTest(SimpleTestCase):
+    FULL_CRAWL = ["/rawdata/rig1/R_1", "/rawdata/rig1/R_2"]
+    EVENTS = ["/rawdata/rig1/R_2"]
+
+    def setUp(self):
+        self.crawled = []
+        self.full_crawls = 0
+        self.end_event = threading.Event()
+        self.saved = dict(
+            (name, getattr(crawler, name))
+            for name in [
+                "construct_crawl_directories",
+                "crawl",
+                "CrawlIndex",
+                "connection",
+                "db",
+                "settings",
+            ]
+        )
+        crawler.construct_crawl_directories = self.construct_crawl_directories
+        crawler.crawl = lambda folders, logger, index: self.crawled.append(folders)
+        crawler.CrawlIndex = FakeIndex
+        crawler.connection = Stub(close=lambda: None)
+        crawler.db = Stub(reset_queries=lambda: None)
+        crawler.settings = Stub(CRAWLER_INDEX=None)
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(crawler, name, value)
+
+    def construct_crawl_directories(self, logger, index):
+        self.full_crawls += 1
+        if self.full_crawls == 3:
+            self.end_event.set()
+        self.crawled.append("full")
+        return list(self.FULL_CRAWL)
+
+    def test_process_events_until_full_crawl(self):
+        # a steady stream of events does not hold off the next full crawl
+        watcher = FakeWatcher(self.EVENTS, 0.02)
+        start = crawler.datetime.datetime.now()
+        crawler.process_events(FakeLog(), FakeIndex(), watcher, start, 0.3)
+        elapsed = crawler.tdelt2secs(crawler.datetime.datetime.now() - start)
+        self.assertTrue(0.3 <= elapsed < 2, elapsed)
+        self.assertTrue(len(self.crawled) > 3)
+        self.assertEqual(self.crawled, [self.EVENTS] * len(self.crawled))
+
+    def test_loop_full_crawls(self):
+        watcher = FakeWatcher(self.EVENTS, 0.05)
+        start = time.time()
+        self.assertRaises(
+            SystemExit, crawler.loop, FakeLog(), self.end_event, 0.2, watcher
+        )
+        self.assertTrue(time.time() - start >= 3 * 0.2)
+        self.assertEqual(self.full_crawls, 3)
+        # each full crawl crawls every pending run and updates the watches,
+        # runs reported in between are crawled alone
+        full = [i for i, folders in enumerate(self.crawled) if folders == "full"]
+        self.assertEqual(len(full), 3)
+        for i in full:
+            self.assertEqual(self.crawled[i + 1], self.FULL_CRAWL)
+        events = [
+            folders
+            for i, folders in enumerate(self.crawled)
+            if folders != "full" and i - 1 not in full
+        ]
+        self.assertTrue(events)
+        self.assertEqual(events, [self.EVENTS] * len(events))
+        self.assertEqual(
+            watcher.watch_calls, [(["/rawdata/rig1"], self.FULL_CRAWL)] * 3
+        )
+
+    def test_loop_without_watcher(self):
+        start = time.time()
+        self.assertRaises(SystemExit, crawler.loop, FakeLog(), self.end_event, 0.1)
+        self.assertTrue(time.time() - start >= 2 * 0.1)
+        self.assertEqual(self.crawled, ["full", self.FULL_CRAWL] * 3)
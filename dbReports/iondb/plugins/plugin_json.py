@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 # Copyright (C) 2011 Ion Torrent Systems, Inc. All Rights Reserved
+import copy
 import os
 import traceback
 import json
@@ -20,6 +21,7 @@ def get_runinfo(
     username,
     runlevel,
     blockId,
+    chipDescription=None,
 ):
 
     raw_data_dir = ion_params["pathToRaw"]
@@ -83,17 +85,22 @@ def get_runinfo(
         "systemType": ion_params.get("systemType", ""),
     }
 
-    try:
-        chipDescription = Chip.objects.filter(
-            name=ion_params.get("chipType", "")
-        ).values_list("description", flat=True)[0]
-    except Exception:
-        chipDescription = ""
+    if chipDescription is None:
+        chipDescription = get_chipDescription(ion_params)
     d["chipDescription"] = chipDescription
 
     return d
 
 
+def get_chipDescription(ion_params):
+    try:
+        return Chip.objects.filter(name=ion_params.get("chipType", "")).values_list(
+            "description", flat=True
+        )[0]
+    except Exception:
+        return ""
+
+
 def get_runplugin(ion_params, runlevel, blockId, block_dirs):
     d = {
         "run_type": ion_params.get("report_type", "unknown"),
@@ -302,6 +309,30 @@ def get_datamanagement(pk, result=None):
     return retval
 
 
+def make_result_context(primary_key, report_dir, result=None):
+    """The parts of the startplugin json that only depend on the result,
+    computed once and passed as context to make_plugin_json for each plugin
+    of a launch"""
+    try:
+        ion_params, warn = getparameter(os.path.join(report_dir, "ion_params_00.json"))
+    except Exception:
+        ion_params = getparameter_minimal(
+            os.path.join(report_dir, "ion_params_00.json")
+        )
+
+    return {
+        "primary_key": primary_key,
+        "report_dir": report_dir,
+        "ion_params": ion_params,
+        "chipDescription": get_chipDescription(ion_params),
+        "expmeta": get_expmeta(ion_params, report_dir, primary_key),
+        "chefSummary": get_chefSummary(ion_params, report_dir),
+        "globalconfig": get_globalconfig(),
+        "plan": get_plan(ion_params),
+        "datamanagement": get_datamanagement(primary_key, result),
+    }
+
+
 def make_plugin_json(
     primary_key,
     report_dir,
@@ -314,14 +345,17 @@ def make_plugin_json(
     blockId="",
     block_dirs=["."],
     instance_config={},
+    context=None,
 ):
-    try:
-        ion_params, warn = getparameter(os.path.join(report_dir, "ion_params_00.json"))
-    except Exception:
-        ion_params = getparameter_minimal(
-            os.path.join(report_dir, "ion_params_00.json")
-        )
-
+    if (
+        context is None
+        or context["primary_key"] != primary_key
+        or context["report_dir"] != report_dir
+    ):
+        context = make_result_context(primary_key, report_dir)
+    ion_params = context["ion_params"]
+
+    # each plugin gets its own copy, callers update the startplugin json
     json_obj = {
         "runinfo": get_runinfo(
             ion_params,
@@ -334,15 +368,16 @@ def make_plugin_json(
             username,
             runlevel,
             blockId,
+            context["chipDescription"],
         ),
         "runplugin": get_runplugin(ion_params, runlevel, blockId, block_dirs),
-        "expmeta": get_expmeta(ion_params, report_dir, primary_key),
-        "chefSummary": get_chefSummary(ion_params, report_dir),
+        "expmeta": copy.deepcopy(context["expmeta"]),
+        "chefSummary": copy.deepcopy(context["chefSummary"]),
         "pluginconfig": get_pluginconfig(plugin, instance_config),
-        "globalconfig": get_globalconfig(),
-        "plan": get_plan(ion_params),
-        "sampleinfo": ion_params.get("sampleInfo", {}),
-        "datamanagement": get_datamanagement(primary_key),
+        "globalconfig": copy.deepcopy(context["globalconfig"]),
+        "plan": copy.deepcopy(context["plan"]),
+        "sampleinfo": copy.deepcopy(ion_params.get("sampleInfo", {})),
+        "datamanagement": copy.deepcopy(context["datamanagement"]),
     }
     # IonReporterUploader_V1_0 compatibility shim
     if plugin["name"] == "IonReporterUploader_V1_0" and plugin.get("userInput", ""):
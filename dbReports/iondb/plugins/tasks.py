@@ -5,6 +5,7 @@ from __future__ import absolute_import
 import os
 import logging
 import traceback
+from itertools import groupby
 
 import iondb.celery
 from django.conf import settings
@@ -12,6 +13,8 @@ from celery.task import task, group
 from celery.result import ResultSet
 from celery.utils.log import get_task_logger
 
+from iondb.rundb.data import disk_usage
+
 log = logging.getLogger(__name__)
 logger = get_task_logger(__name__)
 
@@ -196,27 +199,41 @@ def backfill_pluginresult_diskusage():
     log.addHandler(handler)
     log.info("\n===== New Run =====")
     log.info("PluginResults:")
-    obj_list = models.PluginResultJob.objects.filter(
-        Q(plugin_result__size=-1) | Q(plugin_result__inodes=-1),
-        state__in=("Complete", "Error"),
-        starttime__gte=(timezone.now() - timedelta(days=30)),
-    )
-    for obj in obj_list:
-        try:
-            obj.UpdateSizeAndINodeCount()
-        except OSError:
-            obj.size, obj.inodes = -1
-            obj.save(update_fields=["size", "inodes"])
-        except:
-            log.exception(traceback.format_exc())
-
-        log.debug(
-            "Scanned: %s at %s -- %d (%d)",
-            str(obj),
-            obj.default_path,
-            obj.size,
-            obj.inodes,
+    obj_list = (
+        models.PluginResult.objects.filter(
+            Q(size=-1) | Q(inodes=-1),
+            plugin_result_jobs__state__in=("Completed", "Error"),
+            plugin_result_jobs__starttime__gte=(timezone.now() - timedelta(days=30)),
         )
+        .distinct()
+        .select_related("result", "plugin")
+        .order_by("result")
+    )
+    # scan the plugin folders of each report together
+    for _, objs in groupby(obj_list, key=lambda obj: obj.result_id):
+        objs = list(objs)
+        paths = [
+            obj.default_path
+            for obj in objs
+            if obj.default_path and os.path.exists(obj.default_path)
+        ]
+        usage = disk_usage.scan(paths)
+        for obj in objs:
+            try:
+                obj.UpdateSizeAndINodeCount(usage=usage)
+            except OSError:
+                obj.size, obj.inodes = -1, -1
+                obj.save(update_fields=["size", "inodes"])
+            except:
+                log.exception(traceback.format_exc())
+
+            log.debug(
+                "Scanned: %s at %s -- %d (%d)",
+                str(obj),
+                obj.default_path,
+                obj.size,
+                obj.inodes,
+            )
 
 
 @task
@@ -247,13 +264,13 @@ def calc_size(prid):
                 obj.inodes,
             )
             return
-        obj.size, obj.inodes = obj._calc_size
+        obj.size, obj.inodes = disk_usage.get_size_and_inodes(d)
         log.debug("Scanning: %s at %s -- %d (%d)", str(obj), d, obj.size, obj.inodes)
     except OSError:
         log.exception(
             "Failed to compute plugin size: %s at '%s'", str(obj), obj.default_path
         )
-        obj.size, obj.inodes = -1
+        obj.size, obj.inodes = -1, -1
     except:
         log.exception(traceback.format_exc())
     finally:
@@ -48,7 +48,7 @@ from iondb.rundb import models, forms, tasks, json_field
 from iondb.rundb.configure.genomes import get_references
 from iondb.rundb.json_lazy import LazyJSONEncoder
 from iondb.rundb.labels import IonMeshNodeStatus
-from iondb.rundb.data import dmactions_types
+from iondb.rundb.data import dmactions_types, disk_usage
 from iondb.rundb.plan import plan_validator
 from iondb.rundb.plan.chef_flexible_workflow_validator import (
     ChefFlexibleWorkflowValidator,
@@ -3214,7 +3214,7 @@ class PluginResultResource(ModelResource):
         bundle = self.build_bundle(request=request)
         obj = self.cached_obj_get(bundle, **self.remove_api_resource_names(kwargs))
         try:
-            size, inodes = obj._calc_size
+            size, inodes = disk_usage.get_size_and_inodes(obj.default_path)
             if size > 0:
                 obj.size = size
                 obj.inodes = inodes
@@ -5447,14 +5447,25 @@ class CompositeExperimentResource(ModelResource):
     def dispatch_show(self, request, **kwargs):
         return self.dispatch("show", request, **kwargs)
 
-    def get_composite_applCatDisplayedName(self, bundle):
-
-        if bundle.obj and bundle.obj.plan:
-            categoryDisplayedName = bundle.obj.plan.get_composite_applCatDisplayedName()
-        else:
-            categoryDisplayedName = ""
+    @staticmethod
+    def get_displayed_name_lookups(request):
+        """
+        PlannedExperiment.get_displayed_name_lookups(), loaded once per request
+        instead of once per experiment row
+        """
+        lookups = getattr(request, "_composite_displayed_names", None)
+        if lookups is None:
+            lookups = models.PlannedExperiment.get_displayed_name_lookups()
+            if request is not None:
+                request._composite_displayed_names = lookups
+        return lookups
 
-        return categoryDisplayedName
+    def get_composite_applCatDisplayedName(self, bundle):
+        if not (bundle.obj and bundle.obj.plan):
+            return ""
+        return bundle.obj.plan.get_composite_applCatDisplayedName(
+            self.get_displayed_name_lookups(bundle.request)
+        )
 
     def dehydrate(self, bundle):
         # We used result_status to filter out experiments before. But if we picked 'Completed' we would get all exps
@@ -5527,9 +5538,12 @@ class CompositeExperimentResource(ModelResource):
         ] = self.get_composite_applCatDisplayedName(bundle)
 
         if bundle.obj.plan:
-            sampleSets = bundle.obj.plan.sampleSets.order_by("displayedName")
+            # sampleSets are prefetched, sort here rather than query again
             bundle.data["sampleSetName"] = ",".join(
-                sampleSets.values_list("displayedName", flat=True)
+                sorted(
+                    sampleSet.displayedName
+                    for sampleSet in bundle.obj.plan.sampleSets.all()
+                )
             )
         else:
             bundle.data["sampleSetName"] = ""
@@ -5646,16 +5660,19 @@ class CompositeExperimentResource(ModelResource):
         #   select_related/prefetch_related to minimize number of dbase queries
         #   use only() or defer() to defer fields and reduce query size
         queryset = (
-            models.Experiment.objects.select_related("plan")
+            models.Experiment.objects.select_related("plan", "plan__latestEAS")
             .prefetch_related(
+                "repResult",
                 "results_set",
                 "results_set__analysismetrics",
                 "results_set__libmetrics",
                 "results_set__qualitymetrics",
                 "results_set__eas",
+                "results_set__eas__experiment",
                 "results_set__projects",
                 "results_set__dmfilestat_set",
                 "samples",
+                "plan__sampleSets",
             )
             .exclude(expName="NONE_ReportOnly_NONE")
             .order_by("-resultDate")
@@ -5673,6 +5690,13 @@ class CompositeExperimentResource(ModelResource):
                 "runMode",
                 "expName",
                 "date",
+                "displayName",
+                "ftpStatus",
+                "status",
+                "storage_options",
+                "chefReagentsSerialNum",
+                "chefSolutionsSerialNum",
+                "chefStartTime",
             )
         )
 
@@ -0,0 +1,212 @@
+# Copyright (C) 2018 Ion Torrent Systems, Inc. All Rights Reserved
+"""
+Parallel disk usage scanner for report and plugin output trees.
+
+Directories are listed with scandir and every non-directory entry is lstat'ed
+exactly once; its size is counted and it is counted as one inode.  Links are
+never followed, so a link counts as one inode of its own (link) size.  The
+directories are fanned out over a pool of threads, since on NFS the cost of a
+scan is the latency of each listing and stat, not CPU.
+
+The result holds the bytes and inodes of every directory scanned, so a single
+scan of a report directory answers for every subtree under it: the DMFileStat
+diskspace of each file set and the size of each PluginResult.
+
+When the report's file list is needed as well, walk() takes the directory
+listings from the dm_filelist manifest of the walk and only lstats the files,
+so each tree is walked once and unchanged directories are not listed again.
+"""
+
+from __future__ import absolute_import
+import os
+import stat
+import errno
+from multiprocessing.pool import ThreadPool
+from celery.utils.log import get_task_logger
+
+from iondb.rundb.data.dm_filelist import FileListManifest, scandir, walk_filelist
+
+# Send logging to data_management log file
+logger = get_task_logger("data_management")
+logid = {"logid": "%s" % ("disk_usage")}
+
+DEFAULT_WORKERS = 8
+
+
+def _scan_dir(path):
+    """Returns (path, files, subdirs, error) for a single directory.
+    files is a list of (path, size, islink) of its non-directory entries."""
+    files = []
+    subdirs = []
+    try:
+        for entry in scandir(path):
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                    continue
+                st = entry.stat(follow_symlinks=False)
+            except OSError as err:
+                if err.errno == errno.ENOENT:
+                    continue  # removed while scanning
+                raise
+            files.append((entry.path, st.st_size, stat.S_ISLNK(st.st_mode)))
+    except OSError as err:
+        return path, files, subdirs, err
+    return path, files, subdirs, None
+
+
+class DiskUsage(object):
+    """Bytes and inodes found by a scan, per directory and per file"""
+
+    def __init__(self):
+        self.dirs = {}  # directory -> (bytes, inodes) of its own entries
+        self.files = {}  # file -> size, links are 0
+        self.errors = []  # (directory, OSError)
+        self._totals = None
+
+    def add(self, path, files, error=None):
+        nbytes = 0
+        for filepath, size, islink in files:
+            nbytes += size
+            self.files[filepath] = 0 if islink else size
+        self.dirs[path] = (nbytes, len(files))
+        if error is not None:
+            self.errors.append((path, error))
+        self._totals = None
+
+    def scanned(self, path):
+        """True if directory path was part of the scan"""
+        return os.path.normpath(path) in self.dirs
+
+    def total(self, path):
+        """Returns (bytes, inodes) of the subtree rooted at directory path,
+        (0, 0) if it was not scanned"""
+        if self._totals is None:
+            self._totals = self._rollup()
+        return self._totals.get(os.path.normpath(path), (0, 0))
+
+    def file_size(self, path):
+        """Returns the size of file path, 0 for a link, None if not scanned"""
+        return self.files.get(path)
+
+    def _rollup(self):
+        totals = {}
+        for path, (nbytes, inodes) in self.dirs.items():
+            parent = path
+            while True:
+                subtotal = totals.get(parent, (0, 0))
+                totals[parent] = (subtotal[0] + nbytes, subtotal[1] + inodes)
+                upper = os.path.dirname(parent)
+                if upper == parent or upper not in self.dirs:
+                    break
+                parent = upper
+        return totals
+
+
+def scan(paths, workers=DEFAULT_WORKERS):
+    """Scan the directory trees in paths and return a DiskUsage.
+    Missing or unreadable directories are recorded in DiskUsage.errors."""
+    usage = DiskUsage()
+    seen = set()
+    todo = []
+    for path in paths:
+        path = os.path.normpath(path)
+        if path not in seen:
+            seen.add(path)
+            todo.append(path)
+    tops = set(todo)
+
+    def _collect(ret):
+        path, files, subdirs, error = ret
+        usage.add(path, files, error)
+        if error is not None and not (path in tops and error.errno == errno.ENOENT):
+            logger.warn("Unable to scan %s: %s" % (path, error), extra=logid)
+        subdirs = [d for d in subdirs if d not in seen]
+        seen.update(subdirs)
+        return subdirs
+
+    if workers <= 1:
+        while todo:
+            todo.extend(_collect(_scan_dir(todo.pop())))
+        return usage
+
+    pool = ThreadPool(workers)
+    try:
+        pending = [pool.apply_async(_scan_dir, (path,)) for path in todo]
+        while pending:
+            subdirs = _collect(pending.pop().get())
+            pending.extend(pool.apply_async(_scan_dir, (d,)) for d in subdirs)
+    finally:
+        pool.terminate()
+        pool.join()
+    return usage
+
+
+def _stat_files(job):
+    """Returns (path, files, error) for the entry names of directory path,
+    files as in _scan_dir"""
+    path, names = job
+    files = []
+    for name in names:
+        filepath = os.path.join(path, name)
+        try:
+            st = os.lstat(filepath)
+        except OSError as err:
+            if err.errno == errno.ENOENT:
+                continue  # removed since it was listed
+            return path, files, err
+        files.append((filepath, st.st_size, stat.S_ISLNK(st.st_mode)))
+    return path, files, None
+
+
+def from_manifest(manifest, paths, workers=DEFAULT_WORKERS):
+    """Returns a DiskUsage of the directory trees in paths from the listings
+    of manifest, a dm_filelist.FileListManifest which walked them.  No
+    directory is listed again, only their entries are lstat'ed.  As with
+    scan(), links to directories count as files and are not followed.
+    Directories the manifest has no listing of are left out."""
+    listings = dict(
+        (os.path.normpath(path), cached) for path, cached in manifest.dirs.items()
+    )
+    jobs = []
+    seen = set()
+    todo = [os.path.normpath(path) for path in paths]
+    while todo:
+        path = todo.pop()
+        if path in seen or path not in listings:
+            continue
+        seen.add(path)
+        files, subdirs, linkdirs = listings[path][2:]
+        jobs.append((path, files + linkdirs))
+        todo.extend(os.path.join(path, name) for name in subdirs)
+
+    if workers > 1 and len(jobs) > 1:
+        pool = ThreadPool(min(workers, len(jobs)))
+        try:
+            results = pool.map(_stat_files, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_stat_files(job) for job in jobs]
+
+    usage = DiskUsage()
+    for path, files, error in results:
+        usage.add(path, files, error)
+        if error is not None:
+            logger.warn("Unable to scan %s: %s" % (path, error), extra=logid)
+    return usage
+
+
+def walk(input_dirs, list_dir=None, save_list=True, workers=DEFAULT_WORKERS):
+    """Returns (filelist, usage): the dm_filelist.walk_filelist of input_dirs
+    with the manifest in list_dir, and the DiskUsage of input_dirs from the
+    listings of that same walk"""
+    manifest = FileListManifest(list_dir)
+    filelist = walk_filelist(input_dirs, save_list=save_list, manifest=manifest)
+    return filelist, from_manifest(manifest, input_dirs, workers)
+
+
+def get_size_and_inodes(path, workers=DEFAULT_WORKERS):
+    """Returns (bytes, inodes) of the directory tree at path"""
+    return scan([path], workers).total(path)
@@ -0,0 +1,348 @@
+# Copyright (C) 2018 Ion Torrent Systems, Inc. All Rights Reserved
+"""
+Directory walker with a persistent per-report file list manifest.
+
+Directories are listed with scandir, whose d_type tells files from
+directories without an extra stat per entry.  The manifest, stored as
+cached.filelist in the report directory, records the listing and mtime of
+every directory walked.  On the next walk a directory is only re-listed when
+its mtime changed, so once a report is analyzed typically only plugin_out
+subdirectories are listed again.
+
+A directory's mtime changes whenever an entry is added, removed or renamed in
+it, which makes it a safe validator for its listing.  Listings taken within
+RACY_SECONDS of the directory's mtime are not trusted, since a change in the
+same second would not move the mtime.
+"""
+
+from __future__ import absolute_import
+import os
+import sys
+import stat
+import time
+import errno
+import fcntl
+import json
+import numbers
+import traceback
+from celery.utils.log import get_task_logger
+
+try:
+    from os import scandir as _scandir
+except ImportError:
+    try:
+        from scandir import scandir as _scandir
+    except ImportError:
+        _scandir = None
+
+# Send logging to data_management log file
+logger = get_task_logger("data_management")
+logid = {"logid": "%s" % ("dm_filelist")}
+
+MANIFEST_NAME = "cached.filelist"
+MANIFEST_VERSION = 3
+RACY_SECONDS = 2
+
+
+class _DirEntry(object):
+    """Minimal scandir.DirEntry for systems without scandir"""
+
+    def __init__(self, path, name):
+        self.name = name
+        self.path = os.path.join(path, name)
+        self._lstat = None
+
+    def stat(self, follow_symlinks=True):
+        if follow_symlinks:
+            return os.stat(self.path)
+        if self._lstat is None:
+            self._lstat = os.lstat(self.path)
+        return self._lstat
+
+    def is_dir(self, follow_symlinks=True):
+        if follow_symlinks:
+            return os.path.isdir(self.path)
+        return stat.S_ISDIR(self.stat(follow_symlinks=False).st_mode)
+
+    def is_symlink(self):
+        return os.path.islink(self.path)
+
+
+def scandir(path):
+    """The DirEntry iterator of path: os.scandir, the scandir package on
+    python 2, or a listdir based fallback"""
+    if _scandir is not None:
+        return _scandir(path)
+    return (_DirEntry(path, name) for name in os.listdir(path))
+
+
+def _valid_name(name):
+    """This code address specific issue caused by bad plugin code: TS-9917"""
+    try:
+        name.decode("utf-8")
+    except AttributeError:
+        pass  # already unicode
+    except Exception:
+        return False
+    return True
+
+
+def scan_dir(path):
+    """Returns (files, subdirs, linkdirs) entry names of path.
+    files includes links to files and broken links, subdirs are the
+    directories to descend into and linkdirs the links to directories."""
+    files = []
+    subdirs = []
+    linkdirs = []
+    for entry in scandir(path):
+        name = entry.name
+        if not _valid_name(name):
+            logger.warn("Bad file in directory: %s" % path, extra=logid)
+            logger.warn("File is '%s'" % name, extra=logid)
+            continue
+        try:
+            isdir = entry.is_dir()
+        except OSError:
+            isdir = False
+        if not isdir:
+            files.append(name)
+        elif entry.is_symlink():
+            linkdirs.append(name)
+        else:
+            subdirs.append(name)
+    return files, subdirs, linkdirs
+
+
+def _checked_dirs(dirs):
+    """The directory listings of a loaded manifest, with str paths and names.
+    Raises ValueError unless dirs has the shape written by
+    FileListManifest.save, with absolute normalized paths and plain entry
+    names."""
+
+    def _str(value):
+        if not isinstance(value, str) and hasattr(value, "encode"):
+            value = value.encode("utf-8")  # unicode on python 2
+        if not isinstance(value, str):
+            raise ValueError("not a string: %r" % (value,))
+        return value
+
+    def _name(value):
+        value = _str(value)
+        if not value or "/" in value or value in (".", ".."):
+            raise ValueError("bad entry name: %r" % (value,))
+        return value
+
+    if not isinstance(dirs, dict):
+        raise ValueError("dirs is not a dict")
+    checked = {}
+    for path, cached in dirs.items():
+        path = _str(path)
+        if not os.path.isabs(path) or os.path.normpath(path) != path:
+            raise ValueError("bad directory path: %r" % (path,))
+        if not isinstance(cached, list) or len(cached) != 5:
+            raise ValueError("bad listing of %s" % path)
+        for value in cached[:2]:
+            if isinstance(value, bool) or not isinstance(value, numbers.Real):
+                raise ValueError("bad time in listing of %s" % path)
+        for names in cached[2:]:
+            if not isinstance(names, list):
+                raise ValueError("bad listing of %s" % path)
+        checked[path] = cached[:2] + [
+            [_name(name) for name in names] for names in cached[2:]
+        ]
+    return checked
+
+
+class FileListManifest(object):
+    """
+    Cached listings of the directories under a report, keyed by absolute
+    directory path: {path: [mtime, scantime, files, subdirs, linkdirs]}.
+    It is stored as json, report directories are writable by plugins.
+    """
+
+    def __init__(self, list_dir=None):
+        self.filename = os.path.join(list_dir, MANIFEST_NAME) if list_dir else ""
+        self.dirs = {}
+        self.dirty = False
+        self.rescanned = 0
+        self.load()
+
+    def load(self):
+        """Read the manifest.  A missing, unreadable, partially written,
+        malformed or old format file leaves the manifest empty, forcing a full
+        walk."""
+        if not self.filename or not os.path.isfile(self.filename):
+            return
+        try:
+            with open(self.filename, "rb") as fileh:
+                fcntl.flock(fileh, fcntl.LOCK_SH)
+                blob = json.loads(fileh.read().decode("utf-8"))
+            if isinstance(blob, dict) and blob.get("version") == MANIFEST_VERSION:
+                self.dirs = _checked_dirs(blob["dirs"])
+        except Exception:
+            logger.warn("Ignoring unreadable %s" % self.filename, extra=logid)
+
+    def save(self):
+        """Write the manifest if any listing changed.
+        Needs to have same uid/gid as directory, it is not writable by others.
+        The file is rewritten in place rather than renamed, so saving does not
+        change the mtime of the report directory.  Listings with names which
+        are not utf-8 are not saved, those directories are listed again on
+        the next walk."""
+        if not self.filename or not self.dirty:
+            return
+        dirname = os.path.dirname(self.filename)
+        mode = (
+            stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP | stat.S_IROTH
+        )  # 0o664
+        try:
+            dirs = dict(
+                (path, cached)
+                for path, cached in self.dirs.items()
+                if all(_valid_name(name) for name in [path] + sum(cached[2:], []))
+            )
+            blob = json.dumps({"version": MANIFEST_VERSION, "dirs": dirs})
+            fd = os.open(
+                self.filename,
+                os.O_WRONLY | os.O_CREAT | getattr(os, "O_NOFOLLOW", 0),
+                mode,
+            )
+            with os.fdopen(fd, "wb") as fileh:
+                fcntl.flock(fileh, fcntl.LOCK_EX)
+                current = stat.S_IMODE(os.fstat(fd).st_mode)
+                if current & ~mode:
+                    # older manifests were created writable by everyone
+                    try:
+                        os.fchmod(fd, current & mode)
+                    except OSError:
+                        pass
+                fileh.truncate()
+                fileh.write(blob.encode("utf-8"))
+            dir_stat = os.stat(dirname)
+            try:
+                os.chown(self.filename, dir_stat.st_uid, dir_stat.st_gid)
+            except OSError:
+                pass
+            self.dirty = False
+        except Exception:
+            # Remove possible partial file
+            try:
+                os.unlink(self.filename)
+            except OSError:
+                pass
+            logger.error(traceback.format_exc(), extra=logid)
+
+    def invalidate(self):
+        """Forget all listings, and remove the manifest file"""
+        self.dirs = {}
+        self.dirty = False
+        if self.filename:
+            try:
+                os.unlink(self.filename)
+            except OSError:
+                pass
+
+    def listing(self, path):
+        """Returns (files, subdirs, linkdirs) of path, from the manifest if
+        the directory mtime is unchanged.  Raises OSError if path is not
+        accessible."""
+        mtime = os.stat(path).st_mtime
+        cached = self.dirs.get(path)
+        if (
+            cached is not None
+            and cached[0] == mtime
+            and cached[1] - mtime > RACY_SECONDS
+        ):
+            return cached[2:]
+        scantime = time.time()
+        files, subdirs, linkdirs = scan_dir(path)
+        self.dirs[path] = [mtime, scantime, files, subdirs, linkdirs]
+        self.dirty = True
+        self.rescanned += 1
+        return files, subdirs, linkdirs
+
+    def walk(self, top, expand_linked_sigproc=False):
+        """Returns the list of all non-directory entries under top.  Links to
+        directories are not followed, except a linked sigproc_results folder
+        if expand_linked_sigproc is set and it is not a proton onboard_results
+        folder.  Listings of directories which no longer exist are dropped,
+        all of them when top itself cannot be listed."""
+        visited = set()
+        try:
+            return self._walk(top, expand_linked_sigproc, visited)
+        finally:
+            prefix = top.rstrip("/") + "/"
+            stale = [
+                p
+                for p in self.dirs
+                if (p == top or p.startswith(prefix)) and p not in visited
+            ]
+            for path in stale:
+                del self.dirs[path]
+                self.dirty = True
+
+    def _walk(self, top, expand_linked_sigproc, visited):
+        thelist = []
+        stack = [top]
+        while stack:
+            path = stack.pop()
+            try:
+                files, subdirs, linkdirs = self.listing(path)
+            except OSError as e:
+                if path == top:
+                    raise
+                if e.errno not in [errno.ENOENT, errno.ENOTDIR]:
+                    logger.warn("Unable to list %s: %s" % (path, e), extra=logid)
+                continue
+            visited.add(path)
+            thelist.extend(os.path.join(path, name) for name in files)
+            if expand_linked_sigproc and "sigproc_results" in linkdirs:
+                # add files from linked sigproc_results folder, except proton onboard_results files
+                linked = os.path.join(path, "sigproc_results")
+                if "onboard_results" not in os.path.realpath(linked):
+                    try:
+                        thelist.extend(self._walk(linked, False, visited))
+                    except OSError:
+                        pass
+            stack.extend(os.path.join(path, name) for name in reversed(subdirs))
+        return thelist
+
+    def filelist(self):
+        """Returns every file recorded in the manifest, without touching the
+        filesystem"""
+        return [
+            os.path.join(path, name)
+            for path, cached in self.dirs.items()
+            for name in cached[2]
+        ]
+
+
+def walk_filelist(input_dirs, list_dir=None, save_list=True, manifest=None):
+    """Returns the list of all files rooted in input_dirs, expanding linked
+    sigproc_results folders.  With list_dir, directory listings are reused
+    from the manifest in list_dir and, if save_list, the updated manifest is
+    written back.  A FileListManifest already loaded can be passed instead of
+    list_dir, it then holds the listings of the walk on return."""
+    starttime = time.time()
+    if manifest is None:
+        manifest = FileListManifest(list_dir)
+    thelist = []
+    for item in input_dirs:
+        try:
+            thelist.extend(manifest.walk(item, expand_linked_sigproc=True))
+        except OSError as e:
+            if e.errno == errno.ENOENT:  # No such file or directory
+                logger.warn("No such directory: %s" % item, extra=logid)
+            else:
+                logger.error(
+                    "Unhandled error in get_walk_filelist on: %s" % item, extra=logid
+                )
+                logger.error(traceback.format_exc(), extra=logid)
+    if save_list:
+        manifest.save()
+    logger.info(
+        "%s: %f seconds, %d directories listed"
+        % (sys._getframe().f_code.co_name, time.time() - starttime, manifest.rescanned),
+        extra=logid,
+    )
+    return thelist
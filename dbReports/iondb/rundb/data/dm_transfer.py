@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# Copyright (C) 2018 Ion Torrent Systems, Inc. All Rights Reserved
+"""
+Batched, parallel file copy for DM export and archive actions.
+
+The file list is split into batches which are copied in-process by a pool of
+worker threads.  Each file is copied with the semantics of
+``rsync --times --copy-links``, and symbolic links are handled as
+dmactions._copy_to_dir always has:
+
+* a link inside the report tree is recreated as a link at the destination,
+  falling back to a copy if the destination does not support links
+* a broken link is not copied
+* a file which no longer exists is reported, not copied
+* any other per-file error is reported and the batch continues, except
+  running out of space on the destination, which aborts the transfer
+
+check_failures() raises TransferError for the reported errors once the
+files which were copied have been handled.
+"""
+import errno
+import os
+import shutil
+import time
+from multiprocessing.pool import ThreadPool
+
+from iondb.rundb.data import exceptions as DMExceptions
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_WORKERS = 4
+COPY_BUFSIZE = 1024 * 1024
+
+
+class BatchResult(object):
+
+    """Outcome of copying one batch of files"""
+
+    def __init__(self, index):
+        self.index = index
+        self.processed = []  # files handled, including links and broken links
+        self.sizes = {}  # processed file -> size, 0 for links
+        self.broken_links = []
+        self.missing = []
+        self.failed = []  # (file, error message)
+        self.bytes = 0  # bytes actually written
+        self.seconds = 0.0
+
+    @property
+    def throughput(self):
+        """MB per second"""
+        if self.seconds <= 0:
+            return 0.0
+        return self.bytes / (1024.0 * 1024.0) / self.seconds
+
+
+def destination_path(filepath, start_dir, destination):
+    """Path of ``filepath`` rooted in ``destination`` instead of ``start_dir``"""
+    dst = filepath.replace(start_dir, "")
+    dst = dst[1:] if dst.startswith("/") else dst
+    return os.path.join(destination, dst)
+
+
+def _makedirs(dirname):
+    try:
+        os.makedirs(dirname)
+    except OSError as exception:
+        if exception.errno not in [errno.EEXIST, errno.EPERM, errno.EACCES]:
+            raise
+
+
+def _up_to_date(src_stat, dst):
+    """rsync quick check: same size and mtime means nothing to copy"""
+    try:
+        dst_stat = os.stat(dst)
+    except OSError:
+        return False
+    return (
+        dst_stat.st_size == src_stat.st_size
+        and int(dst_stat.st_mtime) == int(src_stat.st_mtime)
+    )
+
+
+def _unlink_quietly(path):
+    # in its own frame, so that a bare raise in the caller re-raises the
+    # caller's exception and not the one handled here
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def _copy_file(src, dst, src_stat):
+    """Copy contents via a temporary file and keep the source mtime"""
+    tmp = os.path.join(os.path.dirname(dst), ".%s.dmtmp" % os.path.basename(dst))
+    try:
+        with open(src, "rb") as fsrc:
+            with open(tmp, "wb") as fdst:
+                shutil.copyfileobj(fsrc, fdst, COPY_BUFSIZE)
+        os.utime(tmp, (src_stat.st_atime, src_stat.st_mtime))
+        os.rename(tmp, dst)
+    except Exception:
+        _unlink_quietly(tmp)
+        raise
+
+
+def copy_file(filepath, start_dir, destination):
+    """Copy one file.  Returns a tuple (size, bytes written), where size is 0
+    for links, or None if the file is a broken link.  Raises OSError/IOError,
+    including ENOENT if the file no longer exists."""
+    dst = destination_path(filepath, start_dir, destination)
+    _makedirs(os.path.dirname(dst))
+
+    islink = os.path.islink(filepath)
+    # Trying to preserve symbolic link within local directory tree
+    if islink and (os.path.basename(start_dir) in filepath):
+        try:
+            os.symlink(os.readlink(filepath), dst)
+            return 0, 0
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                # Target exists so leave it alone
+                return 0, 0
+            elif e.errno not in [errno.EOPNOTSUPP, errno.EACCES]:
+                raise
+            # Cannot create a link so continue to copy instead below
+
+    # Catch broken links and do not copy them
+    try:
+        src_stat = os.stat(filepath)
+    except OSError as e:
+        if e.errno == errno.ENOENT and islink:
+            return None
+        raise
+
+    size = 0 if islink else src_stat.st_size
+    if _up_to_date(src_stat, dst):
+        return size, 0
+    _copy_file(filepath, dst, src_stat)
+    return size, src_stat.st_size
+
+
+def copy_batch(filepaths, start_dir, destination, index=0):
+    """Copy a list of files, returning a `BatchResult`.
+    Raises MediaNotAvailable if ``destination`` disappears and IOError/OSError
+    with errno ENOSPC if it is full."""
+    result = BatchResult(index)
+    starttime = time.time()
+    # The root destination directory is created once.  If it is no longer
+    # available, the mount has disappeared and we should abort.
+    if not os.path.isdir(destination):
+        raise DMExceptions.MediaNotAvailable(
+            "%s is no longer available. Check your remote mounts" % destination
+        )
+    for filepath in filepaths:
+        try:
+            copied = copy_file(filepath, start_dir, destination)
+        except (OSError, IOError) as e:
+            if e.errno == errno.ENOSPC:
+                raise
+            elif e.errno in [errno.ENOENT, errno.ESTALE]:
+                result.missing.append(filepath)
+            else:
+                result.failed.append((filepath, str(e)))
+            continue
+        except Exception as e:
+            result.failed.append((filepath, str(e)))
+            continue
+        result.processed.append(filepath)
+        if copied is None:
+            result.broken_links.append(filepath)
+            result.sizes[filepath] = 0
+        else:
+            result.sizes[filepath] = copied[0]
+            result.bytes += copied[1]
+    result.seconds = time.time() - starttime
+    return result
+
+
+class TransferEngine(object):
+
+    """Copies a file list from ``start_dir`` to ``destination`` in batches
+    of ``batch_size`` files, ``workers`` batches at a time.
+    ``progress(result, nbatches)`` is called as each batch completes."""
+
+    def __init__(
+        self,
+        start_dir,
+        destination,
+        batch_size=DEFAULT_BATCH_SIZE,
+        workers=DEFAULT_WORKERS,
+        progress=None,
+    ):
+        self.start_dir = start_dir
+        self.destination = destination
+        self.batch_size = max(1, batch_size)
+        self.workers = max(1, workers)
+        self.progress = progress
+
+    def batches(self, filepaths):
+        """Split the list into contiguous batches to keep directory locality"""
+        return [
+            filepaths[i : i + self.batch_size]
+            for i in range(0, len(filepaths), self.batch_size)
+        ]
+
+    def run(self, filepaths):
+        """Copy all files.  Returns the list of `BatchResult` in batch order."""
+        batches = self.batches(list(filepaths))
+        if not batches:
+            return []
+
+        def _copy(args):
+            index, batch = args
+            return copy_batch(batch, self.start_dir, self.destination, index)
+
+        results = []
+        if self.workers == 1 or len(batches) == 1:
+            for args in enumerate(batches):
+                results.append(self._report(_copy(args), len(batches)))
+        else:
+            pool = ThreadPool(min(self.workers, len(batches)))
+            try:
+                for result in pool.imap_unordered(_copy, enumerate(batches)):
+                    results.append(self._report(result, len(batches)))
+            except Exception:
+                pool.terminate()
+                raise
+            else:
+                pool.close()
+            finally:
+                pool.join()
+        return sorted(results, key=lambda r: r.index)
+
+    def _report(self, result, nbatches):
+        if self.progress:
+            self.progress(result, nbatches)
+        return result
+
+
+def check_failures(results):
+    """Raise TransferError if any file of the `BatchResult` list could not be
+    copied"""
+    failed = [failure for result in results for failure in result.failed]
+    if failed:
+        raise DMExceptions.TransferError(
+            "%d file(s) could not be copied, first %s: %s"
+            % (len(failed), failed[0][0], failed[0][1])
+        )
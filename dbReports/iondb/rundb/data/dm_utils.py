@@ -4,14 +4,11 @@ from __future__ import absolute_import
 import re
 import os
 import sys
-import pickle
-import stat
 import time
-import errno
-import traceback
 import iondb.settings as settings
 from iondb.utils.files import percent_full, getdeviceid
 from iondb.rundb.models import FileServer, ReportStorage, DMFileSet
+from iondb.rundb.data import dm_filelist
 from celery.utils.log import get_task_logger
 
 # Send logging to data_management log file
@@ -19,157 +16,100 @@ logger = get_task_logger("data_management")
 logid = {"logid": "%s" % ("dm_utils")}
 
 
-def get_walk_filelist(input_dirs, list_dir=None, save_list=False):
+def get_walk_filelist(input_dirs, list_dir=None, save_list=True):
     """
     Purpose of the function is to generate a list of all files rooted in the given directories,
     much like os.walk().
-    Since the os.walk is an expensive operation on large filesystems, we can store the file list
-    in a text file in the report directory.  Once a report is analyzed, the only potential changes
-    to the file list will be in the plugin_out directory.  Thus, we always update the contents of
-    the file list for that directory.
+    Since the os.walk is an expensive operation on large filesystems, we store a manifest of
+    directory listings and mtimes in the cached.filelist file in list_dir, the report directory.
+    Once a report is analyzed, the only potential changes to the file list will be in the
+    plugin_out directory, and only directories whose mtime changed are listed again.
+    See dm_filelist.FileListManifest.
     """
     logger.debug("Function: %s()" % sys._getframe().f_code.co_name, extra=logid)
+    return dm_filelist.walk_filelist(input_dirs, list_dir=list_dir, save_list=save_list)
 
-    def dump_the_list(filepath, thelist):
-        """
-        Write a file to report directory containing cached file list.
-        Needs to have same uid/gid as directory with 0x666 permissions
-        """
-        if filepath == "":
-            return
-
-        uid = os.stat(os.path.dirname(filepath)).st_uid
-        gid = os.stat(os.path.dirname(filepath)).st_gid
-
-        mode = (
-            stat.S_IRUSR
-            | stat.S_IWUSR
-            | stat.S_IRGRP
-            | stat.S_IWGRP
-            | stat.S_IROTH
-            | stat.S_IWOTH
-        )  # 0o666
-        umask_original = os.umask(0)
-
-        with os.fdopen(os.open(filepath, os.O_WRONLY | os.O_CREAT, mode), "w") as fileh:
-            pickle.dump(thelist, fileh)
-        os.chown(filepath, uid, gid)
-        os.umask(umask_original)
-
-    use_file_cache = False
-    # Disable writing the cache file if use_file_cache is False
-    if not use_file_cache:
-        save_list = False
-
-    thelist = []
-    if list_dir:
-        cachefile = os.path.join(list_dir, "cached.filelist")
-    else:
-        cachefile = ""
-
-    starttime = time.time()
-    if use_file_cache and os.path.isfile(cachefile):
-        # if file of cached list exists, read it
-        with open(cachefile, "r") as fileh:
-            thelist = pickle.load(fileh)
-
-        # Remove all plugin_out contents from the list
-        thelist = [item for item in thelist if "plugin_out" not in item]
-
-        # Update the plugins directory contents now.  We test all entries in input_dirs, not knowing
-        # which one contains the plugin_out subdirectory.
-        for item in input_dirs:
-            try:
-                os.chdir(item)
-            except OSError as e:
-                if e.errno == errno.ENOENT:  # No such file or directory
-                    logger.warn("No such directory: %s" % item, extra=logid)
-                    continue
-                else:
-                    logger.error(
-                        "Unhandled error in get_walk_filelist on: %s" % item,
-                        extra=logid,
-                    )
-                    logger.error(traceback.format_exc(), extra=logid)
-                    continue
-
-            this_dir = os.path.join(item, "plugin_out")
-            if os.path.isdir(this_dir):
-                os.chdir(this_dir)
-                for root, dirs, files in os.walk("./", topdown=True):
-                    for j in dirs + files:
-                        # This code address specific issue caused by bad plugin code: TS-9917
-                        try:
-                            j.decode("utf-8")
-                        except Exception:
-                            logger.warn(
-                                "Bad file in directory: %s" % os.path.join(item, root),
-                                extra=logid,
-                            )
-                            logger.warn("File is '%s'" % j, extra=logid)
-                            continue
-                        this_file = os.path.join(this_dir, root.replace("./", ""), j)
-                        if not os.path.isdir(this_file):  # exclude directories
-                            thelist.append(this_file)
-    else:
-        for item in input_dirs:
-            try:
-                os.chdir(item)
-            except OSError as e:
-                if e.errno == errno.ENOENT:  # No such file or directory
-                    logger.warn("No such directory: %s" % item, extra=logid)
-                    continue
-                else:
-                    logger.error(
-                        "Unhandled error in get_walk_filelist on: %s" % item,
-                        extra=logid,
-                    )
-                    logger.error(traceback.format_exc(), extra=logid)
-                    continue
-
-            for root, dirs, files in os.walk("./", topdown=True):
-                for j in dirs + files:
-                    # This code address specific issue caused by bad plugin code: TS-9917
-                    try:
-                        j.decode("utf-8")
-                    except Exception:
-                        logger.warn(
-                            "Bad file in directory: %s" % os.path.join(item, root),
-                            extra=logid,
-                        )
-                        logger.warn("File is '%s'" % j, extra=logid)
-                        continue
-                    this_file = os.path.join(item, root.replace("./", ""), j)
-                    if not os.path.isdir(this_file):  # exclude directories
-                        thelist.append(this_file)
-                    elif j == "sigproc_results":
-                        # add files from linked sigproc_results folder, except proton onboard_results files
-                        if os.path.islink(
-                            this_file
-                        ) and "onboard_results" not in os.path.realpath(this_file):
-                            for root2, _, files2 in os.walk(this_file):
-                                thelist += [
-                                    os.path.join(root2, filename) for filename in files2
-                                ]
 
-    endtime = time.time()
-    logger.info(
-        "%s: %f seconds" % (sys._getframe().f_code.co_name, (endtime - starttime)),
-        extra=logid,
-    )
+class FileSetMatcher(object):
+    """
+    Include, exclude and keep patterns of a DMFileSet compiled into a few
+    alternation regular expressions.  Patterns are matched against the path
+    relative to start_dir, which is equivalent to the r'(%s/)(%s)' %
+    (start_dir, pattern) expression documented in install_dmfilesets.py,
+    so that one matcher serves every report directory.
+    """
 
-    if save_list and thelist:
-        try:
-            dump_the_list(cachefile, thelist)
-        except Exception:
-            # Remove possible partial file
+    # Python limits the number of groups in one expression; alternations are
+    # compiled in chunks of at most this many patterns.
+    CHUNK = 50
+
+    def __init__(self, ipatterns, epatterns, kpatterns):
+        self.include = self._compile(ipatterns)
+        self.exclude = self._compile(epatterns)
+        self.keep = self._compile(kpatterns)
+
+    @classmethod
+    def _compile(cls, patterns):
+        regexes = []
+        patterns = list(patterns or [])
+        for i in range(0, len(patterns), cls.CHUNK):
+            chunk = patterns[i : i + cls.CHUNK]
             try:
-                os.unlink(cachefile)
-            except OSError:
-                pass
-            logger.error(traceback.format_exc(), extra=logid)
+                regexes.append(
+                    re.compile("|".join("(?:%s)" % pattern for pattern in chunk))
+                )
+            except (re.error, AssertionError, OverflowError):
+                # fall back to one expression per pattern for this chunk
+                regexes.extend(re.compile(pattern) for pattern in chunk)
+        return regexes
+
+    @staticmethod
+    def _match(regexes, relpath):
+        for regex in regexes:
+            if regex.match(relpath):
+                return True
+        return False
+
+    def classify(self, start_dir, filelist, skip=None):
+        """Returns (selected, to_keep) for the files in filelist rooted at
+        start_dir, in a single pass.  Files for which skip(filepath) is True
+        are ignored."""
+        prefix = start_dir + "/"
+        prefix_len = len(prefix)
+        selected = []
+        to_keep = []
+        for filepath in filelist:
+            if not filepath.startswith(prefix):
+                continue
+            if skip and skip(filepath):
+                continue
+            relpath = filepath[prefix_len:]
+            if self._match(self.include, relpath) and not self._match(
+                self.exclude, relpath
+            ):
+                selected.append(filepath)
+            if self._match(self.keep, relpath):
+                to_keep.append(filepath)
+        return selected, to_keep
+
+
+_matcher_cache = {}
 
-    return thelist
+
+def get_file_set_matcher(ipatterns, epatterns, kpatterns):
+    """Returns the FileSetMatcher for the pattern lists.  Matchers are cached
+    on the patterns themselves, so a new DMFileSet version with changed
+    patterns gets a new matcher."""
+    key = (
+        tuple(ipatterns or []),
+        tuple(epatterns or []),
+        tuple(kpatterns or []),
+    )
+    matcher = _matcher_cache.get(key)
+    if matcher is None:
+        matcher = FileSetMatcher(*key)
+        _matcher_cache[key] = matcher
+    return matcher
 
 
 def _file_selector(
@@ -188,16 +128,6 @@ def _file_selector(
     """
     logger.debug("Function: %s()" % sys._getframe().f_code.co_name, extra=logid)
     starttime = time.time()  # debugging time of execution
-    to_include = []
-    to_exclude = []
-    to_keep = []
-
-    if not ipatterns:
-        ipatterns = []
-    if not epatterns:
-        epatterns = []
-    if not kpatterns:
-        kpatterns = []
 
     exclude_sigproc_folder = False
     if not add_linked_sigproc and os.path.islink(
@@ -205,38 +135,16 @@ def _file_selector(
     ):
         exclude_sigproc_folder = True
 
-    # find files matching include filters from start_dir
-    # for root, dirs, files in os.walk(start_dir,topdown=True):
-    for filepath in cached:
+    def skip(filepath):
         if exclude_onboard_results and "onboard_results" in filepath:
-            continue
+            return True
         if exclude_sigproc_folder and "sigproc_results" in filepath:
-            continue
-
-        for pattern in ipatterns:
-            file_filter = re.compile(
-                r"(%s/)(%s)" % (start_dir, pattern)
-            )  # NOTE: use of start_dir, not root here
-            match = file_filter.match(filepath)
-            if match:
-                to_include.append(filepath)
-
-        # find files matching keep filters from start_dir
-        for pattern in kpatterns:
-            file_filter = re.compile(r"(%s/)(%s)" % (start_dir, pattern))
-            match = file_filter.match(filepath)
-            if match:
-                to_keep.append(filepath)
+            return True
+        return False
 
-    # find files matching exclude filters from include list
-    for pattern in epatterns:
-        file_filter = re.compile(r"(%s/)(%s)" % (start_dir, pattern))
-        for filename in to_include:
-            match = file_filter.match(filename)
-            if match:
-                to_exclude.append(filename)
+    matcher = get_file_set_matcher(ipatterns, epatterns, kpatterns)
+    selected, to_keep = matcher.classify(start_dir, cached, skip)
 
-    selected = list(set(to_include) - set(to_exclude))
     endtime = time.time()
     logger.info(
         "%s(): %f seconds" % (sys._getframe().f_code.co_name, (endtime - starttime)),
@@ -20,8 +20,11 @@ from iondb.rundb.models import DMFileStat, DMFileSet, Results, EventLog
 from iondb.rundb.data import exceptions as DMExceptions
 from iondb.rundb.data.project_msg_banner import project_msg_banner
 from iondb.rundb.data import dm_utils
+from iondb.rundb.data import dm_filelist
+from iondb.rundb.data import dm_transfer
 from iondb.rundb.data.dmfilestat_utils import update_diskspace
 from django.core import serializers
+from django.conf import settings
 
 # Send logging to data_management log file
 logger = get_task_logger("data_management")
@@ -808,6 +811,11 @@ def _process_task(pfilename):
                 if len(mydict["to_process"]) > 0:
                     terminate = False
 
+                    if mydict["action"] in [EXPORT, ARCHIVE]:
+                        # copy the next chunk of files in parallel batches
+                        _process_transfer(mydict, dmfilestat, logid)
+                        continue
+
                     try:
                         # process one file and remove entry from the list
                         path = mydict["to_process"].pop(0)
@@ -867,31 +875,7 @@ def _process_task(pfilename):
                         not mydict["action"] in [EXPORT, TEST]
                         and dmfilestat.dmfileset.del_empty_dir
                     ):
-                        thisdir = os.path.dirname(path)
-                        try:
-                            if len(os.listdir(thisdir)) == 0:
-                                if not "plugin_out" in thisdir:
-                                    try:
-                                        os.rmdir(thisdir)
-                                        logger.debug(
-                                            "Removed empty directory: %s" % thisdir,
-                                            extra=logid,
-                                        )
-                                    except Exception as e:
-                                        logger.warn(
-                                            "rmdir [%d] %s: %s"
-                                            % (e.errno, e.strerror, thisdir),
-                                            extra=logid,
-                                        )
-                        except OSError as e:
-                            if e.errno == errno.ENOENT:
-                                logger.warn(
-                                    "del_empty_dir Does not exist %s" % (path),
-                                    extra=logid,
-                                )
-                                continue
-                            else:
-                                raise e
+                        _remove_empty_dir(path, logid)
                 else:
                     break
 
@@ -922,6 +906,13 @@ def _process_task(pfilename):
             username="dm_agent",
         )
 
+        # Files may have been removed before the failure
+        try:
+            if mydict["action"] in [ARCHIVE, DELETE]:
+                _file_list_invalidate(dmfilestat)
+        except Exception:
+            logger.error(traceback.format_exc(), extra=logid)
+
         # Release the task lock
         try:
             applock = TaskLock(mydict["lockfile"])
@@ -990,6 +981,7 @@ def _process_task(pfilename):
                         dmfilestat.result.experiment.expDir,
                     ]
                 )
+                _file_list_invalidate(dmfilestat)
         except Exception:
             logger.error(traceback.format_exc(), extra=logid)
 
@@ -1020,6 +1012,100 @@ def _process_task(pfilename):
     return
 
 
+def _remove_empty_dir(path, logid):
+    """Remove the directory containing path if it is empty"""
+    thisdir = os.path.dirname(path)
+    try:
+        if len(os.listdir(thisdir)) == 0:
+            if not "plugin_out" in thisdir:
+                try:
+                    os.rmdir(thisdir)
+                    logger.debug("Removed empty directory: %s" % thisdir, extra=logid)
+                except Exception as e:
+                    logger.warn(
+                        "rmdir [%d] %s: %s" % (e.errno, e.strerror, thisdir),
+                        extra=logid,
+                    )
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            logger.warn("del_empty_dir Does not exist %s" % (path), extra=logid)
+        else:
+            raise e
+
+
+def _process_transfer(mydict, dmfilestat, logid):
+    """
+    Copies the next chunk of files from mydict['to_process'] with the batched
+    transfer engine: DM_TRANSFER_WORKERS batches of DM_TRANSFER_BATCH_SIZE
+    files at a time.
+    EXPORT ACTION: copy files
+    ARCHIVE ACTION: copy files && delete files
+    Files which could not be copied raise TransferError, once the copied ones
+    are done, so that the action is set to Error.
+    """
+    chunk_size = settings.DM_TRANSFER_BATCH_SIZE * settings.DM_TRANSFER_WORKERS
+    chunk = mydict["to_process"][:chunk_size]
+    del mydict["to_process"][:chunk_size]
+
+    def progress(result, nbatches):
+        logger.info(
+            "batch %d/%d: %d files %0.1f MB in %0.1f s (%0.1f MB/s) %s"
+            % (
+                result.index + 1,
+                nbatches,
+                len(result.processed),
+                result.bytes / (1024.0 * 1024.0),
+                result.seconds,
+                result.throughput,
+                mydict["start_dir"],
+            ),
+            extra=logid,
+        )
+
+    engine = dm_transfer.TransferEngine(
+        mydict["start_dir"],
+        mydict["archivepath"],
+        batch_size=settings.DM_TRANSFER_BATCH_SIZE,
+        workers=settings.DM_TRANSFER_WORKERS,
+        progress=progress,
+    )
+    results = engine.run(chunk)
+    for result in results:
+        for path in result.missing:
+            logger.warn("No longer exists %s" % path, extra=logid)
+        for path, errmsg in result.failed:
+            logger.error("%s %s: %s" % (mydict["action"], path, errmsg), extra=logid)
+        for path in result.broken_links:
+            logger.info("Broken link not copied: %s" % path, extra=logid)
+
+        for path in result.processed:
+            if mydict["action"] == ARCHIVE:
+                try:
+                    if not _file_removal(path, mydict["to_keep"]):
+                        continue
+                except OSError as e:
+                    if e.errno in [errno.ENOENT, errno.ESTALE]:
+                        logger.warn("No longer exists %s" % path, extra=logid)
+                        continue
+                    raise
+                if dmfilestat.dmfileset.del_empty_dir:
+                    _remove_empty_dir(path, logid)
+            mydict["processed_cnt"] += 1
+            mydict["total_size"] += result.sizes[path]
+
+    logger.debug(
+        "%04d/%04d %s %10d"
+        % (
+            mydict["processed_cnt"],
+            mydict["total_cnt"],
+            mydict["action"],
+            mydict["total_size"],
+        ),
+        extra=logid,
+    )
+    dm_transfer.check_failures(results)
+
+
 def _get_keeper_list(dmfilestat, action):
     logger.debug("Function: %s()" % sys._getframe().f_code.co_name, extra=logid)
     if action == EXPORT:
@@ -1135,6 +1221,15 @@ def _brokenlinks_delete(search_dirs):
                                 logger.warn(e, extra=logid)
 
 
+def _file_list_invalidate(dmfilestat):
+    """
+    Drop the cached.filelist manifest of the report once files were removed,
+    its listings of removed directories would otherwise linger
+    """
+    logger.debug("Function: %s()" % sys._getframe().f_code.co_name, extra=logid)
+    dm_filelist.FileListManifest(dmfilestat.result.get_report_dir()).invalidate()
+
+
 def set_action_state(dmfilestat, action_state, action=""):
     """Rules for setting action state for Basecalling Input Files with linked sigproc_results:
         action = DELETE or action = EXPORT applies to current report only
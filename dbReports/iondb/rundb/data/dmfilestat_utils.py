@@ -154,8 +154,9 @@ def get_keepers_diskspace(fs_path):
     return keepers_diskspace
 
 
-def update_diskspace(dmfilestat, cached=None):
-    """Update diskspace field in dmfilestat object"""
+def update_diskspace(dmfilestat, cached=None, usage=None):
+    """Update diskspace field in dmfilestat object.
+    usage is an optional disk_usage.DiskUsage with the file sizes."""
     try:
         # search both results directory and raw data directory
         search_dirs = [
@@ -194,6 +195,10 @@ def update_diskspace(dmfilestat, cached=None):
 
                 # process files in list
                 for path in to_process[1:]:
+                    size = usage.file_size(path) if usage is not None else None
+                    if size is not None:
+                        total_size += size
+                        continue
                     try:
                         # logger.debug("%d %s %s" % (j, 'diskspace', path), extra = logid)
                         if not os.path.islink(path):
@@ -101,3 +101,13 @@ class RsyncError(Exception):
 
     def __str__(self):
         return repr(self.message)
+
+
+class TransferError(Exception):
+    def __init__(self, _msg, tag=None):
+        self.tag = "transfer_fail"
+        self.message = str(_msg)
+        Exception.__init__(self, _msg, self.tag)
+
+    def __str__(self):
+        return repr(self.message)
@@ -17,6 +17,7 @@ from django import shortcuts
 from iondb.rundb.models import Message, Results, EventLog, DMFileStat, FileServer, Rig
 from iondb.rundb.data import dmactions
 from iondb.rundb.data import dm_utils
+from iondb.rundb.data import disk_usage
 from iondb.rundb.data import dmfilestat_utils
 from iondb.rundb.data import dmactions_types
 from iondb.rundb.data.dmactions_types import FILESET_TYPES
@@ -172,15 +173,20 @@ def update_dmfilestat_diskusage(resultpk):
     NOTE: This can be a long-lived task
     """
     logid = {"logid": "%s" % ("tasks")}
+    usage = None
     try:
         result = Results.objects.get(pk=resultpk)
         search_dirs = [result.get_report_dir(), result.experiment.expDir]
-        cached_file_list = dm_utils.get_walk_filelist(
+        # one walk lists the files and sizes every file set and every plugin
+        # result of the report
+        cached_file_list, usage = disk_usage.walk(
             search_dirs, list_dir=result.get_report_dir(), save_list=True
         )
         for dmtype in FILESET_TYPES:
             dmfilestat = result.get_filestat(dmtype)
-            dmfilestat_utils.update_diskspace(dmfilestat, cached=cached_file_list)
+            dmfilestat_utils.update_diskspace(
+                dmfilestat, cached=cached_file_list, usage=usage
+            )
     except SoftTimeLimitExceeded:
         logger.warn(
             "Time exceeded update_diskusage for (%d) %s"
@@ -208,6 +214,13 @@ def update_dmfilestat_diskusage(resultpk):
         logger.error(traceback.format_exc(), extra=logid)
         raise
 
+    if usage is not None:
+        for pluginresult in result.pluginresult_set.select_related("plugin"):
+            try:
+                pluginresult.UpdateSizeAndINodeCount(usage=usage)
+            except Exception:
+                logger.error(traceback.format_exc(), extra=logid)
+
 
 @periodic_task(run_every=300, expires=60, queue="diskutil")
 def backfill_dmfilestats_diskspace():
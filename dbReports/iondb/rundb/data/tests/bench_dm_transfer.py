@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# Copyright (C) 2018 Ion Torrent Systems, Inc. All Rights Reserved
+"""
+Benchmark archiving a synthetic report tree to a local directory.
+
+Builds a report directory with ``--files`` small files spread over
+``--dirs`` subdirectories plus a few links, then times
+
+* the legacy copy: one ``rsync --times --copy-links`` process per file
+  (skipped if rsync is not installed)
+* the batched transfer engine with ``--workers`` parallel batches
+
+No database is needed.
+
+    python -m iondb.rundb.data.tests.bench_dm_transfer --files 20000
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from iondb.rundb.data import dm_transfer
+
+
+def make_report(root, nfiles, ndirs, size):
+    report = os.path.join(root, "Auto_user_R_2018_run_1")
+    payload = os.urandom(size)
+    filelist = []
+    for i in range(nfiles):
+        subdir = os.path.join(report, "plugin_out", "dir%03d" % (i % ndirs))
+        if not os.path.isdir(subdir):
+            os.makedirs(subdir)
+        path = os.path.join(subdir, "file%06d.txt" % i)
+        with open(path, "wb") as fileh:
+            fileh.write(payload)
+        filelist.append(path)
+    # a link within the report tree and a broken link
+    os.symlink(filelist[0], os.path.join(report, "link.txt"))
+    os.symlink(os.path.join(report, "missing"), os.path.join(report, "broken.txt"))
+    filelist += [os.path.join(report, "link.txt"), os.path.join(report, "broken.txt")]
+    return report, filelist
+
+
+def legacy_copy(filelist, start_dir, destination):
+    for path in filelist:
+        dst = dm_transfer.destination_path(path, start_dir, destination)
+        dm_transfer._makedirs(os.path.dirname(dst))
+        if os.path.islink(path):
+            os.symlink(os.readlink(path), dst)
+            continue
+        subprocess.check_call(["rsync", "--times", "--copy-links", path, dst])
+
+
+def timed(func, *args):
+    start = time.time()
+    ret = func(*args)
+    return time.time() - start, ret
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark DM file transfer")
+    parser.add_argument("--files", type=int, default=20000)
+    parser.add_argument("--dirs", type=int, default=100)
+    parser.add_argument("--size", type=int, default=4096, help="bytes per file")
+    parser.add_argument("--batch-size", type=int, default=dm_transfer.DEFAULT_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=dm_transfer.DEFAULT_WORKERS)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="bench_dm_transfer_")
+    try:
+        report, filelist = make_report(root, args.files, args.dirs, args.size)
+        print("files: %d  size: %d bytes" % (len(filelist), args.size))
+
+        rsync = any(
+            os.access(os.path.join(p, "rsync"), os.X_OK)
+            for p in os.environ.get("PATH", "").split(os.pathsep)
+        )
+        if rsync:
+            destination = os.path.join(root, "legacy")
+            os.mkdir(destination)
+            seconds, _ = timed(legacy_copy, filelist, report, destination)
+            print("legacy rsync per file:  %8.3f s" % seconds)
+        else:
+            print("legacy rsync per file:  skipped, rsync not found")
+
+        destination = os.path.join(root, "archive")
+        os.mkdir(destination)
+        engine = dm_transfer.TransferEngine(
+            report, destination, batch_size=args.batch_size, workers=args.workers
+        )
+        seconds, results = timed(engine.run, filelist)
+        nbytes = sum(r.bytes for r in results)
+        print(
+            "transfer engine:        %8.3f s  %d batches  %0.1f MB/s  %d broken links"
+            % (
+                seconds,
+                len(results),
+                nbytes / (1024.0 * 1024.0) / seconds if seconds else 0,
+                sum(len(r.broken_links) for r in results),
+            )
+        )
+        seconds, _ = timed(engine.run, filelist)
+        print("transfer engine rerun:  %8.3f s" % seconds)
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# Copyright (C) 2018 Ion Torrent Systems, Inc. All Rights Reserved
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase
+
+from iondb.rundb.data import disk_usage
+from iondb.rundb.data import dm_filelist
+
+
+def walk_usage(top):
+    """Reference (bytes, inodes) of top from os.walk and lstat"""
+    nbytes = 0
+    inodes = 0
+    for root, dirs, files in os.walk(top):
+        for name in files + [d for d in dirs if os.path.islink(os.path.join(root, d))]:
+            nbytes += os.lstat(os.path.join(root, name)).st_size
+            inodes += 1
+    return nbytes, inodes
+
+
+class DiskUsageTest(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.report = os.path.join(self.tmpdir, "report")
+        self.raw = os.path.join(self.tmpdir, "raw")
+        for i, path in enumerate(
+            [
+                "report/basecaller_results/rawlib.basecaller.bam",
+                "report/plugin_out/cov_out.1/results.json",
+                "report/plugin_out/cov_out.1/sub/a.txt",
+                "report/plugin_out/cov_out.1/sub/b.txt",
+                "report/plugin_out/vc_out.2/TSVC_variants.vcf",
+                "report/ion_params_00.json",
+                "raw/acq_0000.dat",
+                "raw/sigproc/1.wells",
+            ]
+        ):
+            path = os.path.join(self.tmpdir, path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "w") as fileh:
+                fileh.write("x" * (100 * (i + 1)))
+        os.mkdir(os.path.join(self.report, "plugin_out", "empty_out.3"))
+        os.symlink(
+            os.path.join(self.raw, "sigproc"),
+            os.path.join(self.report, "sigproc_results"),
+        )
+        os.symlink(
+            os.path.join(self.tmpdir, "missing"), os.path.join(self.report, "broken")
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_subtree_totals(self):
+        for workers in [1, 4]:
+            usage = disk_usage.scan([self.report, self.raw], workers=workers)
+            for top in [self.report, self.raw]:
+                for root, dirs, _ in os.walk(top):
+                    self.assertEqual(walk_usage(root), usage.total(root), root)
+            self.assertEqual(
+                (0, 0),
+                usage.total(os.path.join(self.report, "plugin_out", "empty_out.3")),
+            )
+            self.assertEqual([], usage.errors)
+
+    def test_links_not_followed(self):
+        usage = disk_usage.scan([self.report])
+        link = os.path.join(self.report, "sigproc_results")
+        self.assertEqual(0, usage.file_size(link))
+        self.assertEqual(0, usage.file_size(os.path.join(self.report, "broken")))
+        self.assertEqual(None, usage.file_size(os.path.join(link, "1.wells")))
+        self.assertFalse(usage.scanned(link))
+        self.assertEqual(
+            100,
+            usage.file_size(
+                os.path.join(self.report, "basecaller_results", "rawlib.basecaller.bam")
+            ),
+        )
+
+    def test_plugin_folders(self):
+        plugin_dirs = [
+            os.path.join(self.report, "plugin_out", name)
+            for name in ["cov_out.1", "vc_out.2"]
+        ]
+        usage = disk_usage.scan(plugin_dirs)
+        self.assertEqual((200 + 300 + 400, 3), usage.total(plugin_dirs[0]))
+        self.assertEqual((500, 1), usage.total(plugin_dirs[1]))
+        self.assertEqual(
+            (200 + 300 + 400, 3), disk_usage.get_size_and_inodes(plugin_dirs[0] + "/")
+        )
+
+    def test_missing_directory(self):
+        missing = os.path.join(self.tmpdir, "missing")
+        usage = disk_usage.scan([missing, self.raw])
+        self.assertEqual((0, 0), usage.total(missing))
+        self.assertEqual(walk_usage(self.raw), usage.total(self.raw))
+        self.assertEqual([missing], [path for path, _ in usage.errors])
+
+    def test_walk_from_manifest(self):
+        plugin_dir = os.path.join(self.report, "plugin_out", "cov_out.1")
+        # cached.filelist is kept out of the trees being compared
+        for save_list in [False, True, True]:
+            filelist, usage = disk_usage.walk(
+                [self.report, self.raw], list_dir=self.tmpdir, save_list=save_list
+            )
+            self.assertEqual(
+                sorted(dm_filelist.walk_filelist([self.report, self.raw])),
+                sorted(filelist),
+            )
+            scanned = disk_usage.scan([self.report, self.raw])
+            self.assertEqual(sorted(scanned.dirs), sorted(usage.dirs))
+            for path in scanned.dirs:
+                self.assertEqual(scanned.total(path), usage.total(path), path)
+            self.assertEqual(scanned.files, usage.files)
+
+        # sizes come from lstat, a file which grew in a cached directory
+        # is counted at its new size
+        with open(os.path.join(plugin_dir, "results.json"), "a") as fileh:
+            fileh.write("x" * 50)
+        manifest = dm_filelist.FileListManifest(self.tmpdir)
+        self.assertTrue(manifest.dirs)
+        manifest.walk(plugin_dir)
+        self.assertEqual(
+            (200 + 50 + 300 + 400, 3),
+            disk_usage.from_manifest(manifest, [plugin_dir]).total(plugin_dir),
+        )
@@ -0,0 +1,184 @@
+# Copyright (C) 2018 Ion Torrent Systems, Inc. All Rights Reserved
+import json
+import os
+import pickle
+import shutil
+import stat
+import tempfile
+import time
+
+from django.test import SimpleTestCase
+
+from iondb.rundb.data import dm_filelist
+
+
+def _age(path, seconds=60):
+    """Move mtime of path into the past so its listing is not racy"""
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+class FileListManifestTest(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.report = os.path.join(self.tmpdir, "report")
+        self.raw = os.path.join(self.tmpdir, "raw")
+        for path in [
+            "report/basecaller_results/rawlib.basecaller.bam",
+            "report/plugin_out/cov_out.1/results.json",
+            "report/ion_params_00.json",
+            "raw/acq_0000.dat",
+            "raw/sigproc/1.wells",
+        ]:
+            path = os.path.join(self.tmpdir, path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, "w").close()
+        os.symlink(self.raw, os.path.join(self.report, "rawdata"))
+        os.symlink(
+            os.path.join(self.raw, "sigproc"),
+            os.path.join(self.report, "sigproc_results"),
+        )
+        os.symlink(
+            os.path.join(self.tmpdir, "missing"), os.path.join(self.report, "broken")
+        )
+        self.age_all()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def age_all(self):
+        for top in [self.report, self.raw]:
+            for root, dirs, _ in os.walk(top):
+                for name in dirs:
+                    _age(os.path.join(root, name))
+            _age(top)
+
+    def walk(self):
+        return sorted(
+            dm_filelist.walk_filelist([self.report, self.raw], list_dir=self.report)
+        )
+
+    def test_walk(self):
+        filelist = self.walk()
+        expected = [
+            os.path.join(self.report, name)
+            for name in [
+                "basecaller_results/rawlib.basecaller.bam",
+                "broken",
+                "ion_params_00.json",
+                "plugin_out/cov_out.1/results.json",
+                "sigproc_results/1.wells",
+            ]
+        ] + [
+            os.path.join(self.raw, name) for name in ["acq_0000.dat", "sigproc/1.wells"]
+        ]
+        self.assertEqual(sorted(expected), filelist)
+
+    def test_manifest_reused(self):
+        first = self.walk()
+        # the report directory changed when cached.filelist was created
+        self.age_all()
+        manifest_file = os.path.join(self.report, "cached.filelist")
+        second = self.walk()
+        self.assertEqual(sorted(first + [manifest_file]), second)
+
+        manifest = dm_filelist.FileListManifest(self.report)
+        manifest.walk(self.report, expand_linked_sigproc=True)
+        self.assertEqual(0, manifest.rescanned)
+        self.assertEqual(sorted(second), sorted(manifest.filelist()))
+
+    def test_changed_subtree_rescanned(self):
+        self.walk()
+        self.age_all()
+        self.walk()
+        new_dir = os.path.join(self.report, "plugin_out", "vc_out.2")
+        os.mkdir(new_dir)
+        open(os.path.join(new_dir, "TSVC_variants.vcf"), "w").close()
+        os.remove(
+            os.path.join(self.report, "basecaller_results", "rawlib.basecaller.bam")
+        )
+
+        manifest = dm_filelist.FileListManifest(self.report)
+        filelist = manifest.walk(self.report)
+        self.assertTrue(os.path.join(new_dir, "TSVC_variants.vcf") in filelist)
+        self.assertFalse(
+            os.path.join(self.report, "basecaller_results", "rawlib.basecaller.bam")
+            in filelist
+        )
+        # plugin_out, vc_out.2 and basecaller_results
+        self.assertEqual(3, manifest.rescanned)
+
+    def test_invalid_manifest_ignored(self):
+        with open(os.path.join(self.report, "cached.filelist"), "w") as fileh:
+            fileh.write("not a manifest")
+        manifest = dm_filelist.FileListManifest(self.report)
+        self.assertEqual({}, manifest.dirs)
+        self.assertEqual(8, len(self.walk()))
+
+    def test_manifest_format(self):
+        self.walk()
+        manifest_file = os.path.join(self.report, "cached.filelist")
+        self.assertFalse(os.stat(manifest_file).st_mode & stat.S_IWOTH)
+        with open(manifest_file) as fileh:
+            blob = json.load(fileh)
+        listing = blob["dirs"][self.report]
+        self.assertEqual(5, len(listing))
+        self.assertTrue("ion_params_00.json" in listing[2])
+
+        # a manifest left writable by everyone is tightened on the next save
+        os.chmod(manifest_file, 0o666)
+        manifest = dm_filelist.FileListManifest(self.report)
+        manifest.dirty = True
+        manifest.save()
+        self.assertFalse(os.stat(manifest_file).st_mode & stat.S_IWOTH)
+
+    def test_malformed_manifest_ignored(self):
+        self.walk()
+        manifest_file = os.path.join(self.report, "cached.filelist")
+        with open(manifest_file) as fileh:
+            blob = json.load(fileh)
+        listing = blob["dirs"][self.report]
+        for dirs in [
+            [],
+            {self.report: listing[:4]},
+            {self.report: ["0", listing[1]] + listing[2:]},
+            {self.report: listing[:2] + [["../../etc/passwd"], [], []]},
+            {self.report: listing[:2] + ["ion_params_00.json", [], []]},
+            {"relative/path": listing},
+            {self.report + "/../raw": listing},
+        ]:
+            with open(manifest_file, "w") as fileh:
+                json.dump({"version": blob["version"], "dirs": dirs}, fileh)
+            self.assertEqual({}, dm_filelist.FileListManifest(self.report).dirs)
+
+        # nor is a pickle loaded
+        with open(manifest_file, "wb") as fileh:
+            pickle.dump({"version": blob["version"], "dirs": {}}, fileh)
+        self.assertEqual({}, dm_filelist.FileListManifest(self.report).dirs)
+        self.assertEqual(8, len(self.walk()))
+
+    def test_listdir_fallback(self):
+        expected = dm_filelist.scan_dir(self.report)
+        saved = dm_filelist._scandir
+        dm_filelist._scandir = None
+        try:
+            self.assertEqual(expected, dm_filelist.scan_dir(self.report))
+        finally:
+            dm_filelist._scandir = saved
+
+    def test_removed_tree_dropped(self):
+        self.walk()
+        shutil.rmtree(self.raw)
+        manifest = dm_filelist.FileListManifest(self.report)
+        filelist = dm_filelist.walk_filelist([self.report, self.raw], manifest=manifest)
+        self.assertFalse([path for path in filelist if path.startswith(self.raw)])
+        self.assertFalse([path for path in manifest.dirs if path.startswith(self.raw)])
+
+    def test_invalidate(self):
+        self.walk()
+        manifest_file = os.path.join(self.report, "cached.filelist")
+        self.assertTrue(os.path.exists(manifest_file))
+        dm_filelist.FileListManifest(self.report).invalidate()
+        self.assertFalse(os.path.exists(manifest_file))
+        self.assertEqual({}, dm_filelist.FileListManifest(self.report).dirs)
@@ -0,0 +1,88 @@
+# Copyright (C) 2018 Ion Torrent Systems, Inc. All Rights Reserved
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase
+
+from iondb.rundb.data import dm_transfer
+from iondb.rundb.data import dmactions
+from iondb.rundb.data import exceptions as DMExceptions
+
+
+class FakeDMFileSet(object):
+    del_empty_dir = False
+
+
+class FakeDMFileStat(object):
+    dmfileset = FakeDMFileSet()
+
+
+class DMTransferTest(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.report = os.path.join(self.tmpdir, "Auto_user_run_1")
+        self.archive = os.path.join(self.tmpdir, "archive")
+        os.makedirs(os.path.join(self.report, "basecaller_results"))
+        os.makedirs(self.archive)
+        self.files = []
+        for name in ["ion_params_00.json", "basecaller_results/BaseCaller.json"]:
+            path = os.path.join(self.report, name)
+            with open(path, "w") as fileh:
+                fileh.write(name)
+            self.files.append(path)
+        # reading a directory as a file fails with EISDIR, an error other
+        # than a missing file or a full disk
+        self.unreadable = os.path.join(self.report, "unreadable.bam")
+        os.mkdir(self.unreadable)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def mydict(self, action, files):
+        return {
+            "action": action,
+            "start_dir": self.report,
+            "archivepath": self.archive,
+            "to_process": list(files),
+            "to_keep": [],
+            "processed_cnt": 0,
+            "total_cnt": len(files),
+            "total_size": 0,
+        }
+
+    def test_copy_batch_reports_failures(self):
+        result = dm_transfer.copy_batch(
+            self.files + [self.unreadable], self.report, self.archive
+        )
+        self.assertEqual(result.processed, self.files)
+        self.assertEqual([path for path, _ in result.failed], [self.unreadable])
+        self.assertRaises(
+            DMExceptions.TransferError, dm_transfer.check_failures, [result]
+        )
+        dm_transfer.check_failures(
+            [dm_transfer.copy_batch(self.files, self.report, self.archive)]
+        )
+
+    def process(self, mydict):
+        # chunk by chunk, as _process_task does
+        while mydict["to_process"]:
+            dmactions._process_transfer(mydict, FakeDMFileStat(), {"logid": "test"})
+
+    def test_export_copies(self):
+        mydict = self.mydict(dmactions.EXPORT, self.files)
+        self.process(mydict)
+        self.assertEqual(mydict["processed_cnt"], len(self.files))
+        for path in self.files:
+            self.assertTrue(
+                os.path.exists(
+                    dm_transfer.destination_path(path, self.report, self.archive)
+                )
+            )
+
+    def test_failed_copy_raises(self):
+        for action in [dmactions.EXPORT, dmactions.ARCHIVE]:
+            mydict = self.mydict(action, self.files + [self.unreadable])
+            self.assertRaises(DMExceptions.TransferError, self.process, mydict)
+            # the file which failed is still in the report
+            self.assertTrue(os.path.isdir(self.unreadable))
@@ -0,0 +1,187 @@
+# Copyright (C) 2018 Ion Torrent Systems, Inc. All Rights Reserved
+import os
+import re
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase
+
+from iondb.bin.install_dmfilesets import DM_FILE_SETS
+from iondb.rundb.data import dm_utils
+
+REPORT_DIR = "/results/analysis/output/Home/Auto_user_R_2018_01_01_run_1"
+RAW_DIR = "/results/PGM_test/R_2018_01_01_run"
+
+# Typical contents of a raw data and a report directory
+SAMPLE_FILES = [
+    "acq_0000.dat",
+    "beadfind_pre_0003.dat",
+    "explog.txt",
+    "explog.json",
+    "explog_final.txt",
+    "explog_final.json",
+    "expMeta.dat",
+    "Controller",
+    "DataCollect.config",
+    "InitLog.txt",
+    "RawInit.txt",
+    "X0_Y0/acq_0000.dat",
+    "X0_Y0/explog.txt",
+    "thumbnail/acq_0000.dat",
+    "thumbnail/explog_final.txt",
+    "thumbnail/Gain.lsr",
+    "onboard_results/sigproc_results/block_X0_Y0/1.wells",
+    "onboard_results/sigproc_results/block_X0_Y0/bfmask.bin",
+    "onboard_results/sigproc_results/block_X0_Y0/bfmask.stats",
+    "onboard_results/sigproc_results/analysis.bfmask.stats",
+    "sigproc_results/1.wells",
+    "sigproc_results/bfmask.bin",
+    "sigproc_results/bfmask.stats",
+    "sigproc_results/analysis.bfmask.stats",
+    "sigproc_results/sigproc.log",
+    "sigproc_results/Bead_density_raw.png",
+    "sigproc_results/block_X0_Y0/1.wells",
+    "basecaller_results/rawlib.basecaller.bam",
+    "basecaller_results/BaseCaller.json",
+    "basecaller_results/datasets_basecaller.json",
+    "basecaller_results/block_X0_Y0/rawlib.basecaller.bam",
+    "rawlib.bam",
+    "rawlib.bam.bai",
+    "rawlib.ionstats_alignment.json",
+    "IonXpress_001_rawlib.bam",
+    "ion_params_00.json",
+    "ionstats_alignment.json",
+    "report.pdf",
+    "Default_Report.php",
+    "barcodeList.txt",
+    "drmaa_stdout.txt",
+    "plugin_out/coverageAnalysis_out.1/results.json",
+    "plugin_out/variantCaller_out.2/TSVC_variants.vcf",
+    "pgm_logs.zip",
+    "serialized_Auto_user_R_2018_01_01_run_1.json",
+]
+
+
+def _pattern_to_path(pattern):
+    """Turn a DMFileSet pattern into a file name it is meant to match"""
+    path = pattern
+    for token, text in [
+        (".[^/]*?", "e"),
+        (".[^/]*", "e"),
+        (".*?", "x"),
+        (".*", "x"),
+        ("\\d+", "1"),
+        ("\\.", "."),
+    ]:
+        path = path.replace(token, text)
+    return re.sub(r"[\\^$*+?()\[\]|]", "", path)
+
+
+def legacy_file_selector(
+    start_dir, ipatterns, epatterns, kpatterns, exclude_onboard_results, cached
+):
+    """dm_utils._file_selector before FileSetMatcher, as the reference"""
+    to_include = []
+    to_exclude = []
+    to_keep = []
+    for filepath in cached:
+        if exclude_onboard_results and "onboard_results" in filepath:
+            continue
+        for pattern in ipatterns:
+            file_filter = re.compile(r"(%s/)(%s)" % (start_dir, pattern))
+            if file_filter.match(filepath):
+                to_include.append(filepath)
+        for pattern in kpatterns:
+            file_filter = re.compile(r"(%s/)(%s)" % (start_dir, pattern))
+            if file_filter.match(filepath):
+                to_keep.append(filepath)
+    for pattern in epatterns:
+        file_filter = re.compile(r"(%s/)(%s)" % (start_dir, pattern))
+        for filename in to_include:
+            if file_filter.match(filename):
+                to_exclude.append(filename)
+    return list(set(to_include) - set(to_exclude)), to_keep
+
+
+class FileSetMatcherTest(SimpleTestCase):
+    def setUp(self):
+        relpaths = set(SAMPLE_FILES)
+        for dmfileset in DM_FILE_SETS:
+            patterns = dmfileset["include"] + dmfileset["exclude"]
+            for kpatterns in dmfileset["keepwith"].values():
+                patterns += kpatterns
+            for pattern in patterns:
+                name = _pattern_to_path(pattern)
+                relpaths.update([name, os.path.join("subdir", name)])
+        self.filelist = [
+            os.path.join(start_dir, relpath)
+            for start_dir in [REPORT_DIR, RAW_DIR]
+            for relpath in sorted(relpaths)
+        ]
+
+    def assertSameSelection(self, start_dir, dmfileset, kpatterns, onboard):
+        expected = legacy_file_selector(
+            start_dir,
+            dmfileset["include"],
+            dmfileset["exclude"],
+            kpatterns,
+            onboard,
+            self.filelist,
+        )
+        selected = dm_utils._file_selector(
+            start_dir,
+            dmfileset["include"],
+            dmfileset["exclude"],
+            kpatterns,
+            onboard,
+            cached=self.filelist,
+        )
+        self.assertEqual(sorted(expected[0]), sorted(selected[0]))
+        self.assertEqual(sorted(set(expected[1])), sorted(selected[1]))
+        return selected
+
+    def test_real_dmfilesets(self):
+        for dmfileset in DM_FILE_SETS:
+            keep_lists = [[]] + list(dmfileset["keepwith"].values())
+            all_keep = sum(dmfileset["keepwith"].values(), [])
+            for kpatterns in keep_lists + [all_keep]:
+                for start_dir in [REPORT_DIR, RAW_DIR]:
+                    for onboard in [False, True]:
+                        self.assertSameSelection(
+                            start_dir, dmfileset, kpatterns, onboard
+                        )
+
+    def test_selects_files(self):
+        # guard against a synthetic file list which selects nothing
+        for dmfileset in DM_FILE_SETS:
+            selected, _ = self.assertSameSelection(
+                REPORT_DIR, dmfileset, [], False
+            )
+            raw_selected, _ = self.assertSameSelection(
+                RAW_DIR, dmfileset, [], False
+            )
+            self.assertTrue(selected or raw_selected, dmfileset["type"])
+
+    def test_linked_sigproc_excluded(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            os.symlink(RAW_DIR, os.path.join(tmpdir, "sigproc_results"))
+            filelist = [
+                os.path.join(tmpdir, "sigproc_results", "1.wells"),
+                os.path.join(tmpdir, "rawlib.bam"),
+            ]
+            selected, _ = dm_utils._file_selector(
+                tmpdir, [".*"], [], [], cached=filelist
+            )
+            self.assertEqual([os.path.join(tmpdir, "rawlib.bam")], selected)
+            selected, _ = dm_utils._file_selector(
+                tmpdir, [".*"], [], [], add_linked_sigproc=True, cached=filelist
+            )
+            self.assertEqual(filelist, selected)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_matcher_cached(self):
+        matcher = dm_utils.get_file_set_matcher(["a"], ["b"], [])
+        self.assertTrue(matcher is dm_utils.get_file_set_matcher(["a"], ["b"], None))
+        self.assertFalse(matcher is dm_utils.get_file_set_matcher(["a"], ["c"], []))
@@ -2,14 +2,12 @@
 # Custom Tastypie APIs to support the TS Mesh
 # Wiki page @ https://confluence.amer.thermo.com/x/SwnCBQ
 
-import datetime
 import json
 import logging
 
 import requests
 from django.conf import settings
 from django.core.cache import cache
-from django.utils.dateparse import parse_datetime
 from ion.utils.TSversion import findVersions
 from tastypie.exceptions import InvalidSortError, BadRequest
 from tastypie.http import HttpNotImplemented, HttpCreated
@@ -20,13 +18,13 @@ from iondb.rundb.api import (
     IonAuthentication,
     DjangoAuthorization,
 )
+from iondb.rundb import mesh_query
 from iondb.rundb.labels import IonMeshNodeStatus
 from iondb.rundb.models import IonMeshNode
-from iondb.utils.utils import ManagedPool
 
 
 def fetch_remote_version_process(new_options):
-    """ Used in a multiprocess pool to fetch a TS version for a specific host """
+    """ Used in the mesh thread pool to fetch a TS version for a specific host """
     options = {"address": "localhost", "resource_name": "torrentsuite", "params": {}}
     options.update(new_options)
 
@@ -34,7 +32,7 @@ def fetch_remote_version_process(new_options):
     exceptions = []
 
     try:
-        response = requests.get(
+        response = mesh_query.get_session().get(
             "http://%s/rundb/api/v1/%s/"
             % (options["address"], options["resource_name"]),
             params=options["params"],
@@ -52,7 +50,7 @@ def fetch_remote_version_process(new_options):
 
 
 def fetch_remote_resource_list_process(new_options):
-    """ Used in a multiprocess pool to fetch a TS api resource for a specific host """
+    """ Used in the mesh thread pool to fetch a TS api resource for a specific host """
     options = {
         "address": "localhost",
         "resource_name": "compositeexperiment",
@@ -76,7 +74,9 @@ def fetch_remote_resource_list_process(new_options):
     )
     while next_url:
         try:
-            response = requests.get(next_url, params=options["params"])
+            response = mesh_query.get_session().get(
+                next_url, params=options["params"]
+            )
             response.raise_for_status()
             response_json = response.json()
             objects.extend(response_json["objects"])
@@ -119,8 +119,7 @@ class MeshPrefetchResource(ModelResource):
                 "system_id": settings.SYSTEM_UUID,
             }
             job_arguments.append({"address": mesh_node.hostname, "params": params})
-        with ManagedPool(processes=len(job_arguments)) as job_pool:
-            job_output = job_pool.map(fetch_remote_version_process, job_arguments)
+        job_output = mesh_query.map_nodes(fetch_remote_version_process, job_arguments)
         objects_per_host = {}
         for address, object, exceptions in job_output:
             objects_per_host[address] = {"object": {}, "warnings": []}
@@ -171,8 +170,9 @@ class MeshPrefetchResource(ModelResource):
                     "params": params,
                 }
             )
-        with ManagedPool(processes=len(job_arguments)) as job_pool:
-            job_output = job_pool.map(fetch_remote_resource_list_process, job_arguments)
+        job_output = mesh_query.map_nodes(
+            fetch_remote_resource_list_process, job_arguments
+        )
         objects_per_host = {}
         for address, objects, fetched_all_objects, exceptions in job_output:
             objects_per_host[address] = {"objects": [], "warnings": []}
@@ -357,19 +357,21 @@ class MeshCompositeExperimentResource(CompositeExperimentResource):
 
     def get_list(self, request, **kwargs):
         base_bundle = self.build_bundle(request=request)
-        objects, warnings = self.obj_get_list(
+        objects = self.obj_get_list(
             bundle=base_bundle, **self.remove_api_resource_names(kwargs)
         )
-        sorted_objects = self.apply_sorting(objects, options=request.GET)
 
         paginator = self._meta.paginator_class(
             request.GET,
-            sorted_objects,
+            objects,
             resource_uri=self.get_resource_uri(),
             limit=self._meta.limit,
             max_limit=self._meta.max_limit,
             collection_name=self._meta.collection_name,
         )
+        # Each server only needs to send the objects up to the end of this page
+        limit = paginator.get_limit()
+        objects.fetch(paginator.get_offset() + (limit or self._meta.object_limit))
         to_be_serialized = paginator.page()
 
         # Dehydrate the bundles in preparation for serialization.
@@ -383,11 +385,12 @@ class MeshCompositeExperimentResource(CompositeExperimentResource):
         to_be_serialized[self._meta.collection_name] = bundles
         to_be_serialized = self.alter_list_data_to_serialize(request, to_be_serialized)
 
-        to_be_serialized["warnings"] = warnings
+        to_be_serialized["warnings"] = self.get_warnings(objects, unlimited=not limit)
 
         return self.create_response(request, to_be_serialized)
 
-    def apply_sorting(self, obj_list, options=None):
+    def get_ordering(self, options=None):
+        """ Returns the (field name, reverse) to order by """
         if options is None:
             options = {}
 
@@ -413,11 +416,11 @@ class MeshCompositeExperimentResource(CompositeExperimentResource):
                 "The '%s' field has no 'attribute' for ordering with." % field_name
             )
 
-        return sorted(
-            obj_list,
-            key=lambda k: k[self.fields[field_name].attribute],
-            reverse=reverse,
-        )
+        return field_name, reverse
+
+    def apply_sorting(self, obj_list, options=None):
+        field_name, reverse = self.get_ordering(options)
+        return sorted(obj_list, key=lambda k: k[field_name], reverse=reverse)
 
     def full_dehydrate(self, bundle, for_list=False):
         # The object is a dict not and object, just return it.
@@ -425,12 +428,15 @@ class MeshCompositeExperimentResource(CompositeExperimentResource):
 
     def obj_get_list(self, bundle, **kwargs):
         get_args = bundle.request.GET
+        field_name, reverse = self.get_ordering(get_args)
+        order_by = ("-" if reverse else "") + field_name
 
         applicable_filters = bundle.request.GET.copy()
         applicable_filters.pop("limit", None)
         applicable_filters.pop("offset", None)
         applicable_filters.pop("mesh_node_ids", None)
         applicable_filters.pop("order_by", None)
+        applicable_filters = applicable_filters.dict()
 
         if "mesh_node_ids" in get_args:
             mesh_node_ids = get_args["mesh_node_ids"].split(",")
@@ -444,84 +450,46 @@ class MeshCompositeExperimentResource(CompositeExperimentResource):
             include_local_runs = True
             mesh_nodes = IonMeshNode.objects.all()
 
-        job_arguments = []
-
+        cursors = []
         if include_local_runs:
-            job_arguments.append(
-                {
-                    "address": "localhost",
-                    "resource_name": "compositeexperiment",
-                    "object_limit": self._meta.object_limit,
-                    "params": applicable_filters.copy(),
-                }
+            cursors.append(
+                mesh_query.get_cursor(
+                    "localhost", "compositeexperiment", applicable_filters, order_by
+                )
             )
         for mesh_node in mesh_nodes:
             params = applicable_filters.copy()
             params["api_key"] = mesh_node.apikey_remote
             params["system_id"] = settings.SYSTEM_UUID
-            job_arguments.append(
-                {
-                    "address": mesh_node.hostname,
-                    "resource_name": "compositeexperiment",
-                    "object_limit": self._meta.object_limit,
-                    "params": params,
-                }
+            cursors.append(
+                mesh_query.get_cursor(
+                    mesh_node.hostname,
+                    "compositeexperiment",
+                    params,
+                    order_by,
+                    extra={self._meta.host_field: mesh_node.hostname},
+                )
             )
-        with ManagedPool(processes=len(job_arguments)) as job_pool:
-            job_output = job_pool.map(fetch_remote_resource_list_process, job_arguments)
 
-        # Now that we have lists from all the servers we need to check if any had to many objects.
-        # If they did, truncate all the lists to the same date range and display it as a warning.
+        return mesh_query.FederatedQuery(cursors, field_name, reverse)
 
-        object_truncation_date = datetime.datetime(2000, 1, 1).date()
-        servers_with_truncated_data = []
-        servers_with_exceptions = []
-        merged_obj_list = []
+    def get_warnings(self, objects, unlimited=False):
         warnings = []
-
-        for address, objects, fetched_all_objects, exceptions in job_output:
-            if exceptions:
-                servers_with_exceptions.append(address)
-
-        # Fist loop, see if any servers have truncated results.
-        # If they did, record the truncation date.
-
-        for address, objects, fetched_all_objects, exceptions in job_output:
-            if not exceptions:
-                if not fetched_all_objects:
-                    servers_with_truncated_data.append(address)
-                    object_date = parse_datetime(
-                        objects[-1]["date"]
-                    ).date()  # Strip Time
-                    if object_date > object_truncation_date:
-                        object_truncation_date = object_date
-
-        for address, objects, fetched_all_objects, exceptions in job_output:
-            if not exceptions:
-                for obj in objects:
-                    # Add the _host field
-                    if address != "localhost":
-                        obj[self._meta.host_field] = address
-                    # Add if we are not truncating
-                    if len(servers_with_truncated_data) > 0:
-                        if parse_datetime(obj["date"]).date() > object_truncation_date:
-                            merged_obj_list.append(obj)
-                    else:
-                        merged_obj_list.append(obj)
-
-        if len(servers_with_truncated_data) > 0:
+        # Without a limit only object_limit objects are fetched from each server
+        if unlimited and objects.truncated:
             warnings.append(
                 "The Torrent Server(s) %s have too many results to display. "
-                "Only experiments newer than %s are displayed. Try searching or adding additional filters."
-                % (",".join(servers_with_truncated_data), str(object_truncation_date))
+                "Only the first %d experiments of each are displayed. "
+                "Try searching or adding additional filters."
+                % (",".join(objects.truncated), self._meta.object_limit)
             )
 
-        if len(servers_with_exceptions) > 0:
+        if objects.failed:
             warnings.append(
                 "Could not fetch runs from Torrent Server(s) %s!"
-                % ",".join(servers_with_exceptions)
+                % ",".join(objects.failed)
             )
-        return merged_obj_list, warnings
+        return warnings
 
     def obj_get(self, bundle, **kwargs):
         raise NotImplementedError("This resource only supports listing objects!")
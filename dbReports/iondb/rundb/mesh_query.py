@@ -0,0 +1,201 @@
+# Copyright (C) 2018 Ion Torrent Systems, Inc. All Rights Reserved
+"""
+Paged queries of a list resource across Ion Mesh nodes.
+
+For a page at offset/limit every node is asked only for its first offset+limit
+objects in the requested order, and the sorted per-node lists are combined
+with a k-way heap merge; the merged page is exact because no node can
+contribute more than offset+limit objects to it.
+
+The objects fetched from each node are kept in a NodeCursor for CURSOR_TTL
+seconds, so paging forward only asks each node for the objects it has not
+sent yet.  Requests run on a thread pool shared by the process, and each
+worker thread keeps a requests.Session so connections to the nodes are reused.
+"""
+import heapq
+import logging
+import threading
+import time
+from itertools import islice
+from multiprocessing.pool import ThreadPool
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+CURSOR_TTL = 60  # seconds
+MAX_WORKERS = 16
+POOL_MAXSIZE = 4  # connections kept per host, per worker thread
+
+_local = threading.local()
+_pool = None
+_pool_lock = threading.Lock()
+_cursors = {}
+_cursors_lock = threading.Lock()
+
+
+def get_session():
+    """Returns the requests.Session of the calling thread"""
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=POOL_MAXSIZE)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _local.session = session
+    return session
+
+
+def map_nodes(func, arguments):
+    """Like Pool.map, on the thread pool shared by all mesh requests"""
+    global _pool
+    if len(arguments) <= 1:
+        return [func(argument) for argument in arguments]
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(MAX_WORKERS)
+    return _pool.map(func, arguments)
+
+
+class NodeCursor(object):
+    """The objects fetched so far from one node for one query, in order"""
+
+    def __init__(self, address, resource_name, params, order_by, extra=None):
+        self.address = address
+        self.url = "http://%s/rundb/api/v1/%s/" % (address, resource_name)
+        self.params = dict(params)
+        self.order_by = order_by
+        self.extra = extra or {}  # added to every object fetched
+        self.objects = []
+        self.total_count = 0
+        self.exhausted = False
+        self.created = time.time()
+        self.lock = threading.Lock()
+
+    def expired(self, ttl=CURSOR_TTL):
+        return time.time() - self.created > ttl
+
+    def fetch(self, count):
+        """Returns the first count objects, asking the node only for those
+        not fetched yet"""
+        with self.lock:
+            while not self.exhausted and len(self.objects) < count:
+                params = dict(self.params)
+                params["order_by"] = self.order_by
+                params["offset"] = len(self.objects)
+                params["limit"] = count - len(self.objects)
+                response = get_session().get(self.url, params=params)
+                response.raise_for_status()
+                response_json = response.json()
+
+                objects = response_json["objects"]
+                for obj in objects:
+                    obj.update(self.extra)
+                self.objects.extend(objects)
+                self.total_count = response_json["meta"].get(
+                    "total_count", len(self.objects)
+                )
+                if not objects or not response_json["meta"].get("next"):
+                    self.exhausted = True
+            return self.objects[:count]
+
+
+def get_cursor(address, resource_name, params, order_by, extra=None):
+    """Returns the cached NodeCursor for this query, or a new one"""
+    key = (address, resource_name, order_by, tuple(sorted(params.items())))
+    with _cursors_lock:
+        for expired in [k for k, c in _cursors.items() if c.expired()]:
+            del _cursors[expired]
+        cursor = _cursors.get(key)
+        if cursor is None:
+            cursor = NodeCursor(address, resource_name, params, order_by, extra)
+            _cursors[key] = cursor
+    return cursor
+
+
+class _Descending(object):
+    """Sort key inverting the order of value"""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+def _sort_key(value, reverse):
+    # None sorts first, as it does in python 2
+    key = (value is not None, value)
+    return _Descending(key) if reverse else key
+
+
+def merge(lists, field, reverse=False):
+    """Yields the objects of lists, each sorted by field, in merged order.
+    Ties are taken from the earlier list first."""
+    heap = [
+        (_sort_key(objects[0][field], reverse), index, 0)
+        for index, objects in enumerate(lists)
+        if objects
+    ]
+    heapq.heapify(heap)
+    while heap:
+        _, index, position = heap[0]
+        objects = lists[index]
+        yield objects[position]
+        position += 1
+        if position < len(objects):
+            key = _sort_key(objects[position][field], reverse)
+            heapq.heapreplace(heap, (key, index, position))
+        else:
+            heapq.heappop(heap)
+
+
+def _fetch(args):
+    cursor, count = args
+    try:
+        return cursor.fetch(count), None
+    except Exception as e:
+        logger.exception("Mesh api failed to fetch data from %s" % cursor.url)
+        return [], e
+
+
+class FederatedQuery(object):
+    """
+    Objects of all cursors merged by field.  Call fetch() with the number of
+    objects needed before slicing; len() is the total on all nodes.
+    """
+
+    def __init__(self, cursors, field, reverse=False):
+        self.cursors = cursors
+        self.field = field
+        self.reverse = reverse
+        self.objects = []
+        self.total_count = 0
+        self.failed = []  # addresses
+        self.truncated = []  # addresses with more objects than fetched
+
+    def fetch(self, count):
+        results = map_nodes(_fetch, [(cursor, count) for cursor in self.cursors])
+        lists = []
+        for cursor, (objects, error) in zip(self.cursors, results):
+            if error is not None:
+                self.failed.append(cursor.address)
+                continue
+            lists.append(objects)
+            self.total_count += cursor.total_count
+            if cursor.total_count > len(objects):
+                self.truncated.append(cursor.address)
+        self.objects = list(islice(merge(lists, self.field, self.reverse), count))
+        return self.objects
+
+    def __len__(self):
+        return self.total_count
+
+    def __getitem__(self, index):
+        return self.objects[index]
@@ -1752,32 +1752,40 @@ class PlannedExperiment(models.Model):
                         )
         return categoryDisplayedName
 
-    def get_composite_applCatDisplayedName(self):
+    @staticmethod
+    def get_displayed_name_lookups():
+        """
+        return the application category and run type displayed names as
+        ({lower case category: displayed name}, {runType: description})
+        """
+        categories = {}
+        for value, displayedValue in (
+            common_CV.objects.filter(cv_type="applicationCategory", isVisible=True)
+            .order_by("pk")
+            .values_list("value", "displayedValue")
+        ):
+            categories.setdefault(value.lower(), displayedValue)
+        runTypes = {}
+        for runType, description in RunType.objects.order_by("pk").values_list(
+            "runType", "description"
+        ):
+            runTypes.setdefault(runType, description)
+        return categories, runTypes
+
+    def get_composite_applCatDisplayedName(self, lookups=None):
         """
         return category displayed name(s) for UI pages
+        lookups from get_displayed_name_lookups() can be shared by many plans
         """
-        applicationCategoryDisplayedName = self.get_applicationCategoryDisplayedName(
-            self.categories
-        )
-        try:
-            runTypeObj = RunType.objects.filter(runType=self.runType)
-            if runTypeObj:
-                if applicationCategoryDisplayedName:
-                    categoryDisplayedName = applicationCategoryDisplayedName
-                    categoryDisplayedName += " | "
-                    categoryDisplayedName += runTypeObj[0].description
-                else:
-                    categoryDisplayedName = runTypeObj[0].description
-            else:
-                categoryDisplayedName = applicationCategoryDisplayedName
-        except Exception as err:
-            categoryDisplayedName = (
-                applicationCategoryDisplayedName
-                if applicationCategoryDisplayedName
-                else ""
-            )
+        categories, runTypes = lookups or self.get_displayed_name_lookups()
+        names = []
+        for token in (self.categories or "").split(";"):
+            if token.lower() in categories:
+                names.append(categories[token.lower()])
+        if self.runType in runTypes:
+            names.append(runTypes[self.runType])
 
-        return categoryDisplayedName
+        return " | ".join(names)
 
     @staticmethod
     def get_dualBarcodes_delimiter():
@@ -6230,7 +6238,11 @@ class PluginResult(models.Model):
 
         return path
 
-    def UpdateSizeAndINodeCount(self):
+    def UpdateSizeAndINodeCount(self, usage=None):
+        """Update size and inodes from the plugin output folder.
+        usage is an optional disk_usage.DiskUsage which already scanned it."""
+        from iondb.rundb.data import disk_usage
+        from iondb.rundb.data.dm_filelist import FileListManifest
 
         # reset the size and the inodes
         self.size = 0
@@ -6240,17 +6252,13 @@ class PluginResult(models.Model):
 
         d = self.default_path
         if d and os.path.exists(d):
-            file_walker = (
-                os.path.join(root, f) for root, _, files in os.walk(d) for f in files
-            )
-            for f in file_walker:
-                if not os.path.isfile(f):
-                    continue
-                inodes += 1
-                try:
-                    total_size += os.lstat(f).st_size
-                except OSError:
-                    logger.exception("Failed accessing %s during calc_size", f)
+            if usage is None or not usage.scanned(d):
+                # share the report's file list manifest with data management
+                manifest = FileListManifest(self.result.get_report_dir())
+                manifest.walk(d)
+                manifest.save()
+                usage = disk_usage.from_manifest(manifest, [d])
+            total_size, inodes = usage.total(d)
 
         logger.info(
             "PluginResult %d for %s has %d byte(s) in %d file(s)",
@@ -6263,7 +6271,7 @@ class PluginResult(models.Model):
         # update based on finding
         self.size = total_size
         self.inodes = inodes
-        self.save()
+        self.save(update_fields=["size", "inodes"])
 
         return total_size, inodes
 
@@ -0,0 +1 @@
+# Copyright (C) 2012 Ion Torrent Systems, Inc. All Rights Reserved
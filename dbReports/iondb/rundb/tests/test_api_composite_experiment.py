@@ -0,0 +1,126 @@
+# Copyright (C) 2018 Ion Torrent Systems, Inc. All Rights Reserved
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from tastypie.test import ResourceTestCase
+
+from iondb.rundb import models
+
+API_PATH = "/rundb/api/v1/compositeexperiment/"
+USER = "ionadmin"
+PASS = "ionadmin"
+
+
+def create_experiment(index, user):
+    """An experiment with a plan, EAS, sample set, samples and two reports"""
+    now = timezone.now()
+    sampleName = "sample_%d" % index
+    sampleSet = models.SampleSet.objects.create(
+        displayedName="sampleset_%d" % index, creator=user, lastModifiedUser=user
+    )
+    plan = models.PlannedExperiment.objects.create(
+        planName="plan_%d" % index,
+        runType="AMPS",
+        categories="Oncomine;barcodes_8",
+        planExecuted=True,
+    )
+    plan.sampleSets.add(sampleSet)
+    exp = models.Experiment.objects.create(
+        expName="R_2018_01_01_run_%d" % index,
+        expDir="/results/PGM_test/R_2018_01_01_run_%d" % index,
+        pgmName="PGM_test",
+        date=now,
+        resultDate=now,
+        cycles=0,
+        flows=400,
+        chipType="510",
+        status="run",
+        plan=plan,
+    )
+    eas = models.ExperimentAnalysisSettings.objects.create(
+        experiment=exp,
+        reference="hg19",
+        barcodeKitName="IonXpress",
+        barcodedSamples={
+            sampleName: {
+                "barcodes": ["IonXpress_001", "IonXpress_002"],
+                "barcodeSampleInfo": {
+                    "IonXpress_001": {"reference": "hg19"},
+                    "IonXpress_002": {"reference": "GRCh38"},
+                },
+            }
+        },
+        isEditable=False,
+        isOneTimeOverride=False,
+        status="run",
+    )
+    plan.latestEAS = eas
+    plan.save()
+    for name in [sampleName, "other_%d" % index]:
+        sample = models.Sample.objects.create(name=name, displayedName=name)
+        sample.experiments.add(exp)
+    for n in range(2):
+        result = models.Results.objects.create(
+            experiment=exp,
+            eas=eas,
+            resultsName="Auto_user_R_2018_01_01_run_%d_%d" % (index, n),
+            reportLink="/output/Home/Auto_%d_%d/" % (index, n),
+            status="Completed",
+            processedCycles=0,
+            processedflows=400,
+            framesProcessed=0,
+            timeToComplete="0",
+            metaData={},
+        )
+    exp.repResult = result
+    exp.save()
+    return exp
+
+
+class CompositeExperimentResourceTest(ResourceTestCase):
+    def setUp(self):
+        super(CompositeExperimentResourceTest, self).setUp()
+        self.user = User.objects.create_superuser(USER, "ionadmin@localhost", PASS)
+        models.common_CV.objects.create(
+            cv_type="applicationCategory",
+            value="Oncomine",
+            displayedValue="Oncomine",
+            isVisible=True,
+        )
+        models.RunType.objects.get_or_create(
+            runType="AMPS", defaults={"description": "AmpliSeq DNA"}
+        )
+        self.experiments = [create_experiment(i, self.user) for i in range(6)]
+
+    def get_list(self, limit):
+        with CaptureQueriesContext(connection) as context:
+            resp = self.api_client.get(
+                API_PATH,
+                format="json",
+                data={"limit": limit},
+                authentication=self.create_basic(username=USER, password=PASS),
+            )
+        self.assertHttpOK(resp)
+        return self.deserialize(resp)["objects"], len(context)
+
+    def test_constant_queries_per_page(self):
+        small, small_queries = self.get_list(2)
+        large, large_queries = self.get_list(6)
+        self.assertEqual(2, len(small))
+        self.assertEqual(6, len(large))
+        self.assertEqual(small_queries, large_queries)
+
+    def test_dehydrated_fields(self):
+        objects, _ = self.get_list(6)
+        for obj in objects:
+            index = obj["expName"].rsplit("_", 1)[1]
+            self.assertEqual("2 Samples ...", obj["sample"])
+            self.assertEqual("sampleset_%s" % index, obj["sampleSetName"])
+            self.assertEqual("GRCh38, hg19", obj["references"])
+            self.assertEqual("IonXpress", obj["barcodeId"])
+            self.assertEqual(
+                "Oncomine | AmpliSeq DNA", obj["applicationCategoryDisplayedName"]
+            )
+            self.assertEqual(2, len(obj["results"]))
+            self.assertTrue(obj["repResult"])
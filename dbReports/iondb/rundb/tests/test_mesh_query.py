@@ -0,0 +1,144 @@
+# Copyright (C) 2018 Ion Torrent Systems, Inc. All Rights Reserved
+import random
+
+from django.test import SimpleTestCase
+
+from iondb.rundb import mesh_query
+
+
+class FakeResponse(object):
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+class FakeSession(object):
+    """Serves a sorted list of objects like a tastypie list resource"""
+
+    def __init__(self, objects_per_url):
+        self.objects_per_url = objects_per_url
+        self.requests = []
+
+    def get(self, url, params=None):
+        self.requests.append((url, dict(params)))
+        objects = self.objects_per_url[url]
+        field = params["order_by"].lstrip("-")
+        objects = sorted(
+            objects, key=lambda o: o[field], reverse=params["order_by"][0] == "-"
+        )
+        offset, limit = params["offset"], params["limit"]
+        page = [dict(o) for o in objects[offset : offset + limit]]
+        more = offset + limit < len(objects)
+        return FakeResponse(
+            {
+                "objects": page,
+                "meta": {"total_count": len(objects), "next": "next" if more else None},
+            }
+        )
+
+
+def make_objects(host, count):
+    return [
+        {"id": i, "date": "2018-01-%02dT%02d:00:00" % (1 + i % 28, i % 24), "h": host}
+        for i in range(count)
+    ]
+
+
+class MeshQueryTest(SimpleTestCase):
+    def setUp(self):
+        self.nodes = {"a": 50, "b": 7, "c": 0, "d": 23}
+        self.session = FakeSession(
+            dict(
+                (
+                    "http://%s/rundb/api/v1/compositeexperiment/" % host,
+                    make_objects(host, n),
+                )
+                for host, n in self.nodes.items()
+            )
+        )
+        self.get_session = mesh_query.get_session
+        mesh_query.get_session = lambda: self.session
+        mesh_query._cursors.clear()
+
+    def tearDown(self):
+        mesh_query.get_session = self.get_session
+        mesh_query._cursors.clear()
+
+    def query(self, order_by="-date"):
+        cursors = [
+            mesh_query.get_cursor(
+                host,
+                "compositeexperiment",
+                {"status": "run"},
+                order_by,
+                extra={"_host": host},
+            )
+            for host in sorted(self.nodes)
+        ]
+        return mesh_query.FederatedQuery(
+            cursors, order_by.lstrip("-"), order_by[0] == "-"
+        )
+
+    def expected(self, order_by):
+        objects = []
+        for host in sorted(self.nodes):
+            objects.extend(make_objects(host, self.nodes[host]))
+        field = order_by.lstrip("-")
+        return sorted(objects, key=lambda o: o[field], reverse=order_by[0] == "-")
+
+    def test_merge(self):
+        for reverse in [False, True]:
+            lists = [
+                sorted([random.randint(0, 20) for _ in range(n)], reverse=reverse)
+                for n in [0, 5, 17, 1, 30]
+            ]
+            merged = mesh_query.merge(
+                [[{"v": v} for v in values] for values in lists], "v", reverse
+            )
+            self.assertEqual(
+                sorted(sum(lists, []), reverse=reverse), [o["v"] for o in merged]
+            )
+
+    def test_pages(self):
+        for order_by in ["-date", "date", "id"]:
+            expected = self.expected(order_by)
+            for offset in range(0, 90, 20):
+                query = self.query(order_by)
+                query.fetch(offset + 20)
+                page = query[offset : offset + 20]
+                self.assertEqual(len(expected), len(query))
+                self.assertEqual(
+                    [o[order_by.lstrip("-")] for o in expected[offset : offset + 20]],
+                    [o[order_by.lstrip("-")] for o in page],
+                )
+                for obj in page:
+                    self.assertEqual(obj["h"], obj["_host"])
+
+    def test_next_page_fetches_delta(self):
+        self.query().fetch(20)
+        first = list(self.session.requests)
+        self.assertEqual(len(self.nodes), len(first))
+        self.session.requests = []
+
+        self.query().fetch(40)
+        # c is empty and b sent all 7 of its objects, only a and d are asked
+        self.assertEqual(
+            [("a", 20, 20), ("d", 20, 20)],
+            sorted(
+                (url.split("/")[2], params["offset"], params["limit"])
+                for url, params in self.session.requests
+            ),
+        )
+
+    def test_failed_node(self):
+        self.session.objects_per_url.pop("http://b/rundb/api/v1/compositeexperiment/")
+        query = self.query()
+        objects = query.fetch(100)
+        self.assertEqual(["b"], query.failed)
+        self.assertEqual(73, len(objects))
+        self.assertEqual(73, len(query))
@@ -301,11 +301,32 @@ EXTERNAL_IP_URL = "http://icanhazip.com"
 
 CRAWLER_PORT = 10001
 CRAWLER_PERIOD = 60
+# process runs on inotify events, with a full crawl every CRAWLER_WATCH_PERIOD
+CRAWLER_WATCH = False
+CRAWLER_WATCH_PERIOD = 900
+CRAWLER_INDEX = "/var/spool/ion/crawler_index.json"
+
+# data management export/archive: files per copy batch, batches copied in parallel
+DM_TRANSFER_BATCH_SIZE = 500
+DM_TRANSFER_WORKERS = 4
 
 ANALYSIS_ROOT = "/opt/ion/iondb/anaserve"
 
 JOBSERVER_HOST = HOSTNAME
 JOBSERVER_PORT = 10000
+# job server slots; a full-chip analysis holds the slots of its chip type,
+# chips not listed here hold as many as their Chip.slots, thumbnails hold 1
+JOBSERVER_SLOTS = 8
+JOBSERVER_CHIP_WEIGHTS = {
+    "520": 2,
+    "530": 2,
+    "531": 2,
+    "540": 4,
+    "550": 4,
+    "560": 4,
+    "P1": 4,
+    "P2": 4,
+}
 
 # the settings for the xmlrpc server connection to the plugins daemon
 IPLUGIN_HOST = HOSTNAME
@@ -0,0 +1,133 @@
+# Copyright (C) 2018 Ion Torrent Systems, Inc. All Rights Reserved
+"""
+Crawl index
+===========
+
+Persistent bookkeeping for the ionCrawler daemon.  The index remembers
+
+* the set of experiment directories whose FTP transfer is done, and
+* the mtime and subdirectory listing of every rig folder.
+
+so that a crawl pass only re-lists rig folders whose mtime changed and only
+visits experiment directories that are not yet complete.
+
+This module has no Django dependency; the crawler supplies the database
+lookups through the ``lookup_complete`` callback of `CrawlIndex.pending`.
+"""
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+
+# Drop the completed set once a day so a run whose status is reset in the
+# database is picked up again by the crawler.
+DEFAULT_MAX_AGE = 24 * 3600
+
+
+class CrawlIndex(object):
+
+    """Completed experiment directories and rig folder listings, keyed by
+    rig folder mtime."""
+
+    def __init__(self, filename=None, max_age=DEFAULT_MAX_AGE):
+        self.filename = filename
+        self.max_age = max_age
+        self.completed = set()
+        self.rigs = {}  # rig_folder -> {"mtime": float, "subdirs": [path, ...]}
+        self.created = time.time()
+        self.dirty = False
+
+    def reset(self):
+        """Forget everything; the next pass re-lists every rig folder"""
+        self.completed = set()
+        self.rigs = {}
+        self.created = time.time()
+        self.dirty = True
+
+    def load(self):
+        """Load the index from ``filename``.  A missing, unreadable or stale
+        index file simply leaves the index empty."""
+        if not self.filename:
+            return
+        try:
+            with open(self.filename) as fhandle:
+                blob = json.load(fhandle)
+            if blob.get("version") != INDEX_VERSION:
+                return
+            self.completed = set(blob.get("completed", []))
+            self.rigs = blob.get("rigs", {})
+            self.created = blob.get("created", time.time())
+        except (IOError, OSError, ValueError):
+            logger.debug("Unable to load crawl index %s" % self.filename)
+
+    def save(self):
+        """Write the index to ``filename`` if it changed since the last save.
+        The file is replaced atomically so a crash never leaves a partial
+        index behind."""
+        if not self.filename or not self.dirty:
+            return
+        blob = {
+            "version": INDEX_VERSION,
+            "created": self.created,
+            "completed": sorted(self.completed),
+            "rigs": self.rigs,
+        }
+        tmpname = self.filename + ".tmp"
+        try:
+            with open(tmpname, "w") as fhandle:
+                json.dump(blob, fhandle)
+            os.rename(tmpname, self.filename)
+            self.dirty = False
+        except (IOError, OSError):
+            logger.warn("Unable to save crawl index %s" % self.filename)
+
+    def expire(self):
+        """Reset the index once it is older than ``max_age`` seconds"""
+        if self.max_age and time.time() - self.created > self.max_age:
+            self.reset()
+
+    def list_rig(self, rig_folder):
+        """Return the subdirectories of ``rig_folder``, re-listing the folder
+        only when its mtime differs from the indexed one.
+        Raises OSError if ``rig_folder`` does not exist."""
+        mtime = os.stat(rig_folder).st_mtime
+        entry = self.rigs.get(rig_folder)
+        if entry is not None and entry["mtime"] == mtime:
+            return entry["subdirs"]
+
+        subdirs = [
+            path
+            for path in (os.path.join(rig_folder, d) for d in os.listdir(rig_folder))
+            if os.path.isdir(path)
+        ]
+        if entry is not None:
+            # forget completed runs that have been removed from the rig folder
+            self.completed.difference_update(
+                set(entry["subdirs"]).difference(subdirs)
+            )
+        self.rigs[rig_folder] = {"mtime": mtime, "subdirs": subdirs}
+        self.dirty = True
+        return subdirs
+
+    def pending(self, subdirs, lookup_complete=None):
+        """Return the entries of ``subdirs`` that are not known to be complete.
+        ``lookup_complete(candidates)`` returns the subset of ``candidates``
+        whose transfer is done; it is only asked about unknown directories."""
+        candidates = [d for d in subdirs if d not in self.completed]
+        if candidates and lookup_complete is not None:
+            done = set(lookup_complete(candidates))
+            if done:
+                self.completed.update(done)
+                self.dirty = True
+                candidates = [d for d in candidates if d not in done]
+        return candidates
+
+    def mark_complete(self, expdir):
+        """Record ``expdir`` as complete"""
+        if expdir not in self.completed:
+            self.completed.add(expdir)
+            self.dirty = True
@@ -18,6 +18,8 @@ pkill BaseCaller
 
 mkdir /software/oia
 mv oiad.py /software/oia
+mv oiaScheduler.py /software/oia
+mv oiaSimulate.py /software/oia
 mv oiaTimingPlot.py /software/oia
 mv oia.config /software/oia
 rm /software/config/oia.config
@@ -0,0 +1,297 @@
+# Copyright (C) 2018 Ion Torrent Systems, Inc. All Rights Reserved
+"""
+Resource model of the OIA daemon.
+
+Every block job belongs to a stage (justBeadFind, Analysis or BaseCaller
+phase estimation) and costs CPU threads, host memory and GPU memory, as
+declared per chip in oia.config.  A ResourcePool holds the budgets of the
+instrument and admits a job only while all of them allow; acquiring and
+releasing are atomic, so the dispatcher and the worker threads can both
+update it.  The nb_max_* job limits of oia.config remain in force as count
+budgets.
+
+The Scheduler takes work from the runs in process in turn: the run served
+last goes to the back, and a run with nothing that fits gives its turn to the
+next one, so one run cannot starve the others and idle capacity is taken by
+whichever run can use it.
+
+The pool integrates the jobs running per stage and the resources in use over
+time; utilization() and summary() report them.  oiaSimulate.py replays
+recorded timing.txt traces through the same classes.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from collections import namedtuple
+
+STAGES = ("beadfind", "analysis", "basecaller")
+RESOURCES = ("cpu", "host_memory", "gpu_memory")
+
+# block.status while a job of the stage runs
+STAGE_STATUS = {
+    "beadfind": "performJustBeadFind",
+    "analysis": "performAnalysis",
+    "basecaller": "performPhaseEstimation",
+}
+
+# the nb_max_<stage>_jobs limit counts the jobs of all stages in its group,
+# basecaller and justBeadFind don't run at full count at the same time
+LIMIT_GROUPS = {
+    "beadfind": ("beadfind",),
+    "analysis": ("analysis",),
+    "basecaller": ("beadfind", "basecaller"),
+}
+
+# Analysis and justBeadFind threads spend most of their time waiting on the
+# GPU and on the disk, the default CPU budget allows for that
+CPU_OVERSUBSCRIPTION = 4
+# fraction of the host memory kept for the OS and data collection
+HOST_MEMORY_RESERVE = 0.1
+# GPU memory budgeted per 1000 Mb detected.  The count-only policy allowed
+# total_GPU_memory/1000 analysis jobs of 1 Gb each, a 4000 Mb card still
+# takes 4 of them
+GPU_MEMORY_PER_1000_MB = 1073741824
+
+Cost = namedtuple("Cost", RESOURCES)
+
+
+def _getint(config, sections, option, default=None):
+    """Returns option from the first of sections that has it"""
+    for section in sections:
+        if config.has_section(section) and config.has_option(section, option):
+            return config.getint(section, option)
+    if default is None:
+        raise ValueError("%s not found in %s" % (option, ", ".join(sections)))
+    return default
+
+
+def get_host_memory():
+    """Returns the total host memory in bytes"""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, ValueError):
+        pass
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def get_stage_costs(config, chipversion, basecaller_threads):
+    """Returns {stage: Cost} of a job of each stage for chipversion.
+
+    CPU costs are the thread counts the commands are started with, memory
+    costs come from the chip section or DefaultChip.  BaseCaller defaults to
+    the host memory of justBeadFind, GPU memory defaults to 0 except for
+    Analysis."""
+    sections = (chipversion, "DefaultChip")
+    beadfind_memory = _getint(config, sections, "HOST_memory_requirement_beadfind")
+    return {
+        "beadfind": Cost(
+            config.getint("global", "nb_beadfind_threads"),
+            beadfind_memory,
+            _getint(config, sections, "GPU_memory_requirement_beadfind", 0),
+        ),
+        "analysis": Cost(
+            config.getint("global", "nb_analysis_threads"),
+            _getint(config, sections, "HOST_memory_requirement_analysis"),
+            _getint(config, sections, "GPU_memory_requirement_analysis"),
+        ),
+        "basecaller": Cost(
+            basecaller_threads,
+            _getint(
+                config, sections, "HOST_memory_requirement_basecaller", beadfind_memory
+            ),
+            _getint(config, sections, "GPU_memory_requirement_basecaller", 0),
+        ),
+    }
+
+
+def get_stage_limits(config, section):
+    """Returns the nb_max_jobs and nb_max_<stage>_jobs of section, falling
+    back to DefaultChip"""
+    sections = (section, "DefaultChip")
+    limits = {"jobs": _getint(config, sections, "nb_max_jobs")}
+    for stage in STAGES:
+        limits[stage] = _getint(config, sections, "nb_max_%s_jobs" % stage)
+    return limits
+
+
+def get_budgets(config, total_GPU_memory):
+    """Returns the budgets of the instrument: CPU threads, host and GPU memory
+    in bytes, and the global job limits.  CPU_budget, HOST_memory_budget and
+    GPU_memory_budget in the global section override the detected values.
+    total_GPU_memory is in Mb."""
+    section = ("global",)
+    budgets = {
+        "cpu": _getint(
+            config,
+            section,
+            "CPU_budget",
+            multiprocessing.cpu_count() * CPU_OVERSUBSCRIPTION,
+        ),
+        "host_memory": _getint(
+            config,
+            section,
+            "HOST_memory_budget",
+            int(get_host_memory() * (1 - HOST_MEMORY_RESERVE)),
+        ),
+        "gpu_memory": _getint(
+            config,
+            section,
+            "GPU_memory_budget",
+            int(total_GPU_memory) * GPU_MEMORY_PER_1000_MB // 1000,
+        ),
+    }
+    budgets.update(get_stage_limits(config, "global"))
+    return budgets
+
+
+class ResourcePool(object):
+    """Budgets, and the jobs and resources in use, of the instrument.
+
+    A job whose cost alone exceeds a budget is admitted when nothing else
+    holds that resource, so it runs by itself instead of never."""
+
+    def __init__(self, budgets, clock=time.time):
+        self.budgets = dict(budgets)
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.used = dict((resource, 0) for resource in RESOURCES)
+        self.jobs = dict((stage, 0) for stage in STAGES)
+        self.started = dict((stage, 0) for stage in STAGES)
+        self.peak = dict((resource, 0) for resource in RESOURCES)
+        # job seconds per stage and resource seconds in use
+        self.area = dict((key, 0.0) for key in STAGES + RESOURCES)
+        self.start_time = self._last = clock()
+
+    def _advance(self):
+        now = self.clock()
+        elapsed = now - self._last
+        for stage in STAGES:
+            self.area[stage] += self.jobs[stage] * elapsed
+        for resource in RESOURCES:
+            self.area[resource] += self.used[resource] * elapsed
+        self._last = now
+
+    def _fits(self, stage, cost, limits):
+        for bounds in (self.budgets, limits):
+            if sum(self.jobs.values()) >= bounds.get("jobs", float("inf")):
+                return False
+            count = sum(self.jobs[s] for s in LIMIT_GROUPS[stage])
+            if count >= bounds.get(stage, float("inf")):
+                return False
+        for resource, amount in zip(RESOURCES, cost):
+            used = self.used[resource]
+            if (
+                amount
+                and used
+                and used + amount > self.budgets.get(resource, float("inf"))
+            ):
+                return False
+        return True
+
+    def try_acquire(self, stage, cost, limits=None):
+        """Takes the resources of a job of stage if they are available under
+        the budgets and the job limits in limits. Returns True if taken."""
+        with self.lock:
+            if not self._fits(stage, cost, limits or {}):
+                return False
+            self._advance()
+            self.jobs[stage] += 1
+            self.started[stage] += 1
+            for resource, amount in zip(RESOURCES, cost):
+                self.used[resource] += amount
+                self.peak[resource] = max(self.peak[resource], self.used[resource])
+            return True
+
+    def release(self, stage, cost):
+        """Gives back the resources of a finished job of stage"""
+        with self.lock:
+            self._advance()
+            self.jobs[stage] -= 1
+            for resource, amount in zip(RESOURCES, cost):
+                self.used[resource] -= amount
+
+    def running(self, *stages):
+        """Number of jobs running, of stages or of all stages"""
+        with self.lock:
+            return sum(self.jobs[stage] for stage in stages or STAGES)
+
+    def utilization(self):
+        """Per stage: jobs running and started, busy job seconds and mean jobs
+        running.  Per resource: in use, budget, peak and mean fraction of the
+        budget used."""
+        with self.lock:
+            self._advance()
+            elapsed = max(self._last - self.start_time, 1e-9)
+            ret = {"elapsed": self._last - self.start_time}
+            for stage in STAGES:
+                ret[stage] = {
+                    "running": self.jobs[stage],
+                    "started": self.started[stage],
+                    "busy": self.area[stage],
+                    "mean": self.area[stage] / elapsed,
+                }
+            for resource in RESOURCES:
+                budget = self.budgets.get(resource) or 1
+                ret[resource] = {
+                    "used": self.used[resource],
+                    "budget": self.budgets.get(resource),
+                    "peak": self.peak[resource],
+                    "mean": self.area[resource] / elapsed / budget,
+                }
+            return ret
+
+    def summary(self):
+        """utilization() on one line"""
+        u = self.utilization()
+        s = "Utilization over %ds:" % u["elapsed"]
+        for stage in STAGES:
+            s += " %s %d running %d started %ds busy %.1f mean;" % (
+                stage,
+                u[stage]["running"],
+                u[stage]["started"],
+                u[stage]["busy"],
+                u[stage]["mean"],
+            )
+        for resource in RESOURCES:
+            if not u[resource]["budget"]:
+                continue
+            budget = float(u[resource]["budget"])
+            s += " %s %d%% now %d%% peak %d%% mean;" % (
+                resource,
+                100 * u[resource]["used"] / budget,
+                100 * u[resource]["peak"] / budget,
+                100 * u[resource]["mean"],
+            )
+        return s
+
+
+class Scheduler(object):
+    """Picks the next job to run from the runs in process.
+
+    candidates(run) yields (stage, job) in the order the run prefers them,
+    get_costs(run) returns ({stage: Cost}, limits) for the run's chip.  With
+    rotate False the runs are always visited in the order given."""
+
+    def __init__(self, resources, rotate=True):
+        self.resources = resources
+        self.rotate = rotate
+        self.last = None  # run served last
+
+    def next_job(self, runs, candidates, get_costs):
+        """Returns (run, stage, job, cost) of the first candidate whose
+        resources could be acquired, or None"""
+        runs = list(runs)
+        if self.rotate and self.last in runs:
+            start = runs.index(self.last) + 1
+            runs = runs[start:] + runs[:start]
+        for run in runs:
+            costs, limits = get_costs(run)
+            for stage, job in candidates(run):
+                if self.resources.try_acquire(stage, costs[stage], limits):
+                    self.last = run
+                    return run, stage, job, costs[stage]
+        return None
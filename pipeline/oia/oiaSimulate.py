@@ -0,0 +1,241 @@
+#!/usr/bin/python
+# Copyright (C) 2018 Ion Torrent Systems, Inc. All Rights Reserved
+"""
+Replay recorded OIA timing.txt traces through the scheduler, offline.
+
+Each block of a trace replays its jobs in the recorded order and with the
+recorded durations, a job becoming ready when the previous job of its block
+finishes.  A run arrives at the time of its first recorded job, with all of
+its flows available.  The same ResourcePool and Scheduler as oiad.py decide
+which job starts next, so scheduling policies and budgets can be compared
+without an instrument:
+
+    oiaSimulate.py --config oia.config timing.txt:540 other/timing.txt:P2.2.2
+
+Policies:
+    resource   CPU, host and GPU memory budgets, runs served in turn (oiad.py)
+    counters   nb_max_* job counts only and at most total_GPU_memory/1000
+               analyses, runs served in order (OIA before the resource model)
+"""
+import argparse
+import heapq
+import shlex
+import time
+
+try:
+    import ConfigParser
+except ImportError:
+    import configparser as ConfigParser
+
+from oiaScheduler import (
+    CPU_OVERSUBSCRIPTION,
+    ResourcePool,
+    Scheduler,
+    get_budgets,
+    get_stage_costs,
+    get_stage_limits,
+)
+
+
+class SimBlock(object):
+    def __init__(self, run, name):
+        self.run = run
+        self.name = name
+        self.jobs = []  # (stage, duration) not yet started
+        self.done = 0
+        self.busy = False
+        self.ready = 0.0  # time the next job became ready
+
+
+class SimRun(object):
+    def __init__(self, name, chipversion):
+        self.name = name
+        self.chipversion = chipversion
+        self.blocks = {}
+        self.arrival = None
+        self.recorded_end = None
+        self.finished = None
+
+
+def _parse_time(text):
+    return time.mktime(time.strptime(text, "%Y-%m-%d %H:%M:%S"))
+
+
+def read_trace(path, chipversion, runs):
+    """Adds the jobs of a timing.txt file to runs, {name: SimRun}"""
+    records = []
+    with open(path) as f:
+        for line in f:
+            fields = shlex.split(line)
+            if len(fields) < 9 or fields[0] != "TIMING" or fields[1] == "run":
+                continue
+            run_name, block_name, chunk, duration = fields[1:5]
+            stage = fields[9] if len(fields) > 9 else None
+            start, stop = _parse_time(fields[6]), _parse_time(fields[7])
+            records.append((start, stop, run_name, block_name, chunk, stage, duration))
+
+    last_chunk = {}
+    for start, stop, run_name, block_name, chunk, stage, duration in sorted(records):
+        run = runs.setdefault(run_name, SimRun(run_name, chipversion))
+        block = run.blocks.setdefault(block_name, SimBlock(run, block_name))
+        if stage is None:
+            # traces before the stage column: beadfind has no flows, the
+            # basecaller repeats the chunk of the analysis before it
+            if chunk == "-1--1":
+                stage = "beadfind"
+            elif last_chunk.get((run_name, block_name)) == chunk:
+                stage = "basecaller"
+            else:
+                stage = "analysis"
+        last_chunk[(run_name, block_name)] = chunk
+        block.jobs.append((stage, float(duration)))
+        run.arrival = start if run.arrival is None else min(run.arrival, start)
+        run.recorded_end = max(run.recorded_end or stop, stop)
+
+
+def simulate(runs, budgets, get_costs, rotate=True):
+    """Replays runs, returns (ResourcePool, {run name: finish time},
+    [wait of every job])"""
+    now = [0.0]
+    resources = ResourcePool(budgets, clock=lambda: now[0])
+    scheduler = Scheduler(resources, rotate=rotate)
+    t0 = min(run.arrival for run in runs)
+
+    events = []  # (time, sequence, run or (block, stage, cost))
+    for sequence, run in enumerate(runs):
+        heapq.heappush(events, (run.arrival - t0, sequence, run))
+    sequence = len(runs)
+
+    def candidates(run):
+        for block in sorted(run.blocks.values(), key=lambda b: (b.done, b.name)):
+            if not block.busy and block.jobs:
+                yield block.jobs[0][0], block
+
+    active = []
+    finished = {}
+    waits = []
+    while events:
+        now[0] = events[0][0]
+        while events and events[0][0] == now[0]:
+            _, _, event = heapq.heappop(events)
+            if isinstance(event, SimRun):
+                for block in event.blocks.values():
+                    block.ready = now[0]
+                active.append(event)
+            else:
+                block, stage, cost = event
+                resources.release(stage, cost)
+                block.busy = False
+                block.done += 1
+                block.ready = now[0]
+
+        for run in list(active):
+            if not any(block.jobs or block.busy for block in run.blocks.values()):
+                finished[run.name] = now[0]
+                active.remove(run)
+
+        while True:
+            job = scheduler.next_job(active, candidates, get_costs)
+            if job is None:
+                break
+            run, stage, block, cost = job
+            _, duration = block.jobs.pop(0)
+            block.busy = True
+            waits.append(now[0] - block.ready)
+            sequence += 1
+            heapq.heappush(events, (now[0] + duration, sequence, (block, stage, cost)))
+
+    return resources, finished, waits
+
+
+def _copy_run(run):
+    copy = SimRun(run.name, run.chipversion)
+    copy.arrival = run.arrival
+    copy.recorded_end = run.recorded_end
+    for name, block in run.blocks.items():
+        copy.blocks[name] = SimBlock(copy, name)
+        copy.blocks[name].jobs = list(block.jobs)
+    return copy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("traces", nargs="+", help="timing.txt[:chipversion]")
+    parser.add_argument("--config", default="/software/config/oia.config")
+    parser.add_argument(
+        "--policy", choices=["resource", "counters", "both"], default="both"
+    )
+    parser.add_argument("--cores", type=int, default=40, help="instrument CPU cores")
+    parser.add_argument("--cpu", type=int, help="CPU thread budget")
+    parser.add_argument(
+        "--host-memory", type=float, default=128, help="host memory budget, Gb"
+    )
+    parser.add_argument(
+        "--gpu-memory", type=int, default=4000, help="total GPU memory, Mb"
+    )
+    args = parser.parse_args()
+
+    config = ConfigParser.RawConfigParser()
+    config.optionxform = str
+    if not config.read(args.config):
+        parser.error("cannot read %s" % args.config)
+
+    runs = {}
+    for trace in args.traces:
+        path, _, chipversion = trace.partition(":")
+        read_trace(path, chipversion or "DefaultChip", runs)
+    runs = sorted(runs.values(), key=lambda run: run.arrival)
+    if not runs:
+        parser.error("no jobs found in %s" % ", ".join(args.traces))
+
+    t0 = min(run.arrival for run in runs)
+    print("recorded: %ds" % (max(run.recorded_end for run in runs) - t0))
+
+    costs = {}
+
+    def get_costs(run):
+        if run.chipversion not in costs:
+            costs[run.chipversion] = (
+                get_stage_costs(config, run.chipversion, args.cores // 2),
+                get_stage_limits(config, run.chipversion),
+            )
+        return costs[run.chipversion]
+
+    budgets = get_budgets(config, args.gpu_memory)
+    budgets["cpu"] = args.cpu or args.cores * CPU_OVERSUBSCRIPTION
+    budgets["host_memory"] = int(args.host_memory * 1073741824)
+
+    policies = ["resource", "counters"] if args.policy == "both" else [args.policy]
+    for policy in policies:
+        if policy == "resource":
+            policy_budgets = budgets
+        else:
+            policy_budgets = get_stage_limits(config, "global")
+            policy_budgets["analysis"] = min(
+                policy_budgets["analysis"], args.gpu_memory // 1000
+            )
+        resources, finished, waits = simulate(
+            [_copy_run(run) for run in runs],
+            policy_budgets,
+            get_costs,
+            policy == "resource",
+        )
+        print(
+            "%s: %ds, mean wait %.1fs, max wait %ds"
+            % (
+                policy,
+                max(finished.values()),
+                sum(waits) / max(len(waits), 1),
+                max(waits or [0]),
+            )
+        )
+        for run in runs:
+            print(
+                "  %s: %ds (recorded %ds)"
+                % (run.name, finished[run.name], run.recorded_end - t0)
+            )
+        print("  " + resources.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -32,6 +32,15 @@ import multiprocessing
 import logging
 import logging.handlers
 
+from oiaScheduler import (
+    STAGE_STATUS,
+    ResourcePool,
+    Scheduler,
+    get_budgets,
+    get_stage_costs,
+    get_stage_limits,
+)
+
 try:
     from pynvml import *
 
@@ -59,16 +68,7 @@ class Worker(Thread):
         while True:
 
             block = self.tasks.get()
-
-            if "justBeadFind" in block.command:
-                self.pool.beadfind_counter += 1
-                block.status = "performJustBeadFind"
-            if "Analysis" in block.command:
-                self.pool.analysis_counter += 1
-                block.status = "performAnalysis"
-            if "BaseCaller" in block.command:
-                self.pool.basecaller_counter += 1
-                block.status = "performPhaseEstimation"
+            block.status = STAGE_STATUS[block.stage]
 
             logger.info("%s: T1: %s" % (self.id, block))
             starttime = time.localtime()
@@ -162,20 +162,16 @@ class Worker(Thread):
                 logger.error(traceback.format_exc())
                 pass
 
+            if block.stage == "basecaller":
+                block.basecaller_done = True
+            self.pool.resources.release(block.stage, block.cost)
+
             block.status = "processed"
             self.tasks.task_done()
 
-            if "justBeadFind" in block.command:
-                self.pool.beadfind_counter -= 1
-            if "Analysis" in block.command:
-                self.pool.analysis_counter -= 1
-            if "BaseCaller" in block.command:
-                self.pool.basecaller_counter -= 1
-                block.basecaller_done = True
-
             stoptime = time.localtime()
             block.jobtiming.append(
-                (starttime, stoptime, block.info, block.ret, self.id)
+                (starttime, stoptime, block.info, block.ret, self.id, block.stage)
             )
             logger.info("%s: T2: %s" % (self.id, block))
 
@@ -183,11 +179,10 @@ class Worker(Thread):
 class ThreadPool:
     """Pool of threads consuming tasks from a queue"""
 
-    def __init__(self, num_threads, logger):
+    def __init__(self, num_threads, logger, resources):
         self.tasks = Queue(num_threads)  # limit the queue to the number of threads
-        self.beadfind_counter = 0
-        self.analysis_counter = 0
-        self.basecaller_counter = 0
+        # resources of the queued and running blocks, released by the workers
+        self.resources = resources
 
         for threadid in range(num_threads):
             Worker(threadid, self.tasks, self, logger)
@@ -539,7 +534,7 @@ class Run:
 
     def gettiming(self):
         # write header
-        s = "TIMING run block chunk duration threadid start stop returncode\n"
+        s = "TIMING run block chunk duration threadid start stop returncode stage\n"
         for block in self.blocks:
             s += block.gettiming()
         return s
@@ -660,6 +655,8 @@ class Block:
         self.status = status
         self.process = None
         self.command = ""
+        self.stage = None
+        self.cost = None
         self.ret = 0
         self.run = run
         self.run_name = run_name
@@ -697,10 +694,11 @@ class Block:
             block_info = x[2]
             block_return_code = x[3]
             thread_id = x[4]
+            stage = x[5]
             duration = int(time.strftime("%s", stoptime)) - int(
                 time.strftime("%s", starttime)
             )
-            s += 'TIMING %s %s %s %s %s "%s" "%s" %s\n' % (
+            s += 'TIMING %s %s %s %s %s "%s" "%s" %s %s\n' % (
                 self.run_name,
                 self.name,
                 block_info,
@@ -709,6 +707,7 @@ class Block:
                 str(time.strftime("%Y-%m-%d %H:%M:%S", starttime)),
                 str(time.strftime("%Y-%m-%d %H:%M:%S", stoptime)),
                 str(block_return_code),
+                stage,
             )
 
         return s
@@ -731,8 +730,13 @@ class App:
 
         self.flowblocks = config.getint("global", "flowblocks")
 
+        self.resources = ResourcePool(get_budgets(config, total_GPU_memory))
+        logger.info("resource budgets: %s" % self.resources.budgets)
+        self.scheduler = Scheduler(self.resources)
+        self.run_costs = {}
+
         # 1) Init a Thread pool with the desired number of threads
-        self.pool = ThreadPool(self.nb_max_jobs, logger)
+        self.pool = ThreadPool(self.nb_max_jobs, logger, self.resources)
 
         self.blocks_to_process = []
         self.runs_in_process = []
@@ -752,14 +756,7 @@ class App:
                     % time.strftime("%Y_%m_%d_%H_%M_%S", time.localtime())
                 )
                 f.write("# Processes can be Analysis, justBeadFind or BaseCaller\n")
-                f.write(
-                    "Processes:%s\n"
-                    % str(
-                        self.pool.beadfind_counter
-                        + self.pool.analysis_counter
-                        + self.pool.basecaller_counter
-                    )
-                )
+                f.write("Processes:%s\n" % str(self.resources.running()))
         except Exception:
             logger.error(traceback.format_exc())
 
@@ -776,215 +773,115 @@ class App:
 
         return run_dirs
 
-    def get_next_available_job(self, config):
-
-        # logger.debug('get_next_available_job')
-        # what kind of jobs are allowed to run?
-        beadfind_request = True
-        analysis_request = True
-        basecaller_request = True
-
-        if (
-            self.pool.beadfind_counter
-            + self.pool.analysis_counter
-            + self.pool.basecaller_counter
-            >= self.nb_max_jobs
-        ):
-            logger.debug("max jobs limit reached (total)")
-            beadfind_request = False
-            analysis_request = False
-            basecaller_request = False
-
-        if self.pool.beadfind_counter >= self.nb_max_beadfind_jobs:
-            logger.debug("max jobs limit reached (beadfind)")
-            beadfind_request = False
-            basecaller_request = (
-                False
-            )  # don't run basecaller and justBeadFind at the same time..
-
-        if self.pool.analysis_counter >= self.nb_max_analysis_jobs:
-            logger.debug("max jobs limit reached (analysis)")
-            analysis_request = False
-
-        if (
-            self.pool.beadfind_counter + self.pool.basecaller_counter
-        ) >= self.nb_max_basecaller_jobs:
-            logger.debug("max jobs limit reached (basecaller)")
-            basecaller_request = False
-        # 6 analysis jobs are too much for some GPU's # find . -name sigproc.log | xargs grep -i StreamResources
-        # sigproc.log:CUDA 0 StreamManager: No StreamResources could be aquired!
-        # retry pending. jobs will he handled by CPU for now!
-        if self.pool.analysis_counter >= total_GPU_memory / 1000:
-            logger.debug("GPU memory reached (analysis)")
-            analysis_request = False
-
-        # check if enough ressources are available
-        # GPU limit
-        #       if current_HOST_memory + block.HOST_memory_requirement_beadfind >= 128G
-        #            beadfind_request = False
-
-        #       if current_HOST_memory + block.HOST_memory_requirement_analysis >= 128G
-        #            analysis_request = False
-        #        total_GPU_memory = 4000
-
-        #       if current_GPU_memory + block.GPU_memory_requirement_analysis >= 6G
-        #            analysis_request = False
-
-        # nb_beadfind_threads = 4
-        # nb_analysis_threads = 6
-        # nb_max_jobs = 5
-        # nb_max_beadfind_jobs = 5
-        # nb_max_analysis_jobs = 4
-        # HOST_memory_requirement_beadfind = 7G
-        # HOST_memory_requirement_analysis = 20G
-        # GPU_memory_requirement_analysis = 1G
-
-        # for development: beadfind first
-        # if self.pool.beadfind_counter > 0:
-        #    analysis_request = False
-
-        anablock = None
-
-        if not beadfind_request and not analysis_request and not basecaller_request:
-            # full queues
-            return anablock
-
-        for run in self.runs_in_process:
-
-            runblocks = [
-                block for block in self.blocks_to_process if block.run.name == run.name
-            ]
-
-            rev = True
-            # run in progress
-            if run.last_flow == run.exp_flows - 1:
-                rev = False
-
-            sorted_blocks = sorted(
-                runblocks,
-                key=lambda block: block.run.last_flow - block.successful_processed,
-                reverse=rev,
+    def get_run_costs(self, run):
+        """Returns the stage costs and the job limits of the run's chip"""
+        if run.name not in self.run_costs:
+            self.run_costs[run.name] = (
+                get_stage_costs(config, run.exp_chipversion, cpu_cores),
+                get_stage_limits(config, run.exp_chipversion),
             )
+        return self.run_costs[run.name]
 
-            try:
-                nb_max_jobs = config.getint(run.exp_chipversion, "nb_max_jobs")
-                nb_max_beadfind_jobs = config.getint(
-                    run.exp_chipversion, "nb_max_beadfind_jobs"
-                )
-                nb_max_analysis_jobs = config.getint(
-                    run.exp_chipversion, "nb_max_analysis_jobs"
-                )
-                nb_max_basecaller_jobs = config.getint(
-                    run.exp_chipversion, "nb_max_basecaller_jobs"
-                )
-            except Exception:
-                nb_max_jobs = config.getint("DefaultChip", "nb_max_jobs")
-                nb_max_beadfind_jobs = config.getint(
-                    "DefaultChip", "nb_max_beadfind_jobs"
-                )
-                nb_max_analysis_jobs = config.getint(
-                    "DefaultChip", "nb_max_analysis_jobs"
-                )
-                nb_max_basecaller_jobs = config.getint(
-                    "DefaultChip", "nb_max_basecaller_jobs"
-                )
+    def get_block_candidates(self, run):
+        """Yields (stage, (block, flow_end)) of the run's idle blocks, in the
+        order they should run"""
+        runblocks = [
+            block for block in self.blocks_to_process if block.run.name == run.name
+        ]
 
-            if self.pool.beadfind_counter >= nb_max_beadfind_jobs:
-                logger.debug(
-                    "max beadfind jobs limit reached (%s)" % run.exp_chipversion
-                )
-                beadfind_request = False
-                basecaller_request = (
-                    False
-                )  # don't run beadfind and basecaller at the same time
-
-            if self.pool.analysis_counter >= nb_max_analysis_jobs:
-                logger.debug(
-                    "max analysis jobs limit reached (%s)" % run.exp_chipversion
-                )
-                analysis_request = False
+        rev = True
+        # run in progress
+        if run.last_flow == run.exp_flows - 1:
+            rev = False
 
-            if self.pool.basecaller_counter >= nb_max_basecaller_jobs:
-                logger.debug(
-                    "max basecaller jobs limit reached (%s)" % run.exp_chipversion
-                )
-                basecaller_request = False
+        sorted_blocks = sorted(
+            runblocks,
+            key=lambda block: block.run.last_flow - block.successful_processed,
+            reverse=rev,
+        )
+
+        for block in sorted_blocks:
 
+            if block.status != "idle":
+                continue
+
+            # Analysis
             if (
-                self.pool.analysis_counter
-                + self.pool.beadfind_counter
-                + self.pool.basecaller_counter
-            ) >= nb_max_jobs:
-                logger.debug("max jobs limit reached (%s)" % run.exp_chipversion)
-                analysis_request = False
-                beadfind_request = False
-                basecaller_request = False
-
-            for block in sorted_blocks:
-
-                if block.status != "idle":
-                    # logger.debug('idle')
-                    continue
+                block.beadfind_done
+                and not block.basecaller_done
+                and block.flow_end > 170
+            ):
+                yield "basecaller", (block, block.flow_end)
 
-                # Analysis
-                if (
-                    basecaller_request
-                    and block.beadfind_done
-                    and not block.basecaller_done
-                    and block.flow_end > 170
-                ):
-                    block.command = getBaseCallerCommand(config, block)
-                    anablock = block
-                    return anablock
-
-                if analysis_request and block.beadfind_done and not block.analysis_done:
-
-                    # how far can I go?
-
-                    # check for last flow
-                    if block.run.last_flow == block.flows_total - 1:
-                        new_flow_end = block.flows_total - 1
-                    # run in progress and support odd number of flows (e.g. 396)
-                    else:
-                        new_flow_end = (
-                            (block.run.last_flow + 1) / self.flowblocks
-                        ) * self.flowblocks - 1
-                        if (
-                            block.flows_total - 1 - new_flow_end < self.flowblocks
-                            or new_flow_end <= block.successful_processed - 1
-                        ):
-                            logger.debug(
-                                "new flowend for %s: (%s/%s/%s) filtered out"
-                                % (
-                                    block.name,
-                                    block.successful_processed - 1,
-                                    new_flow_end,
-                                    block.flows_total - 1,
-                                )
-                            )
-                            continue
+            if block.beadfind_done and not block.analysis_done:
 
-                    logger.debug(
-                        "new flowend for %s: (%s/%s/%s)"
-                        % (
-                            block.name,
-                            block.successful_processed - 1,
-                            new_flow_end,
-                            block.flows_total - 1,
+                # how far can I go?
+
+                # check for last flow
+                if block.run.last_flow == block.flows_total - 1:
+                    new_flow_end = block.flows_total - 1
+                # run in progress and support odd number of flows (e.g. 396)
+                else:
+                    new_flow_end = (
+                        (block.run.last_flow + 1) / self.flowblocks
+                    ) * self.flowblocks - 1
+                    if (
+                        block.flows_total - 1 - new_flow_end < self.flowblocks
+                        or new_flow_end <= block.successful_processed - 1
+                    ):
+                        logger.debug(
+                            "new flowend for %s: (%s/%s/%s) filtered out"
+                            % (
+                                block.name,
+                                block.successful_processed - 1,
+                                new_flow_end,
+                                block.flows_total - 1,
+                            )
                         )
-                    )
+                        continue
+
+                yield "analysis", (block, new_flow_end)
 
-                    block.flow_start = block.successful_processed
-                    block.flow_end = new_flow_end
-                    block.command = getAnalysisCommand(config, block)
-                    anablock = block
-                    return anablock
+            # Separator
+            if not block.beadfind_done:
+                yield "beadfind", (block, -1)
 
-                # Separator
-                if beadfind_request and not block.beadfind_done:
-                    block.command = getSeparatorCommand(config, block)
-                    anablock = block
-                    return anablock
+    def get_next_available_job(self, config):
+        """Returns the next block to run with its command, stage and cost set,
+        or None if no block can run within the available resources"""
+
+        nb_retries = config.getint("global", "nb_retries") + LowMemRetry
+        for block in self.blocks_to_process:
+            if block.status == "idle" and block.nb_attempts >= nb_retries:
+                block.status = "sigproc_failed"
+
+        job = self.scheduler.next_job(
+            self.runs_in_process, self.get_block_candidates, self.get_run_costs
+        )
+        if job is None:
+            return None
+        run, stage, (block, new_flow_end), cost = job
+
+        if stage == "analysis":
+            logger.debug(
+                "new flowend for %s: (%s/%s/%s)"
+                % (
+                    block.name,
+                    block.successful_processed - 1,
+                    new_flow_end,
+                    block.flows_total - 1,
+                )
+            )
+            block.flow_start = block.successful_processed
+            block.flow_end = new_flow_end
+            block.command = getAnalysisCommand(config, block)
+        elif stage == "basecaller":
+            block.command = getBaseCallerCommand(config, block)
+        else:
+            block.command = getSeparatorCommand(config, block)
+        block.stage = stage
+        block.cost = cost
+        return block
 
     def updateUsage(self):
         os.system(
@@ -1037,7 +934,7 @@ class App:
                         % LowMemRetry
                     )
                     time.sleep(15)
-            elif (self.pool.beadfind_counter + self.pool.analysis_counter) == 0:
+            elif self.resources.running("beadfind", "analysis") == 0:
                 # logger.info("resetting LowMemRetry counter")
                 LowMemRetry = 0  # reset the counter after all the analysis are complete
 
@@ -1208,22 +1105,17 @@ class App:
                 logger.info(
                     "Status:        Blocks: {0:3d}  Beadfind: {1:2d}/{2:2d}  Analysis: {3:2d}/{4:2d}  BaseCaller: {5:2d}/{6:2d} Total: {7:2d}/{8:2d}".format(
                         len(self.blocks_to_process),
-                        self.pool.beadfind_counter,
+                        self.resources.running("beadfind"),
                         self.nb_max_beadfind_jobs,
-                        self.pool.analysis_counter,
+                        self.resources.running("analysis"),
                         self.nb_max_analysis_jobs,
-                        self.pool.basecaller_counter,
+                        self.resources.running("basecaller"),
                         self.nb_max_basecaller_jobs,
-                        self.pool.beadfind_counter
-                        + self.pool.analysis_counter
-                        + self.pool.basecaller_counter,
+                        self.resources.running(),
                         self.nb_max_jobs,
                     )
                 )
 
-                predicted_total_HOST_memory = 0
-                predicted_total_GPU_memory = 0
-
                 # get list of all different Runs
                 for run in self.runs_in_process:
                     blocks_per_run = [i for i in self.blocks_to_process if i.run == run]
@@ -1248,82 +1140,34 @@ class App:
                             if i.run == run and i.status == "performPhaseEstimation"
                         ]
                     )
-                    try:
-                        nb_max_jobs = config.getint(run.exp_chipversion, "nb_max_jobs")
-                        nb_max_beadfind_jobs = config.getint(
-                            run.exp_chipversion, "nb_max_beadfind_jobs"
-                        )
-                        nb_max_analysis_jobs = config.getint(
-                            run.exp_chipversion, "nb_max_analysis_jobs"
-                        )
-                        nb_max_basecaller_jobs = config.getint(
-                            run.exp_chipversion, "nb_max_basecaller_jobs"
-                        )
-                    except Exception:
-                        nb_max_jobs = config.getint("DefaultChip", "nb_max_jobs")
-                        nb_max_beadfind_jobs = config.getint(
-                            "DefaultChip", "nb_max_beadfind_jobs"
-                        )
-                        nb_max_analysis_jobs = config.getint(
-                            "DefaultChip", "nb_max_analysis_jobs"
-                        )
-                        nb_max_basecaller_jobs = config.getint(
-                            "DefaultChip", "nb_max_basecaller_jobs"
-                        )
                     if len(blocks_per_run):
+                        limits = self.get_run_costs(run)[1]
                         logger.info(
                             "Chip: {0:8} Blocks: {1:3d}  Beadfind: {2:2d}/{3:2d}  Analysis: {4:2d}/{5:2d} BaseCaller: {6:2d}/{7:2d} Total: {8:2d}/{9:2d}  ({10})".format(
                                 run.exp_chipversion,
                                 len(blocks_per_run),
                                 bf,
-                                nb_max_beadfind_jobs,
+                                limits["beadfind"],
                                 an,
-                                nb_max_analysis_jobs,
+                                limits["analysis"],
                                 bc,
-                                nb_max_basecaller_jobs,
+                                limits["basecaller"],
                                 an + bf,
-                                nb_max_jobs,
+                                limits["jobs"],
                                 run.name,
                             )
                         )
-                    try:
-                        HOST_memory_requirement_beadfind = config.getint(
-                            run.exp_chipversion, "HOST_memory_requirement_beadfind"
-                        )
-                        HOST_memory_requirement_analysis = config.getint(
-                            run.exp_chipversion, "HOST_memory_requirement_analysis"
-                        )
-                        GPU_memory_requirement_analysis = config.getint(
-                            run.exp_chipversion, "GPU_memory_requirement_analysis"
-                        )
-                    except Exception:
-                        HOST_memory_requirement_beadfind = config.getint(
-                            "DefaultChip", "HOST_memory_requirement_beadfind"
-                        )
-                        HOST_memory_requirement_analysis = config.getint(
-                            "DefaultChip", "HOST_memory_requirement_analysis"
-                        )
-                        GPU_memory_requirement_analysis = config.getint(
-                            "DefaultChip", "GPU_memory_requirement_analysis"
-                        )
-                    predicted_total_HOST_memory += (
-                        int(HOST_memory_requirement_beadfind) * bf
-                    )
-                    predicted_total_HOST_memory += (
-                        int(HOST_memory_requirement_analysis) * an
-                    )
-                    predicted_total_GPU_memory += (
-                        int(GPU_memory_requirement_analysis) * an
-                    )
 
                 # every 60 sec
                 if time.time() - timestamp > 60:
+                    used = self.resources.utilization()
                     logger.info(
                         "HOST: {0} G   GPU: {1} G".format(
-                            predicted_total_HOST_memory / 1073741824,
-                            predicted_total_GPU_memory / 1073741824,
+                            used["host_memory"]["used"] / 1073741824,
+                            used["gpu_memory"]["used"] / 1073741824,
                         )
                     )
+                    logger.info(self.resources.summary())
 
                 # TODO: run.exp_oia_during_run
                 # TODO: check for new runs only if no data acquisition
@@ -1490,25 +1334,23 @@ class App:
                         block.status = "done"
                         self.blocks_to_process.remove(block)
 
-                try:
-                    ablock = self.get_next_available_job(config)
-                except Exception:
-                    ablock = None
-                    logger.error(traceback.format_exc())
+                # submit blocks while the resources allow
+                while True:
+                    try:
+                        ablock = self.get_next_available_job(config)
+                    except Exception:
+                        ablock = None
+                        logger.error(traceback.format_exc())
 
-                if ablock:
-                    if ablock.nb_attempts >= (
-                        config.getint("global", "nb_retries") + LowMemRetry
-                    ):
-                        ablock.status = "sigproc_failed"
-                    else:
-                        ablock.status = "queued"
-                        ablock.info = "%s-%s" % (ablock.flow_start, ablock.flow_end)
-                        logger.debug(
-                            "%s submitted (%s-%s)"
-                            % (ablock.name, ablock.flow_start, ablock.flow_end)
-                        )
-                        self.pool.add_task(ablock)
+                    if not ablock:
+                        break
+                    ablock.status = "queued"
+                    ablock.info = "%s-%s" % (ablock.flow_start, ablock.flow_end)
+                    logger.debug(
+                        "%s submitted (%s-%s)"
+                        % (ablock.name, ablock.flow_start, ablock.flow_end)
+                    )
+                    self.pool.add_task(ablock)
 
             # wait 10 sec if no blocks are available
             time.sleep(10)
@@ -9,6 +9,25 @@ Bed file reader and writer classers
 Format definitions from https://genome.ucsc.edu/FAQ/FAQformat
 """
 
+import os
+
+import numpy
+
+# IonBedIndex files are written next to the bed file with this suffix
+BED_INDEX_SUFFIX = ".index.npz"
+BED_INDEX_VERSION = 1
+
+
+def _bedInt(val):
+    if val == ".":
+        return None
+    else:
+        return int(val)
+
+
+def _bedList(val):
+    return val.split(",")
+
 
 # ================================================================
 
@@ -105,6 +124,7 @@ class IonBedReader:
     def __init__(self, file=None, filename=None):
 
         self.chromOrder = []
+        self.chromRank = {}
         self.columns = []
         self.header = IonBedHeader()
         self.nBedCols = 0
@@ -165,11 +185,7 @@ class IonBedReader:
             print("IonBedReader ERROR bedfile %s is not open." % self.filename)
             return beddict
 
-        for k in self.columns:
-            beddict[k] = []
-        for k, v in zip(self.columns, self.bline.split("\t")):
-            beddict[k].append(self._convertBedType(k, v))
-
+        rows = [self.bline.split("\t")]
         lnum = 1
         for line in self.bed:
             lnum += 1
@@ -180,13 +196,13 @@ class IonBedReader:
                     % (lnum, self.filename)
                 )
                 return {}
+            rows.append(bsplit)
 
-            for k, v in zip(self.columns, bsplit):
-                beddict[k].append(self._convertBedType(k, v))
+        # Convert column by column, the type only depends on the column
+        for k, values in zip(self.columns, zip(*rows)):
+            beddict[k] = list(map(self._getBedConverter(k), values))
 
         return beddict
-        print("Nothing to see yet!")
-        # for line in self.bed
 
     # ----------------------------------------
     # This function is meant to be evaluates while reading a target file line by line
@@ -196,16 +212,16 @@ class IonBedReader:
 
     def InTarget(self, target, chrom, pos):
 
-        if chrom not in self.chromOrder:
+        if chrom not in self.chromRank:
             return 1
         if not target:
             return -1
         # This case should never happen if the function is used properly
-        if target["chrom"] not in self.chromOrder:
+        if target["chrom"] not in self.chromRank:
             return -1
 
-        t_idx = self.chromOrder.index(target["chrom"])
-        c_idx = self.chromOrder.index(target["chrom"])
+        t_idx = self.chromRank[target["chrom"]]
+        c_idx = self.chromRank[chrom]
         if c_idx < t_idx:
             return -1
         elif c_idx > t_idx:
@@ -228,7 +244,8 @@ class IonBedReader:
             ldict = self.bedLine2Dict(self.bline)
             self.bline = self.bed.readline().rstrip()
 
-        if ldict["chrom"] not in self.chromOrder:
+        if ldict["chrom"] not in self.chromRank:
+            self.chromRank[ldict["chrom"]] = len(self.chromOrder)
             self.chromOrder.append(ldict["chrom"])
         return ldict
 
@@ -252,26 +269,24 @@ class IonBedReader:
     # ----------------------------------------
     # Ordered by frequency of use in Ion bed files
 
-    def _convertBedType(self, key, val):
+    def _getBedConverter(self, key):
 
         if key in ["chrom", "name", "strand", "id"]:
-            return str(val)
+            return str
         elif key in ["chromStart", "chromEnd", "score"]:
-            if val == ".":
-                return None
-            else:
-                return int(val)
+            return _bedInt
         elif key == "info":
-            return self._parseInfoField(val)
+            return self._parseInfoField
         elif key in ["thickStart", "thickEnd", "blockCount"]:
-            if val == ".":
-                return None
-            else:
-                return int(val)
+            return _bedInt
         elif key in ["itemRgb", "blockSizes", "blockStarts"]:
-            return val.split(",")
+            return _bedList
         else:
-            return str(val)
+            return str
+
+    def _convertBedType(self, key, val):
+
+        return self._getBedConverter(key)(val)
 
     # ----------------------------------------
     # A 1) semicolon separated list of
@@ -293,6 +308,323 @@ class IonBedReader:
         return idict
 
 
+# ================================================================
+# Index of the target intervals of a bed file for random access queries.
+# The targets of each chromosome are kept in numpy arrays sorted by chromStart,
+# with the running maximum of chromEnd, so that a query is a binary search even
+# if targets overlap. A target is identified by its row, the index of its line
+# among the data lines of the bed file, as in the lists of IonBedReader.load()
+# The index is saved next to the bed file and reused while the bed file is unchanged
+
+
+class IonBedIndex:
+    def __init__(self, filename=None, save=True):
+
+        self.filename = filename
+        self.chromOrder = []
+        self.chromRank = {}
+        self.targets = {}
+        self.numTargets = 0
+
+        if filename == None:
+            return
+        if not self.Load():
+            if self.Build() and save:
+                self.Save()
+
+    # ----------------------------------------
+    # Read chrom, chromStart and chromEnd of all targets of the bed file
+    # Lines without chromStart or chromEnd are left out of the index
+
+    def Build(self):
+
+        intervals = {}
+        chromOrder = []
+        try:
+            bed = open(self.filename, "r")
+        except Exception:
+            print("IonBedIndex ERROR cannot open/read bedfile %s" % self.filename)
+            return False
+
+        with bed:
+            row = -1
+            header = True
+            for line in bed:
+                if header:
+                    sline = line.split()
+                    if sline and sline[0] in ["track", "browser"]:
+                        continue
+                    header = False
+                row += 1
+                bsplit = line.split("\t", 3)
+                try:
+                    start = int(bsplit[1])
+                    end = int(bsplit[2])
+                except (IndexError, ValueError):
+                    continue
+                chrom = bsplit[0]
+                if chrom not in intervals:
+                    intervals[chrom] = ([], [], [])
+                    chromOrder.append(chrom)
+                intervals[chrom][0].append(start)
+                intervals[chrom][1].append(end)
+                intervals[chrom][2].append(row)
+
+        self._clear()
+        for chrom in chromOrder:
+            self._addChrom(chrom, *intervals[chrom])
+        return True
+
+    # ----------------------------------------
+
+    def _clear(self):
+        self.chromOrder = []
+        self.chromRank = {}
+        self.targets = {}
+        self.numTargets = 0
+
+    def _addChrom(self, chrom, starts, ends, rows, isSorted=False):
+
+        starts = numpy.asarray(starts, dtype=numpy.int64)
+        ends = numpy.asarray(ends, dtype=numpy.int64)
+        rows = numpy.asarray(rows, dtype=numpy.int64)
+        if not isSorted:
+            # stable, targets with the same start stay in file order
+            order = numpy.argsort(starts, kind="mergesort")
+            starts, ends, rows = starts[order], ends[order], rows[order]
+
+        # maxEnds[i] is the largest end of targets 0..i, reached by target maxIdx[i]
+        maxEnds = numpy.maximum.accumulate(ends)
+        maxIdx = numpy.maximum.accumulate(
+            numpy.where(ends == maxEnds, numpy.arange(len(ends)), 0)
+        )
+        maxLen = int((ends - starts).max())
+
+        self.chromRank[chrom] = len(self.chromOrder)
+        self.chromOrder.append(chrom)
+        self.targets[chrom] = (starts, ends, rows, maxEnds, maxIdx, maxLen)
+        self.numTargets += len(starts)
+
+    # ----------------------------------------
+
+    def _indexFile(self, index_file):
+        if index_file == None:
+            return self.filename + BED_INDEX_SUFFIX
+        return index_file
+
+    def _getStamp(self):
+        bstat = os.stat(self.filename)
+        return [bstat.st_size, int(bstat.st_mtime)]
+
+    # ----------------------------------------
+    # Write the index, by default next to the bed file
+    # The file is written under a temporary name first, so that plugins running
+    # at the same time never read a partial index
+
+    def Save(self, index_file=None):
+
+        index_file = self._indexFile(index_file)
+        tmp_file = "%s.%d.tmp" % (index_file, os.getpid())
+        columns = [[], [], []]
+        for chrom in self.chromOrder:
+            for column, values in zip(columns, self.targets[chrom]):
+                column.append(values)
+        empty = [numpy.zeros(0, dtype=numpy.int64)]
+        try:
+            with open(tmp_file, "wb") as f:
+                numpy.savez(
+                    f,
+                    version=numpy.array(BED_INDEX_VERSION),
+                    stamp=numpy.array(self._getStamp(), dtype=numpy.int64),
+                    chroms=numpy.array(self.chromOrder, dtype=str),
+                    counts=numpy.array(
+                        [len(self.targets[c][0]) for c in self.chromOrder],
+                        dtype=numpy.int64,
+                    ),
+                    starts=numpy.concatenate(columns[0] or empty),
+                    ends=numpy.concatenate(columns[1] or empty),
+                    rows=numpy.concatenate(columns[2] or empty),
+                )
+            os.rename(tmp_file, index_file)
+        except Exception:
+            print("IonBedIndex WARNING unable to write index file %s" % index_file)
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            return False
+        return True
+
+    # ----------------------------------------
+    # Read the index written by Save()
+    # Returns False if there is no index or if the bed file changed since
+
+    def Load(self, index_file=None):
+
+        try:
+            stamp = self._getStamp()
+            with numpy.load(self._indexFile(index_file)) as data:
+                if (
+                    int(data["version"]) != BED_INDEX_VERSION
+                    or data["stamp"].tolist() != stamp
+                ):
+                    return False
+                chroms = data["chroms"].astype(str).tolist()
+                counts = data["counts"]
+                starts = data["starts"]
+                ends = data["ends"]
+                rows = data["rows"]
+        except Exception:
+            return False
+
+        self._clear()
+        offsets = numpy.concatenate([[0], numpy.cumsum(counts)])
+        for chrom, first, last in zip(chroms, offsets[:-1], offsets[1:]):
+            self._addChrom(
+                chrom,
+                starts[first:last],
+                ends[first:last],
+                rows[first:last],
+                isSorted=True,
+            )
+        return True
+
+    # ----------------------------------------
+    # Row of the leftmost target that contains the 0-based position pos, -1 if none
+
+    def InTarget(self, chrom, pos):
+
+        if chrom not in self.targets:
+            return -1
+        starts, ends, rows, maxEnds, maxIdx, maxLen = self.targets[chrom]
+        # The first target reaching past pos contains it, if it starts at or before pos
+        idx = numpy.searchsorted(maxEnds, pos, "right")
+        if idx < numpy.searchsorted(starts, pos, "right"):
+            return int(rows[idx])
+        return -1
+
+    # ----------------------------------------
+    # Row of the leftmost target that overlaps [start, end), -1 if none
+
+    def FirstOverlap(self, chrom, start, end):
+
+        if chrom not in self.targets:
+            return -1
+        starts, ends, rows, maxEnds, maxIdx, maxLen = self.targets[chrom]
+        idx = numpy.searchsorted(maxEnds, start, "right")
+        if idx < numpy.searchsorted(starts, end, "left"):
+            return int(rows[idx])
+        return -1
+
+    # ----------------------------------------
+    # Rows of all targets that overlap [start, end), ordered by chromStart
+
+    def Overlap(self, chrom, start, end):
+
+        if chrom not in self.targets:
+            return []
+        starts, ends, rows, maxEnds, maxIdx, maxLen = self.targets[chrom]
+        # No target is longer than maxLen, targets starting before start-maxLen end before start
+        first = max(
+            numpy.searchsorted(maxEnds, start, "right"),
+            numpy.searchsorted(starts, start - maxLen, "right"),
+        )
+        last = numpy.searchsorted(starts, end, "left")
+        found = first + numpy.flatnonzero(ends[first:last] > start)
+        return rows[found].tolist()
+
+    # ----------------------------------------
+    # Rows of all targets that contain all of [start, end), ordered by chromStart
+
+    def Containing(self, chrom, start, end):
+
+        if chrom not in self.targets:
+            return []
+        starts, ends, rows, maxEnds, maxIdx, maxLen = self.targets[chrom]
+        first = max(
+            numpy.searchsorted(maxEnds, end, "left"),
+            numpy.searchsorted(starts, end - maxLen, "left"),
+        )
+        last = numpy.searchsorted(starts, start, "right")
+        found = first + numpy.flatnonzero(ends[first:last] >= end)
+        return rows[found].tolist()
+
+    # ----------------------------------------
+    # (row, distance) of the target nearest to the 0-based position pos
+    # distance is 0 inside a target, ties go to the target before pos
+    # Returns (-1, None) if there are no targets on chrom
+
+    def Nearest(self, chrom, pos):
+
+        if chrom not in self.targets:
+            return -1, None
+        rows, distances = self._nearest(self.targets[chrom], numpy.array([pos]))
+        return int(rows[0]), int(distances[0])
+
+    def _nearest(self, targets, positions):
+
+        starts, ends, rows, maxEnds, maxIdx, maxLen = targets
+        after = numpy.searchsorted(starts, positions, "right")
+        before = numpy.maximum(after - 1, 0)
+        # distance to the end of the furthest reaching target starting at or before pos
+        left = numpy.where(
+            after > 0, numpy.maximum(positions - maxEnds[before] + 1, 0), -1
+        )
+        # distance to the next target
+        nxt = numpy.minimum(after, len(starts) - 1)
+        right = numpy.where(after < len(starts), starts[nxt] - positions, -1)
+
+        useLeft = (left >= 0) & ((right < 0) | (left <= right))
+        found = numpy.where(useLeft, rows[maxIdx[before]], rows[nxt])
+        return found, numpy.where(useLeft, left, right)
+
+    # ----------------------------------------
+    # Vectorized queries for arrays of chromosomes and positions
+    # Rows are -1, and distances -1, where there is no target
+
+    def _batch(self, chroms, positions, query, num_results=1):
+
+        chroms = numpy.asarray(chroms)
+        results = [
+            numpy.full(len(chroms), -1, dtype=numpy.int64) for i in range(num_results)
+        ]
+        for chrom in numpy.unique(chroms):
+            if chrom not in self.targets:
+                continue
+            sel = numpy.flatnonzero(chroms == chrom)
+            found = query(self.targets[chrom], [p[sel] for p in positions])
+            if num_results == 1:
+                found = [found]
+            for result, values in zip(results, found):
+                result[sel] = values
+        if num_results == 1:
+            return results[0]
+        return tuple(results)
+
+    def InTargetBatch(self, chroms, positions):
+        def query(targets, args):
+            starts, ends, rows, maxEnds, maxIdx, maxLen = targets
+            idx = numpy.searchsorted(maxEnds, args[0], "right")
+            hit = idx < numpy.searchsorted(starts, args[0], "right")
+            return numpy.where(hit, rows[numpy.minimum(idx, len(rows) - 1)], -1)
+
+        return self._batch(chroms, [numpy.asarray(positions)], query)
+
+    def FirstOverlapBatch(self, chroms, starts, ends):
+        def query(targets, args):
+            tstarts, tends, rows, maxEnds, maxIdx, maxLen = targets
+            idx = numpy.searchsorted(maxEnds, args[0], "right")
+            hit = idx < numpy.searchsorted(tstarts, args[1], "left")
+            return numpy.where(hit, rows[numpy.minimum(idx, len(rows) - 1)], -1)
+
+        return self._batch(chroms, [numpy.asarray(starts), numpy.asarray(ends)], query)
+
+    # Returns the arrays (rows, distances)
+    def NearestBatch(self, chroms, positions):
+        def query(targets, args):
+            return self._nearest(targets, args[0])
+
+        return self._batch(chroms, [numpy.asarray(positions)], query, 2)
+
+
 # ================================================================
 # Writer class that takes a dictionary of the type produced by the bed reader class
 # and transforms it into a bed file
@@ -2,10 +2,16 @@
 # -*- coding: utf-8 -*-
 # Copyright (C) 2017 Thermo Fisher Scientific Inc. All Rights Reserved
 
+import bisect
 import copy
+import os
 from functools import wraps
 
 TVC_FILE_MODE_ATTR = "_TvcVcfFile__mode"
+# bases per bin of the positional index, as the linear index of tabix
+TVC_INDEX_BIN_SIZE = 16384
+TVC_INDEX_SUFFIX = ".tvi"
+TVC_INDEX_MAGIC = "#TVCVCFINDEX"
 
 
 def read_mode_only(func):
@@ -75,6 +81,10 @@ class TvcVcfFile:
         self.__bypass_size_check_tags = ()
         self.__uniq_flag = False
         self.__allow_same_position = False
+        self.__lazy_flag = False
+        # {contig: ([bin, ...], [offset, ...])} and its bin size
+        self.__index = None
+        self.__index_bin_size = None
         # if open for read, self.__previous is the last record I read.
         # if open for write, self.__previous is the last record I flushed.
         self.__previous = None
@@ -186,6 +196,18 @@ class TvcVcfFile:
             self.__allow_same_position = False
         return self.__allow_same_position
 
+    def lazy(self, flag):
+        """
+        lazy(flag) -> Bool
+        If flag = True the iterator returns TvcVcfRecord objects that decode the fields when they are accessed
+        If flag = False the iterator returns the dict of read_vcf_record() (default)
+        """
+        if flag:
+            self.__lazy_flag = True
+        else:
+            self.__lazy_flag = False
+        return self.__lazy_flag
+
     def close(self):
         """
         close() -> int
@@ -229,6 +251,109 @@ class TvcVcfFile:
         """
         return self.__f_vcf.tell() - self.__vcf_record_origin
 
+    def __get_index_path(self, index_path):
+        return self.__vcf_path + TVC_INDEX_SUFFIX if index_path is None else index_path
+
+    def __get_index_stamp(self):
+        my_stat = os.stat(self.__vcf_path)
+        return "%d\t%d" % (my_stat.st_size, int(my_stat.st_mtime))
+
+    @read_mode_only
+    def build_index(self, bin_size=TVC_INDEX_BIN_SIZE, index_path=None, save=True):
+        """
+        build_index(bin_size = TVC_INDEX_BIN_SIZE, index_path = None, save = True) -> None
+        Index the vcf records by position in one pass over the file (mode = 'r' only).
+        As the linear index of tabix, the index keeps the offset of the first record in every bin of bin_size bases of a contig.
+        If save, the index is written to index_path, default vcf_path + '.tvi', for load_index().
+        """
+        index = {}
+        with open(self.__vcf_path, "rb") as f_vcf:
+            f_vcf.seek(self.__vcf_record_origin)
+            offset = 0
+            for line in f_vcf:
+                if line.strip() and not line.startswith(b"#"):
+                    splitted_line = line.split(b"\t", 2)
+                    contig = splitted_line[0].decode()
+                    my_bin = int(splitted_line[1]) // bin_size
+                    bins, offsets = index.setdefault(contig, ([], []))
+                    if not bins or bins[-1] < my_bin:
+                        bins.append(my_bin)
+                        offsets.append(offset)
+                    elif bins[-1] > my_bin:
+                        raise ValueError(
+                            "The vcf file is not sorted: %s:%s comes after position %d"
+                            % (contig, splitted_line[1].decode(), bins[-1] * bin_size)
+                        )
+                offset += len(line)
+        self.__index = index
+        self.__index_bin_size = bin_size
+
+        if save:
+            with open(self.__get_index_path(index_path), "w") as f_index:
+                f_index.write(
+                    "%s\t%d\t%s\n"
+                    % (TVC_INDEX_MAGIC, bin_size, self.__get_index_stamp())
+                )
+                for contig_id in self.__contig_id_list:
+                    bins, offsets = index.get(contig_id, ([], []))
+                    for my_bin, offset in zip(bins, offsets):
+                        f_index.write("%s\t%d\t%d\n" % (contig_id, my_bin, offset))
+
+    @read_mode_only
+    def load_index(self, index_path=None):
+        """
+        load_index(index_path = None) -> bool
+        Load the index written by build_index() (mode = 'r' only).
+        Return False if there is no index or if the vcf file changed after the index was written.
+        """
+        try:
+            with open(self.__get_index_path(index_path), "r") as f_index:
+                header = f_index.readline().rstrip("\n").split("\t", 2)
+                if (
+                    header[0] != TVC_INDEX_MAGIC
+                    or header[2] != self.__get_index_stamp()
+                ):
+                    return False
+                index = {}
+                for line in f_index:
+                    contig, my_bin, offset = line.rstrip("\n").split("\t")
+                    bins, offsets = index.setdefault(contig, ([], []))
+                    bins.append(int(my_bin))
+                    offsets.append(int(offset))
+        except (IOError, OSError, IndexError, ValueError):
+            return False
+        self.__index = index
+        self.__index_bin_size = int(header[1])
+        return True
+
+    @read_mode_only
+    def seek_position(self, contig, pos):
+        """
+        seek_position(contig, pos) -> bool
+        Go to the first vcf record of contig at or after the position pos (mode = 'r' only).
+        The index is loaded, or built and saved, on the first call, so the file is not scanned for every call.
+        Return True if there is such a record, else go to the record that comes after pos and return False.
+        """
+        if self.__index is None and not self.load_index():
+            self.build_index()
+        bins, offsets = self.__index.get(contig, ([], []))
+        if not bins:
+            return False
+        bin_idx = max(bisect.bisect_right(bins, pos // self.__index_bin_size) - 1, 0)
+        self.seek(offsets[bin_idx])
+        # Skip the records before pos in the bin
+        while True:
+            offset = self.tell()
+            line = self.__f_vcf.readline()
+            if line == "":
+                return False
+            if line.startswith("#") or not line.strip():
+                continue
+            splitted_line = line.split("\t", 2)
+            if splitted_line[0] != contig or int(splitted_line[1]) >= pos:
+                self.seek(offset)
+                return splitted_line[0] == contig
+
     @read_mode_only
     def __iter__(self):
         """
@@ -382,7 +507,10 @@ class TvcVcfFile:
             if line == "":
                 raise StopIteration
 
-        my_record = self.read_vcf_record(line.strip("\n"))
+        if self.__lazy_flag:
+            my_record = TvcVcfRecord(self, line.strip("\n"))
+        else:
+            my_record = self.read_vcf_record(line.strip("\n"))
         my_offset = self.__f_vcf.tell()
         self.__vcf_record_basic_sanity_check(my_record, my_offset)
         return my_record
@@ -777,6 +905,65 @@ class TvcVcfFile:
 
         return vcf_dict
 
+    def _decode_record_column(self, splitted_line, key, num_alt):
+        """
+        _decode_record_column(splitted_line, key, num_alt) -> value
+        Decode the value of key in the dict of read_vcf_record() from the split vcf line (used by TvcVcfRecord)
+        """
+        if key == "POS":
+            return int(splitted_line[self.column_to_index["POS"]])
+        elif key == "ALT":
+            return splitted_line[self.column_to_index["ALT"]].split(",")
+        elif key == "QUAL":
+            return float(splitted_line[self.column_to_index["QUAL"]])
+        elif key == "INFO":
+            return self.__decode_info_field(
+                splitted_line[self.column_to_index["INFO"]], num_alt
+            )
+        elif key == "FORMAT":
+            return self.__decode_format_tag(
+                splitted_line[self.column_to_index["FORMAT"]],
+                splitted_line[self.column_to_index["FORMAT"] + 1 :],
+                num_alt,
+            )
+        elif key == "FORMAT_ORDER":
+            return splitted_line[self.column_to_index["FORMAT"]].split(":")
+        return splitted_line[self.column_to_index[key]]
+
+    def _decode_info_key(self, info_text, key, num_alt):
+        """
+        _decode_info_key(info_text, key, num_alt) -> (bool, value)
+        Decode the INFO FIELD key only. Return (False, None) if key is not in info_text (used by TvcVcfRecord)
+        """
+        for info_text_one_entry in info_text.split(";"):
+            if info_text_one_entry == key or info_text_one_entry.startswith(key + "="):
+                return (
+                    True,
+                    self.__decode_info_field_one_entry(info_text_one_entry, num_alt)[1],
+                )
+        return False, None
+
+    def _decode_format_key(self, format_keys, sample_tags, key, num_alt):
+        """
+        _decode_format_key(format_keys, sample_tags, key, num_alt) -> (bool, value)
+        Decode the FORMAT TAG key of one sample only. Return (False, None) if key is not in format_keys (used by TvcVcfRecord)
+        """
+        splitted_format_tag_key = format_keys.split(":")
+        splitted_format_tag_value = sample_tags.split(":")
+        if len(splitted_format_tag_key) != len(splitted_format_tag_value):
+            raise ValueError(
+                'FORMAT "%s"and TAGS "%s"mismatches:' % (format_keys, sample_tags)
+            )
+        if key not in splitted_format_tag_key:
+            return False, None
+        tag_idx = splitted_format_tag_key.index(key)
+        return (
+            True,
+            self.__decode_format_tag_one_entry(
+                key, splitted_format_tag_value[tag_idx], num_alt
+            )[1],
+        )
+
     def __encode_info_field(self, info_dict, num_alt):
         info_list = []
         info_keys = list(info_dict.keys())
@@ -913,6 +1100,145 @@ class TvcVcfFile:
         self.vcf_double_hash_header.append(new_header_text)
 
 
+class TvcVcfRecord(object):
+    """
+    A vcf record read by TvcVcfFile in lazy mode (see TvcVcfFile.lazy).
+    It reads as the dict of TvcVcfFile.read_vcf_record(), but the line is split on the first access,
+    and each value, INFO and FORMAT in particular, is decoded when it is accessed for the first time.
+    info(key) and format_tag(key, sample) decode a single key without decoding the whole INFO or FORMAT.
+    """
+
+    __slots__ = ("_vcf", "_line", "_splitted_line", "_num_alt", "_values")
+
+    KEYS = (
+        "CHROM",
+        "POS",
+        "ID",
+        "REF",
+        "ALT",
+        "QUAL",
+        "FILTER",
+        "INFO",
+        "FORMAT",
+        "FORMAT_ORDER",
+        "RAWLINE",
+    )
+
+    def __init__(self, vcf, line):
+        self._vcf = vcf
+        self._line = line
+        self._splitted_line = None
+        self._num_alt = None
+        self._values = {}
+
+    def __split(self):
+        if self._splitted_line is None:
+            if " " in self._line:
+                raise ValueError(
+                    'A valid vcf record can not have a space: "%s"' % self._line
+                )
+            self._splitted_line = self._line.split("\t")
+        return self._splitted_line
+
+    def __num_alt(self):
+        if self._num_alt is None:
+            alt = self.__split()[self._vcf.column_to_index["ALT"]]
+            self._num_alt = alt.count(",") + 1
+        return self._num_alt
+
+    def __decode(self, decode_method, *args):
+        try:
+            return decode_method(*args)
+        except Exception as e:
+            print("Error in vcf line: " + self._line)
+            raise type(e)(str(e) + " happens at %s" % self._line)
+
+    def __getitem__(self, key):
+        if key in self._values:
+            return self._values[key]
+        if key == "RAWLINE":
+            return self._line
+        if key not in self.KEYS:
+            raise KeyError(key)
+        num_alt = self.__num_alt() if key in ("INFO", "FORMAT") else None
+        value = self.__decode(
+            self._vcf._decode_record_column, self.__split(), key, num_alt
+        )
+        self._values[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._values[key] = value
+
+    def __contains__(self, key):
+        return key in self.KEYS or key in self._values
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, TvcVcfRecord):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def keys(self):
+        return list(self.KEYS) + [key for key in self._values if key not in self.KEYS]
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def info(self, key, default=None):
+        """
+        info(key, default = None) -> value
+        The decoded INFO FIELD key, i.e., self['INFO'].get(key, default), decoding key only.
+        """
+        if "INFO" in self._values:
+            return self._values["INFO"].get(key, default)
+        found, value = self.__decode(
+            self._vcf._decode_info_key,
+            self.__split()[self._vcf.column_to_index["INFO"]],
+            key,
+            self.__num_alt(),
+        )
+        return value if found else default
+
+    def format_tag(self, key, sample=0, default=None):
+        """
+        format_tag(key, sample = 0, default = None) -> value
+        The decoded FORMAT TAG key of sample, the index or the name of the sample, i.e., self['FORMAT'][sample_idx].get(key, default), decoding key only.
+        """
+        sample_idx = (
+            sample if isinstance(sample, int) else self._vcf.sample_to_index[sample]
+        )
+        if "FORMAT" in self._values:
+            return self._values["FORMAT"][sample_idx].get(key, default)
+        splitted_line = self.__split()
+        format_idx = self._vcf.column_to_index["FORMAT"]
+        found, value = self.__decode(
+            self._vcf._decode_format_key,
+            splitted_line[format_idx],
+            splitted_line[format_idx + 1 + sample_idx],
+            key,
+            self.__num_alt(),
+        )
+        return value if found else default
+
+    def to_dict(self):
+        """
+        to_dict() -> dict
+        The dict of TvcVcfFile.read_vcf_record(), with the values that have been set.
+        """
+        return dict((key, self[key]) for key in self.keys())
+
+
 class TestTvcVcfFileReadMode:
     @staticmethod
     def write_vcf_headers(f):
@@ -1047,6 +1373,74 @@ class TestTvcVcfFileReadMode:
                 assert "File not open in write (w) mode for flush" in msg
 
 
+class TestTvcVcfRecord:
+    @staticmethod
+    def write_vcf(f):
+        f.write(b"##contig=<ID=chr1,length=1000,assembly=hg19>\n")
+        f.write(b"##contig=<ID=chr2,length=1000,assembly=hg19>\n")
+        f.write(b'##INFO=<ID=AO,Number=A,Type=Integer,Description="AO">\n')
+        f.write(b'##INFO=<ID=HS,Number=0,Type=Flag,Description="HS">\n')
+        f.write(b'##FORMAT=<ID=DP,Number=1,Type=Integer,Description="DP">\n')
+        f.write(b'##FORMAT=<ID=AF,Number=A,Type=Float,Description="AF">\n')
+        f.write(
+            b"#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\ts1\ts2\n"
+        )
+        for pos in (5, 90, 200, 210, 990):
+            f.write(
+                b"chr1\t%d\t.\tA\tC,G\t10.5\tPASS\tAO=1,2;HS\tDP:AF\t9:0.1,0.2\t8:0,1\n"
+                % pos
+            )
+        f.write(b"chr2\t300\t.\tA\tC\t1\tPASS\tAO=3\tDP:AF\t7:0.5\t6:0.25\n")
+        f.flush()
+
+    @classmethod
+    def runTest(cls):
+        t = cls()
+        for method in dir(t):
+            if method.startswith("test_"):
+                getattr(t, method)()
+
+    def __init__(self):
+        from tempfile import NamedTemporaryFile
+
+        self.tempfile = NamedTemporaryFile
+
+    def test_lazy(self):
+        with self.tempfile() as f:
+            TestTvcVcfRecord.write_vcf(f)
+            eager = list(TvcVcfFile(f.name, "r"))
+            vcf = TvcVcfFile(f.name, "r")
+            vcf.lazy(True)
+            records = list(vcf)
+            assert records == eager
+            assert records[0].info("AO") == [1, 2] and records[0].info("HS", 0) is None
+            assert records[5].info("HS", 0) == 0
+            assert records[0].format_tag("AF", "s2") == [0.0, 1.0]
+            assert records[5].format_tag("DP", 1) == 6
+            records[1]["FILTER"] = "NOCALL"
+            assert vcf.vcf_dict_to_text(records[1]).split("\t")[6] == "NOCALL"
+
+    def test_seek_position(self):
+        with self.tempfile() as f:
+            TestTvcVcfRecord.write_vcf(f)
+            vcf = TvcVcfFile(f.name, "r")
+            vcf.build_index(bin_size=100, save=False)
+            for contig, pos, expected in [
+                ("chr1", 1, 5),
+                ("chr1", 90, 90),
+                ("chr1", 91, 200),
+                ("chr1", 201, 210),
+                ("chr1", 500, 990),
+                ("chr2", 1, 300),
+            ]:
+                assert vcf.seek_position(contig, pos)
+                assert next(vcf)["POS"] == expected
+            assert not vcf.seek_position("chr1", 991)
+            assert next(vcf)["CHROM"] == "chr2"
+            assert not vcf.seek_position("chr2", 301)
+            assert not vcf.seek_position("chr3", 1)
+
+
 if __name__ == "__main__":
     """
     # Example 1: read the vcf line by line.
@@ -1107,3 +1501,4 @@ if __name__ == "__main__":
 
     # run test with read mode
     TestTvcVcfFileReadMode.runTest()
+    TestTvcVcfRecord.runTest()
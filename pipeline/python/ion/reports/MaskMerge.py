@@ -8,15 +8,32 @@ import pylab
 import numpy
 import math
 import os
+import struct
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 import ConfigParser
 import io
 
-
-def merge(folder, infile, out_list, verbose, offset_str):
-
-    infile = os.path.join(folder, infile)
-
+# mask bits, see Analysis/Mask/Mask.h
+MASK_TYPES = {
+    "MaskEmpty": 1 << 0,
+    "MaskBead": 1 << 1,
+    "MaskLive": 1 << 2,
+    "MaskDud": 1 << 3,
+    "MaskReference": 1 << 4,
+    "MaskTF": 1 << 5,
+    "MaskLib": 1 << 6,
+    "MaskPinned": 1 << 7,
+    "MaskIgnore": 1 << 8,
+    "MaskWashout": 1 << 9,
+    "MaskExclude": 1 << 10,
+}
+MERGE_THREADS = 8
+
+
+def get_offset(folder, offset_str):
+    """Returns (offsetx, offsety) of the block in folder"""
     config = ConfigParser.RawConfigParser()
     config.read(os.path.join(folder, "processParameters.txt"))
     if offset_str == "use_blocks":
@@ -28,8 +45,23 @@ def merge(folder, infile, out_list, verbose, offset_str):
         sys.exit(1)
 
     offset = size.split(",")
-    offsetx = int(offset[0])
-    offsety = int(offset[1])
+    return int(offset[0]), int(offset[1])
+
+
+def get_chip_size(folder):
+    """Returns (width, height) of the chip from processParameters.txt"""
+    config = ConfigParser.RawConfigParser()
+    config.read(os.path.join(folder, "processParameters.txt"))
+    size = config.get("global", "Chip").split(",")
+    return int(size[0]), int(size[1])
+
+
+def merge(folder, infile, out_list, verbose, offset_str):
+    """Appends the text bead list infile of the block in folder, moved to
+    chip coordinates, to out_list as an array of (row, column)"""
+
+    infile = os.path.join(folder, infile)
+    offsetx, offsety = get_offset(folder, offset_str)
 
     if verbose:
         print("MaskMerge: Reading " + str(infile))
@@ -54,14 +86,11 @@ def merge(folder, infile, out_list, verbose, offset_str):
             + str(offsety)
         )
 
-    # remove first element, extend list
-    l = beadlist.tolist()
-    del l[0]
-    out_list.extend(l)
+    # remove first element
+    out_list.append(beadlist[1:])
 
 
 def main_merge(inputfile, blockfolder, outputfile, verbose, offset_str):
-
     print("MaskMerge: started")
 
     if verbose:
@@ -72,9 +101,7 @@ def main_merge(inputfile, blockfolder, outputfile, verbose, offset_str):
 
     # add block data to outputfile
     for i, folder in enumerate(blockfolder):
-
         if i == 0:
-
             config = ConfigParser.RawConfigParser()
             config.read(os.path.join(folder, "processParameters.txt"))
             chip = config.get("global", "Chip")
@@ -99,13 +126,99 @@ def main_merge(inputfile, blockfolder, outputfile, verbose, offset_str):
 
     # append data
     f_handle = file(outputfile, "a")
-    outdata = numpy.array(out_list)
-    numpy.savetxt(f_handle, outdata, fmt="%1.1i")
+    for outdata in out_list:
+        numpy.savetxt(f_handle, outdata, fmt="%1.1i")
     f_handle.close()
 
 
-if __name__ == "__main__":
+def read_bfmask(filename):
+    """Returns the mask values of a bfmask.bin file, rows x columns"""
+    with open(filename, "rb") as f:
+        h, w = struct.unpack("ii", f.read(8))
+        data = numpy.fromfile(f, dtype=numpy.uint16, count=h * w)
+    return data.reshape((h, w))
+
+
+def merge_binary(
+    blockfolder,
+    inputfile="analysis.bfmask.bin",
+    outputfile=None,
+    verbose=False,
+    offset_str="use_blocks",
+    processes=None,
+    init_exclude=False,
+):
+    """Places the binary mask inputfile of each block in blockfolder at the
+    block's offset in a full chip mask, on several threads.
+
+    The full chip mask is preallocated, or memory mapped from outputfile in
+    bfmask.bin format if given, so no block is ever copied into a list.
+    Wells no block covers are 0, or MaskExclude with init_exclude, like
+    BeadmaskMerge -c.  Returns the full chip mask, rows x columns, and the
+    (offsety, offsetx, height, width) of each block in blockfolder order."""
+
+    width, height = get_chip_size(blockfolder[0])
+    if verbose:
+        print("MaskMerge: chip size:", width, height)
+
+    if outputfile:
+        with open(outputfile, "wb") as f:
+            f.write(struct.pack("II", height, width))
+            f.truncate(8 + 2 * width * height)
+        fullmask = numpy.memmap(
+            outputfile, dtype=numpy.uint16, mode="r+", offset=8, shape=(height, width)
+        )
+    else:
+        fullmask = numpy.zeros((height, width), dtype=numpy.uint16)
+    if init_exclude:
+        fullmask[:] = MASK_TYPES["MaskExclude"]
+
+    def place(folder):
+        offsetx, offsety = get_offset(folder, offset_str)
+        block = read_bfmask(os.path.join(folder, inputfile))
+        h, w = block.shape
+        if verbose:
+            print(
+                "MaskMerge: place %s (%d x %d) at x: %d y: %d"
+                % (folder, w, h, offsetx, offsety)
+            )
+        fullmask[offsety : offsety + h, offsetx : offsetx + w] = block
+        return offsety, offsetx, h, w
+
+    if processes is None:
+        processes = min(multiprocessing.cpu_count(), MERGE_THREADS)
+    processes = min(processes, len(blockfolder))
+    if processes > 1:
+        pool = ThreadPool(processes)
+        try:
+            regions = pool.map(place, blockfolder)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        regions = [place(folder) for folder in blockfolder]
+
+    if outputfile:
+        fullmask.flush()
+    return fullmask, regions
 
+
+def write_mask_list(fullmask, regions, mask_type, outputfile):
+    """Writes the text bead list of main_merge: the chip width and height,
+    then the row and column of every well of mask_type, block by block"""
+    bit = MASK_TYPES[mask_type]
+    height, width = fullmask.shape
+    with open(outputfile, "w") as f:
+        f.write("%d %d\n" % (width, height))
+        for offsety, offsetx, h, w in regions:
+            rows, cols = numpy.nonzero(
+                fullmask[offsety : offsety + h, offsetx : offsetx + w] & bit
+            )
+            outdata = numpy.column_stack((rows + offsety, cols + offsetx))
+            numpy.savetxt(f, outdata, fmt="%1.1i")
+
+
+if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-v", dest="verbose", action="store_true")
     parser.add_argument(
@@ -121,6 +234,27 @@ if __name__ == "__main__":
         default="use_blocks",
         help=" offset string",
     )
+    parser.add_argument(
+        "-b",
+        "--binary",
+        action="store_true",
+        help="merge the blocks' bfmask.bin, -i defaults to analysis.bfmask.bin. "
+        "Writes a bfmask.bin if -o ends with .bin, else the text list of -m",
+    )
+    parser.add_argument(
+        "-m",
+        "--mask_type",
+        default="MaskBead",
+        choices=sorted(MASK_TYPES),
+        help="wells listed in a text output of --binary",
+    )
+    parser.add_argument(
+        "-c",
+        "--init_exclude",
+        action="store_true",
+        help="mark wells of no block MaskExclude in a --binary merge",
+    )
+    parser.add_argument("-p", "--processes", type=int, help="threads, --binary")
     parser.add_argument("blockfolder", nargs="+")
 
     args = parser.parse_args()
@@ -128,6 +262,36 @@ if __name__ == "__main__":
     if args.verbose:
         print("MaskMerge:", args)
 
-    main_merge(
-        args.inputfile, args.blockfolder, args.outputfile, args.verbose, args.offset_str
-    )
+    if args.binary:
+        inputfile = args.inputfile
+        if inputfile == parser.get_default("inputfile"):
+            inputfile = "analysis.bfmask.bin"
+        if args.outputfile.endswith(".bin"):
+            merge_binary(
+                args.blockfolder,
+                inputfile,
+                args.outputfile,
+                args.verbose,
+                args.offset_str,
+                args.processes,
+                args.init_exclude,
+            )
+        else:
+            fullmask, regions = merge_binary(
+                args.blockfolder,
+                inputfile,
+                None,
+                args.verbose,
+                args.offset_str,
+                args.processes,
+                args.init_exclude,
+            )
+            write_mask_list(fullmask, regions, args.mask_type, args.outputfile)
+    else:
+        main_merge(
+            args.inputfile,
+            args.blockfolder,
+            args.outputfile,
+            args.verbose,
+            args.offset_str,
+        )
@@ -18,6 +18,7 @@ import argparse
 import struct
 import numpy
 import math
+import multiprocessing
 import scipy.ndimage
 import scipy.misc
 import scipy.signal
@@ -211,14 +212,10 @@ def extractMaskInfo(filename):
 
 def makeBarcodeArr(qBcId, row, col, bcIds, HEIGHT, WIDTH):
     # TODO: x/y are reversed from what is typical
-    # print "makeBarcodeArr", qBcId, row, col, bcIds, HEIGHT, WIDTH
-    counts = 0
     arr = numpy.zeros((HEIGHT, WIDTH))
-    for i in range(len(row)):
-        if qBcId == bcIds[i]:
-            arr[row[i], col[i]] = 1
-            counts += 1
-    return arr, counts
+    selected = numpy.asarray(bcIds) == qBcId
+    arr[numpy.asarray(row)[selected], numpy.asarray(col)[selected]] = 1
+    return arr, int(selected.sum())
 
 
 def extractBarcodeMaskInfo(filePath):
@@ -231,12 +228,132 @@ def extractBarcodeMaskInfo(filePath):
     bcbead_col = beadlist[1:, 1]  # really x, but is the second column
     bcbead_bcIds = beadlist[1:, 2]
 
-    unique_barcodeIds = list(dict.fromkeys(bcbead_bcIds).keys())
+    unique_barcodeIds = numpy.unique(bcbead_bcIds).tolist()
     print("Unique barcode ids found: ", unique_barcodeIds)
 
     return unique_barcodeIds, HEIGHT, WIDTH, bcbead_row, bcbead_col, bcbead_bcIds
 
 
+def extractBarcodeMaskInfoBin(filePath):
+    """extractBarcodeMaskInfo of barcodeMask.bin, the binary mask
+    barcodeMaskParse makes the text bead list from"""
+    print("Reading", filePath)
+    with open(filePath, "rb") as f:
+        h, w = struct.unpack_from("ii", f.read(8))
+        barcodes = numpy.fromfile(f, dtype=numpy.uint16, count=h * w)
+    # 0xffff marks wells without a barcode
+    wells = numpy.flatnonzero(barcodes != 0xFFFF)
+    bcbead_bcIds = barcodes[wells]
+    del barcodes
+    bcbead_row, bcbead_col = numpy.divmod(wells, w)
+
+    unique_barcodeIds = numpy.unique(bcbead_bcIds).tolist()
+    print("Unique barcode ids found: ", unique_barcodeIds)
+
+    return unique_barcodeIds, h, w, bcbead_row, bcbead_col, bcbead_bcIds
+
+
+# wells per side of the areas beads are counted in for barcode heatmaps, the
+# 10x10 area of makeContourMap; larger on chips whose heatmap would have more
+# than BARCODE_GRID_BOUND areas per side, the size reasonable_shrink gives
+BARCODE_CELL = 10
+BARCODE_GRID_BOUND = 1000
+# bound on the counters of one bincount, about 256Mb
+BARCODE_MAX_COUNTS = 1 << 25
+
+
+def getBarcodeCellSize(HEIGHT, WIDTH):
+    largest = max(HEIGHT, WIDTH)
+    return max(BARCODE_CELL, int(math.ceil(float(largest) / BARCODE_GRID_BOUND)))
+
+
+def iterBarcodeDensity(row, col, bcIds, HEIGHT, WIDTH, cell=None):
+    """Counts the beads of all barcodes in cell x cell well areas and yields
+    (barcode id, beads, density) per barcode, density being the percentage
+    of the wells of each area with a bead of that barcode.
+
+    Each bead is binned once, with numpy.bincount over barcode and area, so
+    the cost does not grow with the number of barcodes.  Barcodes are
+    counted in groups so that no more than BARCODE_MAX_COUNTS counters are
+    held at once."""
+    cell = cell or getBarcodeCellSize(HEIGHT, WIDTH)
+    gh = -(-HEIGHT // cell)
+    gw = -(-WIDTH // cell)
+    ncells = gh * gw
+    area = numpy.outer(
+        numpy.minimum(cell, HEIGHT - numpy.arange(gh) * cell),
+        numpy.minimum(cell, WIDTH - numpy.arange(gw) * cell),
+    )
+    scale = 100.0 / area
+
+    ids, index = numpy.unique(bcIds, return_inverse=True)
+    cells = (numpy.asarray(row) // cell) * gw + numpy.asarray(col) // cell
+    group = max(1, BARCODE_MAX_COUNTS // ncells)
+    for first in range(0, len(ids), group):
+        last = min(first + group, len(ids))
+        if first == 0 and last == len(ids):
+            selected = slice(None)
+        else:
+            selected = (index >= first) & (index < last)
+        keys = (index[selected] - first) * ncells + cells[selected]
+        counts = numpy.bincount(keys, minlength=(last - first) * ncells)
+        counts = counts.reshape((last - first, gh, gw))
+        for i in range(last - first):
+            yield int(ids[first + i]), int(counts[i].sum()), counts[i] * scale
+
+
+def _renderBarcodeHeatmap(job):
+    barcodeId, beads, density, HEIGHT, WIDTH, plt_title, outputdir = job
+    average = 100.0 * beads / (HEIGHT * WIDTH)
+    vmaxVal = min(100, max(5, 5 * int(math.ceil(density.max() / 5.0))))
+    outputId = "Bead_barcode_%d" % barcodeId
+    makeContourPlot(
+        density,
+        average,
+        HEIGHT,
+        WIDTH,
+        outputId,
+        "",
+        plt_title,
+        outputdir,
+        barcodeId,
+        vmaxVal,
+    )
+    pyplot.close("all")
+    flipped = numpy.flipud(density)
+    makeRawDataPlot(flipped, outputId, outputdir)
+    makeFullBleed(flipped, outputId, outputdir)
+    return barcodeId
+
+
+def genBarcodeHeatmap(filePath, outputdir, plot_title, processes=1):
+    """Writes a loading density heatmap per barcode of filePath, a
+    barcodeMask.bin or its text bead list, rendered in processes worker
+    processes"""
+    if filePath.endswith(".bin"):
+        info = extractBarcodeMaskInfoBin(filePath)
+    else:
+        info = extractBarcodeMaskInfo(filePath)
+    ids, HEIGHT, WIDTH, row, col, bcIds = info
+    jobs = (
+        (barcodeId, beads, density, HEIGHT, WIDTH, plot_title, outputdir)
+        for barcodeId, beads, density in iterBarcodeDensity(
+            row, col, bcIds, HEIGHT, WIDTH
+        )
+    )
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            for barcodeId in pool.imap_unordered(_renderBarcodeHeatmap, jobs):
+                print("Barcode %d heatmap done" % barcodeId)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for job in jobs:
+            _renderBarcodeHeatmap(job)
+
+
 def genHeatmap(filePath, bfmaskstatspath, outputdir, plot_title):
     #
     # Called from TLScript.py
@@ -265,11 +382,17 @@ def genHeatmap(filePath, bfmaskstatspath, outputdir, plot_title):
 # MaskBead.mask contains all well coordinations with Beads (Bead Wells = NUMBER), see bfmask.stats
 
 if __name__ == "__main__":
-
     parser = argparse.ArgumentParser()
     parser.add_argument("maskfile", default="bfmask.bin", help="e.g. bfmask.bin")
     parser.add_argument("bfmask", default="bfmask.stats", help="e.g. bfmask.stats")
     parser.add_argument("plt_title", default="title", help="e.g. FOZ-223")
+    parser.add_argument(
+        "--barcode-mask",
+        help="also plot each barcode of this barcodeMask.bin or barcodeMask.txt",
+    )
+    parser.add_argument("--processes", type=int, default=1)
     args = parser.parse_args()
 
     genHeatmap(args.maskfile, args.bfmask, "./", args.plt_title)
+    if args.barcode_mask:
+        genBarcodeHeatmap(args.barcode_mask, "./", args.plt_title, args.processes)
@@ -7,14 +7,30 @@ from ion.utils.blockprocessing import printtime
 from ion.utils import blockprocessing
 
 import traceback
+import glob
 import os
 import subprocess
 import sys
+import threading
 import time
 import multiprocessing
 import ionstats
 import ion
 
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
+
+# samtools sort -m of align(), for each sort thread
+SORT_MEMORY_PER_THREAD = 1000 * 1024 * 1024
+MAX_SORT_THREADS = 12
+# Memory of an alignment for each read of the dataset, or of a block when it is
+# aligned block by block, besides the tmap index and the sort buffers.  Whole
+# datasets are aligned up to about 20M reads on a 64GB server and 60M reads on
+# a 140GB one, the former fixed limits.
+ALIGN_MEMORY_PER_READ = 2048
+
 
 def _get_total_memory_gb():
     return (
@@ -22,6 +38,28 @@ def _get_total_memory_gb():
     )
 
 
+def _get_available_memory():
+    """Bytes of memory new processes can use, MemAvailable of /proc/meminfo,
+    or the total memory"""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, ValueError, IndexError):
+        pass
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def _get_reference_index_size(referenceName):
+    """Bytes of the tmap index files of the reference, which each tmap process
+    loads"""
+    if not referenceName:
+        return 0
+    prefix = ion.referenceBasePath + referenceName + "/" + referenceName + ".fasta.tmap."
+    return sum(os.path.getsize(filename) for filename in glob.glob(prefix + "*"))
+
+
 def _add_read_queue_size(input_cmd, queue_size=50000):
     """
     only add when mapall option is used and
@@ -453,17 +491,14 @@ def align_dataset_parallel(
     do_indexing,
     align_threads,
     barcodeInfo,
+    align_by_block=False,
 ):
 
     do_sorting = True
 
     try:
         # process block by block
-        memTotalGb = _get_total_memory_gb()
-        maxReads = 20000000
-        if memTotalGb > 140:
-            maxReads = 60000000
-        if reference and len(blocks) > 1 and int(dataset["read_count"]) > maxReads:
+        if reference and len(blocks) > 1 and align_by_block:
             printtime(
                 "DEBUG: TRADITIONAL BLOCK PROCESSING ------ prefix: %20s ----------- reference: %20s ---------- reads: %10s ----------"
                 % (dataset["file_prefix"], reference, dataset["read_count"])
@@ -594,8 +629,142 @@ def align_dataset_parallel(
         traceback.print_exc()
 
 
-def align_dataset_parallel_wrap(args):
-    return align_dataset_parallel(*args)
+class AlignmentJob(object):
+    """A dataset of process_datasets, with the threads, memory and alignment
+    mode it is given when it starts"""
+
+    def __init__(self, dataset, reference, blocks, args=()):
+        self.dataset = dataset
+        self.name = dataset["file_prefix"]
+        self.reads = int(dataset["read_count"])
+        self.reference = reference
+        self.num_blocks = len(blocks)
+        self.args = args
+        self.threads = 0
+        self.memory = 0
+        self.align_by_block = False
+        self.wall_time = None
+
+    def can_align_by_block(self):
+        return bool(self.reference) and self.num_blocks > 1
+
+    def memory_needed(self, threads, align_by_block, index_size):
+        """Bytes of memory of the alignment, the tmap index, sort buffers and
+        the reads of the dataset or of its largest block"""
+        if not self.reference:
+            return 0
+        reads = self.reads
+        if align_by_block:
+            reads = -(-reads // self.num_blocks)
+        sort_memory = min(threads, MAX_SORT_THREADS) * SORT_MEMORY_PER_THREAD
+        return index_size + sort_memory + reads * ALIGN_MEMORY_PER_READ
+
+    def plan(self, threads, free_memory, index_size):
+        """Set threads, memory and align_by_block to align as a whole if that
+        fits in free_memory, else block by block.  Returns whether it fits,
+        if not the job is left planned in the mode that needs less memory."""
+        self.threads = threads
+        modes = [False, True] if self.can_align_by_block() else [False]
+        for align_by_block in modes:
+            self.align_by_block = align_by_block
+            self.memory = self.memory_needed(threads, align_by_block, index_size)
+            if self.memory <= free_memory:
+                return True
+        return False
+
+
+def schedule_alignment_jobs(jobs, run_job, threads, memory):
+    """Runs run_job(job) for each AlignmentJob of jobs, the largest datasets
+    first, each in its own thread.
+
+    A job starts when there are free threads and the memory it needs.  It is
+    given a share of the free threads in proportion to its reads among the
+    jobs not started yet, and at least an even share of the jobs that fit in
+    the free memory, so that the small datasets run beside the large ones and
+    start as soon as threads free up.  It is aligned as a whole if that fits
+    in the free memory, else block by block.  A job that does not fit starts
+    once nothing else runs.  Returns the jobs, with their wall time."""
+
+    pending = sorted(jobs, key=lambda job: job.reads, reverse=True)
+    index_sizes = {}
+    for job in pending:
+        if job.reference not in index_sizes:
+            index_sizes[job.reference] = _get_reference_index_size(job.reference)
+    free_threads = threads
+    free_memory = memory
+    running = 0
+    finished = Queue.Queue()
+
+    def run(job, start_time):
+        try:
+            run_job(job)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            job.wall_time = time.time() - start_time
+            finished.put(job)
+
+    start_time = time.time()
+    busy_thread_seconds = 0.0
+    while pending or running:
+        while pending and free_threads > 0:
+            job = pending[0]
+            index_size = index_sizes[job.reference]
+            pending_reads = sum(pending_job.reads for pending_job in pending)
+            share = free_threads * job.reads // max(pending_reads, 1)
+            smallest_memory = job.memory_needed(1, job.can_align_by_block(), index_size)
+            if smallest_memory:
+                fitting_jobs = max(1, min(len(pending), free_memory // smallest_memory))
+                share = max(share, free_threads // fitting_jobs)
+            job_threads = min(max(share, 1), free_threads)
+            if not job.plan(job_threads, free_memory, index_size) and running:
+                break
+            pending.pop(0)
+            free_threads -= job.threads
+            free_memory -= job.memory
+            running += 1
+            printtime(
+                "DEBUG: ALIGN START %s: %d reads, %d threads, %s, %.1f GB"
+                % (
+                    job.name,
+                    job.reads,
+                    job.threads,
+                    "by block" if job.align_by_block else "whole",
+                    job.memory / 1073741824.0,
+                )
+            )
+            thread = threading.Thread(target=run, args=(job, time.time()))
+            thread.daemon = True
+            thread.start()
+
+        job = finished.get()
+        running -= 1
+        free_threads += job.threads
+        free_memory += job.memory
+        busy_thread_seconds += job.threads * job.wall_time
+        printtime(
+            "DEBUG: ALIGN DONE %s: %d reads, %d threads, %s, %.1fs"
+            % (
+                job.name,
+                job.reads,
+                job.threads,
+                "by block" if job.align_by_block else "whole",
+                job.wall_time,
+            )
+        )
+
+    elapsed = time.time() - start_time
+    if jobs:
+        printtime(
+            "DEBUG: ALIGNED %d datasets in %.1fs, %d threads %.0f%% busy"
+            % (
+                len(jobs),
+                elapsed,
+                threads,
+                100.0 * busy_thread_seconds / max(elapsed * threads, 1e-6),
+            )
+        )
+    return jobs
 
 
 def process_datasets(
@@ -615,24 +784,16 @@ def process_datasets(
     barcodeInfo,
 ):
 
-    parallel_datasets = 1
     memTotalGb = _get_total_memory_gb()
-    try:
-        if memTotalGb > 140:
-            parallel_datasets = 4
-        elif memTotalGb >= 70:
-            parallel_datasets = 2
-    except Exception:
-        pass
-
-    align_threads = multiprocessing.cpu_count() / parallel_datasets
+    align_threads = multiprocessing.cpu_count()
     if memTotalGb <= 40:
         # reduce number of CPU (1 vCPU = 2 cores)
-        align_threads = align_threads - 2
+        align_threads = max(align_threads - 2, 1)
+    align_memory = _get_available_memory()
     printtime("Attempt to align")
     printtime(
-        "DEBUG: PROCESS DATASETS blocks: '%s', parallel datasets: %d"
-        % (blocks, parallel_datasets)
+        "DEBUG: PROCESS DATASETS blocks: '%s', threads: %d, available memory: %.1f GB"
+        % (blocks, align_threads, align_memory / 1073741824.0)
     )
 
     # TODO: compare with pipeline/python/ion/utils/ionstats.py
@@ -641,7 +802,7 @@ def process_datasets(
     ionstats_basecaller_filtered_file_list = []
     ionstats_alignment_filtered_file_list = []
 
-    align_dataset_args = []
+    align_jobs = []
 
     for dataset in basecaller_datasets["datasets"]:
 
@@ -658,24 +819,27 @@ def process_datasets(
         if int(dataset["read_count"]) == 0:
             continue
 
-        align_dataset_args.append(
-            (
+        align_jobs.append(
+            AlignmentJob(
                 dataset,
-                blocks,
                 reference,
-                alignmentArgs,
-                ionstatsArgs,
-                BASECALLER_RESULTS,
-                basecaller_meta_information,
-                library_key,
-                graph_max_x,
-                ALIGNMENT_RESULTS,
-                do_realign,
-                do_ionstats,
-                do_mark_duplicates,
-                do_indexing,
-                align_threads,
-                barcodeInfo,
+                blocks,
+                (
+                    dataset,
+                    blocks,
+                    reference,
+                    alignmentArgs,
+                    ionstatsArgs,
+                    BASECALLER_RESULTS,
+                    basecaller_meta_information,
+                    library_key,
+                    graph_max_x,
+                    ALIGNMENT_RESULTS,
+                    do_realign,
+                    do_ionstats,
+                    do_mark_duplicates,
+                    do_indexing,
+                ),
             )
         )
 
@@ -710,9 +874,15 @@ def process_datasets(
                     )
                 )
 
-    # do alignment in multiprocessing pool
-    pool = multiprocessing.Pool(processes=parallel_datasets)
-    pool.map(align_dataset_parallel_wrap, align_dataset_args)
+    def run_job(job):
+        align_dataset_parallel(
+            *job.args,
+            align_threads=job.threads,
+            barcodeInfo=barcodeInfo,
+            align_by_block=job.align_by_block
+        )
+
+    schedule_alignment_jobs(align_jobs, run_job, align_threads, align_memory)
 
     if do_ionstats:
 
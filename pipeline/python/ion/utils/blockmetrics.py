@@ -0,0 +1,500 @@
+# Copyright (C) 2018 Ion Torrent Systems, Inc. All Rights Reserved
+"""
+Merge per-block metrics files into the composite report's.
+
+load_files() reads the BaseCaller.json or analysis.bfmask.stats of every
+block once, on a thread pool, into a MetricTable: a NumPy column per metric
+path with a row per block.  The merge_* functions
+compute the composite files from the columns.
+
+The counters of a section are summed whatever their names, so counters added
+to BaseCaller or Analysis are merged without changes here.  Float columns are
+summed with cumsum, which adds in block order like the loops these functions
+replaced, so the results are identical to the last bit; numpy.sum adds
+pairwise.
+"""
+import ConfigParser
+import copy
+import json
+import multiprocessing
+import numbers
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from ion.utils.blockprocessing import printtime
+
+LOAD_THREADS = 8
+
+QV_HISTOGRAM_LENGTH = 50
+# BeadAdapters averages and the counts they are weighted by
+ADAPTER_AVERAGES = {
+    "average_metric": "read_count",
+    "average_separation": "num_decisions",
+}
+
+BFMASK_COUNTS = [
+    "Excluded Wells",
+    "Addressable Wells",
+    "Empty Wells",
+    "Pinned Wells",
+    "Ignored Wells",
+    "Bead Wells",
+    "Dud Beads",
+    "Reference Beads",
+    "Live Beads",
+    "Test Fragment Beads",
+    "Library Beads",
+    "TF Filtered Beads (read too short)",
+    "TF Filtered Beads (fail keypass)",
+    "TF Filtered Beads (too many positive flows)",
+    "TF Filtered Beads (poor signal fit)",
+    "TF Validated Beads",
+    "Lib Filtered Beads (read too short)",
+    "Lib Filtered Beads (fail keypass)",
+    "Lib Filtered Beads (too many positive flows)",
+    "Lib Filtered Beads (poor signal fit)",
+    "Lib Validated Beads",
+]
+# bfmask.stats values of the whole chip, not summed
+BFMASK_GEOMETRY = [
+    "Start Row",
+    "Start Column",
+    "Width",
+    "Height",
+    "Total Wells",
+    "Percent Template-Positive Library Beads",
+    "Adjusted Addressable Wells",
+]
+ADDRESSABLE_FRACTION = {"15456,10656": 0.88, "7680,5328": 0.88}
+
+
+def _number(value):
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def _is_number(value):
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+def read_json(filename):
+    with open(filename, "r") as f:
+        return json.load(f)
+
+
+def read_stats(filename):
+    """Returns the [global] section of a bfmask.stats file, integer values as
+    int"""
+    config = ConfigParser.RawConfigParser()
+    config.optionxform = str
+    if not config.read(filename):
+        raise IOError("cannot read %s" % filename)
+    return OrderedDict(
+        (key, _number(value.strip())) for key, value in config.items("global")
+    )
+
+
+READERS = {"basecaller": read_json, "bfmask": read_stats}
+
+
+def _flatten(obj, prefix=()):
+    """Yields (path, value) of the numbers and lists of numbers in obj"""
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            for item in _flatten(value, prefix + (key,)):
+                yield item
+    elif _is_number(obj):
+        yield prefix, obj
+    elif isinstance(obj, list) and obj and all(_is_number(v) for v in obj):
+        yield prefix, obj
+
+
+def _get(obj, path, default=None):
+    for key in path:
+        if not isinstance(obj, dict) or key not in obj:
+            return default
+        obj = obj[key]
+    return obj
+
+
+def _set(obj, path, value):
+    for key in path[:-1]:
+        obj = obj.setdefault(key, {})
+    obj[path[-1]] = value
+
+
+class MetricTable(object):
+    """One kind of file across blocks.
+
+    records holds the parsed file of each block, None if it could not be
+    read.  columns maps the path of every number or list of numbers found to
+    an array with a row per block: 0 where a block does not have it, lists
+    padded with 0 to the longest.  present maps the paths to the blocks that
+    have them."""
+
+    def __init__(self, names, records):
+        self.names = list(names)
+        self.records = list(records)
+        flat = [OrderedDict(_flatten(r)) if r is not None else {} for r in records]
+        kinds = OrderedDict()
+        for metrics in flat:
+            for path, value in metrics.items():
+                kinds.setdefault(path, isinstance(value, list))
+        self.paths = list(kinds)
+        self.columns = {}
+        self.present = {}
+        for path, is_list in kinds.items():
+            present = [
+                path in metrics and isinstance(metrics[path], list) == is_list
+                for metrics in flat
+            ]
+            if is_list:
+                width = max(len(m[path]) for m, p in zip(flat, present) if p)
+                values = [
+                    m[path] + [0] * (width - len(m[path])) if p else [0] * width
+                    for m, p in zip(flat, present)
+                ]
+            else:
+                values = [m[path] if p else 0 for m, p in zip(flat, present)]
+            self.columns[path] = np.array(values)
+            self.present[path] = np.array(present, dtype=bool)
+
+    def __len__(self):
+        return len(self.records)
+
+    def get(self, row, path, default=None):
+        return _get(self.records[row], path, default)
+
+    def rows(self, prefix):
+        """Mask of the blocks whose file has a section at prefix"""
+        return np.array(
+            [isinstance(_get(r, prefix), dict) for r in self.records], dtype=bool
+        )
+
+    def under(self, prefix, exclude=()):
+        """Paths below prefix, except those continuing with a key in exclude"""
+        n = len(prefix)
+        return [
+            path
+            for path in self.paths
+            if len(path) > n and path[:n] == prefix and path[n] not in exclude
+        ]
+
+    def total(self, path, rows, weights=None):
+        """Sum of column path, or of its products with column weights, over
+        the blocks in mask rows"""
+        if path not in self.columns:
+            return 0
+        column = self.columns[path][rows]
+        if weights is not None:
+            if weights not in self.columns:
+                return 0
+            column = column * self.columns[weights][rows]
+        if not len(column):
+            return np.zeros(column.shape[1:], dtype=int).tolist()
+        if column.dtype.kind == "f":
+            return np.cumsum(column, axis=0)[-1].tolist()
+        return column.sum(axis=0).tolist()
+
+    def sum_into(self, target, prefix, rows, exclude=()):
+        """Sets the totals of every metric below prefix in the nested dict
+        target, at their paths relative to prefix"""
+        for path in self.under(prefix, exclude):
+            _set(target, path[len(prefix) :], self.total(path, rows))
+
+
+def _read(job):
+    reader, filename = job
+    try:
+        return reader(filename)
+    except Exception as e:
+        printtime("ERROR: blockmetrics: cannot read %s: %s" % (filename, e))
+        return None
+
+
+def _load(jobs, processes):
+    if processes is None:
+        processes = min(multiprocessing.cpu_count(), LOAD_THREADS)
+    if processes > 1 and len(jobs) > 1:
+        pool = ThreadPool(min(processes, len(jobs)))
+        try:
+            return pool.map(_read, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    return [_read(job) for job in jobs]
+
+
+def load_files(filenames, kind, processes=None):
+    """Reads filenames of one kind of READERS, returns a MetricTable"""
+    jobs = [(READERS[kind], filename) for filename in filenames]
+    return MetricTable(filenames, _load(jobs, processes))
+
+
+def _skip(table, rows, function):
+    for row in np.flatnonzero(~rows):
+        print("blockmetrics.%s: skipping block %s" % (function, table.names[row]))
+
+
+def merge_bead_summary(table):
+    """BeadSummary of the merged BaseCaller.json"""
+    rows = table.rows(("BeadSummary", "lib")) & table.rows(("BeadSummary", "tf"))
+    _skip(table, rows, "merge_bead_summary")
+    # literals, not built from key lists: the key order of a py2 dict, and so
+    # of the merged BaseCaller.json, depends on how the dict was built
+    bs_lib = {
+        "badKey": 0,
+        "highPPF": 0,
+        "highRes": 0,
+        "polyclonal": 0,
+        "short": 0,
+        "valid": 0,
+        "zero": 0,
+        "key": "TCAG",
+    }
+    bs_tf = {
+        "badKey": 0,
+        "highPPF": 0,
+        "highRes": 0,
+        "polyclonal": 0,
+        "short": 0,
+        "valid": 0,
+        "zero": 0,
+        "key": "ATCG",
+    }
+    summary = {"lib": bs_lib, "tf": bs_tf}
+    table.sum_into(summary, ("BeadSummary",), rows)
+    return summary
+
+
+def _merge_bead_adapters(table, rows):
+    prefix = ("Filtering", "BeadAdapters")
+    adapters = {}
+    for name in OrderedDict.fromkeys(path[2] for path in table.under(prefix)):
+        adapter_rows = rows & table.rows(prefix + (name,))
+        if not adapter_rows.any():
+            continue
+        # other values, such as the adapter sequence, of the first block
+        first = np.flatnonzero(adapter_rows)[0]
+        adapter = copy.deepcopy(table.get(first, prefix + (name,)))
+        table.sum_into(adapter, prefix + (name,), adapter_rows, ADAPTER_AVERAGES)
+        for average, weight in ADAPTER_AVERAGES.items():
+            if average in adapter:
+                adapter[average] = table.total(
+                    prefix + (name, average), adapter_rows, prefix + (name, weight)
+                ) / max(adapter.get(weight, 0), 1)
+        adapters[name] = adapter
+    return adapters
+
+
+def merge_filtering(table):
+    """Filtering of the merged BaseCaller.json"""
+    rows = table.rows(("Filtering",))
+    _skip(table, rows, "merge_filtering")
+    # dict literals, see merge_bead_summary
+    bd = {
+        "adapter_trim": 0,
+        "barcode_trim": 0,
+        "extra_trim": 0,
+        "failed_keypass": 0,
+        "final": 0,
+        "high_residual": 0,
+        "initial": 0,
+        "key_trim": 0,
+        "quality_filter": 0,
+        "quality_trim": 0,
+        "short": 0,
+        "tag_trim": 0,
+    }
+    lr = {
+        "filtered_low_quality": 0,
+        "filtered_polyclonal": 0,
+        "filtered_primer_dimer": 0,
+        "final_library_reads": 0,
+    }
+    rd_lib = {
+        "adapter_trim": 0,
+        "barcode_trim": 0,
+        "bkgmodel_high_ppf": 0,
+        "bkgmodel_keypass": 0,
+        "bkgmodel_polyclonal": 0,
+        "extra_trim": 0,
+        "failed_keypass": 0,
+        "high_ppf": 0,
+        "high_residual": 0,
+        "key": "ATCG",
+        "polyclonal": 0,
+        "quality_filter": 0,
+        "quality_trim": 0,
+        "short": 0,
+        "tag_trim": 0,
+        "valid": 0,
+        "zero": 0,
+    }
+    rd_tf = {
+        "adapter_trim": 0,
+        "bkgmodel_high_ppf": 0,
+        "bkgmodel_keypass": 0,
+        "bkgmodel_polyclonal": 0,
+        "extra_trim": 0,
+        "failed_keypass": 0,
+        "high_ppf": 0,
+        "high_residual": 0,
+        "key": "ATCG",
+        "polyclonal": 0,
+        "quality_filter": 0,
+        "quality_trim": 0,
+        "short": 0,
+        "tag_trim": 0,
+        "valid": 0,
+        "zero": 0,
+    }
+    filtering = {
+        "BaseDetails": bd,
+        "BeadAdapters": _merge_bead_adapters(table, rows),
+        "LibraryReport": lr,
+        "ReadDetails": {"lib": rd_lib, "tf": rd_tf},
+        "qv_histogram": [0] * QV_HISTOGRAM_LENGTH,
+    }
+    table.sum_into(filtering, ("Filtering",), rows, ["BeadAdapters"])
+    for group in ["lib", "tf"]:
+        details = filtering["ReadDetails"][group]
+        for row in np.flatnonzero(rows):
+            details["key"] = table.get(
+                row, ("Filtering", "ReadDetails", group, "key"), details["key"]
+            )
+    return filtering
+
+
+def merge_phasing(table):
+    """Phasing of the merged BaseCaller.json, the block estimates laid out by
+    block coordinates and their averages"""
+    ph = {
+        "CF": 0,
+        "IE": 0,
+        "DR": 0,
+        "CFbyRegion": 0,
+        "IEbyRegion": 0,
+        "DRbyRegion": 0,
+        "RegionRows": 1,
+        "RegionCols": 1,
+    }
+    try:
+        coord_x = [-1] * len(table)
+        coord_y = [-1] * len(table)
+        for idx, name in enumerate(table.names):
+            parts = name.split("_")
+            if not parts[0] == "block":
+                continue
+            coord_x[idx] = int(parts[1][1:])
+            coord_y[idx] = int(parts[2][1:])
+
+        coord_x_to_idx = dict(
+            (val, idx) for (idx, val) in enumerate(sorted(set(coord_x)))
+        )
+        coord_y_to_idx = dict(
+            (val, idx) for (idx, val) in enumerate(sorted(set(coord_y)))
+        )
+        region_cols = len(coord_x_to_idx)
+        region_rows = len(coord_y_to_idx)
+        if region_cols == 0 or region_rows == 0:
+            return ph
+
+        ph["RegionRows"] = region_rows
+        ph["RegionCols"] = region_cols
+        for key in ["CF", "IE", "DR"]:
+            ph[key + "byRegion"] = [0.0] * (region_rows * region_cols)
+
+        for idx in range(len(table)):
+            phasing = table.get(idx, ("Phasing",))
+            if not isinstance(phasing, dict) or not all(
+                key in phasing for key in ["CF", "IE", "DR"]
+            ):
+                print("blockmetrics.merge_phasing: skipping block " + table.names[idx])
+                continue
+            my_x = coord_x_to_idx.get(coord_x[idx], -1)
+            my_y = coord_y_to_idx.get(coord_y[idx], -1)
+            my_idx = my_y + my_x * region_rows
+            if my_x < 0 or my_y < 0 or my_idx >= (region_rows * region_cols):
+                continue
+            for key in ["CF", "IE", "DR"]:
+                ph[key + "byRegion"][my_idx] = phasing[key]
+
+        for key in ["CF", "IE", "DR"]:
+            values = [v for v in ph[key + "byRegion"] if v > 0.0]
+            ph[key] = sum(values, 0.0) / len(values)
+    except Exception:
+        pass
+
+    return ph
+
+
+def merge_basecaller_json(table):
+    """The merged BaseCaller.json of a table of BaseCaller.json files"""
+    return {
+        "BeadSummary": merge_bead_summary(table),
+        "Filtering": merge_filtering(table),
+        "Phasing": merge_phasing(table),
+    }
+
+
+def merge_bfmask_stats(table, chip):
+    """The [global] section of the merged bfmask.stats, an OrderedDict.
+    chip is the "width,height" of the chip in processParameters.txt."""
+    size = chip.split(",")
+    stats = OrderedDict()
+    stats["Start Row"] = "0"
+    stats["Start Column"] = "0"
+    stats["Width"] = int(size[0])
+    stats["Height"] = int(size[1])
+    stats["Total Wells"] = int(size[0]) * int(size[1])
+    stats["Percent Template-Positive Library Beads"] = "0"  # TODO
+
+    missing = np.zeros(len(table), dtype=bool)
+    for key in BFMASK_COUNTS:
+        present = table.present.get((key,), missing)
+        for _ in np.flatnonzero(~present):
+            print("ERROR: StatsMerge: key %s doesn't exist" % key)
+        stats[key] = table.total((key,), present)
+    for path in table.paths:
+        key = path[0]
+        if key not in stats and key not in BFMASK_GEOMETRY:
+            stats[key] = table.total(path, table.present[path])
+
+    sum_wells = sum(
+        stats[key]
+        for key in [
+            "Empty Wells",
+            "Pinned Wells",
+            "Ignored Wells",
+            "Bead Wells",
+            "Excluded Wells",
+        ]
+    )
+    if stats["Total Wells"] != sum_wells:
+        print(
+            "ERROR: StatsMerge: Total Wells: %s (sum) != %s (expected)"
+            % (sum_wells, stats["Total Wells"])
+        )
+
+    # adjust total wells by the addressable fraction if specified
+    if chip in ADDRESSABLE_FRACTION and stats["Excluded Wells"] == 0:
+        stats["Adjusted Addressable Wells"] = int(
+            ADDRESSABLE_FRACTION[chip] * stats["Total Wells"]
+        )
+    return stats
+
+
+def write_stats(stats, filename):
+    """Writes stats as the [global] section of filename"""
+    config = ConfigParser.RawConfigParser()
+    config.optionxform = str
+    config.add_section("global")
+    for key, value in stats.items():
+        config.set("global", key, value)
+    with open(filename, "wb") as f:
+        config.write(f)
@@ -4,10 +4,20 @@
 import os
 import subprocess
 import json
+import time
 import traceback
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 from ion.utils.blockprocessing import printtime
 
+# files merged by one ionstats reduce call, unless given: enough to keep
+# every cpu busy, within these bounds
+REDUCE_MIN_FAN_IN = 16
+REDUCE_MAX_FAN_IN = 100
+# seconds to wait for inputs still written by asynchronous processes
+INPUT_READY_TIMEOUT = 60
+
 
 """ Invoke ionstats basecaller to generate alignment-independent metrics for unmapped BAM files"""
 
@@ -347,6 +357,9 @@ def merge_ionstats(
         ionstats_alignment_file_list = []
         ionstats_alignment_h5_file_list = []
         ionstats_basecaller_file_list = []
+        # reduced together, all datasets in parallel
+        reduce_jobs = []
+        reduce_h5_jobs = []
 
         for dataset in basecaller_datasets["datasets"]:
 
@@ -386,7 +399,7 @@ def merge_ionstats(
                 composite_filename = os.path.join(
                     ionstats_folder, dataset["file_prefix"] + "." + ionstats_file
                 )
-                reduce_stats(block_filename_list, composite_filename)
+                reduce_jobs.append((block_filename_list, composite_filename))
                 if reference:
                     ionstats_alignment_file_list.append(composite_filename)
                 else:
@@ -411,9 +424,14 @@ def merge_ionstats(
                         ALIGNMENT_RESULTS,
                         dataset["file_prefix"] + ".ionstats_error_summary.h5",
                     )
-                    reduce_stats_h5(block_h5_filename_list, composite_h5_filename)
+                    reduce_h5_jobs.append(
+                        (block_h5_filename_list, composite_h5_filename)
+                    )
                     ionstats_alignment_h5_file_list.append(composite_h5_filename)
 
+        reduce_stats_batch(reduce_jobs)
+        reduce_stats_h5_batch(reduce_h5_jobs)
+
         merge_ionstats_total(
             ionstats_basecaller_file_list,
             ionstats_alignment_file_list,
@@ -453,81 +471,166 @@ def generate_ionstats_tf(tf_bam_filename, tfref_fasta_filename, ionstats_tf_file
 """ Invoke ionstats reduce to combine multiple ionstats json files by merging the metrics """
 
 
-def reduce_stats(input_filename_list, output_filename):
-
-    # wait for asynchronous process substitution processes # TODO
-    import time
-
-    time.sleep(10)
+def _json_complete(filename):
+    """True if filename holds a whole ionstats json file.
 
+    ionstats writes indented json, the closing brace of the top level object
+    is the only one at the start of a line."""
+    try:
+        with open(filename, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - 64))
+            if f.read().rstrip().endswith(b"\n}"):
+                return True
+            if 0 < size < 1048576:
+                f.seek(0)
+                json.loads(f.read().decode("utf-8"))
+                return True
+    except (IOError, OSError, ValueError):
+        pass
+    return False
+
+
+def wait_for_json_inputs(filenames, timeout=INPUT_READY_TIMEOUT, poll=0.2):
+    """Wait until every file exists and is complete, they may still be
+    written by asynchronous process substitution processes, ionstats only
+    writes its json file when it is done.
+
+    Returns the files which are still missing or incomplete after timeout
+    seconds."""
+    pending = set(filenames)
+    deadline = time.time() + timeout
+    while True:
+        pending = set(f for f in pending if not _json_complete(f))
+        if not pending or time.time() >= deadline:
+            break
+        time.sleep(poll)
+    missing = sorted(f for f in pending if not os.path.exists(f))
+    incomplete = sorted(f for f in pending if f not in missing)
+    if missing:
+        printtime("ERROR: missing after %ds: %s" % (timeout, " ".join(missing)))
+    if incomplete:
+        printtime("ERROR: incomplete after %ds: %s" % (timeout, " ".join(incomplete)))
+    return missing + incomplete
+
+
+def _reduce(args):
+    command, input_files, output_file = args
+    com = command
+    com += " -o %s" % (output_file)
+    com += " " + " ".join(input_files)
+    printtime("DEBUG: Calling '%s'" % com)
+    return com, subprocess.call(com, shell=True)
+
+
+def tree_reduce(command, jobs, fan_in=None, processes=None):
+    """Run command on each (input_filename_list, output_filename) of jobs.
+
+    Lists longer than fan_in are merged in a tree: groups of fan_in
+    consecutive files are reduced to intermediate files, which are reduced
+    again until one call writes output_filename.  The calls of one level,
+    of all jobs, run concurrently.  The order of the inputs is kept.
+
+    A failed call only stops its own job, the other jobs are completed
+    before an exception naming the failed outputs is raised."""
+    level = 0
+    todo = [(list(inputs), output) for inputs, output in jobs if inputs]
+    failed = []
+    processes = processes or multiprocessing.cpu_count()
+    if not fan_in:
+        nfiles = sum(len(inputs) for inputs, _ in todo)
+        fan_in = -(-nfiles // processes)
+        fan_in = min(max(fan_in, REDUCE_MIN_FAN_IN), REDUCE_MAX_FAN_IN)
+    intermediates = []
+    pool = None
     try:
-        # need to copy, cannot index an iterator
-        copy_input_filename_list = list(input_filename_list)
-        length = len(copy_input_filename_list)
-
-        # process file list in smaller intervalls
-        size = 100
-        i = 0
-        while i < length:
-            if i + size < length:
-                input_files = copy_input_filename_list[i : i + size]
-                output_file = output_filename + "." + str(i + size)
+        while todo:
+            calls = []
+            owners = []  # output_filename of the job of each call
+            next_todo = []
+            for inputs, output in todo:
+                if len(inputs) <= fan_in:
+                    calls.append((command, inputs, output))
+                    owners.append(output)
+                    continue
+                partials = []
+                for i in range(0, len(inputs), fan_in):
+                    partial = "%s.%d.%d" % (output, level, i // fan_in)
+                    calls.append((command, inputs[i : i + fan_in], partial))
+                    owners.append(output)
+                    partials.append(partial)
+                intermediates.extend(partials)
+                next_todo.append((partials, output))
+
+            if len(calls) > 1:
+                if pool is None:
+                    pool = ThreadPool(min(processes, len(calls)))
+                results = pool.map(_reduce, calls)
             else:
-                input_files = copy_input_filename_list[i:length]
-                output_file = output_filename
-            # add results from earlier iterations
-            if i > 0:
-                input_files = input_files + [output_filename + "." + str(i)]
-            i = i + size
-
-            com = "ionstats reduce"
-            com += " -o %s" % (output_file)
-            com += " " + " ".join(input_files)
-            printtime("DEBUG: Calling '%s'" % com)
-            subprocess.call(com, shell=True)
+                results = [_reduce(call) for call in calls]
+            for output, (com, returncode) in zip(owners, results):
+                if returncode != 0:
+                    printtime("ERROR: '%s' return code: %s" % (com, returncode))
+                    if output not in failed:
+                        failed.append(output)
+            todo = [job for job in next_todo if job[1] not in failed]
+            level += 1
+        if failed:
+            raise Exception("ERROR: %s failed for %s" % (command, " ".join(failed)))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        for filename in intermediates:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+
+def reduce_stats_batch(jobs, fan_in=None, processes=None):
+    """ionstats reduce for each (input_filename_list, output_filename) of
+    jobs, in parallel"""
+
+    try:
+        # need to copy, cannot iterate twice over an iterator
+        jobs = [(list(inputs), output) for inputs, output in jobs]
+        not_ready = set(wait_for_json_inputs([f for inputs, _ in jobs for f in inputs]))
+        # a job with an input not ready is not merged from a partial set,
+        # the other jobs are still reduced
+        skipped = [output for inputs, output in jobs if not_ready.intersection(inputs)]
+        tree_reduce(
+            "ionstats reduce",
+            [job for job in jobs if job[1] not in skipped],
+            fan_in,
+            processes,
+        )
+        if skipped:
+            raise Exception("ERROR: inputs not ready for %s" % " ".join(skipped))
     except Exception:
         printtime("ERROR: Failed ionstats reduce")
         traceback.print_exc()
 
 
-def reduce_stats_h5(input_filename_list, output_filename):
+def reduce_stats(input_filename_list, output_filename, **kwargs):
+    reduce_stats_batch([(input_filename_list, output_filename)], **kwargs)
+
+
+def reduce_stats_h5_batch(jobs, fan_in=None, processes=None):
+    """ionstats reduce-h5 for each (input_filename_list, output_filename) of
+    jobs, in parallel"""
 
     try:
-        # need to copy, cannot index an iterator
-        copy_input_filename_list = list(input_filename_list)
-        length = len(copy_input_filename_list)
-
-        # process file list in smaller intervalls
-        size = 100
-        i = 0
-        while i < length:
-            if i + size < length:
-                input_files = copy_input_filename_list[i : i + size]
-                output_file = output_filename + "." + str(i + size)
-            else:
-                input_files = copy_input_filename_list[i:length]
-                output_file = output_filename
-            # add results from earlier iterations
-            if i > 0:
-                input_files = input_files + [output_filename + "." + str(i)]
-            i = i + size
-
-            com = "ionstats reduce-h5"
-            com += " -o %s" % (output_file)
-            com += " " + " ".join(input_files)
-            printtime("DEBUG: Calling '%s'" % com)
-            proc = subprocess.Popen(com, shell=True)
-            status = proc.wait()
-            if proc.returncode != 0:
-                raise Exception(
-                    "ERROR: ionstats reduce-h5 return code: %s" % proc.returncode
-                )
+        tree_reduce("ionstats reduce-h5", jobs, fan_in, processes)
     except Exception:
         printtime("ERROR: Failed ionstats reduce-h5")
         traceback.print_exc()
         raise
 
 
+def reduce_stats_h5(input_filename_list, output_filename, **kwargs):
+    reduce_stats_h5_batch([(input_filename_list, output_filename)], **kwargs)
+
+
 """ Use ionstats_quality.json file to generate legacy files: quality.summary """
 
 
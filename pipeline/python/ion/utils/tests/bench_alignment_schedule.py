@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# Copyright (C) 2018 Ion Torrent Systems, Inc. All Rights Reserved
+"""
+Benchmark scheduling the alignment of skewed barcoded datasets.
+
+Makes one dataset of ``--big`` reads and ``--small`` datasets of
+``--small-reads`` reads each, then times
+
+* the legacy pool: ``--parallel`` datasets at a time, each given
+  threads / parallel threads, in the order of the datasets
+* alignment.schedule_alignment_jobs
+
+with a stand-in alignment that sleeps ``--cost`` seconds per million reads
+and per thread-second, up to 12 threads, plus ``--startup`` seconds.  The
+stand-in runs its reads at ``threads`` times the speed of one thread, a best
+case for the legacy pool that splits threads evenly.
+
+    python -m ion.utils.tests.bench_alignment_schedule --threads 32 --small 90
+"""
+import argparse
+import time
+from multiprocessing.pool import ThreadPool
+
+from ion.utils import alignment
+
+MAX_SPEEDUP = 12
+
+
+def make_jobs(args):
+    datasets = [{"file_prefix": "IonXpress_001", "read_count": args.big}]
+    for i in range(args.small):
+        datasets.append(
+            {"file_prefix": "IonXpress_%03d" % (i + 2), "read_count": args.small_reads}
+        )
+    return [alignment.AlignmentJob(dataset, None, []) for dataset in datasets]
+
+
+def align_time(args, job, threads):
+    return args.startup + args.cost * job.reads / 1e6 / min(threads, MAX_SPEEDUP)
+
+
+def legacy(args, jobs):
+    threads = max(args.threads // args.parallel, 1)
+
+    def run(job):
+        start = time.time()
+        time.sleep(align_time(args, job, threads))
+        job.wall_time = time.time() - start
+
+    pool = ThreadPool(args.parallel)
+    pool.map(run, jobs)
+    pool.close()
+    pool.join()
+
+
+def scheduled(args, jobs):
+    def run(job):
+        time.sleep(align_time(args, job, job.threads))
+
+    alignment.schedule_alignment_jobs(jobs, run, args.threads, 1 << 40)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--parallel", type=int, default=4)
+    parser.add_argument("--big", type=int, default=40000000)
+    parser.add_argument("--small", type=int, default=90)
+    parser.add_argument("--small-reads", type=int, default=100000)
+    parser.add_argument("--cost", type=float, default=0.5)
+    parser.add_argument("--startup", type=float, default=0.05)
+    args = parser.parse_args()
+
+    jobs = make_jobs(args)
+    start = time.time()
+    legacy(args, jobs)
+    print("legacy pool: %7.2fs" % (time.time() - start))
+
+    jobs = make_jobs(args)
+    start = time.time()
+    scheduled(args, jobs)
+    print("scheduled:   %7.2fs" % (time.time() - start))
+    big = max(jobs, key=lambda job: job.reads)
+    print("largest dataset: %d threads, %.2fs" % (big.threads, big.wall_time))
+
+
+if __name__ == "__main__":
+    main()
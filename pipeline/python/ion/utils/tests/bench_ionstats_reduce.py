@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# Copyright (C) 2018 Ion Torrent Systems, Inc. All Rights Reserved
+"""
+Benchmark merging per-block ionstats files across blocks and datasets.
+
+Writes ``--blocks`` synthetic ionstats_alignment.json files for each of
+``--datasets`` barcodes, then times
+
+* the legacy merge: one serial chain of 100-file ionstats reduce calls per
+  dataset, each chain preceded by a fixed sleep (reported, not slept)
+* ionstats.reduce_stats_batch: tree reduction of all datasets at once, for
+  each ``--fan-in``, 0 picks it from the number of files and processes
+
+and checks that all merges give the same result.  Unless ``--real`` is given
+the ionstats binary is replaced by a stand-in that sums the histograms and
+sleeps ``--call-cost`` seconds per call, roughly the start-up and parse cost
+of the real reduce.
+
+    python -m ion.utils.tests.bench_ionstats_reduce --blocks 96 --datasets 24
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+
+from ion.utils import ionstats
+
+LEGACY_SLEEP = 10
+LEGACY_CHUNK = 100
+
+STANDIN = """#!%(python)s
+import json, sys, time
+time.sleep(%(call_cost)f)
+args = sys.argv[2:]
+output = args[args.index("-o") + 1]
+inputs = [a for i, a in enumerate(args) if a != "-o" and args[i - 1] != "-o"]
+total = None
+for filename in inputs:
+    with open(filename) as f:
+        data = json.load(f)
+    if total is None:
+        total = data
+        continue
+    for key, value in data.items():
+        if isinstance(value, list):
+            total[key] = [a + b for a, b in zip(total[key], value)]
+        elif isinstance(value, int):
+            total[key] += value
+with open(output, "w") as f:
+    json.dump(total, f, indent=3, sort_keys=True)
+    f.write("\\n")
+"""
+
+
+def make_block_files(root, blocks, datasets, bins):
+    jobs = []
+    for d in range(datasets):
+        prefix = "IonXpress_%03d" % (d + 1)
+        inputs = []
+        for b in range(blocks):
+            block_dir = os.path.join(root, "block_X%d_Y%d" % (b % 12, b // 12))
+            if not os.path.isdir(block_dir):
+                os.makedirs(block_dir)
+            filename = os.path.join(block_dir, prefix + ".ionstats_alignment.json")
+            data = {
+                "num_reads": random.randint(0, 10000),
+                "num_bases": random.randint(0, 2000000),
+                "read_length_histogram": [random.randint(0, 50) for _ in range(bins)],
+                "aq20_histogram": [random.randint(0, 50) for _ in range(bins)],
+            }
+            with open(filename, "w") as f:
+                json.dump(data, f, indent=3, sort_keys=True)
+                f.write("\n")
+            inputs.append(filename)
+        jobs.append((inputs, os.path.join(root, prefix + ".ionstats_alignment.json")))
+    return jobs
+
+
+def legacy_merge(jobs):
+    """The serial chains of reduce_stats before the tree reduction"""
+    for inputs, output in jobs:
+        i = 0
+        while i < len(inputs):
+            if i + LEGACY_CHUNK < len(inputs):
+                input_files = inputs[i : i + LEGACY_CHUNK]
+                output_file = output + "." + str(i + LEGACY_CHUNK)
+            else:
+                input_files = inputs[i:]
+                output_file = output
+            if i > 0:
+                input_files = input_files + [output + "." + str(i)]
+            i = i + LEGACY_CHUNK
+            com = "ionstats reduce -o %s %s" % (output_file, " ".join(input_files))
+            subprocess.call(com, shell=True)
+
+
+def read_outputs(jobs):
+    outputs = []
+    for _, output in jobs:
+        with open(output) as f:
+            outputs.append(json.load(f))
+        os.remove(output)
+    return outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--blocks", type=int, default=96)
+    parser.add_argument("--datasets", type=int, default=24)
+    parser.add_argument("--bins", type=int, default=1000)
+    parser.add_argument("--fan-in", type=int, nargs="+", default=[0, 4, 16, 100])
+    parser.add_argument("--processes", type=int)
+    parser.add_argument("--call-cost", type=float, default=0.05)
+    parser.add_argument("--real", action="store_true", help="use ionstats on PATH")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    try:
+        if not args.real:
+            bindir = os.path.join(root, "bin")
+            os.mkdir(bindir)
+            standin = os.path.join(bindir, "ionstats")
+            with open(standin, "w") as f:
+                f.write(
+                    STANDIN % {"python": sys.executable, "call_cost": args.call_cost}
+                )
+            os.chmod(standin, os.stat(standin).st_mode | stat.S_IEXEC)
+            os.environ["PATH"] = bindir + os.pathsep + os.environ["PATH"]
+
+        jobs = make_block_files(root, args.blocks, args.datasets, args.bins)
+        print("%d datasets x %d blocks" % (args.datasets, args.blocks))
+
+        start = time.time()
+        legacy_merge(jobs)
+        elapsed = time.time() - start
+        expected = read_outputs(jobs)
+        print(
+            "legacy:        %6.2fs (+ %ds of sleep)"
+            % (elapsed, LEGACY_SLEEP * len(jobs))
+        )
+
+        for fan_in in args.fan_in:
+            start = time.time()
+            ionstats.reduce_stats_batch(jobs, fan_in=fan_in, processes=args.processes)
+            elapsed = time.time() - start
+            same = read_outputs(jobs) == expected
+            print(
+                "fan-in %4s:   %6.2fs%s"
+                % (fan_in or "auto", elapsed, "" if same else "  RESULTS DIFFER")
+            )
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# Copyright (C) 2018 Ion Torrent Systems, Inc. All Rights Reserved
+"""
+Benchmark reading a large TVC vcf file with TvcVcfFile.
+
+Writes a synthetic vcf of ``--lines`` hotspot records, the INFO and FORMAT
+of the TVC output, or reads ``--vcf``, then times
+
+* eager: iterating over the dicts of read_vcf_record
+* lazy: iterating over TvcVcfRecord objects, reading CHROM, POS, ALT, the
+  HS flag and the FAO and FDP tags as generate_variant_tables.py does
+* build_index, then ``--seeks`` random seek_position calls, against the same
+  lookups done by scanning the file
+
+and checks that the eager and lazy reads agree.
+
+    python -m ion.utils.tests.bench_tvc_vcf_file --lines 5000000
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from ion.plugin.tvc_vcf_file import TvcVcfFile
+
+CONTIGS = [("chr%d" % (i + 1), 250000000 - i * 8000000) for i in range(22)]
+
+HEADER = """##fileformat=VCFv4.1
+##source="tvc 5.10-8 (a7fcb4f) - Torrent Variant Caller"
+%(contigs)s
+##INFO=<ID=AF,Number=A,Type=Float,Description="Allele frequency based on Flow Evaluator observation counts">
+##INFO=<ID=AO,Number=A,Type=Integer,Description="Alternate allele observations">
+##INFO=<ID=DP,Number=1,Type=Integer,Description="Total read depth at the locus">
+##INFO=<ID=FAO,Number=A,Type=Integer,Description="Flow Evaluator Alternate allele observations">
+##INFO=<ID=FDP,Number=1,Type=Integer,Description="Flow Evaluator read depth at the locus">
+##INFO=<ID=FR,Number=.,Type=String,Description="Reason why the variant was filtered.">
+##INFO=<ID=FRO,Number=1,Type=Integer,Description="Flow Evaluator Reference allele observations">
+##INFO=<ID=FSAF,Number=A,Type=Integer,Description="Flow Evaluator Alternate allele observations on the forward strand">
+##INFO=<ID=FSAR,Number=A,Type=Integer,Description="Flow Evaluator Alternate allele observations on the reverse strand">
+##INFO=<ID=HS,Number=0,Type=Flag,Description="Indicate it is at a hot spot">
+##INFO=<ID=LEN,Number=A,Type=Integer,Description="allele length">
+##INFO=<ID=OALT,Number=.,Type=String,Description="List of original variant bases">
+##INFO=<ID=OID,Number=.,Type=String,Description="List of original Hotspot IDs">
+##INFO=<ID=OPOS,Number=.,Type=Integer,Description="List of original allele positions">
+##INFO=<ID=OREF,Number=.,Type=String,Description="List of original reference bases">
+##INFO=<ID=QD,Number=1,Type=Float,Description="QualityByDepth as 4*QUAL/FDP (analogous to GATK)">
+##INFO=<ID=RO,Number=1,Type=Integer,Description="Reference allele observations">
+##INFO=<ID=STB,Number=A,Type=Float,Description="Strand bias in variant relative to reference.">
+##INFO=<ID=TYPE,Number=A,Type=String,Description="The type of allele, either snp, mnp, ins, del, or complex.">
+##FORMAT=<ID=AF,Number=A,Type=Float,Description="Allele frequency based on Flow Evaluator observation counts">
+##FORMAT=<ID=AO,Number=A,Type=Integer,Description="Alternate allele observation count">
+##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read Depth">
+##FORMAT=<ID=FAO,Number=A,Type=Integer,Description="Flow Evaluator Alternate allele observation count">
+##FORMAT=<ID=FDP,Number=1,Type=Integer,Description="Flow Evaluator Read Depth">
+##FORMAT=<ID=FRO,Number=1,Type=Integer,Description="Flow Evaluator Reference allele observation count">
+##FORMAT=<ID=GQ,Number=1,Type=Integer,Description="Genotype Quality, the Phred-scaled marginal (or unconditional) probability of the called genotype">
+##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">
+##FORMAT=<ID=RO,Number=1,Type=Integer,Description="Reference allele observation count">
+##FORMAT=<ID=SAF,Number=A,Type=Integer,Description="Alternate allele observations on the forward strand">
+##FORMAT=<ID=SAR,Number=A,Type=Integer,Description="Alternate allele observations on the reverse strand">
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tsample
+"""
+
+FORMAT_KEYS = "GT:GQ:DP:FDP:RO:FRO:AO:FAO:AF:SAR:SAF"
+
+
+def write_vcf(path, lines):
+    contigs = "\n".join(
+        "##contig=<ID=%s,length=%d,assembly=hg19>" % contig for contig in CONTIGS
+    )
+    per_contig = lines // len(CONTIGS) + 1
+    written = 0
+    with open(path, "w") as f:
+        f.write(HEADER % {"contigs": contigs})
+        for contig, length in CONTIGS:
+            step = max(1, (length - 10) // per_contig)
+            for i in range(min(per_contig, lines - written)):
+                pos = 1 + i * step
+                dp = random.randint(50, 3000)
+                ao = random.randint(0, dp // 2)
+                af = round(float(ao) / dp, 4)
+                info = (
+                    "AF=%s;AO=%d;DP=%d;FAO=%d;FDP=%d;FRO=%d;FSAF=%d;FSAR=%d;HS;LEN=1;"
+                    "OALT=T;OID=COSM%d;OPOS=%d;OREF=C;QD=%s;RO=%d;STB=0.5;TYPE=snp"
+                    % (
+                        af,
+                        ao,
+                        dp,
+                        ao,
+                        dp,
+                        dp - ao,
+                        ao // 2,
+                        ao - ao // 2,
+                        i,
+                        pos,
+                        round(random.random() * 40, 3),
+                        dp - ao,
+                    )
+                )
+                sample = "0/1:%d:%d:%d:%d:%d:%d:%d:%s:%d:%d" % (
+                    random.randint(1, 99),
+                    dp,
+                    dp,
+                    dp - ao,
+                    dp - ao,
+                    ao,
+                    ao,
+                    af,
+                    ao // 2,
+                    ao - ao // 2,
+                )
+                f.write(
+                    "%s\t%d\tCOSM%d\tC\tT\t%s\tPASS\t%s\t%s\t%s\n"
+                    % (
+                        contig,
+                        pos,
+                        i,
+                        round(random.random() * 100, 3),
+                        info,
+                        FORMAT_KEYS,
+                        sample,
+                    )
+                )
+                written += 1
+    return written
+
+
+def read_eager(path):
+    total = 0
+    with TvcVcfFile(path, "r") as f_vcf:
+        f_vcf.set_bypass_size_check_tags(["FR"])
+        for record in f_vcf:
+            if "HS" in record["INFO"]:
+                total += record["FORMAT"][0]["FAO"][0] + record["FORMAT"][0]["FDP"]
+    return total
+
+
+def read_lazy(path):
+    total = 0
+    with TvcVcfFile(path, "r") as f_vcf:
+        f_vcf.set_bypass_size_check_tags(["FR"])
+        f_vcf.lazy(True)
+        for record in f_vcf:
+            if record["CHROM"] and record["POS"] and record["ALT"]:
+                # a flag decodes to None, as in read_vcf_record
+                if record.info("HS", False) is None:
+                    total += record.format_tag("FAO")[0] + record.format_tag("FDP")
+    return total
+
+
+def scan_to(path, contig, pos):
+    with open(path) as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            fields = line.split("\t", 2)
+            if fields[0] == contig and int(fields[1]) >= pos:
+                return line
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--lines", type=int, default=5000000)
+    parser.add_argument("--vcf", help="read this vcf instead of a synthetic one")
+    parser.add_argument("--seeks", type=int, default=1000)
+    parser.add_argument("--scans", type=int, default=5)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    try:
+        path = args.vcf
+        if path is None:
+            path = os.path.join(root, "hotspots.vcf")
+            lines = write_vcf(path, args.lines)
+            print("%d records, %d Mb" % (lines, os.path.getsize(path) >> 20))
+
+        start = time.time()
+        eager = read_eager(path)
+        print("eager:        %7.2fs" % (time.time() - start))
+        start = time.time()
+        lazy = read_lazy(path)
+        print(
+            "lazy:         %7.2fs%s"
+            % (time.time() - start, "" if lazy == eager else "  RESULTS DIFFER")
+        )
+
+        with TvcVcfFile(path, "r") as f_vcf:
+            f_vcf.lazy(True)
+            start = time.time()
+            f_vcf.build_index(index_path=os.path.join(root, "index.tvi"))
+            print("build_index:  %7.2fs" % (time.time() - start))
+
+            contigs = [(c["ID"], c["length"]) for c in f_vcf.contig_list]
+            queries = [random.choice(contigs) for _ in range(args.seeks)]
+            queries = [(c, random.randint(1, length)) for c, length in queries]
+            start = time.time()
+            found = []
+            for contig, pos in queries:
+                if f_vcf.seek_position(contig, pos):
+                    found.append(next(f_vcf)["RAWLINE"] + "\n")
+                else:
+                    found.append(None)
+            elapsed = time.time() - start
+            print("seek_position: %6.2fms per lookup" % (1000 * elapsed / len(queries)))
+
+        start = time.time()
+        same = all(
+            scan_to(path, contig, pos) == line
+            for (contig, pos), line in list(zip(queries, found))[: args.scans]
+        )
+        elapsed = time.time() - start
+        print(
+            "scan:         %7.2fms per lookup%s"
+            % (1000 * elapsed / args.scans, "" if same else "  RESULTS DIFFER")
+        )
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
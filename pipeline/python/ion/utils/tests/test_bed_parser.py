@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# Copyright (C) 2018 Ion Torrent Systems, Inc. All Rights Reserved
+"""
+Tests of IonBedReader.InTarget and of the IonBedIndex queries, checked
+against a scan of all the targets of the bed file.
+
+    python -m unittest ion.utils.tests.test_bed_parser
+"""
+import os
+import random
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy
+
+from ion.plugin.bedParser import BED_INDEX_SUFFIX, IonBedIndex, IonBedReader
+
+# chr3 has no usable targets and chrX is not in the bed at all
+BED = """track name=test type=bedDetail
+chr1\t100\t200\tA\t.\tGENE_ID=A
+chr1\t150\t160\tB\t.\tGENE_ID=B
+chr1\t150\t400\tC\t.\tGENE_ID=C
+chr1\t500\t510\tD\t.\tGENE_ID=D
+chr2\t10\t20\tE\t.\tGENE_ID=E
+chr3\t.\t.\tF\t.\tGENE_ID=F
+chr2\t5\t50\tG\t.\tGENE_ID=G
+chr1\t90\t95\tH\t.\tGENE_ID=H
+"""
+
+
+def write_bed(filename, text):
+    with open(filename, "w") as f:
+        f.write(text)
+
+
+class Targets(object):
+    """The targets of a bed file as a list, queried by brute force"""
+
+    def __init__(self, filename):
+        reader = IonBedReader(filename=filename)
+        beddict = reader.load()
+        reader.close()
+        self.targets = [
+            (chrom, start, end, row)
+            for row, (chrom, start, end) in enumerate(
+                zip(beddict["chrom"], beddict["chromStart"], beddict["chromEnd"])
+            )
+            if start is not None and end is not None
+        ]
+
+    def select(self, chrom, accept):
+        """Rows of the targets on chrom accepted by accept(start, end),
+        ordered by chromStart, then by row"""
+        return [
+            row
+            for c, start, end, row in sorted(self.targets, key=lambda t: (t[1], t[3]))
+            if c == chrom and accept(start, end)
+        ]
+
+    def distances(self, chrom, pos):
+        """{row: (distance, starts after pos)} of the targets on chrom"""
+        ret = {}
+        for c, start, end, row in self.targets:
+            if c != chrom:
+                continue
+            if start <= pos < end:
+                ret[row] = (0, False)
+            elif pos >= end:
+                ret[row] = (pos - end + 1, False)
+            else:
+                ret[row] = (start - pos, True)
+        return ret
+
+
+class IonBedReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.bed = os.path.join(self.tmpdir, "targets.bed")
+        write_bed(self.bed, BED)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_load(self):
+        reader = IonBedReader(filename=self.bed)
+        beddict = reader.load()
+        reader.close()
+        self.assertEqual(reader.header.type, "bedDetail")
+        self.assertEqual(beddict["chromStart"][:2], [100, 150])
+        self.assertEqual(beddict["chromStart"][5], None)
+        self.assertEqual(beddict["info"][6], {"GENE_ID": ["G"]})
+
+    def test_in_target_across_chromosomes(self):
+        reader = IonBedReader(filename=self.bed)
+        chr1_target = reader.readline()
+        # chr1 is the only chromosome seen so far, chr2 is not in the bed yet
+        self.assertEqual(reader.InTarget(chr1_target, "chr1", 99), -1)
+        self.assertEqual(reader.InTarget(chr1_target, "chr1", 100), 0)
+        self.assertEqual(reader.InTarget(chr1_target, "chr1", 200), 1)
+        self.assertEqual(reader.InTarget(chr1_target, "chr2", 0), 1)
+        self.assertEqual(reader.InTarget({}, "chr1", 0), -1)
+
+        for i in range(3):
+            reader.readline()
+        chr2_target = reader.readline()
+        self.assertEqual(chr2_target["chrom"], "chr2")
+        # a position on an earlier chromosome is before the target whatever
+        # its coordinate, one on a later chromosome is after it
+        self.assertEqual(reader.InTarget(chr2_target, "chr1", 15), -1)
+        self.assertEqual(reader.InTarget(chr2_target, "chr1", 1000000), -1)
+        self.assertEqual(reader.InTarget(chr2_target, "chr2", 15), 0)
+        self.assertEqual(reader.InTarget(chr1_target, "chr2", 0), 1)
+        self.assertEqual(reader.InTarget(chr1_target, "chr2", 150), 1)
+        self.assertEqual(reader.InTarget(chr2_target, "chrX", 15), 1)
+        reader.close()
+
+
+class IonBedIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.bed = os.path.join(self.tmpdir, "targets.bed")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def random_bed(self, seed, num_targets=300):
+        rand = random.Random(seed)
+        lines = ["track name=random"]
+        for i in range(num_targets):
+            chrom = rand.choice(["chr1", "chr2", "chr3"])
+            start = rand.randint(0, 5000)
+            # mostly short targets, some long ones spanning many others
+            length = rand.randint(1, 3000 if rand.random() < 0.05 else 60)
+            lines.append("%s\t%d\t%d\tT%d" % (chrom, start, start + length, i))
+        write_bed(self.bed, "\n".join(lines) + "\n")
+
+    def check_queries(self, index, targets, chroms, positions):
+        for chrom in chroms:
+            for pos in positions:
+                contained = targets.select(chrom, lambda s, e: s <= pos < e)
+                self.assertEqual(
+                    index.InTarget(chrom, pos), contained[0] if contained else -1
+                )
+
+                end = pos + 25
+                overlapping = targets.select(chrom, lambda s, e: s < end and e > pos)
+                self.assertEqual(index.Overlap(chrom, pos, end), overlapping)
+                self.assertEqual(
+                    index.FirstOverlap(chrom, pos, end),
+                    overlapping[0] if overlapping else -1,
+                )
+                self.assertEqual(
+                    index.Containing(chrom, pos, end),
+                    targets.select(chrom, lambda s, e: s <= pos and e >= end),
+                )
+
+                distances = targets.distances(chrom, pos)
+                row, distance = index.Nearest(chrom, pos)
+                if not distances:
+                    self.assertEqual((row, distance), (-1, None))
+                    continue
+                best = min(d for d, _ in distances.values())
+                self.assertEqual(distance, best)
+                self.assertEqual(distances[row][0], best)
+                # ties go to the target before pos
+                if (best, False) in distances.values():
+                    self.assertEqual(distances[row], (best, False))
+
+    def check_batch(self, index, chroms, positions):
+        chroms, positions = zip(*[(c, p) for c in chroms for p in positions])
+        ends = numpy.asarray(positions) + 25
+        self.assertEqual(
+            index.InTargetBatch(chroms, positions).tolist(),
+            [index.InTarget(c, p) for c, p in zip(chroms, positions)],
+        )
+        self.assertEqual(
+            index.FirstOverlapBatch(chroms, positions, ends).tolist(),
+            [index.FirstOverlap(c, p, e) for c, p, e in zip(chroms, positions, ends)],
+        )
+        rows, distances = index.NearestBatch(chroms, positions)
+        nearest = [index.Nearest(c, p) for c, p in zip(chroms, positions)]
+        self.assertEqual(rows.tolist(), [row for row, _ in nearest])
+        self.assertEqual(
+            distances.tolist(), [-1 if d is None else d for _, d in nearest]
+        )
+
+    def test_queries(self):
+        write_bed(self.bed, BED)
+        index = IonBedIndex(self.bed, save=False)
+        self.assertEqual(index.chromOrder, ["chr1", "chr2"])
+        self.assertEqual(index.numTargets, 7)
+        targets = Targets(self.bed)
+        chroms = ["chr1", "chr2", "chr3", "chrX"]
+        positions = list(range(0, 600, 5)) + [89, 90, 149, 150, 159, 160, 399, 400]
+        self.check_queries(index, targets, chroms, positions)
+        self.check_batch(index, chroms, positions)
+
+        self.assertEqual(index.InTarget("chr1", 155), 0)
+        self.assertEqual(index.Overlap("chr1", 155, 156), [0, 1, 2])
+        self.assertEqual(index.Containing("chr1", 190, 210), [2])
+        self.assertEqual(index.Nearest("chr1", 445), (2, 46))
+        self.assertEqual(index.Nearest("chr1", 450), (3, 50))
+        self.assertEqual(index.Nearest("chr3", 10), (-1, None))
+
+    def test_random_overlapping_targets(self):
+        for seed in range(3):
+            self.random_bed(seed)
+            index = IonBedIndex(self.bed, save=False)
+            targets = Targets(self.bed)
+            chroms = ["chr1", "chr2", "chr3", "chr4"]
+            positions = list(range(-10, 8200, 37))
+            self.check_queries(index, targets, chroms, positions)
+            self.check_batch(index, chroms, positions)
+
+    def test_save_load(self):
+        self.random_bed(0)
+        index_file = self.bed + BED_INDEX_SUFFIX
+        index = IonBedIndex(self.bed)
+        self.assertTrue(os.path.exists(index_file))
+        # no temporary file is left behind
+        self.assertEqual(
+            sorted(os.listdir(self.tmpdir)),
+            ["targets.bed", "targets.bed" + BED_INDEX_SUFFIX],
+        )
+
+        loaded = IonBedIndex()
+        loaded.filename = self.bed
+        self.assertTrue(loaded.Load())
+        self.assertEqual(loaded.chromOrder, index.chromOrder)
+        self.assertEqual(loaded.numTargets, index.numTargets)
+        for chrom in index.chromOrder:
+            for saved, read in zip(index.targets[chrom], loaded.targets[chrom]):
+                self.assertEqual(
+                    numpy.asarray(saved).tolist(), numpy.asarray(read).tolist()
+                )
+
+        # to another file, and a bed without targets
+        other = os.path.join(self.tmpdir, "other.npz")
+        self.assertTrue(index.Save(other))
+        self.assertTrue(loaded.Load(other))
+        self.assertEqual(loaded.numTargets, index.numTargets)
+        write_bed(self.bed, "track name=empty\n")
+        empty = IonBedIndex(self.bed)
+        self.assertEqual(empty.numTargets, 0)
+        self.assertTrue(IonBedIndex(self.bed).Load())
+        self.assertEqual(IonBedIndex(self.bed).InTarget("chr1", 0), -1)
+
+    def test_changed_bed_rejected(self):
+        write_bed(self.bed, BED)
+        index = IonBedIndex(self.bed)
+        self.assertTrue(index.Load())
+
+        # a target more, the size changes
+        changed = BED + "chr2\t1000\t1010\tI\t.\tGENE_ID=I\n"
+        write_bed(self.bed, changed)
+        self.assertFalse(index.Load())
+        rebuilt = IonBedIndex(self.bed)
+        self.assertEqual(rebuilt.numTargets, 8)
+        self.assertEqual(rebuilt.InTarget("chr2", 1005), 8)
+        self.assertTrue(rebuilt.Load())
+
+        # same size, only the modification time tells
+        write_bed(self.bed, changed.replace("chr1\t500\t510", "chr1\t600\t610"))
+        then = time.time() - 3600
+        os.utime(self.bed, (then, then))
+        self.assertFalse(rebuilt.Load())
+        self.assertEqual(IonBedIndex(self.bed).InTarget("chr1", 605), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -11,8 +11,8 @@ import zipfile
 from distutils.version import LooseVersion
 from ion.plugin import *
 from ion.utils.explogparser import parse_log
-from ftplib import FTP, error_perm
 from django.utils.functional import cached_property
+from ftptransfer import FtpTransfer, DEFAULT_CONNECTIONS
 
 DJANGO_FTP_PORT = 8021
 PLAN_PARAMS_FILENAME = 'plan_params.json'
@@ -53,14 +53,6 @@ class RunTransfer(IonPlugin):
     rest_auth = None
     spj = dict()
 
-    @cached_property
-    def ftp_client(self):
-        """Helper property to get an ftp client"""
-        client = FTP()
-        client.connect(host=self.server_ip, port=DJANGO_FTP_PORT)
-        client.login(user=self.user_name, passwd=self.user_password)
-        return client
-
     @cached_property
     def barcodedata(self):
         """Gets the barcodes.json data"""
@@ -125,17 +117,12 @@ class RunTransfer(IonPlugin):
     def copy_files(self, file_transfer_list):
         """This helper method will copy over all of the files in the directory"""
         # assuming we have all of the required files on the local system, we will now do the transfer
-
-        destination_directories = set([destination for _, destination in file_transfer_list])
-        for destination_directory in destination_directories:
-            self.create_remote_directory(destination_directory)
-
-        total_transferred = 0
-        total_files = len(file_transfer_list)
-        for source_file_path, destination_directory in file_transfer_list:
-            self.set_upload_status(total_transferred, total_files, source_file_path)
-            self.file_transport(source_file_path, destination_directory)
-            total_transferred += 1
+        connections = self.spj.get('pluginconfig', {}).get('ftp_connections') or DEFAULT_CONNECTIONS
+        transfer = FtpTransfer(self.server_ip, DJANGO_FTP_PORT, self.user_name, self.user_password, connections=connections, progress=self.set_upload_status)
+        stats = transfer.copy_files(file_transfer_list)
+        print("Transferred %d files (%d already on the server), %.1f MB in %.1f s, %.1f MB/s over %d connections" % (
+            stats['files'], stats['skipped'], stats['bytes'] / (1024.0 * 1024.0), stats['seconds'], stats['mbps'], transfer.connections))
+        return stats
 
     def setup_explog(self):
         """This method will find the experiment log and return it's location"""
@@ -168,41 +155,6 @@ class RunTransfer(IonPlugin):
 
         return original
 
-    def create_remote_directory(self, directory_path):
-        """Helper method to create the directory on the remote server via ftp"""
-        directories = filter(None, directory_path.split('/'))
-        cur_dir = '/'
-        for sub_directory in directories:
-            # Create remote directory
-            cur_dir = os.path.join(cur_dir, sub_directory)
-            try:
-                self.ftp_client.mkd(cur_dir)
-            except error_perm:
-                pass
-
-    def file_transport(self, filename, destination_path):
-        """Transfers a file across the ftp"""
-        # delete the old file
-        try:
-            self.ftp_client.delete(os.path.join(destination_path, os.path.basename(filename)))
-        except:
-            # don't do anything in case this fails....
-            pass
-
-        # push the new file
-        try:
-            self.ftp_client.cwd(destination_path)
-            self.ftp_client.storbinary('STOR ' + os.path.basename(filename), open(filename, 'rb'))
-        except error_perm as exc:
-            if '550' in exc.message:
-
-                print(traceback.format_exc())
-                print("550 Error while attempting to transfer file %s to %s" % (filename, destination_path))
-                print(filename + " -> " + destination_path)
-                raise Exception("The destination already contains the files and cannot overwrite them.  This is most likely due to a previous execution of Run Transfer.")
-            else:
-                raise
-
     def start_reanalysis(self):
         """Set the status for a reanalysis"""
         self.show_standard_status("<p><h2>Status:</h2><small>Launching Analysis</small><img src=\"/site_media/jquery/colorbox/images/loading.gif\" alt=\"Running Plugin\" style=\"float:center\"></img></p>\n")
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# Copyright (C) 2019 Ion Torrent Systems, Inc. All Rights Reserved
+# Parallel ftp upload used by the RunTransfer plugin
+import calendar
+import os
+import posixpath
+import threading
+import time
+import traceback
+from ftplib import FTP, error_perm
+
+DEFAULT_CONNECTIONS = 4
+# storbinary sends 8KB blocks by default, far too small for GB sized wells files
+TRANSFER_BLOCK_SIZE = 1024 * 1024
+
+
+class FtpTransfer(object):
+    """Uploads files over a pool of ftp connections
+
+    Each connection uploads the files of a shared list, the largest first.  A
+    file whose remote copy has its size and is not older than it is skipped,
+    so that a transfer which failed half way only sends the remaining files
+    when run again.  Remote directories are only created once."""
+
+    def __init__(self, host, port, user, password, connections=DEFAULT_CONNECTIONS, block_size=TRANSFER_BLOCK_SIZE, progress=None):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.connections = max(1, int(connections))
+        self.block_size = block_size
+        # called as progress(files done, total files, file name)
+        self.progress = progress
+        self.created_directories = set()
+        self.lock = threading.Lock()
+
+    def connect(self):
+        """Opens a logged in connection, in binary mode for SIZE"""
+        client = FTP()
+        client.connect(host=self.host, port=self.port)
+        client.login(user=self.user, passwd=self.password)
+        client.voidcmd('TYPE I')
+        return client
+
+    def create_remote_directory(self, client, directory_path):
+        """Creates the directory and its parents, skipping those created before"""
+        cur_dir = '/'
+        for sub_directory in filter(None, directory_path.split('/')):
+            cur_dir = posixpath.join(cur_dir, sub_directory)
+            if cur_dir in self.created_directories:
+                continue
+            try:
+                client.mkd(cur_dir)
+            except error_perm:
+                # already exists
+                pass
+            self.created_directories.add(cur_dir)
+
+    @staticmethod
+    def remote_size(client, path):
+        try:
+            return client.size(path)
+        except error_perm:
+            return None
+
+    @staticmethod
+    def remote_mtime(client, path):
+        """The modification time of a remote file as a unix time, None if unknown"""
+        try:
+            response = client.sendcmd('MDTM ' + path)
+            return calendar.timegm(time.strptime(response.split()[1][:14], '%Y%m%d%H%M%S'))
+        except (error_perm, IndexError, ValueError):
+            return None
+
+    def is_transferred(self, client, filename, remote_path):
+        """Whether the remote file is a complete copy of the local one from a previous run"""
+        stat = os.stat(filename)
+        if self.remote_size(client, remote_path) != stat.st_size:
+            return False
+        remote_mtime = self.remote_mtime(client, remote_path)
+        return remote_mtime is not None and remote_mtime >= int(stat.st_mtime)
+
+    def upload(self, client, filename, destination_path):
+        """Transfers a file, replacing the remote one, and checks its remote size"""
+        remote_path = posixpath.join(destination_path, os.path.basename(filename))
+        try:
+            client.delete(remote_path)
+        except:
+            # don't do anything in case this fails....
+            pass
+
+        try:
+            with open(filename, 'rb') as handle:
+                client.storbinary('STOR ' + remote_path, handle, blocksize=self.block_size)
+        except error_perm as exc:
+            if '550' in str(exc):
+                print(traceback.format_exc())
+                print("550 Error while attempting to transfer file %s to %s" % (filename, destination_path))
+                print(filename + " -> " + destination_path)
+                raise Exception("The destination already contains the files and cannot overwrite them.  This is most likely due to a previous execution of Run Transfer.")
+            raise
+
+        size = os.path.getsize(filename)
+        remote_size = self.remote_size(client, remote_path)
+        if remote_size != size:
+            raise Exception("The transfer of %s is incomplete, %s of %d bytes were received." % (filename, remote_size, size))
+        return size
+
+    def copy_files(self, file_transfer_list):
+        """Uploads the (source path, destination directory) pairs
+
+        Returns a dict of the number of files, of files skipped, of bytes
+        sent, the seconds taken and the throughput in MB/s.  The first error
+        of any connection stops the transfer and is raised."""
+        start = time.time()
+        client = self.connect()
+        try:
+            for destination_directory in sorted(set(destination for _, destination in file_transfer_list)):
+                self.create_remote_directory(client, destination_directory)
+        finally:
+            client.quit()
+
+        pending = sorted(file_transfer_list, key=lambda pair: os.path.getsize(pair[0]))
+        stats = {'files': len(pending), 'skipped': 0, 'bytes': 0}
+        errors = []
+        done = [0]
+
+        def worker():
+            try:
+                client = self.connect()
+            except Exception as exc:
+                with self.lock:
+                    errors.append(exc)
+                return
+            try:
+                while True:
+                    with self.lock:
+                        if errors or not pending:
+                            return
+                        filename, destination_path = pending.pop()
+                        if self.progress:
+                            self.progress(done[0], stats['files'], filename)
+                    remote_path = posixpath.join(destination_path, os.path.basename(filename))
+                    if self.is_transferred(client, filename, remote_path):
+                        sent, skipped = 0, 1
+                    else:
+                        sent, skipped = self.upload(client, filename, destination_path), 0
+                    with self.lock:
+                        stats['bytes'] += sent
+                        stats['skipped'] += skipped
+                        done[0] += 1
+            except Exception as exc:
+                print(traceback.format_exc())
+                with self.lock:
+                    errors.append(exc)
+            finally:
+                try:
+                    client.quit()
+                except Exception:
+                    client.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(min(self.connections, len(pending)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+        stats['seconds'] = time.time() - start
+        stats['mbps'] = stats['bytes'] / (1024.0 * 1024.0) / max(stats['seconds'], 1e-6)
+        if self.progress:
+            self.progress(done[0], stats['files'], '')
+        return stats
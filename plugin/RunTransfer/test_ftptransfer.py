@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# Copyright (C) 2019 Ion Torrent Systems, Inc. All Rights Reserved
+# Tests of ftptransfer against a local pyftpdlib server
+#
+#   python -m unittest test_ftptransfer
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from pyftpdlib.authorizers import DummyAuthorizer
+from pyftpdlib.handlers import FTPHandler
+from pyftpdlib.servers import FTPServer
+
+from ftptransfer import FtpTransfer
+
+USER = 'ionadmin'
+PASSWORD = 'ionadmin'
+
+logging.getLogger('pyftpdlib').setLevel(logging.WARNING)
+
+
+class FtpTransferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.local = tempfile.mkdtemp()
+        self.remote = tempfile.mkdtemp()
+
+        authorizer = DummyAuthorizer()
+        authorizer.add_user(USER, PASSWORD, self.remote, perm='elradfmw')
+
+        class Handler(FTPHandler):
+            mkd_calls = []
+            stor_calls = []
+
+            def ftp_MKD(self, path):
+                self.mkd_calls.append(path)
+                return FTPHandler.ftp_MKD(self, path)
+
+            def ftp_STOR(self, file, mode='w'):
+                self.stor_calls.append(file)
+                return FTPHandler.ftp_STOR(self, file, mode)
+
+        Handler.authorizer = authorizer
+        self.handler = Handler
+        self.server = FTPServer(('127.0.0.1', 0), Handler)
+        self.port = self.server.address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={'timeout': 0.1})
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.close_all()
+        self.thread.join()
+        shutil.rmtree(self.local)
+        shutil.rmtree(self.remote)
+
+    def make_files(self, blocks=6, size=300000):
+        """A block style sigproc layout, (source path, destination directory) pairs"""
+        file_transfer_list = []
+        for block in range(blocks):
+            block_dir = os.path.join(self.local, 'block_X%d_Y0' % block)
+            os.makedirs(block_dir)
+            for name, length in (('1.wells', size * (block + 1)), ('bfmask.bin', size // 10), ('sigproc.log', 100)):
+                path = os.path.join(block_dir, name)
+                with open(path, 'wb') as handle:
+                    handle.write(os.urandom(length))
+                file_transfer_list.append((path, '/upload/run_foreign/onboard_results/sigproc_results/' + os.path.basename(block_dir)))
+        return file_transfer_list
+
+    def transfer(self, connections=4):
+        return FtpTransfer('127.0.0.1', self.port, USER, PASSWORD, connections=connections, block_size=65536)
+
+    def assert_transferred(self, file_transfer_list):
+        for source, destination in file_transfer_list:
+            remote = os.path.join(self.remote, destination.lstrip('/'), os.path.basename(source))
+            with open(source, 'rb') as local_handle, open(remote, 'rb') as remote_handle:
+                self.assertEqual(local_handle.read(), remote_handle.read(), remote)
+
+    def test_copy_files(self):
+        file_transfer_list = self.make_files()
+        progress = []
+        transfer = self.transfer()
+        transfer.progress = lambda done, total, filename: progress.append((done, total))
+        stats = transfer.copy_files(file_transfer_list)
+
+        self.assert_transferred(file_transfer_list)
+        self.assertEqual(stats['files'], len(file_transfer_list))
+        self.assertEqual(stats['skipped'], 0)
+        self.assertEqual(stats['bytes'], sum(os.path.getsize(source) for source, _ in file_transfer_list))
+        self.assertTrue(stats['mbps'] > 0)
+        self.assertEqual(progress[-1], (len(file_transfer_list), len(file_transfer_list)))
+        # one mkd per directory, not per path component of each destination
+        self.assertEqual(len(self.handler.mkd_calls), len(set(self.handler.mkd_calls)))
+        self.assertEqual(len(self.handler.mkd_calls), 4 + 6)
+
+    def test_rerun_skips_transferred_files(self):
+        file_transfer_list = self.make_files()
+        self.transfer().copy_files(file_transfer_list)
+
+        # a partial remote file and a changed local file are sent again
+        truncated = os.path.join(self.remote, file_transfer_list[0][1].lstrip('/'), '1.wells')
+        with open(truncated, 'r+b') as handle:
+            handle.truncate(1000)
+        changed = file_transfer_list[4][0]
+        with open(changed, 'wb') as handle:
+            handle.write(os.urandom(os.path.getsize(changed)))
+        os.utime(changed, (time.time() + 10, time.time() + 10))
+
+        del self.handler.stor_calls[:]
+        stats = self.transfer().copy_files(file_transfer_list)
+        self.assert_transferred(file_transfer_list)
+        self.assertEqual(stats['skipped'], len(file_transfer_list) - 2)
+        self.assertEqual(len(self.handler.stor_calls), 2)
+
+    def test_single_connection(self):
+        file_transfer_list = self.make_files(blocks=2)
+        stats = self.transfer(connections=1).copy_files(file_transfer_list)
+        self.assert_transferred(file_transfer_list)
+        self.assertEqual(stats['skipped'], 0)
+
+    def test_missing_source_raises(self):
+        file_transfer_list = self.make_files(blocks=1)
+        os.remove(file_transfer_list[1][0])
+        self.assertRaises(OSError, self.transfer().copy_files, file_transfer_list)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -138,6 +138,19 @@ class FamilyManager:
     def set_ignore_zr(self, flag):
         self.__ignore_zr = True if flag else False
         return self.__ignore_zr
+
+    def load_lod_table(self, table_dir):
+        """
+        Precompute the LOD table of the tvc parameters, or load it from table_dir if it is there. Return the table.
+        """
+        self.__lod_manager.set_table_dir(table_dir)
+        return self.__lod_manager.load_table()
+
+    def set_lod_table(self, lod_table):
+        """
+        Use the LOD table returned by load_lod_table with the same tvc parameters.
+        """
+        self.__lod_manager.set_table(lod_table)
     
     def __enter__(self):
         return self
@@ -308,9 +321,12 @@ class FamilyManager:
         else:
             fam_strand_key = 'R' if bam_read.is_reverse else 'F'
     
+        fam_key = '%s+%s+%s' %(fam_strand_key, zt, yt)
         if (region_list is None) or (search_around_idx is None):
-            return '%s+%s+%s' %(fam_strand_key, zt, yt)
-        
+            return fam_key
+        return self.add_super_amplicon_to_fam_key(fam_key, bam_read, region_list, search_around_idx)
+
+    def add_super_amplicon_to_fam_key(self, fam_key, bam_read, region_list, search_around_idx):
         # Now handle super amplicon, as TVC does.
         #@TODO (?)
         # The breaking condition is not ideal if you have highly overlapping regions with small length and large length.
@@ -337,12 +353,12 @@ class FamilyManager:
         
         # Most of the reads are not super amplicon. Don't bother sorting an empty list.
         if not covered_target_idx_list:
-            return '%s+%s+%s' %(fam_strand_key, zt, yt)
+            return fam_key
         
         covered_target_idx_list.sort()
         
         # The covered regions are also part of the key for family identification, as TVC does. 
-        return '%s+%s+%s+%s' %(fam_strand_key, zt, yt, ','.join(map(str, covered_target_idx_list)))
+        return '%s+%s' %(fam_key, ','.join(map(str, covered_target_idx_list)))
 
     def is_strict_tag(self, umt, tag_key):
         my_tag_structure = self.umt_structure[tag_key]
@@ -389,11 +405,32 @@ class FamilyManager:
         target_overlap = self.get_overlap(bam_read, region_dict, is_check_chrom)
         return (target_overlap >= self.__tvc_param_dict['min_cov_fraction']['value'] * region_dict['region_len']) and target_overlap    
 
+    def new_all_fam_dict(self):
+        return {'B': {}, 'R': {}, 'F': {}, 'miss_tag': {'fwd': 0, 'rev': 0}}
+
+    def get_zr(self, bam_read):
+        # Get ZR for consensus BAM
+        zr = 1
+        # self.__get_tag(bam_read, 'ZR') could be slow (in catching exception) in rawlib.bam...
+        # Therefore please ignore ZR if not using consensus BAM.
+        if not self.__ignore_zr:
+            try:
+                zr = self.__get_tag(bam_read, 'ZR')
+            except KeyError:
+                pass
+        return zr
+
+    def add_read_to_fam_dict(self, all_fam_dict, fam_key, bam_read, zr):
+        # Add the read to the family
+        # It is very important to use setdefault. Otherwise, try or check the existance the key could be slow.  
+        fam_dict = all_fam_dict[fam_key[0]].setdefault(fam_key, {'fwd': 0, 'rev': 0}) if (fam_key is not None) else all_fam_dict['miss_tag']
+        fam_dict['rev' if bam_read.is_reverse else 'fwd'] += zr
+
     def gen_fam_dict_one_region(self, region_dict, region_list=None, search_around_idx=None):
         """
         region_list=None, search_around_idx=None are for super amplicons.
         """
-        all_fam_dict = {'B': {}, 'R': {}, 'F': {}, 'miss_tag': {'fwd': 0, 'rev': 0}}
+        all_fam_dict = self.new_all_fam_dict()
         for bam_read in self.__f_bam.fetch(region_dict['chrom'], region_dict['chromStart'], region_dict['chromEnd']):
             # Must cover a certain portion of the region
             if not self.is_bam_read_cover_the_region(bam_read, region_dict, False):
@@ -401,22 +438,68 @@ class FamilyManager:
 
             # Generate fam_key
             fam_key = self.get_fam_key(bam_read, region_list, search_around_idx)
+            self.add_read_to_fam_dict(all_fam_dict, fam_key, bam_read, self.get_zr(bam_read))
 
-            # Get ZR for consensus BAM
-            zr = 1
-            # self.__get_tag(bam_read, 'ZR') could be slow (in catching exception) in rawlib.bam...
-            # Therefore please ignore ZR if not using consensus BAM.
-            if not self.__ignore_zr:
-                try:
-                    zr = self.__get_tag(bam_read, 'ZR')
-                except KeyError:
-                    pass
-
-            # Add the read to the family
-            # It is very important to use setdefault. Otherwise, try or check the existance the key could be slow.  
-            fam_dict = all_fam_dict[fam_key[0]].setdefault(fam_key, {'fwd': 0, 'rev': 0}) if (fam_key is not None) else all_fam_dict['miss_tag']
-            fam_dict['rev' if bam_read.is_reverse else 'fwd'] += zr
+        return self.finalize_fam_dict(all_fam_dict)
 
+    def gen_fam_dict_sweep(self, region_list, region_idx_list):
+        """
+        Generate (region_idx, all_fam_dict) for region_idx in region_idx_list, the same all_fam_dict as gen_fam_dict_one_region(region_list[region_idx], region_list, region_idx).
+        Instead of fetching the reads of every region, the reads of each chromosome are streamed once over the span of its regions.
+        The regions sorted by chromStart that may overlap the current read are kept in a window, and the read is added to all regions of the window that it covers.
+        A region is generated as soon as no later read can overlap it, so only the families of the regions in the window are kept in memory.
+        """
+        region_idx_by_chrom = {}
+        chrom_list = []
+        for region_idx in region_idx_list:
+            chrom = region_list[region_idx]['chrom']
+            if chrom not in region_idx_by_chrom:
+                region_idx_by_chrom[chrom] = []
+                chrom_list.append(chrom)
+            region_idx_by_chrom[chrom].append(region_idx)
+
+        for chrom in chrom_list:
+            sorted_idx_list = sorted(region_idx_by_chrom[chrom], key=lambda region_idx: region_list[region_idx]['chromStart'])
+            fetch_start = region_list[sorted_idx_list[0]]['chromStart']
+            fetch_end = max([region_list[region_idx]['chromEnd'] for region_idx in sorted_idx_list])
+            all_fam_dict_by_region = {}
+            window_idx_list = []
+            next_sorted_idx = 0
+            for bam_read in self.__f_bam.fetch(chrom, fetch_start, fetch_end):
+                read_start = self.__reference_start(bam_read)
+                read_end = self.__reference_end(bam_read)
+
+                # The reads come sorted by start: a region that ends before the read is done.
+                new_window_idx_list = []
+                for region_idx in window_idx_list:
+                    if region_list[region_idx]['chromEnd'] <= read_start:
+                        yield region_idx, self.finalize_fam_dict(all_fam_dict_by_region.pop(region_idx))
+                    else:
+                        new_window_idx_list.append(region_idx)
+                window_idx_list = new_window_idx_list
+                while next_sorted_idx < len(sorted_idx_list) and region_list[sorted_idx_list[next_sorted_idx]]['chromStart'] < read_end:
+                    region_idx = sorted_idx_list[next_sorted_idx]
+                    all_fam_dict_by_region[region_idx] = self.new_all_fam_dict()
+                    window_idx_list.append(region_idx)
+                    next_sorted_idx += 1
+
+                # Must cover a certain portion of the region
+                covered_idx_list = [region_idx for region_idx in window_idx_list if self.is_bam_read_cover_the_region(bam_read, region_list[region_idx], False)]
+                if not covered_idx_list:
+                    continue
+
+                # The tags and the read filters do not depend on the region. Only the super amplicon part of fam_key does.
+                fam_key = self.get_fam_key(bam_read)
+                zr = self.get_zr(bam_read)
+                for region_idx in covered_idx_list:
+                    region_fam_key = None if fam_key is None else self.add_super_amplicon_to_fam_key(fam_key, bam_read, region_list, region_idx)
+                    self.add_read_to_fam_dict(all_fam_dict_by_region[region_idx], region_fam_key, bam_read, zr)
+
+            for region_idx in window_idx_list + sorted_idx_list[next_sorted_idx:]:
+                all_fam_dict = all_fam_dict_by_region.pop(region_idx, self.new_all_fam_dict())
+                yield region_idx, self.finalize_fam_dict(all_fam_dict)
+
+    def finalize_fam_dict(self, all_fam_dict):
         # Following the same logic in TVC: I use the "type" (i.e., B, F, R) of the UMT that has the highest family coverage. Other "types" are thrown to "miss_tag"
         # I.e., I shall get all "B" families in ASHD, and I should get either R or F in TagSeq.
         key_order = ('B', 'F', 'R')
@@ -558,7 +641,9 @@ class FamilyManager:
         my_stats_dict['func_fam_cov_loss_due_to_strand'] = (1.0 - float(my_stats_dict['func_fam_cov']) / float(fam_cov_no_strand_constraint)) if fam_cov_no_strand_constraint != 0 else 0.0
         
         # LOD
-        my_stats_dict['lod'] = self.__lod_manager.calculate_lod(my_stats_dict['func_fam_cov'])
+        # A python float, as it used to be when the stats were read back from the json file
+        lod = self.__lod_manager.calculate_lod(my_stats_dict['func_fam_cov'])
+        my_stats_dict['lod'] = None if lod is None else float(lod)
         # Put the region in if needed
         if region_dict is not None:
             my_stats_dict.update(region_dict)
@@ -914,6 +999,28 @@ def gen_meta_stats(stats_for_xls_list):
     return meta_stats_dict
     
 
+def get_stats_for_xls_one_region(umt_manager, all_fam_dict, region_dict, input_dict):
+    output_dir = input_dict['output_dir']
+    details_dir = os.path.join(output_dir, '%s.details'%input_dict['output_prefix'])
+    file_prefix_one_region = '%s.%s_%d-%d'%(input_dict['output_prefix'], region_dict['chrom'], region_dict['chromStart'], region_dict['chromEnd'])
+
+    # Analyze the stats for the region
+    stats_one_region = umt_manager.gen_stats_one_region(all_fam_dict, region_dict)
+
+    # Dump stats_one_region to json
+    stats_one_region_json_path = os.path.join(details_dir, '%s.stats.json' %(file_prefix_one_region))
+    dump_to_json(stats_one_region, stats_one_region_json_path)
+
+    # Make a plot
+
+    # CZB: Could be slow. Need a solution to speed up.
+    if input_dict['make_plots']:
+        png_path_prefix = os.path.join(details_dir, '%s' %(file_prefix_one_region))
+        plot_stats(stats_one_region, png_path_prefix, input_dict['worker_id'] + 1)
+
+    # For xls and meta stats
+    return get_stats_for_xls(stats_one_region)
+
 def mol_coverage_analysis_worker(input_dict):
     bam_path = input_dict['bam_path']
     region_start_idx = input_dict['region_start_idx']
@@ -922,48 +1029,58 @@ def mol_coverage_analysis_worker(input_dict):
     # I input the entire region_list because of the handling of super amplicons, as TVC does.
     region_list = input_dict['region_list']
     tvc_param_dict = input_dict['tvc_param_dict']
-    output_dir = input_dict['output_dir']
-    details_dir = os.path.join(output_dir, '%s.details'%input_dict['output_prefix'])
-    output_prefix = input_dict['output_prefix']
     ignore_zr = input_dict['ignore_zr']
-    make_plots = input_dict['make_plots']
 
-    # Initialize stats_list
-    stats_for_xls_list = []
-    
     # Family Manager
     with FamilyManager(bam_path) as umt_manager:
         umt_manager.set_tvc_param(tvc_param_dict)
         umt_manager.set_ignore_zr(ignore_zr)
+        umt_manager.set_lod_table(input_dict['lod_table'])
+
+        if input_dict.get('sweep', False):
+            # The regions come out of the sweep in the order they are done
+            stats_for_xls_dict = {}
+            for region_idx, all_fam_dict in umt_manager.gen_fam_dict_sweep(region_list, range(region_start_idx, region_end_idx)):
+                stats_for_xls_dict[region_idx] = get_stats_for_xls_one_region(umt_manager, all_fam_dict, region_list[region_idx], input_dict)
+            return [stats_for_xls_dict[region_idx] for region_idx in xrange(region_start_idx, region_end_idx)]
+
+        # Initialize stats_list
+        stats_for_xls_list = []
+
         # Iterate over all regions
-        for region_idx, region_dict in enumerate(region_list[region_start_idx:region_end_idx]):
-            file_prefix_one_region = '%s.%s_%d-%d'%(output_prefix, region_dict['chrom'], region_dict['chromStart'], region_dict['chromEnd'])
+        for region_idx in xrange(region_start_idx, region_end_idx):
+            region_dict = region_list[region_idx]
             # Do family classification
             all_fam_dict = umt_manager.gen_fam_dict_one_region(region_dict, region_list, region_idx)
-    
-            # Analyze the stats for the region
-            stats_one_region = umt_manager.gen_stats_one_region(all_fam_dict, region_dict)
-            
-            # Dump stats_one_region to json
-            stats_one_region_json_path = os.path.join(details_dir, '%s.stats.json' %(file_prefix_one_region))
-            dump_to_json(stats_one_region, stats_one_region_json_path)
-            with open(stats_one_region_json_path, 'r') as f_json:
-                stats_one_region = json.load(f_json)
-               
-            # Make a plot
-            
-            # CZB: Could be slow. Need a solution to speed up.
-            if make_plots:
-                png_path_prefix = os.path.join(details_dir, '%s' %(file_prefix_one_region))          
-                plot_stats(stats_one_region, png_path_prefix, input_dict['worker_id'] + 1)
-             
-            # For xls and meta stats
-            stats_for_xls_list.append(get_stats_for_xls(stats_one_region))
+            stats_for_xls_list.append(get_stats_for_xls_one_region(umt_manager, all_fam_dict, region_dict, input_dict))
 
             # Track the status of the worker
-#            print('    - Worker #%d: %d/%d completed' %(input_dict['worker_id'], region_idx + 1, len(region_list[region_start_idx:region_end_idx])))
+#            print('    - Worker #%d: %d/%d completed' %(input_dict['worker_id'], region_idx + 1 - region_start_idx, region_end_idx - region_start_idx))
 
     return stats_for_xls_list
+
+#--------------------------------------------------------------------------------------------------------
+
+def count_reads_by_region(bam_path, region_list):
+    """
+    Number of reads that overlap each region, counted by pysam without making python objects of the reads.
+    """
+    f_bam = pysam.AlignmentFile(bam_path, 'rb') if hasattr(pysam, 'AlignmentFile') else pysam.Samfile(bam_path, 'rb')
+    try:
+        return [f_bam.count(region_dict['chrom'], region_dict['chromStart'], region_dict['chromEnd']) for region_dict in region_list]
+    finally:
+        f_bam.close()
+
+def split_by_weight(weight_list, num_workers):
+    """
+    Split range(len(weight_list)) into at most num_workers consecutive ranges of about the same total weight.
+    Return the start indices of the ranges followed by len(weight_list), as worker_start_idx_list.
+    """
+    cum_weight_ary = numpy.cumsum(weight_list)
+    split_weight_ary = cum_weight_ary[-1] * numpy.arange(1, num_workers) / float(num_workers)
+    # A range ends after the region that reaches its share of the weight
+    split_idx_ary = numpy.searchsorted(cum_weight_ary, split_weight_ary, 'left') + 1
+    return numpy.unique(numpy.concatenate(([0], split_idx_ary, [len(weight_list)])))
                     
 #--------------------------------------------------------------------------------------------------------
 
@@ -976,6 +1093,7 @@ def main(input_dict):
     output_prefix = input_dict['output_prefix']
     ignore_zr = input_dict['ignore_zr']
     make_plots = input_dict['make_plots']
+    sweep = input_dict.get('sweep', 0)
 
     printtime('Start analyzing coverage related metrics for UMT.')
     print('    - BAM file: %s'%bam_path)
@@ -994,12 +1112,24 @@ def main(input_dict):
     # Create job for the workers
     num_workers = num_threads
     num_workers = min(num_workers, len(region_list))
-    num_regions_per_worker = len(region_list) / num_workers
-    num_extra_regions = len(region_list) % num_workers 
-    worker_start_idx_list = numpy.cumsum([0] + [num_regions_per_worker + 1 if work_id < num_extra_regions else num_regions_per_worker for work_id in xrange(num_workers)])
-    
-    printtime('Processing %d regions with %d threads (# of regions per thread = %d%s) '%(len(region_list), num_workers, num_regions_per_worker, ' or %d'%(num_regions_per_worker + 1) if num_extra_regions else ''))    
+    if sweep:
+        # Balance the workers by the number of reads to process. A region without reads still costs something.
+        read_count_list = count_reads_by_region(bam_path, region_list)
+        worker_start_idx_list = split_by_weight([read_count + 1 for read_count in read_count_list], num_workers)
+        num_workers = len(worker_start_idx_list) - 1
+        printtime('Processing %d regions (%d reads) with %d threads in sweep mode (# of reads per thread = %d)'%(len(region_list), sum(read_count_list), num_workers, sum(read_count_list) / num_workers))
+    else:
+        num_regions_per_worker = len(region_list) / num_workers
+        num_extra_regions = len(region_list) % num_workers 
+        worker_start_idx_list = numpy.cumsum([0] + [num_regions_per_worker + 1 if work_id < num_extra_regions else num_regions_per_worker for work_id in xrange(num_workers)])
+
+        printtime('Processing %d regions with %d threads (# of regions per thread = %d%s) '%(len(region_list), num_workers, num_regions_per_worker, ' or %d'%(num_regions_per_worker + 1) if num_extra_regions else ''))    
     
+    # The LOD table is calculated once here, or loaded from the tables shared by the runs, and passed to the workers.
+    with FamilyManager(bam_path) as umt_manager:
+        umt_manager.set_tvc_param(tvc_param_dict)
+        lod_table = umt_manager.load_lod_table(lod.DEFAULT_LOD_TABLE_DIR)
+
     # Prepare input dict for the workers    
     input_dict_list = [{
             'worker_id': worker_id, 
@@ -1012,6 +1142,8 @@ def main(input_dict):
             'output_dir': output_dir, 
             'output_prefix': output_prefix,
             'make_plots': make_plots,
+            'sweep': sweep,
+            'lod_table': lod_table,
         } for worker_id in xrange(num_workers)]
 
     # pool for the workers
@@ -1048,6 +1180,7 @@ if __name__ == '__main__':
     parser.add_option('-o', '--output-prefix',    help='The prefix that will be added to the name of the output files [Default=""]', dest='output_prefix')
     parser.add_option('-p', '--make-plots',       help='Make plots of the family size histogram [Default=0]', dest='make_plots')    
     parser.add_option('-z', '--ignore-zr',        help='Ignore ZR tag of the BAM reads. Set to 1 if it is not a consensus BAM. [Default=0]', dest='ignore_zr')    
+    parser.add_option('-s', '--sweep',            help='Read the BAM file once per thread and chromosome instead of once per region, and balance the threads by the number of reads. [Default=0]', dest='sweep')
     parser.add_option('-j', '--tvc-json',         help='(Optional) TVC parameter json file (for determining the functionality of families, etc).', dest='tvc_json')
 
     (options, args) = parser.parse_args()
@@ -1083,6 +1216,9 @@ if __name__ == '__main__':
     # make_plots ?
     input_dict['make_plots'] = 0 if options.make_plots is None else int(options.make_plots)
 
+    # sweep ?
+    input_dict['sweep'] = 0 if options.sweep is None else int(options.sweep)
+
     # output dir
     input_dict['output_dir'] = os.getcwd() if options.output_dir is None else options.output_dir
         
@@ -17,7 +17,7 @@ STATS_TXT_FILE=${OUTPUT_DIR}/${OUTPUT_PREFIX}.cov.stats.txt
 COV_FILE=${OUTPUT_DIR}/${OUTPUT_PREFIX}.amplicon.cov.xls
 TCCINITFILE=${OUTPUT_DIR}/tmc.aux.ttc.xls
 
-python ${BIN_DIR}/molecular_coverage_analysis.py --bam-file ${BAM_FILE} --bed-file ${TARGET_BED_FILE} --num-threads ${NUM_THREADS} --output-dir ${OUTPUT_DIR} --output-prefix ${OUTPUT_PREFIX} --tvc-json ${TVC_JSON} --ignore-zr  1 --make-plots 0
+python ${BIN_DIR}/molecular_coverage_analysis.py --bam-file ${BAM_FILE} --bed-file ${TARGET_BED_FILE} --num-threads ${NUM_THREADS} --output-dir ${OUTPUT_DIR} --output-prefix ${OUTPUT_PREFIX} --tvc-json ${TVC_JSON} --ignore-zr  1 --make-plots 0 --sweep 1
 cp ${COV_FILE} ${COV_FILE}.bak
 head -1 ${COV_FILE}.bak > ${COV_FILE}
 tail -n +2  ${COV_FILE}.bak | sort -nk 6 >> ${COV_FILE}
@@ -4,8 +4,19 @@ import numpy
 import sys
 import json
 import os
+import hashlib
+import tempfile
 from optparse import OptionParser
 
+# LOD of the depths up to this are precomputed in a table, deeper depths are calculated one at a time.
+DEFAULT_MAX_TABLE_DP = 10000
+# Bump this if the table changes for the same parameters, so that the saved tables are not used.
+LOD_TABLE_VERSION = 1
+# The LOD tables are shared by all the runs, a table is saved under the hash of its parameters.
+DEFAULT_LOD_TABLE_DIR = '/results/plugins/scratch/lod_tables'
+# Max number of (depth, ao) pairs in a block of the vectorized line search, per allele frequency.
+LOD_TABLE_BLOCK_SIZE = 100000
+
 # ------------------------------------- Useful Utils ---------------------------------------------
 """
 # For debug only, not used.
@@ -85,6 +96,16 @@ def linear_interpolation(x, x1, y1, x2, y2):
     assert(min(x1, x2) < x < max(x1, x2))
     alpha = (x - x2) / (x1 - x2)    
     return alpha * y1 + (1.0 - alpha) * y2
+
+def linear_interpolation_ary(x, x1, y1, x2, y2):
+    """
+    Element-wise linear_interpolation for numpy arrays, without checking that x is between x1 and x2.
+    """
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        alpha = (x - x2) / (x1 - x2)
+        y = alpha * y1 + (1.0 - alpha) * y2
+    y = numpy.where(x == x2, y2, y)
+    return numpy.where(x == x1, y1, y)
     
 # ------------------------------------- Useful Utils ---------------------------------------------
     
@@ -122,6 +143,23 @@ class BinomialUtils:
         assert(0 <= k <= n)
         return max(BinomialUtils.log_factorial(n) - (BinomialUtils.log_factorial(k) + BinomialUtils.log_factorial(n - k)), 1.0)
         
+    @staticmethod
+    def log_factorial_ary(max_x):
+        """
+        [BinomialUtils.log_factorial(x) for x in xrange(max_x + 1)] as a numpy array
+        """
+        num_exact = min(max_x + 1, len(BinomialUtils.exact_log_factorial))
+        x = numpy.arange(num_exact, max_x + 1, dtype = float)
+        return numpy.concatenate((BinomialUtils.exact_log_factorial[:num_exact], BinomialUtils.stirling_names_approx(x)))
+
+    @staticmethod
+    def log_n_choose_k_ary(n, k, log_factorial_ary):
+        """
+        Element-wise log_n_choose_k for the integer arrays n and k, where 0 <= k <= n <= len(log_factorial_ary) - 1
+        """
+        log_n_choose_k = log_factorial_ary[n] - (log_factorial_ary[k] + log_factorial_ary[n - k])
+        return numpy.where((k == 0) | (k == n), 0.0, numpy.maximum(log_n_choose_k, 1.0))
+
     @staticmethod
     def log_binomial_pmf(n, k, log_p, log_q = None):
         """
@@ -170,6 +208,20 @@ class BinomialUtils:
             return numpy.log(-log_p)
         
         return numpy.log(q)
+
+    @staticmethod
+    def log_complement_from_log_p_ary(log_p):
+        """
+        Element-wise log_complement_from_log_p for a numpy array log_p <= 0
+        """
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            p = numpy.exp(log_p)
+            q = 1.0 - p
+            log_q = numpy.log(q)
+            log_q = numpy.where(q == 1.0, -p, log_q)
+            log_q = numpy.where(q == 0.0, numpy.log(-log_p), log_q)
+        log_q = numpy.where(numpy.isfinite(log_p), log_q, 0.0)
+        return numpy.where(log_p == 0.0, -numpy.inf, log_q)
 # ------------------------------------- End BinomialUtils ---------------------------------------------
 
 # ------------------------------------- LodManager ---------------------------------------------
@@ -181,12 +233,20 @@ class LodManager:
         self.__min_callable_prob = 0.98
         self.__min_allele_freq = 0.0005
         self.__do_smoothing = True
+        self.__max_table_dp = DEFAULT_MAX_TABLE_DP
+        self.__table_dir = None
+        self.__reset_table()
+
+    def __reset_table(self):
+        self.__lod_table = None
+        self.__lod_cache = {}
 
     def do_smoothing(self, flag):
         if flag:
             self.__do_smoothing = True
         else:
             self.__do_smoothing = False
+        self.__reset_table()
         return self.__do_smoothing
         
     def set_parameters(self, param_dict):
@@ -199,6 +259,81 @@ class LodManager:
         assert(0.0 < self.__min_callable_prob < 1.0)
         self.__min_allele_freq = param_dict.get('min_allele_freq', self.__min_allele_freq)
         assert(0.0 < self.__min_allele_freq < 1.0)
+        self.__reset_table()
+
+    def set_max_table_dp(self, max_dp):
+        """
+        LOD of the depths up to max_dp are looked up in a precomputed table. 0 disables the table.
+        """
+        self.__max_table_dp = int(max_dp)
+        assert(self.__max_table_dp >= 0)
+        self.__reset_table()
+
+    def set_table_dir(self, table_dir):
+        """
+        Save the LOD table in table_dir, and load it from there if a LodManager with the same parameters saved it before.
+        table_dir is meant to be shared, e.g. DEFAULT_LOD_TABLE_DIR. None keeps the table in memory only.
+        """
+        self.__table_dir = table_dir
+        self.__lod_table = None
+
+    def set_table(self, lod_table):
+        """
+        Use the LOD table returned by load_table() of a LodManager with the same parameters, e.g. in another process.
+        """
+        assert(lod_table.shape == (self.__max_table_dp + 1, ))
+        self.__lod_table = lod_table
+
+    def table_key(self):
+        """
+        Hash of everything the LOD table depends on, the table is saved under this name.
+        """
+        key = repr((LOD_TABLE_VERSION, self.__max_table_dp, float(self.__min_var_coverage), float(self.__min_variant_score),
+                    float(self.__min_callable_prob), float(self.__min_allele_freq), self.__do_smoothing))
+        return hashlib.sha1(key).hexdigest()
+
+    def load_table(self):
+        """
+        Return the LOD of the depths 0, 1, ..., max_table_dp as a numpy array, NaN if the LOD is None.
+        The table is calculated the first time, or loaded from the table dir.
+        """
+        if self.__lod_table is not None:
+            return self.__lod_table
+
+        table_path = None
+        if self.__table_dir is not None:
+            # Raw float64, a file in a shared directory is never unpickled.
+            table_path = os.path.join(self.__table_dir, 'lod_table.%s.f8' %self.table_key())
+            try:
+                lod_table = numpy.fromfile(table_path, dtype = numpy.float64)
+                if lod_table.shape == (self.__max_table_dp + 1, ):
+                    self.__lod_table = lod_table
+                    return self.__lod_table
+            except (IOError, ValueError):
+                pass
+
+        self.__lod_table = self.__calculate_lod_table(numpy.arange(self.__max_table_dp + 1))
+        if table_path is not None:
+            # Other processes may be loading the same table, so write it in a temporary file first.
+            tmp_path = None
+            try:
+                if not os.path.isdir(self.__table_dir):
+                    try:
+                        os.makedirs(self.__table_dir)
+                    except OSError:
+                        if not os.path.isdir(self.__table_dir):
+                            raise
+                fd, tmp_path = tempfile.mkstemp(dir = self.__table_dir, prefix = '.lod_table.')
+                # Readable by the other runs.
+                os.fchmod(fd, 0644)
+                with os.fdopen(fd, 'wb') as f_tmp:
+                    self.__lod_table.astype(numpy.float64).tofile(f_tmp)
+                os.rename(tmp_path, table_path)
+            except (IOError, OSError) as e:
+                print 'WARNING: Unable to save the LOD table to %s: %s' %(table_path, str(e))
+                if tmp_path is not None and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        return self.__lod_table
 
 
     def __min_callable_ao(self, dp):
@@ -305,7 +440,13 @@ class LodManager:
     """
         
     def calculate_lod(self, dp):
-        return self.__calculate_lod_by_line_search(dp)
+        dp = int(dp)
+        if 0 <= dp <= self.__max_table_dp:
+            lod = self.load_table()[dp]
+            return None if numpy.isnan(lod) else lod
+        if dp not in self.__lod_cache:
+            self.__lod_cache[dp] = self.__calculate_lod_by_line_search(dp)
+        return self.__lod_cache[dp]
         
     # Line search is not too bad due to the monotonicity of P(callable) vs AF
     def __calculate_lod_by_line_search(self, dp):
@@ -366,6 +507,170 @@ class LodManager:
             return linear_interpolation(self.__min_callable_prob, p_callable_new_start, new_start_af, p_callable_new_end, new_end_af)
 
         return 1.0
+
+    # The LOD table does the line search of __calculate_lod_by_line_search for a block of depths at once,
+    # all the depths going through the same rounds, so that the work is done by numpy on arrays.
+    def __calculate_lod_table(self, dp_ary):
+        dp_ary = numpy.asarray(dp_ary, dtype = int)
+        lod_ary = numpy.full(len(dp_ary), numpy.nan)
+        has_lod = (dp_ary > 0) & (dp_ary >= self.__min_var_coverage)
+        lod_ary[has_lod] = 1.0
+        min_callable_ao, qual_plus, qual_minus = self.__min_callable_ao_table(dp_ary[has_lod])
+        is_callable = min_callable_ao >= 0
+        if not is_callable.any():
+            return lod_ary
+        callable_idx = numpy.flatnonzero(has_lod)[is_callable]
+        min_callable_ao, qual_plus, qual_minus = min_callable_ao[is_callable], qual_plus[is_callable], qual_minus[is_callable]
+        log_factorial_ary = BinomialUtils.log_factorial_ary(int(dp_ary[callable_idx].max()))
+
+        # Blocks of depths whose min_callable_ao are alike, so that little of the (depth, ao) arrays is padding.
+        block_list = []
+        block_start = 0
+        max_ao = 0
+        for idx, ao in enumerate(min_callable_ao):
+            max_ao = max(max_ao, ao)
+            if idx > block_start and (idx - block_start + 1) * (max_ao + 1) > LOD_TABLE_BLOCK_SIZE:
+                block_list.append(slice(block_start, idx))
+                block_start = idx
+                max_ao = ao
+        block_list.append(slice(block_start, len(min_callable_ao)))
+
+        for block in block_list:
+            lod_ary[callable_idx[block]] = self.__line_search_table(
+                dp_ary[callable_idx[block]], min_callable_ao[block], qual_plus[block], qual_minus[block], log_factorial_ary)
+        return lod_ary
+
+    def __min_callable_ao_table(self, dp_ary):
+        """
+        __min_callable_ao for an array of depths > 0, following the recursion of beta_inc_gen.
+        Return the arrays of min_callable_ao, qual_plus, qual_minus, where min_callable_ao = -1 and NaN stand for None.
+        """
+        num_dp = len(dp_ary)
+        min_callable_ao = numpy.full(num_dp, -1, dtype = int)
+        qual_plus = numpy.full(num_dp, numpy.nan)
+        qual_minus = numpy.full(num_dp, numpy.nan)
+
+        log_f_c = numpy.log(self.__min_allele_freq)
+        log_1_minus_f_c = numpy.log(1.0 - self.__min_allele_freq)
+        # The depths still looking for min_callable_ao
+        idx = numpy.arange(num_dp)
+        dp = dp_ary.astype(float)
+        beta_inc = numpy.maximum(1.0 - numpy.exp((dp + 1.0) * log_1_minus_f_c), 0.0)
+        log_beta = -numpy.log(dp + 1.0)
+        last_qual = numpy.full(num_dp, numpy.nan)
+        ao = 0
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            while len(idx):
+                qual = linear_to_phread(numpy.maximum(beta_inc, 0.0))
+                found = qual >= self.__min_variant_score if ao >= self.__min_var_coverage else numpy.zeros(len(idx), dtype = bool)
+                min_callable_ao[idx[found]] = ao
+                qual_plus[idx[found]] = qual[found]
+                qual_minus[idx[found]] = last_qual[found]
+                # Keep on the depths with ao + 1 <= dp
+                keep = ~found & (dp > ao)
+                idx, dp, beta_inc, log_beta, last_qual = idx[keep], dp[keep], beta_inc[keep], log_beta[keep], qual[keep]
+                beta_inc -= numpy.exp(log_f_c * (ao + 1.0) + log_1_minus_f_c * (dp - ao) - log_beta - numpy.log(ao + 1.0))
+                log_beta += (numpy.log(ao + 1.0) - numpy.log(dp - ao))
+                ao += 1
+        return min_callable_ao, qual_plus, qual_minus
+
+    def __callable_prob_table(self, af, min_callable_ao, qual_plus, qual_minus, log_n_choose_k, ro):
+        """
+        __callable_prob for a number of depths, at the allele frequency af[i] of the i-th depth.
+        log_n_choose_k[i, ao] (-inf if ao >= min_callable_ao[i]) and ro[i, ao] = dp - ao of the i-th depth are precalculated.
+        """
+        ao = numpy.arange(log_n_choose_k.shape[1], dtype = float)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            log_p = numpy.log(af)
+            log_q = BinomialUtils.log_complement_from_log_p_ary(log_p)
+            # log_n_choose_k + (ao * log_p + (dp - ao) * log_q), with as few temporary arrays as possible
+            log_pmf = ao[None, :] * log_p[:, None]
+            log_pmf += ro * log_q[:, None]
+            log_pmf += log_n_choose_k
+            numpy.minimum(log_pmf, 0.0, out = log_pmf)
+            max_log = log_pmf.max(axis = 1) if len(ao) else numpy.full(len(af), -numpy.inf)
+            pmf = log_pmf - max_log[:, None]
+            numpy.exp(pmf, out = pmf)
+            log_cdf = numpy.minimum(max_log + numpy.log(pmf.sum(axis = 1)), 0.0)
+            p_callable = numpy.where(min_callable_ao > 0, 1.0 - numpy.exp(log_cdf), 1.0)
+
+            no_smoothing = numpy.isnan(qual_plus) | numpy.isnan(qual_minus) | (min_callable_ao == self.__min_var_coverage) | (qual_minus >= qual_plus)
+            if (not self.__do_smoothing) or no_smoothing.all():
+                return p_callable
+            # Do linear interpolation
+            p_callable_minus = p_callable + numpy.exp(log_pmf[numpy.arange(len(af)), numpy.maximum(min_callable_ao - 1, 0)])
+            p_smooth = linear_interpolation_ary(self.__min_variant_score, qual_minus, p_callable_minus, qual_plus, p_callable)
+        return numpy.where(no_smoothing, p_callable, p_smooth)
+
+    def __line_search_table(self, dp, min_callable_ao, qual_plus, qual_minus, log_factorial_ary):
+        """
+        __calculate_lod_by_line_search for the depths dp, given their min_callable_ao.
+        """
+        max_rounds = 10
+        num_div = 10
+        lod = numpy.full(len(dp), 1.0)
+        start_af = numpy.minimum(1.0 / (10.0 * dp), 0.1 * self.__min_allele_freq)
+        end_af = 1.0 - start_af
+        # The depths still in the line search
+        idx = numpy.arange(len(dp))
+        div_ary = numpy.arange(num_div, dtype = float)
+        # The parts of log_pmf that do not depend on af
+        ao = numpy.arange(min_callable_ao.max())
+        log_n_choose_k = BinomialUtils.log_n_choose_k_ary(dp[:, None], ao[None, :], log_factorial_ary)
+        # Sum over ao < min_callable_ao only: adding -inf drops a term, adding 0.0 keeps it as it is.
+        log_n_choose_k += numpy.where(ao[None, :] < min_callable_ao[:, None], 0.0, -numpy.inf)
+        ro = (dp[:, None] - ao[None, :]).astype(float)
+        for round_idx in xrange(max_rounds):
+            # numpy.linspace(start_af, end_af, num_div) of each depth
+            af_ary = div_ary[None, :] * ((end_af - start_af) / (num_div - 1.0))[:, None] + start_af[:, None]
+            af_ary[:, -1] = end_af
+            new_start_af = numpy.full(len(idx), numpy.nan)
+            new_end_af = numpy.full(len(idx), numpy.nan)
+            p_callable_new_start = numpy.full(len(idx), numpy.nan)
+            p_callable_new_end = numpy.full(len(idx), numpy.nan)
+            is_done = numpy.zeros(len(idx), dtype = bool)
+            # Try the af in order, only for the depths that have not found one below and one above min_callable_prob.
+            is_scanning = numpy.ones(len(idx), dtype = bool)
+            for div_idx in xrange(num_div):
+                rows = numpy.flatnonzero(is_scanning)
+                if not len(rows):
+                    break
+                af = af_ary[rows, div_idx]
+                dp_rows = idx[rows]
+                p_callable = self.__callable_prob_table(af, min_callable_ao[dp_rows], qual_plus[dp_rows], qual_minus[dp_rows], log_n_choose_k[dp_rows], ro[dp_rows])
+                is_below = p_callable < self.__min_callable_prob
+                is_above = p_callable > self.__min_callable_prob
+                new_start_af[rows[is_below]] = af[is_below]
+                p_callable_new_start[rows[is_below]] = p_callable[is_below]
+                new_end_af[rows[is_above]] = af[is_above]
+                p_callable_new_end[rows[is_above]] = p_callable[is_above]
+                # Lucky me! Exactly hit self.__min_callable_prob.
+                is_hit = ~(is_below | is_above)
+                lod[idx[rows[is_hit]]] = af[is_hit]
+                is_done[rows[is_hit]] = True
+                is_scanning[rows[is_hit]] = False
+                # Stoping rule in a round
+                is_scanning[rows] &= numpy.isnan(new_start_af[rows]) | numpy.isnan(new_end_af[rows])
+
+            has_both = ~(numpy.isnan(new_start_af) | numpy.isnan(new_end_af))
+            interpolated = linear_interpolation_ary(self.__min_callable_prob, p_callable_new_start, new_start_af, p_callable_new_end, new_end_af)
+            # Stopping if we are very close, or reach the max round, use interpolation.
+            with numpy.errstate(invalid='ignore'):
+                is_close = has_both & (numpy.abs(p_callable_new_start - p_callable_new_end) < 0.001 * self.__min_callable_prob)
+            if round_idx == max_rounds - 1:
+                is_close = has_both
+            lod[idx[is_close]] = interpolated[is_close]
+            is_done |= is_close
+
+            start_af = numpy.where(has_both, new_start_af, start_af)
+            end_af = numpy.where(has_both, new_end_af, end_af)
+            # Bad initial condition:
+            end_af = numpy.where(numpy.isnan(new_end_af), 0.5 * (end_af + 1.0), end_af)
+            start_af = numpy.where(numpy.isnan(new_start_af), 0.5 * start_af, start_af)
+            idx, start_af, end_af = idx[~is_done], start_af[~is_done], end_af[~is_done]
+            if not len(idx):
+                break
+        return lod
 # ------------------------------------- End LodManager ---------------------------------------------
 
 
@@ -384,6 +689,7 @@ if __name__ == '__main__':
     parser.add_option('-F', '--fig',               help='(Optional) Path to the output figure', dest='fig_path')
     parser.add_option('-a', '--axis-type',         help='(Optional) X-Y axis for plotting LOD vs MDP. Options: {linear, loglog, semilogx, semilogy} [linear]', dest='axis_type')
     parser.add_option('-j', '--json',              help='(Optional) Path to the output json', dest='json_path')
+    parser.add_option('-T', '--table-dir',         help='(Optional) Save the LOD table in this directory, or load it from there if it was saved with the same parameters, e.g. %s' %DEFAULT_LOD_TABLE_DIR, dest='table_dir')
     (options, args) = parser.parse_args()
     
     if len(sys.argv) == 1:
@@ -434,6 +740,10 @@ if __name__ == '__main__':
     lod_manager = LodManager()
     lod_manager.set_parameters(param_dict)
     lod_manager.do_smoothing(True)
+    # No need of the LOD of the depths deeper than the ones asked.
+    lod_manager.set_max_table_dp(min(dp_list[-1], DEFAULT_MAX_TABLE_DP))
+    if options.table_dir is not None:
+        lod_manager.set_table_dir(options.table_dir)
     lod_list = [lod_manager.calculate_lod(dp) for dp in dp_list]
 
     # Print results
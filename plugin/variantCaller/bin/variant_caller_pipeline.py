@@ -183,7 +183,7 @@ def consensus_alignment_pipeline(options, parameters, consensus_bam_name, remove
 
 def create_consensus_metrics(options, parameters):
     # Import LodManager
-    from lod import LodManager
+    from lod import LodManager, DEFAULT_MAX_TABLE_DP
     lod_manager = LodManager()
     # Parameters for LOD
     param_dict = {'min_var_coverage': 2, 'min_variant_score': 3, 'min_callable_prob': 0.98, 'min_allele_freq': 0.0005}    
@@ -195,6 +195,8 @@ def create_consensus_metrics(options, parameters):
     targets_depth_path = os.path.join(options.outdir, 'targets_depth.txt') 
     with open(targets_depth_path, 'r') as f_target_depth:
         read_depth_list, family_depth_list = zip(*[(int(region_dict['read_depth']), int(region_dict['family_depth'])) for region_dict in csv.DictReader(f_target_depth, delimiter='\t')])
+    # The LOD of the family depths up to the deepest one are looked up in a table.
+    lod_manager.set_max_table_dp(min(max(family_depth_list), DEFAULT_MAX_TABLE_DP))
     lod_list = [1.0 if lod is None else lod for lod in map(lod_manager.calculate_lod, family_depth_list)]
     # Get stats
     read_depth_median = numpy.median(read_depth_list) if read_depth_list else 0
@@ -685,9 +685,9 @@ $(function () {
         TVC.grid.render();
     };
 
-    TVC.subload = function (offset) {
+    TVC.subload = function (offset, after) {
         TVC.empty_grid();
-        TVC.loadtable(offset);
+        TVC.loadtable(offset, after);
         setCheckAll();
         TVC.grid.render();
         TVC.pager_update();
@@ -1091,7 +1091,8 @@ copyTextToClipboard(text);
 
     $("#next").click(function () {
         TVC.pos = TVC.pos + TVC.page_size;
-        TVC.subload(TVC.pos);
+        //continue after the last row of this page, the server does not skip the rows before it
+        TVC.subload(TVC.pos, TVC.next_key);
         TVC.pager_toggle();
     });
 
@@ -1310,7 +1311,7 @@ copyTextToClipboard(text);
     TVC.dataView.syncGridSelection(TVC.grid, true);
 
 
-    TVC.loadtable = function (offset) {
+    TVC.loadtable = function (offset, after) {
         //This gets the data one page at a time from the server
 
         function onLoadPartial() {
@@ -1342,6 +1343,10 @@ copyTextToClipboard(text);
             plugin_extend += "&where=" + TVC.filter_query_string;
         }
 
+        if (after) {
+            plugin_extend += "&after=" + encodeURIComponent(JSON.stringify(after));
+        }
+
         //request the data from the extend.py query endpoint, get one page at a time.
         var get_page = $.ajax({
             url: plugin_extend,
@@ -1350,6 +1355,8 @@ copyTextToClipboard(text);
         });
         get_page.done(function (mem) {
             TVC.total_variants = mem["total"];
+            //the sort key of the last row, for the next page
+            TVC.next_key = mem["next"];
             $.each(mem["items"], function (n, fields) {
                 var pk = fields.shift();
                 var sortValue = fields.shift();
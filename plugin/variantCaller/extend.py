@@ -4,6 +4,7 @@
 # Ion Plugin - Ion Variant Caller
 
 import os
+import re
 import time
 import json
 import sys
@@ -29,29 +30,107 @@ def run_command(command,description):
 
 WINDOW = 300
 
-def _execute(path, query, limit, offset):
-    """Function to execute queries against a local sqlite database"""
+# Filters on the numbers of the variant table, "BETWEEN a AND b" or "<op> a"
+NUMBER_FILTER = re.compile(r'^\s*(?:BETWEEN\s+(\S+)\s+AND\s+(\S+)|(<=|>=|<>|!=|=|<|>)\s*(\S+))\s*$', re.IGNORECASE)
+NUMBER_COLUMNS = ["Position", "Frequency", "Coverage"]
 
-    page_str = " LIMIT {limit} OFFSET {offset}".format(limit=limit, offset=offset)
+# The columns searched with LIKE "%value%", and their names in the variants_fts table of csv2sqlite.py
+SEARCH_COLUMNS = {"Allele Name": "allele_name", "Gene ID": "gene_id", "Region Name": "region_name"}
+# Search texts that are a single word of the FTS tokenizer can use the full text index
+FTS_WORD = re.compile('^[A-Za-z0-9]+$')
 
-    if os.path.exists(os.path.join(path,"alleles.db")):
-        dbPath = os.path.join(path,'alleles.db')
-        connection = sqlite3.connect(dbPath)
+def _quote(name):
+    return '"%s"' % name.replace('"', '""')
 
-        cursorobj = connection.cursor()
-        try:
-                cursorobj.execute(query + page_str)
-                result = cursorobj.fetchall()
+def _number(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
 
-                #now find the total number of records that match the query
-                cursorobj.execute(query.replace("SELECT *", "SELECT COUNT(*)") )
-                count =  cursorobj.fetchall()
-        except Exception as e:
-                raise e
-        connection.close()
-        return count, result
-    else:
+def _connect(path):
+    dbPath = os.path.join(path, 'alleles.db')
+    if not os.path.exists(dbPath):
         raise Exception("Unable to open database file")
+    return sqlite3.connect(dbPath)
+
+def _table_names(connection):
+    cursorobj = connection.cursor()
+    cursorobj.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    return set([row[0] for row in cursorobj.fetchall()])
+
+def _where(where, columns, has_fts):
+    """Returns (where_str, params) of the search filter JSON, with the values as parameters"""
+    where_list = []
+    params = []
+    match_list = []
+    for key, value in sorted(where.iteritems()):
+        if key not in columns:
+            raise ValueError('Unknown column "%s"' % key)
+        if isinstance(value, list):
+            if value:
+                where_list.append('%s IN (%s)' % (_quote(key), ','.join(['?'] * len(value))))
+                params += value
+            else:
+                # nothing selected
+                where_list.append('0')
+        elif key in NUMBER_COLUMNS:
+            match = NUMBER_FILTER.match(value)
+            if match is None:
+                raise ValueError('Bad filter "%s" for column "%s"' % (value, key))
+            if match.group(1) is not None:
+                where_list.append('%s BETWEEN ? AND ?' % _quote(key))
+                params += [_number(match.group(1)), _number(match.group(2))]
+            else:
+                where_list.append('%s %s ?' % (_quote(key), match.group(3)))
+                params.append(_number(match.group(4)))
+        elif key in SEARCH_COLUMNS:
+            if has_fts and FTS_WORD.match(value):
+                match_list.append('%s:%s*' % (SEARCH_COLUMNS[key], value.lower()))
+            else:
+                where_list.append('%s LIKE ?' % _quote(key))
+                params.append('%' + value + '%')
+
+    if match_list:
+        where_list.append('"id" IN (SELECT docid FROM variants_fts WHERE variants_fts MATCH ?)')
+        params.append(' '.join(match_list))
+
+    if where_list:
+        return "WHERE " + " AND ".join(where_list), params
+    return "", params
+
+def _count(connection, where_str, params, signature, has_cache):
+    """COUNT(*) of the filter, cached in the variants_count table by the signature of the filter"""
+    cursorobj = connection.cursor()
+    if has_cache:
+        cursorobj.execute('SELECT total FROM variants_count WHERE signature = ?', (signature, ))
+        row = cursorobj.fetchone()
+        if row is not None:
+            return row[0]
+
+    cursorobj.execute('SELECT COUNT(*) FROM variants ' + where_str, params)
+    total = cursorobj.fetchone()[0]
+    if has_cache:
+        try:
+            cursorobj.execute('INSERT OR REPLACE INTO variants_count VALUES (?, ?)', (signature, total))
+            connection.commit()
+        except sqlite3.Error:
+            # read only database, count again next time
+            connection.rollback()
+    return total
+
+def _keyset(sort_columns, direction, after):
+    """Returns (where_str, params) for the rows after the sort key after, the rows of the next page
+
+    For sort columns a, b the condition is a >= ? AND (a > ? OR (a = ? AND b > ?)),
+    the first term lets sqlite start the index scan at the key."""
+    op = '>' if direction == "ASC" else '<'
+    terms = []
+    params = [after[0]]
+    for i, column in enumerate(sort_columns):
+        terms.append('(%s)' % ' AND '.join(['%s = ?' % _quote(c) for c in sort_columns[:i]] + ['%s %s ?' % (_quote(column), op)]))
+        params += after[:i + 1]
+    return '%s %s= ? AND (%s)' % (_quote(sort_columns[0]), op, ' OR '.join(terms)), params
 
 def db_columns(bucket):
     """returns the keys of columns from database"""
@@ -74,71 +153,80 @@ def db_columns(bucket):
      
 
 def query(bucket):
-    """returns a list of rows from database"""
-
-    where = bucket["request_get"].get("where", False)
-    #get the search filter JSON, then use that to build the SQL where statements
-    where_list = []
-    if where:
-        where = json.loads(where)
-        for key,value in where.iteritems():
-
-                if isinstance(value,list):
-                    for i,v in enumerate(value):
-                        if i == 0:
-                            where_local = "("
-                        where_local += '"{key}" = "{value}"'.format(key=key,value=v)
-                        if i+1 < len(value):
-                            where_local += ' OR '
-                        else:
-                            where_local += ")"
-                    where_list.append(where_local)
-                elif key in ["Position", "Frequency", "Coverage"]:
-                    where_list.append('"{key}" {value}'.format(key=key, value=value))
-                elif key in ["Allele Name", "Gene ID", "Region Name"]:
-                    where_list.append('"{key}" LIKE "%{value}%"'.format(key=key, value=value))
+    """returns a list of rows from database
 
-    if where_list:
-        where_str = "WHERE "
-        for i,w in enumerate(where_list):
-            if i == 0:
-                where_str += w
-            else:
-                where_str += " AND " + w
-    else:
-        where_str = ""
+    A page is limit rows from offset, or with after, the sort key in "next"
+    of the previous page, the limit rows after it. Deep pages are read
+    from the index instead of skipping offset rows."""
 
-    limit = bucket["request_get"].get("limit", "20")
-    offset = bucket["request_get"].get("offset", "0")
     #pass the path in from the JS, it is in startplugin.json - runinfo -> results_dir
     path = bucket["request_get"].get("path", "")
+    connection = _connect(path)
+    try:
+        cursorobj = connection.cursor()
+        cursorobj.execute('PRAGMA table_info(variants)')
+        columns = [row[1] for row in cursorobj.fetchall()]
+        tables = _table_names(connection)
+
+        where = bucket["request_get"].get("where", False)
+        #get the search filter JSON, then use that to build the SQL where statements
+        where = json.loads(where) if where else {}
+        where_str, params = _where(where, columns, "variants_fts" in tables)
 
-    #now do filtering 1 column and direction at a time
-    column = bucket["request_get"].get("column", False)
-    direction = bucket["request_get"].get("direction", "ASC")
+        limit = int(bucket["request_get"].get("limit", "20"))
+        offset = int(bucket["request_get"].get("offset", "0"))
+
+        #now do filtering 1 column and direction at a time
+        column = bucket["request_get"].get("column", False)
+        direction = bucket["request_get"].get("direction", "ASC").upper()
+        if direction not in ["ASC", "DESC"]:
+            raise ValueError('Bad sort direction "%s"' % direction)
 
-    #TODO do the WHERE filtering
-    #TODO just use string.format to make all the SQL, the built in parameterasation feature isn't good enough
-    if column:
-        q= 'SELECT * FROM variants {where} ORDER BY "{column}" {direction}'.format(
-                        column=column, direction=direction, where=where_str)
         #lower case position is a special field that has a combination of chrm and the Position (int)
-        if column == "position":
+        #the JS sorts it as "Location"
+        if column == "position" or (column == "Location" and column not in columns):
             #order by the by the ChromSort, then the position
-            q= 'SELECT * FROM variants {where} ORDER BY "ChromSort" {direction}, "Position" {direction}'.format(
-                direction=direction, where=where_str)
-        count, rows = _execute(path, q, limit, offset)
-    else:
-        q = 'SELECT * FROM variants {where} ORDER BY "id"'.format(
-                where=where_str)
-        count, rows = _execute(path, q, limit, offset)
+            sort_columns = ["ChromSort", "Position"]
+        elif column:
+            if column not in columns:
+                raise ValueError('Unknown column "%s"' % column)
+            sort_columns = [column]
+        else:
+            sort_columns = []
+            direction = "ASC"
+        # the id breaks the ties, so that the sort key of a row is unique
+        sort_columns.append("id")
+        order_str = ' ORDER BY ' + ', '.join(['%s %s' % (_quote(c), direction) for c in sort_columns])
+
+        signature = json.dumps(where, sort_keys=True) if where else ''
+        count = _count(connection, where_str, params, signature, "variants_count" in tables)
+
+        after = bucket["request_get"].get("after", False)
+        if after:
+            after = json.loads(after)
+            if len(after) != len(sort_columns):
+                raise ValueError('Bad sort key "%s"' % bucket["request_get"]["after"])
+            keyset_str, keyset_params = _keyset(sort_columns, direction, after)
+            q = 'SELECT * FROM variants %s %s%s LIMIT ?' % (where_str + " AND" if where_str else "WHERE", keyset_str, order_str)
+            cursorobj.execute(q, params + keyset_params + [limit])
+        else:
+            q = 'SELECT * FROM variants %s%s LIMIT ? OFFSET ?' % (where_str, order_str)
+            cursorobj.execute(q, params + [limit, offset])
+        rows = cursorobj.fetchall()
+    finally:
+        connection.close()
 
     #make the first item the total count of items
     data = {}
-    data["total"] = [count[0][0]]
+    data["total"] = [count]
     data["items"] = []
     for row in rows:
         data["items"].append(row)
+    if rows:
+        next_key = [rows[-1][columns.index(c)] for c in sort_columns]
+        # NULL does not compare, such a page is followed by offset
+        if None not in next_key:
+            data["next"] = next_key
     return data
 
 
@@ -8,15 +8,37 @@
 # from https://github.com/rgrp/csv2sqlite
 
 import csv
+import re
 import sqlite3
 import json
 import os
 
+# Columns that extend.query filters or sorts on. Each gets an index, which also
+# answers the COUNT(*) of a filter on the column without reading the table.
+INDEXED_COLUMNS = ["Allele Name", "Gene ID", "Region Name", "Position", "Frequency", "Coverage"]
+
+# Columns that extend.query searches with LIKE "%value%", and their names in the FTS table
+FTS_COLUMNS = [("Allele Name", "allele_name"), ("Gene ID", "gene_id"), ("Region Name", "region_name")]
+
+# Runs of the characters that the simple tokenizer of sqlite FTS keeps in a token
+_FTS_TOKEN = re.compile('[A-Za-z0-9]+')
+
+def fts_suffixes(value):
+    """All suffixes of the words of value, separated by spaces.
+
+    A word that contains the search text has a suffix that starts with it, so
+    the FTS prefix query "text*" on the suffixes finds the same rows as
+    LIKE "%text%" does, as long as text is a single word.
+    """
+    return ' '.join([word[i:] for word in _FTS_TOKEN.findall(value) for i in xrange(len(word))])
+
 def convert(filepath_or_fileobj, dbpath, table='data'):
     if isinstance(filepath_or_fileobj, basestring):
         fo = open(filepath_or_fileobj)
+        csvdir = os.path.dirname(os.path.abspath(filepath_or_fileobj))
     else:
         fo = filepath_or_fileobj
+        csvdir = None
     reader = csv.reader(fo,delimiter='\t')
 
     types = _guess_types(fo)
@@ -32,6 +54,9 @@ def convert(filepath_or_fileobj, dbpath, table='data'):
         )
 
     conn = sqlite3.connect(dbpath)
+    # The database is built from scratch, a failed build is thrown away
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
     c = conn.cursor()
 
     #NOTE: Chrom is expected to be the first col in the csv file
@@ -39,10 +64,15 @@ def convert(filepath_or_fileobj, dbpath, table='data'):
     c.execute('CREATE table %s (%s)' % (table, columns))
 
     #try to get the correct chromosome order
+    #the database is usually written to a temporary file first, look next to the csv file too
     chromosome_order = {}
-    if os.path.exists(os.path.join(os.path.split(dbpath)[0],"variant_summary.json")):
+    summary_paths = [os.path.join(os.path.split(dbpath)[0],"variant_summary.json")]
+    if csvdir is not None:
+        summary_paths.insert(0, os.path.join(csvdir, "variant_summary.json"))
+    summary_paths = [path for path in summary_paths if os.path.exists(path)]
+    if summary_paths:
         print "the variant_summary file is there"
-        variant_summary = json.load(open(os.path.join(os.path.split(dbpath)[0],"variant_summary.json")))
+        variant_summary = json.load(open(summary_paths[0]))
         for i, variant in enumerate(variant_summary["variants_by_chromosome"]):
             chromosome_order[variant["chromosome"]] = i
     else:
@@ -50,20 +80,44 @@ def convert(filepath_or_fileobj, dbpath, table='data'):
 
     #add one more ? to be for the PK
     _insert_tmpl = 'insert into %s values (%s)' % (table, ','.join(['?']*(2+len(headers))))
-    for i, row in enumerate(reader):
-        # we need to take out commas from int and floats for sqlite to
-        # recognize them properly ...
-        row = [ x.replace(',', '') if y in ['real', 'integer'] else x
-                for (x,y) in zip(row, types) ]
-
-        #convert the chrom name into an int so it can be sorted
-        row.insert(0, chromosome_order.get(row[0], 0))
-        #insert the PK, starting at 0
-        row.insert(0,i)
-        c.execute(_insert_tmpl, row)
-
+    def _rows():
+        for i, row in enumerate(reader):
+            # we need to take out commas from int and floats for sqlite to
+            # recognize them properly ...
+            row = [ x.replace(',', '') if y in ['real', 'integer'] else x
+                    for (x,y) in zip(row, types) ]
+
+            #convert the chrom name into an int so it can be sorted
+            row.insert(0, chromosome_order.get(row[0], 0))
+            #insert the PK, starting at 0
+            row.insert(0,i)
+            yield row
+
+    # all rows in one transaction
+    c.executemany(_insert_tmpl, _rows())
+
+    c.execute('CREATE INDEX "%s_ChromSort_Position" ON %s ("ChromSort", "Position")' % (table, table))
+    for header in INDEXED_COLUMNS:
+        if header in headers:
+            c.execute('CREATE INDEX "%s_%s" ON %s ("%s")' % (table, header.replace(' ', '_'), table, header))
+
+    # Full text index of the suffixes of the searched columns, the docid is the id of the row.
+    # Only the docids of the matches are used, so the table keeps no copy of the text.
+    fts_columns = [(header, fts_name) for (header, fts_name) in FTS_COLUMNS if header in headers]
+    if fts_columns:
+        c.execute('CREATE VIRTUAL TABLE %s_fts USING fts4(%s, content="", matchinfo=fts3)' % (table, ','.join([fts_name for (header, fts_name) in fts_columns])))
+        c.execute('SELECT "id",%s FROM %s' % (','.join(['"%s"' % header for (header, fts_name) in fts_columns]), table))
+        c.executemany('INSERT INTO %s_fts (docid,%s) VALUES (?,%s)' % (table, ','.join([fts_name for (header, fts_name) in fts_columns]), ','.join(['?'] * len(fts_columns))),
+                      [[row[0]] + [fts_suffixes(unicode(value)) for value in row[1:]] for row in c.fetchall()])
+
+    # Totals of the filters already counted, by extend.query. The total without a filter is known now.
+    c.execute('CREATE TABLE %s_count (signature TEXT PRIMARY KEY, total INTEGER)' % table)
+    c.execute('INSERT INTO %s_count SELECT ?, COUNT(*) FROM %s' % (table, table), ('', ))
+
+    c.execute('ANALYZE')
     conn.commit()
     c.close()
+    conn.close()
 
 def _guess_types(fileobj, max_sample_size=100):
     '''Guess column types (as for SQLite) of CSV.
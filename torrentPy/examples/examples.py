@@ -100,6 +100,43 @@ def read_BfMask(file_name):
     return locals()
 
 
+def read_Windows(dir_name):
+    # Iterate over a chip in 25x25 windows, only one window is held in memory
+    max_amplitude = 0
+    for row, col, flow, w in torrentPy.IO.wellsWindows(
+        os.path.join(dir_name, "1.wells"), 25, 25, flows=(0, 20)
+    ):
+        max_amplitude = max(max_amplitude, w.max())  # w is height x width x flows
+
+    dat_wells = 0
+    for row, col, d in torrentPy.IO.rawDatWindows(
+        os.path.join(dir_name, "acq_0000.dat"), 25, 25
+    ):
+        dat_wells += d.shape[0] * d.shape[1]  # d is height x width x frames
+
+    # Library beads in a region of the chip, region is (row, col, height, width)
+    lib_beads = 0
+    for row, col, m in torrentPy.IO.bfMaskWindows(
+        os.path.join(dir_name, "bfmask.bin"),
+        25,
+        25,
+        region=(10, 10, 40, 40),
+        mask=torrentPy.BfMask.MaskLib,
+    ):
+        lib_beads += m.sum()
+    return locals()
+
+
+def read_Bam_Chunks(file_name):
+    # Read a bam file 100 reads at a time, keeping only some of the fields
+    numRecs = 0
+    for chunk in torrentPy.IO.bamChunks(
+        file_name, 100, columns=["row", "col", "qseq_bases"]
+    ):
+        numRecs += len(chunk["row"])  # each field is an array with one entry per read
+    return locals()
+
+
 def read_Debug(dir_name):
     db = torrentPy.IonDebugData.DebugParams(dir_name)
     db.LoadData()
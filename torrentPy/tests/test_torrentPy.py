@@ -2,6 +2,7 @@
 
 import torrentPy
 import unittest
+import numpy
 import os
 
 # execfile('../example/examples.py')
@@ -49,12 +50,65 @@ class TestTorrentPy(unittest.TestCase):
             print("Expected Error:")
             r = read_BfMask(os.path.join(".", "blah.bin"))
 
+    def test_read_Windows(self):
+        r = read_Windows(".")
+        self.assertGreater(r["max_amplitude"], 0)
+        self.assertGreater(r["dat_wells"], 0)
+        self.assertGreater(r["lib_beads"], 0)
+
+        wells = torrentPy.WellsReader(os.path.join(".", "1.wells"))
+        w = wells.LoadWells(0, 0, 25, 25)
+        for row, col, flow, v in torrentPy.IO.wellsWindows(
+            os.path.join(".", "1.wells"), 25, 25, region=(0, 0, 25, 25)
+        ):
+            self.assertTrue(numpy.allclose(v, w, atol=1e-5))
+
+        d = torrentPy.RawDatReader(os.path.join(".", "acq_0000.dat")).LoadSlice(
+            10, 20, 25, 20
+        )
+        windows = list(
+            torrentPy.IO.rawDatWindows(
+                os.path.join(".", "acq_0000.dat"), 10, 10, region=(10, 20, 25, 20)
+            )
+        )
+        self.assertEqual(len(windows), 6)
+        for row, col, v in windows:
+            self.assertTrue(
+                numpy.array_equal(
+                    v,
+                    d[
+                        row - 10 : row - 10 + v.shape[0],
+                        col - 20 : col - 20 + v.shape[1],
+                    ],
+                )
+            )
+
+    def test_read_Bam_Chunks(self):
+        r = read_Bam_Chunks(os.path.join(".", "rawlib.bam"))
+        bam = torrentPy.BamReader(os.path.join(".", "rawlib.bam"))
+        self.assertEqual(r["numRecs"], bam.GetNumRecords())
+        self.assertEqual(sorted(r["chunk"].keys()), ["col", "qseq_bases", "row"])
+
     def test_read_Debug(self):
         r = read_Debug(".")
         with self.assertRaises(Exception):
             print("Expected Error:")
             r = read_Debug("blah")
 
+    def test_debug_batch(self):
+        db = torrentPy.IonDebugData.DebugParams(".")
+        db.LoadData()
+        pos = numpy.array([(10, 11), (10, 12), (22, 33), (51, 3)])
+        reg = db.getRegionParams(pos, [0, 7, 33], "G")
+        bead = db.getBeadParams(pos, 7)
+        for i, p in enumerate(pos):
+            one = db.getBgRegionParams((tuple(p),), 33, "G")
+            self.assertEqual(reg["krate"][i, 2], one["krate"][0])
+            self.assertEqual(reg["t_mid_nuc"][i, 2], one["t_mid_nuc"][0])
+            self.assertEqual(
+                bead["amplitude"][i], db.getBeadParams([p], 7)["amplitude"][0]
+            )
+
     def test_treephaser(self):
         r = treephaser(".")
 
@@ -1,11 +1,23 @@
 # Copyright (C) 2013 Ion Torrent Systems, Inc. All Rights Reserved
 
+import warnings
+
+import numpy
+import tables
 import torrentPyLib
 
+# rows and columns of a window when none are given
+WINDOW = 100
+# larger than any block, the whole-chip readers load up to this size
+MAX_SIZE = 60000
+# reads per chunk of bamChunks
+BAM_CHUNK = 10000
+# columns that are only filled in when the reader does flow space alignment
+FLOW_ALIGN_COLUMNS = ("qseq", "tseq", "aln_flow_idx", "aln", "flowOrder")
+
 
 def bamReader(fname):
-    bam = torrentPyLib.BamReader()
-    bam.Open(fname)
+    bam = torrentPyLib.BamReader(fname)
     # nrec = bam.GetNumRecords()
     hdr = bam.ReadBamHeader()
     dat = bam.ReadBam()
@@ -13,9 +25,8 @@ def bamReader(fname):
 
 
 def wellsReader(fname):
-    w = torrentPyLib.WellsReader()
-    w.Open(fname)
-    a = w.LoadWells(0, 0, 60000, 60000)
+    w = torrentPyLib.WellsReader(fname)
+    a = w.LoadWells(0, 0, MAX_SIZE, MAX_SIZE)
     return a
 
 
@@ -25,7 +36,173 @@ def bfMaskReader(path, mask):
 
 
 def rawDat(path):
-    i = torrentPyLib.RawDatReader()
-    i.Open(path)
-    a = i.LoadSlice(0, 0, 60000, 60000)
+    i = torrentPyLib.RawDatReader(path)
+    a = i.LoadSlice(0, 0, MAX_SIZE, MAX_SIZE)
     return a
+
+
+def chipWindows(rows, cols, height=WINDOW, width=WINDOW, region=None):
+    """Yields (row, col, h, w) of the windows tiling a rows x cols chip, or
+    the part of it in region (row, col, height, width), row by row.  Windows
+    on the bottom and right edges are cut to the chip."""
+    row0, col0, row_end, col_end = 0, 0, rows, cols
+    if region is not None:
+        row0, col0 = region[0], region[1]
+        row_end = min(rows, row0 + region[2])
+        col_end = min(cols, col0 + region[3])
+    for row in range(row0, row_end, height):
+        for col in range(col0, col_end, width):
+            yield row, col, min(height, row_end - row), min(width, col_end - col)
+
+
+def _probeWindows(load, height, width, region):
+    """chipWindows() for readers that don't tell the chip size: load(row,
+    col, h, w) cuts the window to the chip, a short window is the last one of
+    its row or column.  Yields (row, col, array)."""
+    row, col0 = 0, 0
+    row_end = col_end = MAX_SIZE
+    if region is not None:
+        row, col0 = region[0], region[1]
+        row_end, col_end = row + region[2], col0 + region[3]
+    while row < row_end:
+        h = min(height, row_end - row)
+        col, data = col0, None
+        while col < col_end:
+            w = min(width, col_end - col)
+            window = load(row, col, h, w)
+            if window.shape[0] == 0 or window.shape[1] == 0:
+                break
+            data = window
+            yield row, col, data
+            if data.shape[1] < w:
+                break
+            col += width
+        if data is None or data.shape[0] < h:
+            return
+        row += height
+
+
+def _flowRanges(nflows, flows, flow_window):
+    start, stop = flows if flows is not None else (0, nflows)
+    stop = min(stop, nflows)
+    step = flow_window or max(stop - start, 1)
+    return [(f, min(f + step, stop)) for f in range(start, stop, step)]
+
+
+def _readCopies(copies, row, col, h, w, cols):
+    # wells_copies is rows x cols, older files store it flat
+    if len(copies.shape) == 2:
+        return copies[row : row + h, col : col + w]
+    return copies[row * cols : (row + h) * cols].reshape(h, cols)[:, col : col + w]
+
+
+def wellsWindows(
+    fname, height=WINDOW, width=WINDOW, flows=None, flow_window=None, region=None
+):
+    """Yields (row, col, flow, array) over a wells file, array holding the
+    signal of the wells in the window, h x w x flows as WellsReader.LoadWells.
+
+    flows (start, stop) limits the flows read, flow_window splits them into
+    windows of that many flows, by default a window has all of them.  Only
+    the window is read from the file, so the memory used depends on the
+    window size and not on the chip.  Files stored as 16 bit integers are
+    converted, and scaled by wells_copies, as RawWells does.  Wells files
+    older than HDF5 are read through WellsReader."""
+    if not tables.is_hdf5_file(fname):
+        wells = torrentPyLib.WellsReader(fname)
+        for row, col, data in _probeWindows(wells.LoadWells, height, width, region):
+            for start, stop in _flowRanges(data.shape[2], flows, flow_window):
+                yield row, col, start, data[:, :, start:stop]
+        return
+
+    with warnings.catch_warnings():
+        # info_keys and info_values are variable length strings, unused here
+        warnings.simplefilter("ignore")
+        h5 = tables.open_file(fname, "r")
+    try:
+        wells = h5.get_node("/wells")
+        rows, cols, nflows = wells.shape
+        attrs = wells.attrs._v_attrnames
+        convert = "convert_low" in attrs or "convert_high" in attrs
+        copies = None
+        if convert:
+            lower = numpy.float32(getattr(wells.attrs, "convert_low", -5.0))
+            upper = numpy.float32(getattr(wells.attrs, "convert_high", 28.0))
+            factor = numpy.float32(65535) / (upper - lower)
+            if "/wells_copies" in h5:
+                copies = h5.get_node("/wells_copies")
+        ranges = _flowRanges(nflows, flows, flow_window)
+        for row, col, h, w in chipWindows(rows, cols, height, width, region):
+            if copies is not None:
+                scale = _readCopies(copies, row, col, h, w, cols)[:, :, numpy.newaxis]
+            for start, stop in ranges:
+                data = wells[row : row + h, col : col + w, start:stop]
+                if convert:
+                    data = data.astype(numpy.float32) / factor + lower
+                    if copies is not None:
+                        data = numpy.where(scale > 0, data * scale, numpy.float32(-1.0))
+                yield row, col, start, data
+    finally:
+        h5.close()
+
+
+def rawDatWindows(fname, height=WINDOW, width=WINDOW, region=None, normalize=True):
+    """Yields (row, col, array) over a dat file, array holding the traces of
+    the wells in the window, h x w x frames as RawDatReader.LoadSlice.  The
+    image is read once, only one window of traces is expanded to floats at a
+    time."""
+    dat = torrentPyLib.RawDatReader(fname, normalize)
+    for window in _probeWindows(dat.LoadSlice, height, width, region):
+        yield window
+
+
+def bfMaskWindows(fname, height=WINDOW, width=WINDOW, region=None, mask=None):
+    """Yields (row, col, array) over a bfmask.bin file, array holding the
+    h x w mask values of the window, or with mask, e.g. BfMask.MaskLib,
+    whether the wells have any of its bits.  The file is memory mapped."""
+    with open(fname, "rb") as f:
+        rows, cols = [int(n) for n in numpy.fromfile(f, dtype=numpy.uint32, count=2)]
+    values = numpy.memmap(
+        fname, dtype=numpy.uint16, mode="r", offset=8, shape=(int(rows), int(cols))
+    )
+    for row, col, h, w in chipWindows(rows, cols, height, width, region):
+        data = numpy.array(values[row : row + h, col : col + w])
+        if mask is not None:
+            data = (data & int(mask)) != 0
+        yield row, col, data
+
+
+def _toColumns(reads, columns):
+    chunk = {}
+    for column in columns:
+        values = [read[column] for read in reads]
+        if not isinstance(values[0], numpy.ndarray):
+            values = numpy.array(values)
+        chunk[column] = values
+    return chunk
+
+
+def bamChunks(fname, chunksize=BAM_CHUNK, columns=None, region=None):
+    """Yields the reads of a bam file in chunks of up to chunksize reads, as
+    {column: values} with a numpy array for scalar and string columns and a
+    list of arrays for per flow columns.
+
+    columns selects the fields kept, by default all the fields of the first
+    read.  Flow space alignment is skipped when none of FLOW_ALIGN_COLUMNS
+    is selected.  region (minRow, maxRow, minCol, maxCol) restricts the reads
+    to a region of the chip as BamReader.SetChipRegion."""
+    bam = torrentPyLib.BamReader(fname)
+    if columns is not None and not set(columns) & set(FLOW_ALIGN_COLUMNS):
+        bam.flowAlign = 0
+    if region is not None:
+        bam.SetChipRegion(*region)
+    reads = []
+    for read in bam:
+        if columns is None:
+            columns = list(read.keys())
+        reads.append(dict((column, read[column]) for column in columns))
+        if len(reads) == chunksize:
+            yield _toColumns(reads, columns)
+            reads = []
+    if reads:
+        yield _toColumns(reads, columns)
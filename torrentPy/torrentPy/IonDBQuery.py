@@ -44,16 +44,33 @@ class IonDBData(object):
             result.append(item)
         return result
 
+    def __frame(self, rows, description):
+        columns = [col_desc[0] for col_desc in description]
+        columns = self.uniquify_columns(columns)
+        return pandas.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+
     def df_from_db(self, query):
         self.__db.query(query)
         rows = self.__db.rows
         if not isinstance(rows, list):
             result = list(rows)
-        columns = [col_desc[0] for col_desc in self.__db.cursor.description]
-
-        columns = self.uniquify_columns(columns)
-        result = pandas.DataFrame.from_records(rows, columns=columns, coerce_float=True)
-        return result
+        return self.__frame(rows, self.__db.cursor.description)
+
+    def iter_df_from_db(self, query, chunksize):
+        """Yields the result of query as DataFrames of up to chunksize rows,
+        fetched through a server side cursor"""
+        cursor = self.__db.connection.cursor(name="iondbdata_%d" % id(self))
+        cursor.itersize = chunksize
+        try:
+            cursor.execute(query)
+            while True:
+                rows = cursor.fetchmany(chunksize)
+                if not rows:
+                    break
+                yield self.__frame(rows, cursor.description)
+        finally:
+            cursor.close()
+            self.__db.connection.commit()
 
     def getExplogData(self, data, username, password):
         host = self.__db._IonDB__host
@@ -127,68 +144,74 @@ class IonDBData(object):
         return data
 
     def getPluginData(self, run_df, plugin_list):
-        if len(plugin_list) < 1:
+        if len(plugin_list) < 1 or len(run_df) == 0:
             return run_df
 
-        query = """SELECT rundb_plugin.name,state,store FROM rundb_pluginresult JOIN rundb_plugin ON rundb_plugin.id=rundb_pluginresult.plugin_id WHERE rundb_plugin.name IN %s AND rundb_pluginresult.result_id=%s"""
-        plugin_data_list = []
-        for run_id in run_df.index:
-            # db.cursor.mogrify(query,(plugin_list,run_id))
-            self.__db.cursor.execute(query, (plugin_list, run_id))
-            rf = {"run_id": run_id}
-            for r in self.__db.cursor:
-                if r[1] == "Completed":
-                    plugin_name = r[0]
-                    try:
-                        plugin_data = json.loads(r[2])
-                        rf.update(flatten_dict(plugin_data, plugin_name + "_"))
-                    except Exception as e:
-                        # print e
-                        # print plugin_data
-                        # print r[0], r[2], run_id
-                        pass
-            plugin_data_list.append(rf)
-            self.__db.connection.commit()
+        query = """SELECT rundb_pluginresult.result_id,rundb_plugin.name,store FROM rundb_pluginresult JOIN rundb_plugin ON rundb_plugin.id=rundb_pluginresult.plugin_id WHERE rundb_plugin.name IN %s AND rundb_pluginresult.result_id = ANY(%s) AND state='Completed' ORDER BY rundb_pluginresult.result_id,rundb_pluginresult.id"""
+        run_ids = [int(run_id) for run_id in run_df.index]
+        cursor = self.__db.connection.cursor(name="iondbdata_plugins_%d" % id(self))
+        cursor.itersize = 1000
+        cursor.execute(query, (tuple(plugin_list), run_ids))
+        plugin_data = {}
+        for run_id, plugin_name, store in cursor:
+            try:
+                rf = flatten_dict(json.loads(store), plugin_name + "_")
+            except Exception:
+                continue
+            plugin_data.setdefault(run_id, {}).update(rf)
+        cursor.close()
 
-        plugin_df = pandas.DataFrame(plugin_data_list)
-        plugin_df.set_index("run_id", inplace=True)
+        if not plugin_data:
+            return run_df
+        plugin_df = pandas.DataFrame.from_dict(plugin_data, orient="index")
         data = run_df.join(plugin_df)
         return data
 
     def __getProjectId(self, run_df):
-        query = """SELECT rundb_project.name FROM rundb_project JOIN rundb_results_projects ON  rundb_project.id=rundb_results_projects.project_id WHERE rundb_results_projects.results_id=%s"""
-        for run_id in run_df.index:
-            try:
-                querystr = self.__db.cursor.mogrify(query, (run_id,))
-                dat = self.__db.query(querystr)
-                project_id = dat[0][0]
-                run_df = run_df.set_value(run_id, "project_id", project_id)
-            except Exception:
-                pass
+        if len(run_df) == 0:
+            return run_df
+        query = """SELECT rundb_results_projects.results_id,rundb_project.name FROM rundb_project JOIN rundb_results_projects ON  rundb_project.id=rundb_results_projects.project_id WHERE rundb_results_projects.results_id = ANY(%s) ORDER BY rundb_results_projects.id DESC"""
+        self.__db.cursor.execute(query, ([int(run_id) for run_id in run_df.index],))
+        # the first project of each run, as one lookup per run found it
+        projects = dict(self.__db.cursor.fetchall())
+        run_df["project_id"] = [projects.get(run_id, "") for run_id in run_df.index]
         return run_df
 
+    def __addRunData(self, run_df, plugin_list):
+        run_df.set_index("report_id", inplace=True)
+        run_df["project_id"] = ""
+        run_df = self.__getProjectId(run_df)
+        run_df = self.getPluginData(run_df, plugin_list)
+        return run_df
+
+    def __iterData(self, querystr, plugin_list, chunksize):
+        for run_df in self.iter_df_from_db(querystr, chunksize):
+            yield self.__addRunData(run_df, plugin_list)
+
     def getDataByDate(
         self,
         start=(datetime.datetime.now() - datetime.timedelta(days=31)),
         end=(datetime.datetime.now() - datetime.timedelta(days=0)),
         plugin_list=(),
+        chunksize=None,
     ):
+        """Runs with a timeStamp from start to end, newest first.  With
+        chunksize, returns a generator of DataFrames of up to chunksize runs
+        each, so that long ranges don't have to fit in memory."""
         query = """select * from rundb_results JOIN rundb_experiment ON rundb_results.experiment_id=rundb_experiment.id JOIN rundb_libmetrics ON rundb_results.id=rundb_libmetrics.report_id JOIN rundb_analysismetrics ON rundb_results.id=rundb_analysismetrics.report_id where "timeStamp">=%s AND "timeStamp"<=%s ORDER BY "timeStamp" DESC"""
         querystr = self.__db.cursor.mogrify(query, (start, end))
-        run_df = self.df_from_db(querystr)
-        run_df.set_index("report_id", inplace=True)
-        run_df["project_id"] = ""
-        run_df = self.__getProjectId(run_df)
-        run_df = self.getPluginData(run_df, plugin_list)
+        if chunksize:
+            return self.__iterData(querystr, plugin_list, chunksize)
+        run_df = self.__addRunData(self.df_from_db(querystr), plugin_list)
+        self.__db.connection.commit()
         return run_df
 
-    def getData(self, query, params):
+    def getData(self, query, params, plugin_list=(), chunksize=None):
         querystr = self.__db.cursor.mogrify(query, params)
-        run_df = self.df_from_db(querystr)
-        run_df.set_index("report_id", inplace=True)
-        run_df["project_id"] = ""
-        run_df = self.__getProjectId(run_df)
-        run_df = self.getPluginData(run_df, plugin_list)
+        if chunksize:
+            return self.__iterData(querystr, plugin_list, chunksize)
+        run_df = self.__addRunData(self.df_from_db(querystr), plugin_list)
+        self.__db.connection.commit()
         return run_df
 
 
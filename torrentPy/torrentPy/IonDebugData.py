@@ -6,6 +6,41 @@ import os
 import os.path
 
 
+# bytes of bead parameters read from the file at a time
+READ_BYTES = 1 << 26
+
+
+def _readWells(node, rows, cols, flow=slice(None)):
+    """node[rows[i], cols[i], flow] for all i, stacked.  Reads slabs of whole
+    rows, up to READ_BYTES at a time, and picks the wells out of them."""
+    if not isinstance(flow, slice) and np.ndim(flow) > 0:
+        flows = np.asarray(flow, dtype=int)
+        low, high = (flows.min(), flows.max() + 1) if flows.size else (0, 0)
+        values = _readWells(node, rows, cols, slice(low, high))
+        return values[:, flows - low]
+    if isinstance(flow, slice):
+        width = len(range(*flow.indices(node.shape[2])))
+    else:
+        width = 1
+    step = max(1, READ_BYTES // max(1, node.shape[1] * width * node.dtype.itemsize))
+    order = np.argsort(rows, kind="mergesort")
+    sorted_rows = rows[order]
+    out = None
+    start = 0
+    while start < len(order):
+        row = sorted_rows[start]
+        end = np.searchsorted(sorted_rows, row + step)
+        wells = order[start:end]
+        values = node[row : row + step, :, flow][rows[wells] - row, cols[wells]]
+        if out is None:
+            out = np.empty((len(rows),) + values.shape[1:], dtype=values.dtype)
+        out[wells] = values
+        start = end
+    if out is None:
+        out = np.empty((0,), dtype=node.dtype)
+    return out
+
+
 class DebugParams(object):
     def __init__(self, path_to_sigproc):
         self.__path = path_to_sigproc
@@ -40,83 +75,124 @@ class DebugParams(object):
         }  #'sigma':'nuc_shape',
         self.__nuc_map = {"T": 0, "A": 1, "C": 2, "G": 3}
 
+    def getRegionIdx(self, pos):
+        """Region indexes of the wells at pos, (row, col) pairs, -1 for wells
+        in no region"""
+        pos = np.asarray(pos, dtype=int).reshape(-1, 2)
+        corner = np.floor_divide(pos, self.step)
+        inside = ((corner >= 0) & (corner < self.region_grid.shape)).all(axis=1)
+        ret = np.full(len(pos), -1, dtype=int)
+        ret[inside] = self.region_grid[corner[inside, 0], corner[inside, 1]]
+        return ret
+
     def getRegionIdxByPos(self, pos):
-        reg_corner = np.floor_divide(pos, self.step) * self.step
-        ind = np.where((self.loc == reg_corner).all(axis=1))
-        return (ind[0] if ind[0].size > 0 else -1).min()
-
-    def __get_nuc_attr(self, name, attr, flow, nuc, reg):
-        flow_group = int(flow // self.nFlowsPerGroup)
-        nuc_idx = self.__nuc_map[nuc]
-        full_name = name + "_" + str(nuc_idx)
+        return int(self.getRegionIdx([pos])[0])
+
+    def __buildRegionGrid(self):
+        # region_grid[row // step, col // step] is the first region whose
+        # corner is at (row, col), regions off the grid are never found
+        step = np.ones(2, dtype=int) * self.step
+        on_grid = np.flatnonzero(((self.loc % step == 0) & (self.loc >= 0)).all(axis=1))
+        corner = self.loc[on_grid] // step
+        shape = corner.max(axis=0) + 1 if len(on_grid) else np.zeros(2, dtype=int)
+        self.region_grid = np.full(shape, -1, dtype=int)
+        keys, first = np.unique(
+            np.ravel_multi_index(corner.T, shape) if len(on_grid) else [],
+            return_index=True,
+        )
+        self.region_grid.flat[keys.astype(int)] = on_grid[first]
+
+    def __getParamNames(self, full_attr):
+        if full_attr not in self.__param_names:
+            names = self.__region_param.get_node_attr(full_attr, "paramNames")
+            names = names.split(",")
+            self.__param_names[full_attr] = names[:-1] if names[-1] == "" else names
+        return self.__param_names[full_attr]
+
+    def __getParamIndex(self, full_attr):
+        if full_attr not in self.__param_index:
+            names = self.__getParamNames(full_attr)
+            self.__param_index[full_attr] = dict(
+                (name, k) for k, name in reversed(list(enumerate(names)))
+            )
+        return self.__param_index[full_attr]
+
+    def __getRegionArray(self, full_attr):
+        if full_attr not in self.__region_arrays:
+            self.__region_arrays[full_attr] = self.__region_param.get_node(
+                full_attr
+            ).read()
+        return self.__region_arrays[full_attr]
+
+    def __getRegionValues(self, attr, names, reg, flow_group):
         full_attr = (
             ("/region/region_param/" + attr)
             if attr != "derived_param"
             else "/region/derived_param"
         )
-        namedParameterList = np.array(
-            self.__region_param.get_node_attr(full_attr, "paramNames").split(",")
-        )
-        param_idx = np.where(namedParameterList == full_name)[0][0]
-        val = self.__region_param.get_node(full_attr)
-        return val[reg, param_idx, flow_group]
-
-    def __get_flow_group_attr(self, name, attr, flow, nuc, reg):
-        flow_group = int(flow // self.nFlowsPerGroup)
-        full_name = name
-        full_attr = "/region/region_param/" + attr
-        namedParameterList = np.array(
-            self.__region_param.get_node_attr(full_attr, "paramNames").split(",")
-        )
-        param_idx = np.where(namedParameterList == full_name)[0][0]
-        val = self.__region_param.get_node(full_attr)
-        return val[reg, param_idx, flow_group]
-
-    def __get_flow_attr(self, name, attr, flow, nuc, reg):
-        flow_group = int(flow // self.nFlowsPerGroup)
-        flow_idx = int(flow % self.nFlowsPerGroup)
-        full_name = name + "_" + str(flow_idx)
-        full_attr = "/region/region_param/" + attr
-        namedParameterList = np.array(
-            self.__region_param.get_node_attr(full_attr, "paramNames").split(",")
-        )
-        param_idx = np.where(namedParameterList == full_name)[0][0]
-        val = self.__region_param.get_node(full_attr)
-        return val[reg, param_idx, flow_group]
+        index = self.__getParamIndex(full_attr)
+        if any(name not in index for name in names):
+            return None
+        param_idx = np.array([index[name] for name in names])
+        return self.__getRegionArray(full_attr)[reg, param_idx, flow_group]
 
-    def __get_darkness_attr(self, reg, nuc):
-        full_attr = "/region/darkMatter/missingMass"
-        val = self.__region_param.get_node(full_attr).read()
-        nuc_idx = self.__nuc_map[nuc]
-        return val[reg, nuc_idx, :]
+    def __getParam(self, name, reg, flows, nuc):
+        """name for regions reg and flows, broadcast against each other, or
+        None if the file doesn't have it"""
+        flow_group = flows // self.nFlowsPerGroup
+        if name in self.__nuc_param:
+            full_name = name + "_" + str(self.__nuc_map[nuc])
+            return self.__getRegionValues(
+                self.__nuc_param[name], [full_name], reg, flow_group
+            )
+        if name in self.__flow_param:
+            names = [name + "_" + str(int(f)) for f in flows.ravel() % self.nFlowsPerGroup]
+            return self.__getRegionValues(
+                self.__flow_param[name], names, reg, flow_group
+            )
+        if name in self.__flow_group_param:
+            return self.__getRegionValues(
+                self.__flow_group_param[name], [name], reg, flow_group
+            )
+        return None
 
     def getRegionParam(self, reg, name, flow, nuc):
-        try:
-            attr = self.__nuc_param[name]
-            return self.__get_nuc_attr(name, attr, flow, nuc, reg)
-        except Exception:
-            pass
-        try:
-            attr = self.__flow_param[name]
-            return self.__get_flow_attr(name, attr, flow, nuc, reg)
-        except Exception:
-            pass
-        try:
-            attr = self.__flow_group_param[name]
-            return self.__get_flow_group_attr(name, attr, flow, nuc, reg)
-        except Exception:
-            return
+        values = self.__getParam(
+            name, np.atleast_1d(reg)[:, np.newaxis], np.array([[int(flow)]]), nuc
+        )
+        if values is None or np.ndim(reg) > 0:
+            return values if values is None else values[:, 0]
+        return values[0, 0]
 
-    def getBgRegionParams(self, pos, flow, nuc):
+    def getRegionParams(self, pos, flows, nuc):
+        """Regional parameters of the wells at pos, (row, col) pairs, for
+        each of flows with nucleotide nuc.  Returns {name: array}, arrays of
+        len(pos) x len(flows), None for parameters not in the file, and
+        missingMass of len(pos) x points."""
+        reg = self.getRegionIdx(pos)
+        if (reg < 0).any():
+            raise ValueError(
+                "No region for wells %s" % np.asarray(pos).reshape(-1, 2)[reg < 0]
+            )
+        flows = np.atleast_1d(np.asarray(flows, dtype=int))[np.newaxis, :]
         ret = dict()
-        reg = tuple(self.getRegionIdxByPos(pos_1) for pos_1 in pos)
-        for (par, temp) in (
-            list(self.__nuc_param.items())
-            + list(self.__flow_param.items())
-            + list(self.__flow_group_param.items())
+        for par in (
+            list(self.__nuc_param.keys())
+            + list(self.__flow_param.keys())
+            + list(self.__flow_group_param.keys())
         ):
-            ret[par] = self.getRegionParam(reg, par, flow, nuc)
-        ret["missingMass"] = tuple(self.__get_darkness_attr(r, nuc) for r in reg)
+            ret[par] = self.__getParam(par, reg[:, np.newaxis], flows, nuc)
+        ret["missingMass"] = self.__getRegionArray("/region/darkMatter/missingMass")[
+            reg, self.__nuc_map[nuc], :
+        ]
+        return ret
+
+    def getBgRegionParams(self, pos, flow, nuc):
+        ret = self.getRegionParams(pos, [flow], nuc)
+        for par, values in ret.items():
+            if par != "missingMass" and values is not None:
+                ret[par] = values[:, 0]
+        ret["missingMass"] = tuple(ret["missingMass"])
         return ret
 
     def _getRegionParams(self, pos):
@@ -127,55 +203,36 @@ class DebugParams(object):
             "/region/region_param/buffering",
         )
         params = {}
+        reg = self.getRegionIdxByPos(pos[0])
 
         for attr in attributes:
-            namedParameterList = self.__region_param.get_node_attr(
-                attr, "paramNames"
-            ).split(",")
-            namedParameterList = (
-                namedParameterList[:-1]
-                if namedParameterList[-1] == ""
-                else namedParameterList
-            )
-            param_values = self.__region_param.get_node(attr)
-
+            namedParameterList = self.__getParamNames(attr)
+            param_values = self.__getRegionArray(attr)
             for k in range(len(namedParameterList)):
-                val = [
-                    param_values[self.getRegionIdxByPos(well_pos), k, :]
-                    for well_pos in pos
-                ]
-                params[namedParameterList[k]] = val[0]
+                params[namedParameterList[k]] = param_values[reg, k, :]
 
         return params
 
     def getBeadParams(self, pos, flow=slice(None)):
+        """Bead parameters of the wells at pos, (row, col) pairs, as arrays
+        with one entry per well.  The per flow parameters are for flow, a
+        flow, a slice or a list of flows."""
+        pos = np.asarray(pos, dtype=int).reshape(-1, 2)
+        rows, cols = pos[:, 0], pos[:, 1]
+        base = _readWells(self.__data["bead_base_parameters"], rows, cols)
         params = {}
-        params["kmult"] = [self.__data["kmult"][row, col, flow] for row, col in pos]
-        params["copies"] = [
-            self.__data["bead_base_parameters"][row, col, 0] for row, col in pos
-        ]
-        params["etbR"] = [
-            self.__data["bead_base_parameters"][row, col, 1] for row, col in pos
-        ]
-        params["dmult"] = [
-            self.__data["bead_base_parameters"][row, col, 2] for row, col in pos
-        ]
-        params["gain"] = [
-            self.__data["bead_base_parameters"][row, col, 3] for row, col in pos
-        ]
-        params["deltaTime"] = [
-            self.__data["bead_base_parameters"][row, col, 4] for row, col in pos
-        ]
-        params["amplitude"] = [
-            self.__data["amplitude"][row, col, flow] for row, col in pos
-        ]
-        params["resError"] = [
-            self.__data["residual_error"][row, col, flow] for row, col in pos
-        ]
-        # params['errByBlock']=[self.__data['average_error_by_block'][row,col,flow] for row,col in pos]
-        params["dcOffset"] = [
-            self.__data["trace_dc_offset"][row, col, flow] for row, col in pos
-        ]
+        params["kmult"] = _readWells(self.__data["kmult"], rows, cols, flow)
+        params["copies"] = base[:, 0]
+        params["etbR"] = base[:, 1]
+        params["dmult"] = base[:, 2]
+        params["gain"] = base[:, 3]
+        params["deltaTime"] = base[:, 4]
+        params["amplitude"] = _readWells(self.__data["amplitude"], rows, cols, flow)
+        params["resError"] = _readWells(self.__data["residual_error"], rows, cols, flow)
+        # params['errByBlock']=_readWells(self.__data['average_error_by_block'], rows, cols, flow)
+        params["dcOffset"] = _readWells(
+            self.__data["trace_dc_offset"], rows, cols, flow
+        )
         return params
 
     def _getRegParams(self, pos):
@@ -187,6 +244,9 @@ class DebugParams(object):
             os.path.join(self.__path, "region_param.h5")
         )
         self.__bead_param = tables.open_file(os.path.join(self.__path, "bead_param.h5"))
+        self.__param_names = {}
+        self.__param_index = {}
+        self.__region_arrays = {}
         self.__data = {}
         self.__data["kmult"] = self.__bead_param.get_node("/bead/kmult")
         self.__data["bead_base_parameters"] = self.__bead_param.get_node(
@@ -222,6 +282,7 @@ class DebugParams(object):
             )
         else:
             self.step = 100000
+        self.__buildRegionGrid()
 
     def getParamsForWells(self, pos):
         params = self.getBeadParams(pos)